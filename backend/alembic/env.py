@@ -7,8 +7,9 @@ from sqlalchemy import pool
 
 from alembic import context
 
-# This adds the 'backend' directory's parent to sys.path, so 'app' can be imported as 'app'
-sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+# This adds the 'backend' directory to sys.path, so 'app' can be imported as 'app'
+# (alembic/ lives in backend/, next to app/)
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 
 
 # Import your application's settings and Base metadata
@@ -27,6 +28,16 @@ if config.config_file_name is not None:
 config.set_main_option('sqlalchemy.url', settings.DATABASE_URL)
 target_metadata = Base.metadata
 
+# Partitions of `messages` (see versions/0002) exist only in the database. Without this
+# filter autogenerate would propose dropping them.
+MESSAGE_PARTITION_PREFIXES = ("messages_p", "messages_legacy", "messages_default")
+
+
+def include_object(object, name, type_, reflected, compare_to):
+    if type_ == "table" and reflected and compare_to is None and name.startswith(MESSAGE_PARTITION_PREFIXES):
+        return False
+    return True
+
 
 def run_migrations_offline() -> None:
     """Run migrations in 'offline' mode.
@@ -46,6 +57,7 @@ def run_migrations_offline() -> None:
         target_metadata=target_metadata,
         literal_binds=True,
         dialect_opts={"paramstyle": "named"},
+        include_object=include_object,
     )
 
     with context.begin_transaction():
@@ -60,14 +72,14 @@ def run_migrations_online() -> None:
 
     """
     connectable = engine_from_config(
-        config.get_section(config.main_section_name, {}), 
+        config.get_section(config.config_ini_section, {}),
         prefix="sqlalchemy.",
         poolclass=pool.NullPool,
     )
 
     with connectable.connect() as connection:
         context.configure(
-            connection=connection, target_metadata=target_metadata
+            connection=connection, target_metadata=target_metadata, include_object=include_object
         )
 
         with context.begin_transaction():
@@ -0,0 +1,61 @@
+"""Baseline: the conversations, messages and escalation_tickets tables of db/init.sql
+
+Databases created by docker-compose already have these tables (from db/init.sql); the
+upgrade only creates what is missing, so `alembic upgrade head` works on both those and
+on an empty database.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-17
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0001"
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    existing = set(sa.inspect(op.get_bind()).get_table_names())
+    if "conversations" not in existing:
+        op.create_table(
+            "conversations",
+            sa.Column("id", sa.Integer, primary_key=True),
+            sa.Column("user_id", sa.String(255)),
+            sa.Column("start_time", sa.DateTime, server_default=sa.func.current_timestamp()),
+            sa.Column("end_time", sa.DateTime),
+            sa.Column("escalated", sa.Boolean, server_default=sa.false()),
+        )
+    if "messages" not in existing:
+        op.create_table(
+            "messages",
+            sa.Column("id", sa.Integer, primary_key=True),
+            sa.Column("conversation_id", sa.Integer, sa.ForeignKey("conversations.id")),
+            sa.Column("content", sa.Text),
+            sa.Column("timestamp", sa.DateTime, server_default=sa.func.current_timestamp()),
+            sa.Column("sender", sa.String(50)),
+            sa.Column("intent", sa.String(100)),
+            sa.Column("confidence", sa.Float),
+        )
+    if "escalation_tickets" not in existing:
+        op.create_table(
+            "escalation_tickets",
+            sa.Column("id", sa.Integer, primary_key=True),
+            sa.Column("conversation_id", sa.Integer, sa.ForeignKey("conversations.id")),
+            sa.Column("created_at", sa.DateTime, server_default=sa.func.current_timestamp()),
+            sa.Column("status", sa.String(50)),
+            sa.Column("assigned_agent", sa.String(255)),
+        )
+
+
+def downgrade() -> None:
+    op.drop_table("escalation_tickets")
+    op.drop_table("messages")
+    op.drop_table("conversations")
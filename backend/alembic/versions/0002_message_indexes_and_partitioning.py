@@ -0,0 +1,217 @@
+"""Composite indexes; monthly range partitioning of messages (PostgreSQL)
+
+Indexes, matching the queries the app and the agent dashboard run:
+  messages (conversation_id, timestamp)       conversation history, in order
+  messages (timestamp), BRIN                  time-window scans; rows arrive in time order, so BRIN stays tiny
+  conversations (user_id, start_time)         a user's conversations, newest first
+  escalation_tickets (conversation_id)        the ticket of a conversation
+  escalation_tickets (status, created_at)     the pending queue, oldest first
+
+On PostgreSQL `messages` becomes a table partitioned by RANGE (timestamp), one partition
+per month (messages_pYYYYMM). Existing rows are not copied: the old table is attached as
+the partition messages_legacy covering everything before the first monthly partition.
+Its indexes are built CONCURRENTLY first, so the only exclusive locks taken are for
+renames and catalogue changes. An empty table gets no legacy partition, so history loaded
+later (imports, scripts/generate_chat_data.py) can go into monthly partitions.
+
+Partitions are created ahead of time by ensure_messages_partitions(months_ahead,
+from_month), which this migration installs and calls. The app calls it at startup and a daily Celery beat
+task does too (app/db/partitions.py). Rows whose month has no partition yet land in
+messages_default; the function moves them into the new partition when it creates it.
+
+The primary key becomes (id, timestamp), because PostgreSQL requires unique constraints
+on a partitioned table to include the partition key. ids still come from the same
+sequence, so they stay unique.
+
+Other databases (SQLite in development) only get the indexes.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0002"
+down_revision: Union[str, None] = "0001"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+PARTITIONS_AHEAD = 3 # Months of empty partitions created by the migration itself
+UTC_NOW = "(now() AT TIME ZONE 'UTC')"
+
+# (name, table, columns); the BRIN index on messages.timestamp is handled separately
+INDEXES = [
+    ("ix_conversations_user_id_start_time", "conversations", ["user_id", "start_time"]),
+    ("ix_escalation_tickets_conversation_id", "escalation_tickets", ["conversation_id"]),
+    ("ix_escalation_tickets_status_created_at", "escalation_tickets", ["status", "created_at"]),
+]
+
+ENSURE_PARTITIONS_FUNCTION = """
+CREATE OR REPLACE FUNCTION ensure_messages_partitions(months_ahead integer DEFAULT 3, from_month timestamp DEFAULT NULL)
+RETURNS integer
+LANGUAGE plpgsql AS $$
+DECLARE
+    first_month CONSTANT timestamp := %(first_month)s; -- messages_legacy (if any) holds everything before this
+    month_start timestamp;
+    month_end timestamp;
+    partition_name text;
+    created integer := 0;
+BEGIN
+    -- One caller at a time (app workers and the beat task may run it together)
+    PERFORM pg_advisory_xact_lock(hashtext('ensure_messages_partitions'));
+    -- from_month: also create partitions for past months (backfills); default is the current month
+    month_start := GREATEST(first_month, date_trunc('month', COALESCE(from_month, now() AT TIME ZONE 'UTC')));
+    WHILE month_start <= date_trunc('month', now() AT TIME ZONE 'UTC') + make_interval(months => months_ahead) LOOP
+        month_end := month_start + interval '1 month';
+        partition_name := 'messages_p' || to_char(month_start, 'YYYYMM');
+        IF to_regclass(partition_name) IS NULL THEN
+            -- Built detached, filled from the default partition, then attached: ATTACH only
+            -- succeeds once the default partition holds no rows of the new range
+            EXECUTE format('CREATE TABLE %%I (LIKE messages INCLUDING DEFAULTS)', partition_name);
+            EXECUTE format('INSERT INTO %%I SELECT * FROM messages_default WHERE "timestamp" >= %%L AND "timestamp" < %%L',
+                           partition_name, month_start, month_end);
+            EXECUTE format('DELETE FROM messages_default WHERE "timestamp" >= %%L AND "timestamp" < %%L',
+                           month_start, month_end);
+            EXECUTE format('ALTER TABLE messages ATTACH PARTITION %%I FOR VALUES FROM (%%L) TO (%%L)',
+                           partition_name, month_start, month_end);
+            created := created + 1;
+        END IF;
+        month_start := month_end;
+    END LOOP;
+    RETURN created;
+END;
+$$;
+"""
+
+
+def _create_indexes_concurrently(statements) -> None:
+    # CREATE INDEX CONCURRENTLY can't run inside a transaction
+    with op.get_context().autocommit_block():
+        for statement in statements:
+            op.execute(statement)
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    if bind.dialect.name != "postgresql":
+        op.execute('UPDATE messages SET "timestamp" = CURRENT_TIMESTAMP WHERE "timestamp" IS NULL')
+        with op.batch_alter_table("messages") as batch: # SQLite rebuilds the table for this
+            batch.alter_column("timestamp", existing_type=sa.DateTime, nullable=False)
+        for name, table, columns in INDEXES:
+            op.create_index(name, table, columns)
+        op.create_index("ix_messages_conversation_id_timestamp", "messages", ["conversation_id", "timestamp"])
+        op.create_index("ix_messages_timestamp", "messages", ["timestamp"])
+        return
+
+    # 1. Indexes, built without blocking writes. The two on messages are the legacy
+    #    partition's copies of the partitioned indexes created in step 4. Databases set up
+    #    from db/init.sql or create_all() already have plain versions of the messages
+    #    indexes under the partitioned indexes' names; those are reused or dropped.
+    op.execute("ALTER INDEX IF EXISTS ix_messages_conversation_id_timestamp RENAME TO messages_legacy_conversation_id_timestamp_idx")
+    op.execute("DROP INDEX IF EXISTS ix_messages_timestamp")
+    _create_indexes_concurrently(
+        [f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} ({", ".join(columns)})' for name, table, columns in INDEXES]
+        + [
+            'CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS messages_legacy_id_timestamp_key ON messages (id, "timestamp")',
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS messages_legacy_conversation_id_timestamp_idx ON messages (conversation_id, "timestamp")',
+        ]
+    )
+
+    # 2. The partition key must be NOT NULL, and the legacy rows must provably lie before
+    #    the first monthly partition. Both are proven with CHECK constraints validated
+    #    under a lock that still allows writes, so SET NOT NULL and ATTACH skip their scans.
+    #    Timestamps are naive UTC (the app writes datetime.utcnow()), hence UTC_NOW.
+    op.execute(
+        f'UPDATE messages m SET "timestamp" = COALESCE(c.start_time, {UTC_NOW}) '
+        'FROM conversations c WHERE m."timestamp" IS NULL AND c.id = m.conversation_id'
+    )
+    op.execute(f'UPDATE messages SET "timestamp" = {UTC_NOW} WHERE "timestamp" IS NULL')
+    empty = not bind.execute(sa.text("SELECT EXISTS (SELECT 1 FROM messages)")).scalar()
+    first_month = bind.execute(sa.text(
+        f"SELECT date_trunc('month', GREATEST(COALESCE(MAX(\"timestamp\"), {UTC_NOW}), {UTC_NOW})) + interval '1 month' FROM messages"
+    )).scalar()
+    op.execute('ALTER TABLE messages ADD CONSTRAINT messages_timestamp_not_null CHECK ("timestamp" IS NOT NULL) NOT VALID')
+    op.execute(f"ALTER TABLE messages ADD CONSTRAINT messages_legacy_range CHECK (\"timestamp\" < '{first_month}') NOT VALID")
+    op.execute("ALTER TABLE messages VALIDATE CONSTRAINT messages_timestamp_not_null")
+    op.execute("ALTER TABLE messages VALIDATE CONSTRAINT messages_legacy_range")
+    op.execute('ALTER TABLE messages ALTER COLUMN "timestamp" SET NOT NULL')
+    op.execute("ALTER TABLE messages DROP CONSTRAINT messages_timestamp_not_null")
+    # The partition's primary key has to match the parent's (id, timestamp); swapping it in
+    # on the prebuilt index is a catalogue change only
+    op.execute(
+        "ALTER TABLE messages DROP CONSTRAINT messages_pkey, "
+        "ADD CONSTRAINT messages_legacy_pkey PRIMARY KEY USING INDEX messages_legacy_id_timestamp_key"
+    )
+
+    # 3. The old table becomes the legacy partition of a new partitioned `messages`
+    sequence = bind.execute(sa.text("SELECT pg_get_serial_sequence('messages', 'id')")).scalar()
+    op.execute("ALTER TABLE messages RENAME TO messages_legacy")
+    op.execute(f"""
+        CREATE TABLE messages (
+            id integer NOT NULL DEFAULT nextval('{sequence}'),
+            conversation_id integer REFERENCES conversations (id),
+            content text,
+            "timestamp" timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            sender varchar(50),
+            intent varchar(100),
+            confidence double precision,
+            PRIMARY KEY (id, "timestamp")
+        ) PARTITION BY RANGE ("timestamp")
+    """)
+    op.execute(f"ALTER SEQUENCE {sequence} OWNED BY messages.id")
+    if empty:
+        op.execute("DROP TABLE messages_legacy")
+        first_month = "-infinity"
+    else:
+        op.execute(f"ALTER TABLE messages ATTACH PARTITION messages_legacy FOR VALUES FROM (MINVALUE) TO ('{first_month}')")
+        op.execute("ALTER TABLE messages_legacy DROP CONSTRAINT messages_legacy_range")
+    op.execute("CREATE TABLE messages_default PARTITION OF messages DEFAULT")
+
+    # 4. Partitioned indexes: the legacy partition's matching indexes from step 1 are attached, not rebuilt
+    op.execute('CREATE INDEX ix_messages_conversation_id_timestamp ON messages (conversation_id, "timestamp")')
+    op.execute('CREATE INDEX ix_messages_timestamp ON messages USING brin ("timestamp")')
+
+    # 5. Automatic monthly partitions
+    op.execute(ENSURE_PARTITIONS_FUNCTION % {"first_month": f"'{first_month}'::timestamp"})
+    op.execute(f"SELECT ensure_messages_partitions({PARTITIONS_AHEAD})")
+
+
+def downgrade() -> None:
+    bind = op.get_bind()
+    if bind.dialect.name != "postgresql":
+        op.drop_index("ix_messages_timestamp", "messages")
+        op.drop_index("ix_messages_conversation_id_timestamp", "messages")
+        for name, table, _ in reversed(INDEXES):
+            op.drop_index(name, table)
+        with op.batch_alter_table("messages") as batch:
+            batch.alter_column("timestamp", existing_type=sa.DateTime, nullable=True)
+        return
+
+    # Back to a single table. This copies every row: plan it like any bulk rewrite.
+    sequence = bind.execute(sa.text("SELECT pg_get_serial_sequence('messages', 'id')")).scalar()
+    op.execute("DROP FUNCTION IF EXISTS ensure_messages_partitions(integer, timestamp)")
+    op.execute(f"""
+        CREATE TABLE messages_unpartitioned (
+            id integer PRIMARY KEY DEFAULT nextval('{sequence}'),
+            conversation_id integer REFERENCES conversations (id),
+            content text,
+            "timestamp" timestamp DEFAULT CURRENT_TIMESTAMP,
+            sender varchar(50),
+            intent varchar(100),
+            confidence double precision
+        )
+    """)
+    op.execute("INSERT INTO messages_unpartitioned SELECT * FROM messages")
+    op.execute(f"ALTER SEQUENCE {sequence} OWNED BY messages_unpartitioned.id")
+    op.execute("DROP TABLE messages") # Drops every partition with it
+    op.execute("ALTER TABLE messages_unpartitioned RENAME TO messages")
+    op.execute("ALTER TABLE messages RENAME CONSTRAINT messages_unpartitioned_pkey TO messages_pkey")
+    op.execute("ALTER TABLE messages RENAME CONSTRAINT messages_unpartitioned_conversation_id_fkey TO messages_conversation_id_fkey")
+    for name, table, _ in reversed(INDEXES):
+        op.execute(f"DROP INDEX IF EXISTS {name}")
@@ -1,7 +1,25 @@
-from fastapi import APIRouter
+import logging
+
+from fastapi import APIRouter, Depends
+
+from ...config import settings
 from .chatbot import router as chatbot_router
+from .admin import router as admin_router
+from .auth import require_admin_token
+from .batch import router as batch_router
+from .escalations import router as escalations_router
 
 api_router_v1 = APIRouter()
 
 # Include routers from this version
-api_router_v1.include_router(chatbot_router, prefix="/chat", tags=["Chatbot"])
\ No newline at end of file
+api_router_v1.include_router(chatbot_router, prefix="/chat", tags=["Chatbot"])
+api_router_v1.include_router(batch_router, prefix="/chat", tags=["Chatbot"]) # /chat/batch, /chat/batch/stream
+
+# Operator routes: not mounted unless enabled, and token-protected when they are (auth.py)
+if settings.ADMIN_API_ENABLED:
+    if not settings.ADMIN_API_TOKEN:
+        logging.getLogger(__name__).warning(
+            "ADMIN_API_ENABLED is set without ADMIN_API_TOKEN: /admin and /escalations refuse every request")
+    operator = [Depends(require_admin_token)]
+    api_router_v1.include_router(escalations_router, prefix="/escalations", tags=["Escalations"], dependencies=operator)
+    api_router_v1.include_router(admin_router, prefix="/admin", tags=["Admin"], dependencies=operator)
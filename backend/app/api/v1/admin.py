@@ -0,0 +1,122 @@
+# backend/app/api/v1/admin.py
+# Operational endpoints for inspecting the running worker (cache efficiency, batching, ...).
+# Only mounted with ADMIN_API_ENABLED, behind ADMIN_API_TOKEN (auth.py).
+import asyncio
+import time
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException, Query
+
+from ...config import settings
+from ...core import log, nlp
+from ...core.profiler import MIN_INTERVAL_MS
+from ...core.tracing import to_otlp
+from ...db import schemas
+from .chatbot import (connection_manager, conversation_states, ecommerce_service, lookup_planner, message_log,
+                      profiler, task_batchers, tracer, turn_timings)
+
+router = APIRouter()
+
+
+@router.get("/nlp/stats")
+async def nlp_stats():
+    """Model status, prediction cache hit/miss counters, token-length histogram and micro-batching figures for this worker."""
+    classifier = nlp.model_manager.classifier # None until loaded
+    cache = getattr(classifier, "cache", None)
+    length_tokenizer = getattr(classifier, "length_tokenizer", None)
+    return {
+        "model": nlp.model_manager.status(),
+        "cache": cache.stats() if cache is not None else None,
+        # Tune NLP_SEQ_LENGTH_PERCENTILE / NLP_SEQ_LENGTH_BUCKETS from this
+        "token_lengths": length_tokenizer.stats() if length_tokenizer is not None else None,
+        "batching": {
+            "enabled": settings.NLP_BATCHING_ENABLED,
+            "batches_run": nlp.intent_batcher.batches_run,
+            "items_processed": nlp.intent_batcher.items_processed,
+            "average_batch_size": round(nlp.intent_batcher.average_batch_size, 2),
+        },
+        "pending_inferences": nlp.pending_inferences(),
+    }
+
+
+@router.get("/ecommerce/stats")
+async def ecommerce_stats():
+    """Read-through cache counters, upstream call/retry/failure counters and circuit-breaker state."""
+    stats = getattr(ecommerce_service, "stats", None)
+    return {"service": type(ecommerce_service).__name__, "stats": stats() if stats else None}
+
+
+@router.get("/lookups/stats")
+async def lookup_stats():
+    """
+    Upstream lookups per intent: speculative lookups used and cancelled, and the latency saved
+    (lookups one by one after classification, against what turns actually waited).
+    """
+    return {"speculation": lookup_planner.speculate, **lookup_planner.stats.stats()}
+
+
+@router.get("/message-log/stats")
+async def message_log_stats():
+    """Write-behind message log: buffered rows, flushes and flush lag (how far the database trails replies)."""
+    # stats() reads the buffer, a Redis round-trip with the shared buffer: off the event loop
+    return {"write_behind": message_log is not None,
+            "stats": await asyncio.to_thread(message_log.stats) if message_log is not None else None}
+
+
+@router.get("/connections/stats")
+async def connection_stats():
+    """
+    This worker's WebSockets and fan-out counters (frames published/received over Redis, writes,
+    slow-consumer evictions), and per-stage timings of WebSocket turns.
+    """
+    return {**connection_manager.stats(), "turn_timings": turn_timings.stats()}
+
+
+@router.get("/background/stats")
+async def background_stats():
+    """Batched Celery work of this worker: items buffered and sent, batch sizes, and items dropped (broker down)."""
+    return {"enabled": bool(task_batchers), "batchers": {name: batcher.stats() for name, batcher in task_batchers.items()}}
+
+
+@router.get("/conversation-state/stats")
+async def conversation_state_stats():
+    """Conversation state cache: hit rate, SELECTs saved, follow-up turns answered from remembered slots, invalidations."""
+    return {"enabled": conversation_states is not None,
+            "stats": conversation_states.stats() if conversation_states is not None else None}
+
+
+@router.get("/tracing/stats")
+async def tracing_stats():
+    """Turns traced, kept as slow or sampled, and exported or dropped; the profiler's state; log records dropped."""
+    return {"enabled": tracer is not None, "tracer": tracer.stats() if tracer is not None else None,
+            "profiler": profiler.status(), "logging": log.stats()}
+
+
+@router.get("/traces/slow")
+async def slow_traces(limit: int = Query(10, ge=1, le=100)):
+    """The last kept turn traces on this worker, newest first, as OTLP JSON (with their profile stacks, if any)."""
+    if tracer is None:
+        raise HTTPException(status_code=404, detail="Tracing is disabled (TRACING_ENABLED)")
+    return to_otlp(list(tracer.recent)[::-1][:limit], settings.TRACE_SERVICE_NAME)
+
+
+class ProfilerToggle(schemas.BaseModel):
+    enabled: bool
+    interval_ms: Optional[float] = schemas.Field(None, ge=MIN_INTERVAL_MS)
+
+
+@router.post("/profiler")
+async def toggle_profiler(toggle: ProfilerToggle):
+    """Starts or stops the sampling profiler of this worker; while it runs, slow turn traces carry its stacks."""
+    if toggle.enabled:
+        profiler.start(toggle.interval_ms)
+    else:
+        await asyncio.to_thread(profiler.stop) # Joins the sampling thread
+    return profiler.status()
+
+
+@router.get("/profiler")
+async def profiler_stacks(seconds: float = Query(10.0, gt=0)):
+    """Collapsed stacks ("thread;outer;...;inner" -> samples) of the last `seconds`, for a flame graph."""
+    return {**profiler.status(), "seconds": seconds,
+            "stacks": profiler.collapsed(time.perf_counter() - seconds)}
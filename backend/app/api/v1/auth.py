@@ -0,0 +1,18 @@
+# backend/app/api/v1/auth.py
+# Access to the operator routes (/admin, /escalations), which nginx proxies publicly along
+# with the rest of /api/. They are only mounted with ADMIN_API_ENABLED (api/v1/__init__.py),
+# and every request must carry ADMIN_API_TOKEN as "Authorization: Bearer <token>".
+
+import secrets
+from typing import Optional
+
+from fastapi import Header, HTTPException
+
+from ...config import settings
+
+
+async def require_admin_token(authorization: Optional[str] = Header(None)) -> None:
+    scheme, _, token = (authorization or "").partition(" ")
+    expected = settings.ADMIN_API_TOKEN
+    if not expected or scheme.lower() != "bearer" or not secrets.compare_digest(token.encode(), expected.encode()):
+        raise HTTPException(status_code=401, detail="Admin token required", headers={"WWW-Authenticate": "Bearer"})
@@ -0,0 +1,302 @@
+# backend/app/api/v1/batch.py
+# Bulk chat API, for replaying recorded conversations and for integrations that forward
+# messages in bulk:
+#
+#   POST /chat/batch          {"items": [ChatPayload, ...]} -> {"results": [...]}, in input order
+#   POST /chat/batch/stream   NDJSON body, one ChatPayload per line -> NDJSON results, one line
+#                             per item as soon as it is stored (completion order, with "index")
+#
+# Each item is answered the way /chat answers it, but the work is done in bulk:
+#   classify   chunks of CHAT_BATCH_NLP_CHUNK messages, one forward pass each
+#   lookup     concurrently, at most CHAT_BATCH_LOOKUP_CONCURRENCY items' lookups at a time per
+#              request; not speculative (core/lookups.py): a batch waits on throughput, not latency
+#   persist    whatever turns are ready, up to CHAT_BATCH_PERSIST_SIZE per transaction (persist_turns)
+# The stages overlap: a chunk is classified while the previous chunk's lookups run, and ready
+# turns are stored while others still wait on a lookup. A failed item gets {"index", "error"}
+# and doesn't stop the others.
+#
+# The stages hand items over through bounded queues, and a lookup only starts once it has a
+# slot, so a slow stage holds back the ones before it - down to the request body, which
+# /chat/batch/stream then stops reading: a replay of any length takes a bounded amount of
+# memory, whatever the rate it is uploaded at.
+
+import asyncio
+import json
+import logging
+from typing import Any, AsyncIterator, Dict, List, Tuple, Union
+
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from . import chatbot
+from .chatbot import ChatPayload, HTTP_ESCALATION_REPLY, generate_bot_response
+from ...config import settings
+from ...core.nlp import InferenceQueueFull, InferenceUnavailable, model_manager, process_messages_async
+from ...db import schemas
+from ...db.session import get_async_session_factory
+from ...db.turns import TurnInput, persist_turns
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+NLP_RETRY_SECONDS = 30.0 # A batch waits this long for room in the inference queue before failing a chunk
+
+
+class BatchChatRequest(schemas.BaseModel):
+    items: List[ChatPayload]
+
+
+# An item is a payload, or the error message for one that couldn't be parsed
+BatchItem = Tuple[int, Union[ChatPayload, str]]
+
+
+async def _classify(texts: List[str]) -> List[Tuple[str, float, Dict[str, Any]]]:
+    """process_messages_async, waiting with backoff while the inference queue is full (interactive traffic goes first)."""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + NLP_RETRY_SECONDS
+    delay = 0.05
+    while True:
+        try:
+            return await process_messages_async(texts)
+        except InferenceQueueFull:
+            if loop.time() + delay > deadline:
+                raise
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 1.0)
+
+
+async def run_chat_batch(items: AsyncIterator[BatchItem], session_factory: async_sessionmaker) -> AsyncIterator[Dict[str, Any]]:
+    """Yields one result per item, {"index": ..., **ChatResponse} or {"index": ..., "error": ...}, as each is stored."""
+    chunk_size = max(1, min(settings.CHAT_BATCH_NLP_CHUNK, settings.NLP_INFERENCE_MAX_QUEUE))
+    # (index, payload) waiting for classification; None ends. Full: the body isn't read further
+    incoming: asyncio.Queue = asyncio.Queue(maxsize=2 * chunk_size)
+    # ("turn", index, payload, nlp, bot_text, escalate) / ("error", index, message); None ends
+    ready: asyncio.Queue = asyncio.Queue(maxsize=2 * max(chunk_size, settings.CHAT_BATCH_PERSIST_SIZE))
+    lookup_slots = asyncio.Semaphore(max(1, settings.CHAT_BATCH_LOOKUP_CONCURRENCY))
+
+    async def read() -> None:
+        cancelled = False
+        try:
+            async for index, item in items:
+                if isinstance(item, str):
+                    await ready.put(("error", index, item))
+                elif not item.text:
+                    await ready.put(("error", index, "Text input cannot be empty"))
+                else:
+                    await incoming.put((index, item))
+        except asyncio.CancelledError:
+            cancelled = True # Torn down: nobody is left to take the end marker
+            raise
+        finally:
+            if not cancelled:
+                await incoming.put(None)
+
+    async def lookup(index: int, payload: ChatPayload, nlp: Tuple[str, float, Dict[str, Any]]) -> None:
+        """Runs with a slot of lookup_slots already taken (by classify), and gives it back."""
+        intent, confidence, entities = nlp
+        try:
+            bot_text = await generate_bot_response(intent, confidence, payload.text, entities, None,
+                                                   payload.conversation_id, payload.user_id)
+        except Exception as e:
+            lookup_slots.release()
+            await ready.put(("error", index, str(e)))
+            return
+        lookup_slots.release()
+        await ready.put(("turn", index, payload, nlp, bot_text, False))
+
+    async def classify() -> None:
+        lookups = set()
+        cancelled = False
+        try:
+            done = False
+            while not done:
+                first = await incoming.get()
+                if first is None:
+                    break
+                chunk = [first]
+                while len(chunk) < chunk_size and not incoming.empty(): # Whatever has arrived, up to one chunk
+                    item = incoming.get_nowait()
+                    if item is None:
+                        done = True
+                        break
+                    chunk.append(item)
+                try:
+                    classified = await _classify([payload.text for _, payload in chunk])
+                except Exception as e:
+                    for index, _ in chunk:
+                        await ready.put(("error", index, getattr(e, "detail", str(e))))
+                    continue
+                for (index, payload), nlp in zip(chunk, classified):
+                    intent, confidence, _ = nlp
+                    if confidence < settings.CONFIDENCE_THRESHOLD or intent == "human_agent":
+                        await ready.put(("turn", index, payload, nlp, HTTP_ESCALATION_REPLY, True))
+                    else:
+                        await lookup_slots.acquire() # No more lookups waiting than can run
+                        task = asyncio.get_running_loop().create_task(lookup(index, payload, nlp))
+                        lookups.add(task)
+                        task.add_done_callback(lookups.discard)
+            if lookups:
+                await asyncio.gather(*lookups)
+        except asyncio.CancelledError:
+            cancelled = True
+            raise
+        finally:
+            for task in lookups: # Only left over if we were cancelled (client went away)
+                task.cancel()
+            if not cancelled:
+                await ready.put(None)
+
+    async def store(group: List[Tuple]) -> List[Dict[str, Any]]:
+        turns = [
+            TurnInput(payload.conversation_id, payload.user_id, payload.text, intent, confidence, bot_text,
+                      "bot_response" if escalate else intent, escalate)
+            for _, _, payload, (intent, confidence, _), bot_text, escalate in group
+        ]
+        message_ids = None
+        if chatbot.message_log is not None: # Ids from the same blocks as the buffered turns, so they can't collide
+            message_ids = await chatbot.message_log.ids.allocate_async(2 * len(turns))
+        async with session_factory() as db:
+            records = await persist_turns(db, turns, message_ids=message_ids)
+        results = []
+        for (_, index, payload, (intent, confidence, entities), _, escalate), record in zip(group, records):
+            await chatbot.after_turn("batch", record, payload.user_id, payload.text, intent, confidence, escalate)
+            response_data = {
+                "conversation_id": record.conversation_id,
+                "user_message_id": record.user_message_id,
+                "intent": intent,
+                "confidence": confidence,
+                "entities": entities,
+                "requires_human_escalation": escalate,
+                "response": record.bot_text,
+                "bot_message_id": record.bot_message_id,
+                "escalation_ticket_id": record.escalation_ticket_id,
+            }
+            if payload.conversation_id: # Like /chat: open sockets on the conversation see the turn
+                await chatbot.connection_manager.publish(
+                    record.conversation_id, {**response_data, "type": "conversation_turn", "text_received": payload.text})
+            results.append({"index": index, **response_data})
+        return results
+
+    loop = asyncio.get_running_loop()
+    workers = [loop.create_task(read()), loop.create_task(classify())]
+    try:
+        finished = False
+        while not finished:
+            entry = await ready.get()
+            if entry is None:
+                break
+            group, errors = [], []
+            while entry is not None: # Everything ready right now, up to one transaction's worth
+                (errors if entry[0] == "error" else group).append(entry)
+                if len(group) >= settings.CHAT_BATCH_PERSIST_SIZE or ready.empty():
+                    break
+                entry = ready.get_nowait()
+            finished = entry is None
+            for _, index, message in errors:
+                yield {"index": index, "error": message}
+            if group:
+                try:
+                    results = await store(group)
+                except Exception as e:
+                    logger.warning("Chat batch: storing %d turns failed: %s - %s", len(group), type(e).__name__, e)
+                    results = [{"index": entry[1], "error": f"Could not store the turn: {e}"} for entry in group]
+                for result in results:
+                    yield result
+        await workers[0] # Surfaces a failure reading the request body
+    finally:
+        for worker in workers:
+            worker.cancel()
+
+
+def _ensure_model_ready() -> None:
+    # Checked before any work starts, so an unloaded model is one 503 rather than an error per item
+    try:
+        model_manager.get()
+    except InferenceUnavailable as e:
+        raise HTTPException(status_code=503, detail=e.detail, headers={"Retry-After": "1"})
+
+
+@router.post("/batch")
+async def chat_batch_endpoint(
+    payload: BatchChatRequest,
+    session_factory: async_sessionmaker = Depends(get_async_session_factory)
+):
+    if len(payload.items) > settings.CHAT_BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {settings.CHAT_BATCH_MAX_ITEMS} items per batch")
+    _ensure_model_ready()
+
+    async def items() -> AsyncIterator[BatchItem]:
+        for index, item in enumerate(payload.items):
+            yield index, item
+
+    results: List[Any] = [None] * len(payload.items)
+    async for result in run_chat_batch(items(), session_factory):
+        results[result["index"]] = result
+    return {"count": len(results), "errors": sum("error" in r for r in results), "results": results}
+
+
+async def _ndjson_items(request: Request) -> AsyncIterator[BatchItem]:
+    """
+    Parses the request body line by line as it arrives; blank lines are skipped. An item past
+    CHAT_BATCH_MAX_ITEMS gets one error and the rest of the body is left unread: results are
+    already streaming, so it is too late for the 413 /chat/batch answers.
+    """
+    index = 0
+    buffer = b""
+    too_many = f"At most {settings.CHAT_BATCH_MAX_ITEMS} items per batch; the rest of the body was not read"
+
+    def parse(line: bytes) -> Union[ChatPayload, str]:
+        try:
+            return ChatPayload.model_validate_json(line)
+        except ValidationError as e:
+            return f"Invalid item: {e.errors()[0]['msg']}"
+
+    async for data in request.stream():
+        buffer += data
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if line.strip():
+                if index >= settings.CHAT_BATCH_MAX_ITEMS:
+                    yield index, too_many
+                    return
+                yield index, parse(line)
+                index += 1
+    if buffer.strip():
+        yield index, parse(buffer) if index < settings.CHAT_BATCH_MAX_ITEMS else too_many
+
+
+class DuplexStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse whose results start going out while the request body is still coming in.
+    Starlette's own listens for the client disconnecting by calling receive() alongside the
+    stream, which would take the body chunks away from request.stream(). Here only the body
+    reader calls receive(), and it notices a disconnect itself (ClientDisconnect).
+    """
+
+    async def __call__(self, scope, receive, send) -> None:
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
+
+
+@router.post("/batch/stream")
+async def chat_batch_stream_endpoint(
+    request: Request,
+    session_factory: async_sessionmaker = Depends(get_async_session_factory)
+):
+    """
+    Newline-delimited JSON in and out. Items are picked up while the body is still being
+    uploaded, and each result line is written as soon as its turn is stored, so a client can
+    stream a large replay through without holding it all in memory on either side.
+    """
+    _ensure_model_ready()
+
+    async def lines() -> AsyncIterator[str]:
+        async for result in run_chat_batch(_ndjson_items(request), session_factory):
+            yield json.dumps(result, default=str) + "\n"
+
+    return DuplexStreamingResponse(lines(), media_type="application/x-ndjson",
+                                   headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
@@ -1,60 +1,99 @@
 # backend/app/api/v1/chatbot.py
 from fastapi import APIRouter, Depends, HTTPException, WebSocket, WebSocketDisconnect, Query
-from typing import Dict, Any, Optional, List
-from sqlalchemy.orm import Session
+from fastapi.responses import StreamingResponse
+from typing import AsyncIterator, Dict, Any, Optional, List, Tuple
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
 from datetime import datetime
 import asyncio # For potential async operations with services
+import json
+import logging
 import random # Import random
+import time
 
-from ....app.core.nlp import process_message
-from ....app.core.escalations import handle_escalation # Assuming create_escalation_ticket is also used or part of it
-from ....app.db.session import get_db
-from ....app.db import models, schemas
-from ....app.config import settings
-from ....app.services.ecommerce_api import MockEcommerceAPI # Import the mock service
+from ...core.background import build_task_batchers
+from ...core.connections import build_connection_manager
+from ...core.conversation_state import ConversationState, build_conversation_state_store
+from ...core.escalations import EscalationNotifier, build_escalation_queue
+from ...core.lookups import LookupPlanner, TurnLookups
+from ...core.metrics import WEBSOCKET_CONNECTIONS, count_turn
+from ...core.nlp import process_message_async, InferenceUnavailable
+from ...core.pipeline import StageTimings, TurnPipeline
+from ...core.profiler import SamplingProfiler
+from ...core.tracing import annotate, build_tracer
+from ...db.session import get_async_db, get_async_session_factory
+from ...db import models, schemas
+from ...db.message_log import build_message_log
+from ...db.turns import record_turn
+from ...config import settings
+from ...services.ecommerce_api import build_ecommerce_service
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
-ecommerce_service = MockEcommerceAPI()
+ecommerce_service = build_ecommerce_service() # HTTP client if ECOMMERCE_API_BASE_URL is set, else the mock
+message_log = build_message_log() # Write-behind buffer for messages; None = write each turn synchronously
+connection_manager = build_connection_manager() # This worker's WebSockets; turns fan out to other workers via Redis
+WEBSOCKET_CONNECTIONS.set_function(connection_manager.local_connections) # Read at scrape time
+turn_timings = StageTimings() # Per-stage latency of WebSocket turns on this worker
+escalation_queue = build_escalation_queue() # Redis stream of new tickets for agents and notifications; None = database only
+# This worker's consumer of the stream's notifications group (send_escalation_notification)
+escalation_notifier = (EscalationNotifier(escalation_queue, connection_manager.worker_id)
+                       if escalation_queue is not None and settings.ESCALATION_NOTIFIER_ENABLED else None)
+# Batched Celery tasks for a turn's non-critical work, by task name; empty = none of it runs
+task_batchers = build_task_batchers(delayed=message_log is not None)
+# Starts a turn's likely lookups while it is classified, and counts the latency saved per intent
+lookup_planner = LookupPlanner(speculate=settings.LOOKUP_SPECULATION_ENABLED)
+# Conversation rows and remembered slots (last order, last product); None = every turn reads the database and starts from nothing
+conversation_states = build_conversation_state_store()
+# Stack sampler, off unless PROFILER_ENABLED or switched on through POST /admin/profiler
+profiler = SamplingProfiler(settings.PROFILER_INTERVAL_MS, settings.PROFILER_MAX_SAMPLES)
+# Traces of slow (and TRACE_SAMPLE_RATIO of other) turns, with the profiler's stacks; None = TRACING_ENABLED off
+tracer = build_tracer(profiler)
+
+
+def start_lookups(text: Optional[str] = None) -> TurnLookups:
+    """A turn's upstream lookups; pass the message text before classifying it to start the speculative ones."""
+    return lookup_planner.start(ecommerce_service, text)
 
 # --- Helper function to manage or create conversations and log messages ---
-def get_or_create_conversation(db: Session, user_id: Optional[str], conversation_id: Optional[int] = None) -> models.Conversation:
+async def get_or_create_conversation(db: AsyncSession, user_id: Optional[str], conversation_id: Optional[int] = None) -> models.Conversation:
     db_conversation = None
     if conversation_id:
-        db_conversation = db.query(models.Conversation).filter(models.Conversation.id == conversation_id).first()
+        db_conversation = (await db.execute(
+            select(models.Conversation).where(models.Conversation.id == conversation_id)
+        )).scalar_one_or_none()
 
     if not db_conversation:
         conversation_data = schemas.ConversationCreate(user_id=user_id)
         db_conversation = models.Conversation(**conversation_data.model_dump(), start_time=datetime.utcnow())
         db.add(db_conversation)
-        db.commit()
-        db.refresh(db_conversation)
+        await db.commit()
+        await db.refresh(db_conversation)
     return db_conversation
 
-def log_message(db: Session, conversation_id: int, text: str, sender: str, intent: Optional[str] = None, confidence: Optional[float] = None) -> models.Message:
-    message_data = schemas.MessageCreate(
-        conversation_id=conversation_id,
-        content=text,
-        sender=sender,
-        intent=intent,
-        confidence=confidence
-    )
-    db_message = models.Message(**message_data.model_dump(), timestamp=datetime.utcnow())
-    db.add(db_message)
-    db.commit()
-    db.refresh(db_message)
-    return db_message
-
 # --- Enhanced Response Generation with Business Logic ---
-async def generate_bot_response(
+# stream_bot_response yields the reply in chunks, for the streaming modes of /ws and
+# /chat/stream; generate_bot_response joins them. The intent's upstream lookups are made
+# together up front (core/lookups.py), possibly already running since before classification;
+# a reply combining several lookups (track_order: the order, then its tracking) has a chunk per part.
+async def stream_bot_response(
     intent: str,
     confidence: float,
     message_text: str, # User's original message text
     entities: Dict[str, Any],
-    db: Session, # Keep db session if needed for complex response generation (e.g. fetching history)
-    conversation_id: int, # Keep for context
-    user_id: Optional[str] = None # Keep for context
-) -> str:
+    db: Optional[AsyncSession], # Keep db session if needed for complex response generation (e.g. fetching history); None from the WebSocket pipeline
+    conversation_id: Optional[int], # Keep for context (None for a conversation this turn starts)
+    user_id: Optional[str] = None, # Keep for context
+    lookups: Optional[TurnLookups] = None, # From start_lookups(text) before classifying; None = no speculation
+) -> AsyncIterator[str]:
     response_text = f"I'm not sure how to help with that. (Intent: {intent})"
+    if lookups is None:
+        lookups = start_lookups()
+    try:
+        found = await lookups.fetch(intent, entities) # Every lookup the intent needs, concurrently
+    finally:
+        lookups.close() # Speculative lookups the intent didn't need
 
     if intent == "greet":
         response_text = random.choice(["Hello! How can I assist  today?", "Hi there! What can I do for ?", "Hey! How may I help?"])
@@ -65,13 +104,17 @@ async def generate_bot_response(
     elif intent == "track_order":
         order_id = entities.get("order_id")
         if order_id:
-            order_details = await ecommerce_service.get_order_details(order_id)
+            order_details = found["order_details"]
             if "error" not in order_details:
                 response_text = f"Order {order_id}: Status is '{order_details.get('status', 'N/A')}'."
                 if order_details.get('estimated_delivery'):
                     response_text += f" Estimated delivery: {order_details['estimated_delivery']}."
                 if order_details.get('status') == "Delivered" and order_details.get('delivery_date'):
                      response_text += f" Delivered on: {order_details['delivery_date']}."
+                tracking_number = found["shipping_info"].get("tracking_number")
+                if tracking_number: # Fetched alongside the order, answers "has it shipped?" too
+                    yield response_text
+                    response_text = f" Tracking: {tracking_number}."
             else:
                 response_text = f"Sorry, I couldn't find details for order ID '{order_id}'. {order_details.get('error', 'Please check the ID and try again.')}"
         else:
@@ -80,7 +123,7 @@ async def generate_bot_response(
     elif intent == "product_info":
         product_query = entities.get("product_name_query")
         if product_query:
-            product_details = await ecommerce_service.get_product_info(product_query)
+            product_details = found["product_info"]
             if "error" not in product_details:
                 response_text = f"Regarding '{product_details.get('name', product_query)}': {product_details.get('description', 'No description available.')} Price: ${product_details.get('price', 'N/A'):.2f}. Currently {'in stock' if product_details.get('in_stock') else 'out of stock'}."
                 if not product_details.get('in_stock') and "Expected restock" in product_details.get('description',''):
@@ -93,7 +136,7 @@ async def generate_bot_response(
     elif intent == "price_query":
         product_query = entities.get("product_name_query")
         if product_query:
-            product_details = await ecommerce_service.get_product_info(product_query)
+            product_details = found["product_info"]
             if "error" not in product_details and product_details.get('price') is not None:
                 response_text = f"The price for '{product_details.get('name', product_query)}' is ${product_details['price']:.2f}."
             elif "error" not in product_details:
@@ -106,7 +149,7 @@ async def generate_bot_response(
     elif intent == "availability":
         product_query = entities.get("product_name_query")
         if product_query:
-            product_details = await ecommerce_service.get_product_info(product_query)
+            product_details = found["product_info"]
             if "error" not in product_details:
                 status = 'in stock' if product_details.get('in_stock') else 'out of stock'
                 response_text = f"'{product_details.get('name', product_query)}' is currently {status}."
@@ -138,7 +181,7 @@ async def generate_bot_response(
     elif intent == "shipping_info":
         order_id = entities.get("order_id")
         if order_id:
-            shipping_details = await ecommerce_service.check_shipping_info(order_id)
+            shipping_details = found["shipping_info"]
             if "error" not in shipping_details:
                 response_text = f"Shipping status for order {order_id}: {shipping_details.get('status')}."
                 if shipping_details.get('tracking_number'):
@@ -164,7 +207,62 @@ async def generate_bot_response(
         if confidence < 0.3 and intent != "empty_message": 
             response_text = "I'm not quite sure what  mean. Could  please rephrase the question or ask for 'help'?"
 
-    return response_text
+    yield response_text
+
+
+async def generate_bot_response(
+    intent: str,
+    confidence: float,
+    message_text: str,
+    entities: Dict[str, Any],
+    db: Optional[AsyncSession],
+    conversation_id: Optional[int],
+    user_id: Optional[str] = None,
+    lookups: Optional[TurnLookups] = None,
+) -> str:
+    return "".join([chunk async for chunk in stream_bot_response(intent, confidence, message_text, entities, db, conversation_id, user_id, lookups)])
+
+async def recall_conversation(db: AsyncSession, conversation_id: Optional[int], intent: str,
+                              entities: Dict[str, Any]) -> Tuple[Optional[ConversationState], Dict[str, Any]]:
+    """
+    The conversation's state (cached, else read once from its row; None for a new or unknown
+    conversation) and the turn's entities with remembered slots filled in.
+    """
+    if conversation_states is None:
+        return None, entities
+    state = await conversation_states.lookup(db, conversation_id)
+    return state, conversation_states.fill(state, intent, entities)
+
+
+async def after_turn(channel: str, turn, user_id: Optional[str], text: str, intent: str, confidence: float, escalate: bool,
+                     entities: Optional[Dict[str, Any]] = None, state: Optional[ConversationState] = None) -> None:
+    """
+    Once a turn is stored (record_turn / persist_turns): counts it for /metrics, labels its
+    trace, adds its new ticket to the escalation stream, writes the conversation's state back
+    (slots from `entities`; dropped on escalation), and buffers its background work - an
+    analytics event and, when the model was unsure but we answered anyway, a
+    re-classification. Buffering is in-process; the Celery tasks are sent in batches by the
+    TaskBatchers.
+    """
+    count_turn(channel, intent, escalate)
+    if channel != "batch": # A /chat/batch request is one trace for many turns
+        annotate(channel=channel, intent=intent, confidence=round(confidence, 4), escalated=escalate,
+                 conversation_id=turn.conversation_id)
+    if turn.escalation_ticket_id is not None and escalation_queue is not None:
+        await escalation_queue.enqueue(turn.escalation_ticket_id, turn.conversation_id, user_id, text)
+    if conversation_states is not None:
+        await conversation_states.after_turn(state, turn.conversation_id, user_id, entities, escalate)
+    analytics = task_batchers.get("record_turn_analytics")
+    if analytics is not None:
+        analytics.add({"ts": time.time(), "channel": channel, "intent": intent, "confidence": confidence,
+                       "escalated": escalate, "conversation_id": turn.conversation_id})
+    reclassify = task_batchers.get("reclassify_messages")
+    if reclassify is not None and not escalate and intent != "empty_message" and confidence < settings.RECLASSIFY_BELOW_CONFIDENCE:
+        reclassify.add({"message_id": turn.user_message_id, "text": text, "intent": intent, "confidence": confidence})
+
+# Escalation replies; "{ticket_id}" is filled in by persist_turn once the ticket row exists
+HTTP_ESCALATION_REPLY = "I'm not quite sure how to best assist with that, or 've requested help. I'm connecting  to a human agent. the Ticket ID is: {ticket_id}"
+WS_ESCALATION_REPLY = "Connecting  to a human agent. the Ticket ID: {ticket_id}"
 
 # Model for HTTP Chat Payload
 class ChatPayload(schemas.BaseModel):
@@ -175,137 +273,281 @@ class ChatPayload(schemas.BaseModel):
 @router.post("/chat", response_model=schemas.ChatResponse) # Define a response model
 async def http_chat_endpoint(
     payload: ChatPayload, 
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     if not payload.text:
         raise HTTPException(status_code=400, detail="Text input cannot be empty")
 
-    active_conversation = get_or_create_conversation(db, payload.user_id, payload.conversation_id)
-    
-    # Log user message BEFORE NLP processing
-    user_db_message = log_message(db, active_conversation.id, payload.text, "user")
-    
-    intent, confidence, entities = process_message(payload.text)
+    # Classify first: if the model isn't ready or the inference queue is full we shed the request
+    # before writing anything, so a client retrying after the 503 doesn't leave duplicate user messages behind
+    lookups = start_lookups(payload.text) # An order ID in the message: its lookups run while the model classifies
+    try:
+        intent, confidence, entities = await process_message_async(payload.text)
+    except InferenceUnavailable as e:
+        lookups.close()
+        raise HTTPException(status_code=503, detail=e.detail, headers={"Retry-After": "1"})
 
-    # Update user's message in DB with NLP results
-    user_db_message.intent = intent
-    user_db_message.confidence = confidence
-    db.commit()
-    db.refresh(user_db_message)
+    # A known conversation needs no SELECT, and "has it shipped?" gets the order ID of the turn before
+    state, entities = await recall_conversation(db, payload.conversation_id, intent, entities)
+    escalate = confidence < settings.CONFIDENCE_THRESHOLD or intent == "human_agent"
+    if escalate:
+        logger.info("Escalation triggered for user '%s' in conversation %s", payload.user_id, payload.conversation_id)
+        lookups.close(intent)
+        bot_response_text = HTTP_ESCALATION_REPLY
+    else:
+        bot_response_text = await generate_bot_response(intent, confidence, payload.text, entities, db, payload.conversation_id, payload.user_id, lookups)
 
-    response_payload = {
-        "conversation_id": active_conversation.id,
-        "user_message_id": user_db_message.id, # Send back user message ID
+    # Conversation, user message (with its NLP results), bot message and ticket: one transaction,
+    # or with the write-behind log only the conversation now and the messages in the next bulk flush
+    turn = await record_turn(
+        db, payload.conversation_id, payload.user_id, payload.text, intent, confidence,
+        bot_response_text, "bot_response" if escalate else intent, escalate=escalate,
+        conversation_verified=state is not None, message_log=message_log,
+    )
+    await after_turn("http", turn, payload.user_id, payload.text, intent, confidence, escalate, entities, state)
+    response_data = {
+        "conversation_id": turn.conversation_id,
+        "user_message_id": turn.user_message_id, # Send back user message ID
         "intent": intent,
         "confidence": confidence,
         "entities": entities,
-        "requires_human_escalation": False,
-        "response": "", # Initialize response
-        "bot_message_id": None # Initialize
+        "requires_human_escalation": escalate,
+        "response": turn.bot_text,
+        "bot_message_id": turn.bot_message_id,
+        "escalation_ticket_id": turn.escalation_ticket_id,
     }
+    if payload.conversation_id: # Open sockets on the conversation see turns made over HTTP too
+        await connection_manager.publish(turn.conversation_id, {**response_data, "type": "conversation_turn", "text_received": payload.text})
+    return response_data
 
-    if confidence < settings.CONFIDENCE_THRESHOLD or intent == "human_agent":
-        ticket = handle_escalation(payload.text, payload.user_id, db, conversation_id=active_conversation.id)
-        bot_response_text = f"I'm not quite sure how to best assist with that, or 've requested help. I'm connecting  to a human agent. the Ticket ID is: {ticket.id}"
-        response_payload["response"] = bot_response_text
-        response_payload["requires_human_escalation"] = True
-        response_payload["escalation_ticket_id"] = ticket.id
-    else:
-        bot_response_text = await generate_bot_response(intent, confidence, payload.text, entities, db, active_conversation.id, payload.user_id)
-        response_payload["response"] = bot_response_text
-            
-    bot_db_message = log_message(db, active_conversation.id, bot_response_text, "bot", intent if intent != "human_agent" and confidence >= settings.CONFIDENCE_THRESHOLD else "bot_response", 1.0)
-    response_payload["bot_message_id"] = bot_db_message.id
-    
-    return response_payload
 
-# One conversation can have multiple client connections (e.g. user refreshes tab)
-active_connections: Dict[int, List[WebSocket]] = {} 
+def sse_event(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+@router.post("/chat/stream")
+async def http_chat_stream_endpoint(
+    payload: ChatPayload,
+    session_factory: async_sessionmaker = Depends(get_async_session_factory)
+):
+    """
+    /chat as Server-Sent Events: an `ack` event with the intent as soon as the message is
+    classified, a `chunk` event per part of the reply, then `final` with the same body
+    /chat returns (database ids included). An `error` event replaces `final` if the turn fails.
+    """
+    if not payload.text:
+        raise HTTPException(status_code=400, detail="Text input cannot be empty")
+    lookups = start_lookups(payload.text)
+    try: # Before the stream starts, so overload is still a plain 503
+        intent, confidence, entities = await process_message_async(payload.text)
+    except InferenceUnavailable as e:
+        lookups.close()
+        raise HTTPException(status_code=503, detail=e.detail, headers={"Retry-After": "1"})
+    async with session_factory() as db: # Only queried when the conversation isn't cached
+        state, entities = await recall_conversation(db, payload.conversation_id, intent, entities)
+    escalate = confidence < settings.CONFIDENCE_THRESHOLD or intent == "human_agent"
+
+    async def events():
+        yield sse_event("ack", {
+            "conversation_id": payload.conversation_id, "intent": intent, "confidence": confidence,
+            "entities": entities, "requires_human_escalation": escalate,
+        })
+        try:
+            if escalate:
+                logger.info("Escalation triggered for user '%s' in conversation %s", payload.user_id, payload.conversation_id)
+                lookups.close(intent)
+                bot_response_text = HTTP_ESCALATION_REPLY # Sent in `final`, once the ticket id exists
+            else:
+                chunks = []
+                async for chunk in stream_bot_response(intent, confidence, payload.text, entities, None, payload.conversation_id, payload.user_id, lookups):
+                    chunks.append(chunk)
+                    yield sse_event("chunk", {"index": len(chunks) - 1, "text": chunk})
+                bot_response_text = "".join(chunks)
+            # The session is opened here rather than as a dependency: it must live as long as the stream
+            async with session_factory() as db:
+                turn = await record_turn(
+                    db, payload.conversation_id, payload.user_id, payload.text, intent, confidence,
+                    bot_response_text, "bot_response" if escalate else intent, escalate=escalate,
+                    conversation_verified=state is not None, message_log=message_log,
+                )
+            await after_turn("sse", turn, payload.user_id, payload.text, intent, confidence, escalate, entities, state)
+        except Exception as e:
+            logger.warning("Error in streamed chat turn: %s - %s", type(e).__name__, e)
+            yield sse_event("error", {"error": str(e)})
+            return
+        response_data = {
+            "conversation_id": turn.conversation_id,
+            "user_message_id": turn.user_message_id,
+            "intent": intent,
+            "confidence": confidence,
+            "entities": entities,
+            "requires_human_escalation": escalate,
+            "response": turn.bot_text,
+            "bot_message_id": turn.bot_message_id,
+            "escalation_ticket_id": turn.escalation_ticket_id,
+        }
+        yield sse_event("final", response_data)
+        if payload.conversation_id:
+            await connection_manager.publish(turn.conversation_id, {**response_data, "type": "conversation_turn", "text_received": payload.text})
+
+    # No proxy buffering: every event should reach the client as soon as it is written
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 @router.websocket("/ws")
 async def websocket_chat_endpoint(
     websocket: WebSocket,
     user_id: Optional[str] = Query(None), # Allow user_id as query param
     conversation_id_query: Optional[int] = Query(None, alias="conversationId"), # Allow conversation_id as query param
-    db: Session = Depends(get_db)
+    batch: bool = Query(False), # Client accepts {"type": "batch", "frames": [...]} frames
+    stream: bool = Query(False), # Streaming replies: "ack" frame with the intent, "chunk" frames, then "final"
+    session_factory: async_sessionmaker = Depends(get_async_session_factory)
 ):
     await websocket.accept()
     
-    # Determine conversation: use existing if ID provided and valid, else create new
-    active_conversation = get_or_create_conversation(db, user_id, conversation_id_query)
-    conversation_id = active_conversation.id
+    # Determine conversation: use existing if ID provided and valid, else create new.
+    # Sessions are checked out per step, never per connection: an idle WebSocket holds no pooled connection.
+    state = await conversation_states.get(conversation_id_query) if conversation_states is not None else None
+    if state is not None: # Known conversation: no database round trip to connect
+        conversation_id = state.conversation_id
+    else:
+        async with session_factory() as db:
+            active_conversation = await get_or_create_conversation(db, user_id, conversation_id_query)
+        conversation_id = active_conversation.id
+        if conversation_states is not None:
+            await conversation_states.put(ConversationState(conversation_id, active_conversation.user_id, bool(active_conversation.escalated)))
 
-    if conversation_id not in active_connections:
-        active_connections[conversation_id] = []
-    active_connections[conversation_id].append(websocket)
+    # One conversation can have multiple client connections (e.g. user refreshes tab), on any worker.
+    # Everything sent to this socket goes through its connection's queue and writer.
+    connection = await connection_manager.connect(websocket, conversation_id, batch=batch)
     
-    print(f"WebSocket connected for conversation_id: {conversation_id}, user_id: {user_id}. Total connections for this convo: {len(active_connections[conversation_id])}")
+    logger.debug("WebSocket connected for conversation_id: %s, user_id: %s. Connections for this convo on this worker: %d",
+                 conversation_id, user_id, len(connection_manager.connections.get(conversation_id, ())))
 
     # Send initial connection confirmation with conversation_id
-    await websocket.send_json({"type": "connection_ack", "conversation_id": conversation_id, "message": "Connected to chatbot."})
+    await connection.send({"type": "connection_ack", "conversation_id": conversation_id, "message": "Connected to chatbot."})
+
+    # Turns go through a per-connection pipeline: the NLP and lookup stages of consecutive
+    # messages overlap, while persistence and replies stay in the order the messages arrived
+    def conversation_for(message: Dict[str, Any]) -> int:
+        # Ensure messages are logged to the correct conversation if client sends an ID
+        client_conversation_id = message.get("conversation_id")
+        return client_conversation_id if client_conversation_id and client_conversation_id == conversation_id else conversation_id
+
+    async def classify(message: Dict[str, Any]):
+        lookups = start_lookups(message["text"]) # Speculative order lookups overlap this turn's inference
+        try:
+            intent, confidence, entities = await process_message_async(message["text"])
+        except BaseException:
+            lookups.close()
+            raise
+        return intent, confidence, entities, lookups
+
+    def correlate(frame: Dict[str, Any], message: Dict[str, Any]) -> Dict[str, Any]:
+        if "client_message_id" in message: # Lets a client with several messages in flight match the replies
+            frame["client_message_id"] = message["client_message_id"]
+        return frame
+
+    async def lookup(message: Dict[str, Any], classification, emit):
+        intent, confidence, entities, lookups = classification
+        # Cached only: the conversation was verified at connect. Slots are those of the turns stored so far
+        state = await conversation_states.get(conversation_for(message)) if conversation_states is not None else None
+        if conversation_states is not None:
+            entities = conversation_states.fill(state, intent, entities)
+        escalate = confidence < settings.CONFIDENCE_THRESHOLD or intent == "human_agent"
+        if stream:
+            await emit(correlate({
+                "type": "ack", "conversation_id": conversation_for(message), "intent": intent, "confidence": confidence,
+                "entities": entities, "requires_human_escalation": escalate, "text_received": message["text"],
+            }, message))
+        if escalate:
+            logger.info("Escalation triggered for user '%s' in conversation %s", user_id, conversation_for(message))
+            lookups.close(intent)
+            return escalate, WS_ESCALATION_REPLY, entities, state # Streamed in "final", once the ticket id exists
+        # No session here: lookups of several turns run at once, and none of them queries the database
+        if not stream:
+            return escalate, await generate_bot_response(intent, confidence, message["text"], entities, None, conversation_for(message), user_id, lookups), entities, state
+        chunks = []
+        async for chunk in stream_bot_response(intent, confidence, message["text"], entities, None, conversation_for(message), user_id, lookups):
+            chunks.append(chunk)
+            await emit(correlate({"type": "chunk", "conversation_id": conversation_for(message), "index": len(chunks) - 1, "text": chunk}, message))
+        return escalate, "".join(chunks), entities, state
+
+    async def persist(message: Dict[str, Any], classification, prepared) -> Dict[str, Any]:
+        intent, confidence, _, _ = classification
+        escalate, bot_response_text, entities, state = prepared
+        current_processing_conv_id = conversation_for(message)
+        async with session_factory() as db: # One pooled connection for this turn only
+            turn = await record_turn(
+                db, current_processing_conv_id, user_id, message["text"], intent, confidence,
+                bot_response_text, "bot_response" if escalate else intent,
+                escalate=escalate, conversation_verified=True, # Created at connect
+                message_log=message_log,
+            )
+        await after_turn("ws", turn, user_id, message["text"], intent, confidence, escalate, entities, state)
+        response_data = {
+            "conversation_id": current_processing_conv_id,
+            "user_message_id": turn.user_message_id,
+            "intent": intent,
+            "confidence": confidence,
+            "entities": entities,
+            "requires_human_escalation": escalate,
+            "text_received": message["text"],
+            "response": turn.bot_text,
+            "bot_message_id": turn.bot_message_id
+        }
+        if escalate:
+            response_data["escalation_ticket_id"] = turn.escalation_ticket_id
+        if stream:
+            response_data["type"] = "final"
+        return correlate(response_data, message)
+
+    async def send(response_data: Dict[str, Any]) -> None:
+        await connection.send(response_data)
+        # The conversation's other sockets, on this worker and the others, get the turn as well
+        await connection_manager.publish(response_data["conversation_id"], {**response_data, "type": "conversation_turn"}, origin=connection)
+
+    async def on_error(turn, e: Exception) -> None:
+        error = {"type": "error", "conversation_id": conversation_id, "text_received": turn.message["text"]}
+        if isinstance(e, InferenceUnavailable):
+            # Backpressure / still loading: tell this client to retry rather than queueing without bound
+            await connection.send({**error, "error": e.detail, "retry_after": 1})
+        else:
+            logger.warning("Error in WebSocket turn for conversation %s: %s - %s", conversation_id, type(e).__name__, e)
+            await connection.send({**error, "error": str(e)})
+
+    pipeline = TurnPipeline(classify, lookup, persist, send, on_error, max_pending=settings.WS_MAX_PENDING_TURNS,
+                            timings=turn_timings, send_partial=connection.send, tracer=tracer,
+                            trace_attributes={"channel": "ws", "user_id": user_id})
 
     try:
         while True:
             data = await websocket.receive_json()
+            if data.get("type") == "ping": # Heartbeat: answered right away, even while turns are in flight
+                await connection.send({"type": "pong", "conversation_id": conversation_id, "ts": data.get("ts")})
+                continue
             user_text = data.get("text")
-            client_conversation_id = data.get("conversation_id")
 
             if not user_text:
-                await websocket.send_json({"error": "Text input cannot be empty", "conversation_id": conversation_id})
+                await connection.send({"error": "Text input cannot be empty", "conversation_id": conversation_id})
                 continue
-            
-            # Ensure messages are logged to the correct conversation if client sends an ID
-            current_processing_conv_id = client_conversation_id if client_conversation_id and client_conversation_id == conversation_id else conversation_id
-
-            # Log user message before NLP
-            user_db_message = log_message(db, current_processing_conv_id, user_text, "user")
-            intent, confidence, entities = process_message(user_text)
-
-            # Update user's message in DB with NLP results
-            user_db_message.intent = intent
-            user_db_message.confidence = confidence
-            db.commit()
-            db.refresh(user_db_message)
-            
-            response_data = {
-                "conversation_id": current_processing_conv_id,
-                "user_message_id": user_db_message.id,
-                "intent": intent,
-                "confidence": confidence,
-                "entities": entities,
-                "requires_human_escalation": False,
-                "text_received": user_text,
-                "response": "",
-                "bot_message_id": None
-            }
-
-            if confidence < settings.CONFIDENCE_THRESHOLD or intent == "human_agent":
-                ticket = handle_escalation(user_text, user_id, db, conversation_id=current_processing_conv_id)
-                bot_response_text = f"Connecting  to a human agent. the Ticket ID: {ticket.id}"
-                response_data["response"] = bot_response_text
-                response_data["requires_human_escalation"] = True
-                response_data["escalation_ticket_id"] = ticket.id
-            else:
-                bot_response_text = await generate_bot_response(intent, confidence, user_text, entities, db, current_processing_conv_id, user_id)
-                response_data["response"] = bot_response_text
-            
-            bot_db_message = log_message(db, current_processing_conv_id, bot_response_text, "bot", intent if intent != "human_agent" and confidence >= settings.CONFIDENCE_THRESHOLD else "bot_response", 1.0)
-            response_data["bot_message_id"] = bot_db_message.id
-            
-            await websocket.send_json(response_data)
+
+            if not pipeline.submit(data):
+                await connection.send({"type": "error", "error": "Too many messages in flight, please wait for a reply",
+                                       "retry_after": 1, "conversation_id": conversation_id, "text_received": user_text})
 
     except WebSocketDisconnect:
-        print(f"WebSocket disconnected for conversation_id: {conversation_id}")
+        logger.debug("WebSocket disconnected for conversation_id: %s", conversation_id)
     except Exception as e:
-        print(f"Error in WebSocket for conversation {conversation_id}: {type(e).__name__} - {e}")
+        logger.warning("Error in WebSocket for conversation %s: %s - %s", conversation_id, type(e).__name__, e)
         try:
-            await websocket.send_json({"error": str(e), "type": "error", "conversation_id": conversation_id})
+            await connection.send({"error": str(e), "type": "error", "conversation_id": conversation_id})
+            await connection.flush() # Written before the socket closes
         except Exception as send_e:
-            print(f"Failed to send error to WebSocket: {send_e}")
+            logger.debug("Failed to send error to WebSocket: %s", send_e)
             pass 
     finally:
-        if conversation_id in active_connections:
-            active_connections[conversation_id].remove(websocket)
-            if not active_connections[conversation_id]:
-                del active_connections[conversation_id]
-        print(f"Cleaned up WebSocket connection for conversation_id: {conversation_id}. Remaining for convo: {len(active_connections.get(conversation_id, []))}")
\ No newline at end of file
+        await pipeline.close() # Turns already accepted are still stored
+        await connection_manager.disconnect(connection)
+        logger.debug("Cleaned up WebSocket connection for conversation_id: %s. Remaining for convo on this worker: %d",
+                     conversation_id, len(connection_manager.connections.get(conversation_id, ())))
\ No newline at end of file
@@ -0,0 +1,89 @@
+# backend/app/api/v1/escalations.py
+# Consumer API for agent tooling on the escalation stream (app/core/escalations.py).
+#
+#   POST /escalations/claim   the oldest unclaimed tickets (stale claims of other agents first);
+#                             waits up to block_seconds when there are none
+#   POST /escalations/ack     the agent holding a ticket is done with it; its status (resolved or
+#                             closed) goes to the database
+#   GET  /escalations/stats   stream backlog per consumer group and enqueue -> claim latency
+#
+# Claims and acks are mirrored on the escalation_tickets rows (status, assigned_agent), so
+# the database stays the record of who has which ticket. Mounted, like /admin, only with
+# ADMIN_API_ENABLED and behind ADMIN_API_TOKEN (auth.py).
+
+from typing import Literal
+
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy import update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import chatbot
+from ...config import settings
+from ...db import models, schemas
+from ...db.session import get_async_db
+
+router = APIRouter()
+
+
+class ClaimRequest(schemas.BaseModel):
+    agent: str
+    count: int = 1
+    block_seconds: float = 0 # Long-poll: wait this long for a ticket when none is waiting
+
+
+class AckRequest(schemas.BaseModel):
+    agent: str
+    entry_id: str
+    status: Literal["resolved", "closed"] = "resolved" # Written to the ticket row
+
+
+def _queue():
+    if chatbot.escalation_queue is None:
+        raise HTTPException(status_code=503, detail="Escalation queue is not enabled (ESCALATION_QUEUE_ENABLED, REDIS_URL)")
+    return chatbot.escalation_queue
+
+
+@router.post("/claim")
+async def claim_escalations(payload: ClaimRequest, db: AsyncSession = Depends(get_async_db)):
+    queue = _queue()
+    block_seconds = min(max(payload.block_seconds, 0), settings.ESCALATION_MAX_BLOCK_SECONDS)
+    tickets = await queue.claim(payload.agent, max(1, min(payload.count, 100)), int(block_seconds * 1000))
+    if tickets:
+        await db.execute(
+            update(models.EscalationTicket)
+            .where(models.EscalationTicket.id.in_([t["ticket_id"] for t in tickets]))
+            .values(status="claimed", assigned_agent=payload.agent)
+        )
+        await db.commit()
+    return {"agent": payload.agent, "tickets": tickets}
+
+
+@router.post("/ack")
+async def ack_escalation(payload: AckRequest, db: AsyncSession = Depends(get_async_db)):
+    queue = _queue()
+    ticket = await queue.entry(payload.entry_id)
+    if ticket is None:
+        raise HTTPException(status_code=404, detail=f"No escalation entry {payload.entry_id}")
+    acked = await queue.ack_claim(payload.agent, payload.entry_id)
+    if acked is None:
+        raise HTTPException(status_code=409, detail=f"Entry {payload.entry_id} is not claimed (already acked?)")
+    if not acked:
+        raise HTTPException(status_code=403, detail=f"Entry {payload.entry_id} is claimed by another agent")
+    await db.execute(
+        update(models.EscalationTicket)
+        .where(models.EscalationTicket.id == ticket["ticket_id"])
+        .values(status=payload.status, assigned_agent=payload.agent)
+    )
+    await db.commit()
+    return {"ticket_id": ticket["ticket_id"], "status": payload.status}
+
+
+@router.get("/stats")
+async def escalation_stats():
+    queue = _queue()
+    notifier = chatbot.escalation_notifier
+    return {
+        **queue.stats(),
+        **await queue.backlog(),
+        "notifier": {"notified": notifier.notified, "failures": notifier.failures} if notifier is not None else None,
+    }
@@ -0,0 +1,137 @@
+# backend/app/core/background.py
+# Hands a turn's non-critical work (analytics, low-priority re-classification) to Celery,
+# off the request path, in batches.
+#
+# A Celery task per turn would put one broker round-trip on every reply and keep the workers
+# busy with per-task overhead for items that take microseconds. Instead each kind of work has
+# a TaskBatcher: the endpoints add() items to an in-process buffer (no I/O), and a background
+# task sends one Celery task per TASK_BATCH_MAX_ITEMS items, or whatever has collected after
+# TASK_BATCH_MAX_WAIT_MS. Sending happens in a thread: apply_async is a blocking broker write.
+#
+# This work may be lost, on purpose: if the broker is down a batch is dropped (and counted),
+# and the buffer is bounded (TASK_BATCH_MAX_BUFFER, oldest items dropped first). Escalation
+# notifications don't go through here; they come from the escalation stream (escalations.py).
+
+import asyncio
+import logging
+from typing import Any, Callable, Dict, List, Optional
+
+from ..config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class TaskBatcher:
+    def __init__(
+        self,
+        send: Callable[[List[Any]], Any], # Sends one batch, e.g. a Celery task's apply_async; called in a thread
+        name: str = "batch",
+        max_items: int = 200,
+        max_wait_seconds: float = 1.0,
+        max_buffer: int = 10000,
+    ):
+        self.send = send
+        self.name = name
+        self.max_items = max(1, max_items)
+        self.max_wait = max_wait_seconds
+        self.max_buffer = max(self.max_items, max_buffer)
+        self._items: List[Any] = []
+        self._full: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+        self.added = 0
+        self.dropped = 0 # Buffer overflow, or the batch failed to send
+        self.batches_sent = 0
+        self.items_sent = 0
+        self.send_errors = 0
+
+    def add(self, item: Any) -> None:
+        """Buffers one item; never blocks or raises."""
+        self.added += 1
+        self._items.append(item)
+        if len(self._items) > self.max_buffer: # Broker unreachable for a while: keep the newest
+            overflow = len(self._items) - self.max_buffer
+            del self._items[:overflow]
+            self.dropped += overflow
+        if len(self._items) >= self.max_items and self._full is not None:
+            self._full.set()
+
+    async def flush(self) -> int:
+        """Sends everything buffered, max_items per task; returns how many items were sent."""
+        sent = 0
+        while self._items:
+            batch, self._items = self._items[:self.max_items], self._items[self.max_items:]
+            try:
+                await asyncio.to_thread(self.send, batch)
+            except Exception as e:
+                self.send_errors += 1
+                self.dropped += len(batch)
+                logger.warning("TaskBatcher %s: dropping %d items, sending failed: %s", self.name, len(batch), e)
+                continue
+            self.batches_sent += 1
+            self.items_sent += len(batch)
+            sent += len(batch)
+        return sent
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._full.wait(), self.max_wait)
+            except asyncio.TimeoutError:
+                pass
+            self._full.clear()
+            await self.flush()
+
+    def start(self) -> None:
+        if self._task is None:
+            self._full = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stops the timer and sends what is left."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            self._full = None
+        await self.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "buffered": len(self._items),
+            "added": self.added,
+            "batches_sent": self.batches_sent,
+            "items_sent": self.items_sent,
+            "average_batch_size": round(self.items_sent / self.batches_sent, 2) if self.batches_sent else 0.0,
+            "send_errors": self.send_errors,
+            "dropped": self.dropped,
+        }
+
+
+def celery_sender(task_name: str, **options) -> Callable[[List[Any]], Any]:
+    """send() for a TaskBatcher: apply_async of the named task with the batch as its argument."""
+    def send(items: List[Any]) -> None:
+        from .tasks import celery_app
+        celery_app.tasks[task_name].apply_async(args=[items], **options)
+    return send
+
+
+def build_task_batchers(delayed: bool = False) -> Dict[str, TaskBatcher]:
+    """
+    The batchers per settings, by task name; empty when BACKGROUND_TASKS_ENABLED is off.
+    delayed: messages reach the database late (write-behind log), so re-classification waits a little.
+    """
+    if not settings.BACKGROUND_TASKS_ENABLED:
+        return {}
+    batch = dict(max_items=settings.TASK_BATCH_MAX_ITEMS, max_wait_seconds=settings.TASK_BATCH_MAX_WAIT_MS / 1000,
+                 max_buffer=settings.TASK_BATCH_MAX_BUFFER)
+    reclassify_options = {"priority": 9} # Lowest: behind anything else on its queue
+    if delayed:
+        reclassify_options["countdown"] = max(1, int(settings.MESSAGE_WRITE_BEHIND_FLUSH_MS / 1000) + 1)
+    return {
+        "record_turn_analytics": TaskBatcher(celery_sender("record_turn_analytics"), "record_turn_analytics", **batch),
+        "reclassify_messages": TaskBatcher(celery_sender("reclassify_messages", **reclassify_options), "reclassify_messages", **batch),
+    }
@@ -0,0 +1,128 @@
+# backend/app/core/batching.py
+# Dynamic micro-batching for intent classification.
+#
+# Under concurrent chat traffic, running one transformer forward pass per message
+# wastes most of the CPU on per-call overhead. The MicroBatcher collects requests
+# for up to `max_wait_ms` (or until `max_batch_size` are waiting), runs a single
+# padded forward pass through `predict_batch`, and resolves each caller's future
+# with its own (intent, confidence, entities) tuple.
+
+import asyncio
+from concurrent.futures import Executor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+Prediction = Tuple[str, float, Dict[str, Any]]
+
+
+class MicroBatcher:
+    def __init__(
+        self,
+        predict_batch: Callable[[List[str]], List[Prediction]],
+        max_batch_size: int = 16,
+        max_wait_ms: float = 5.0,
+        executor: Optional[Executor] = None,
+    ):
+        """
+        predict_batch: synchronous function mapping a list of texts to a list of predictions
+                       (same length, same order). It runs in `executor` so the event loop
+                       keeps accepting requests while a batch is in flight.
+        executor: where forward passes run. None means the loop's default thread pool.
+        """
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1")
+        self.predict_batch = predict_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max(max_wait_ms, 0.0) / 1000.0
+        self.executor = executor
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+        # Simple counters, handy for tuning max_batch_size / max_wait_ms
+        self.batches_run = 0
+        self.items_processed = 0
+
+    @property
+    def average_batch_size(self) -> float:
+        return self.items_processed / self.batches_run if self.batches_run else 0.0
+
+    def _ensure_worker(self) -> None:
+        loop = asyncio.get_running_loop()
+        # The queue and worker are bound to the loop that first used them. Test clients and
+        # scripts may spin up a fresh loop, in which case we start over on the new one.
+        if self._worker is None or self._worker.done() or self._loop is not loop:
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._worker = loop.create_task(self._run())
+
+    async def submit(self, text: str) -> Prediction:
+        """Queues `text` for the next batch and waits for its prediction."""
+        self._ensure_worker()
+        future = self._loop.create_future()
+        self._queue.put_nowait((text, future))
+        return await future
+
+    async def _collect(self) -> List[Tuple[str, asyncio.Future]]:
+        # Block until there is at least one request, then keep collecting until the
+        # batch is full or the first request has waited max_wait.
+        batch = [await self._queue.get()]
+        deadline = self._loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            # Anything already queued is taken without yielding to the timer
+            while not self._queue.empty() and len(batch) < self.max_batch_size:
+                batch.append(self._queue.get_nowait())
+            if len(batch) >= self.max_batch_size:
+                break
+            remaining = deadline - self._loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout=remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self) -> None:
+        while True:
+            batch = await self._collect()
+            # Callers that gave up (e.g. a disconnected WebSocket) don't need a forward pass
+            batch = [(text, fut) for text, fut in batch if not fut.cancelled()]
+            if not batch:
+                continue
+            texts = [text for text, _ in batch]
+            try:
+                results = await self._loop.run_in_executor(self.executor, self.predict_batch, texts)
+                if len(results) != len(texts):
+                    raise RuntimeError(f"predict_batch returned {len(results)} results for {len(texts)} inputs")
+            except asyncio.CancelledError:
+                for _, fut in batch:
+                    fut.cancel()
+                raise
+            except Exception as e:
+                for _, fut in batch:
+                    if not fut.done():
+                        fut.set_exception(e)
+                continue
+
+            self.batches_run += 1
+            self.items_processed += len(texts)
+            for (_, fut), result in zip(batch, results):
+                if not fut.done():
+                    fut.set_result(result)
+
+    async def stop(self) -> None:
+        """Stops the worker. Requests still waiting in the queue are cancelled."""
+        if self._worker is not None and not self._worker.done():
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+        if self._queue is not None:
+            while not self._queue.empty():
+                _, fut = self._queue.get_nowait()
+                fut.cancel()
+        self._worker = None
+        self._queue = None
+        self._loop = None
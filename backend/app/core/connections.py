@@ -0,0 +1,309 @@
+# backend/app/core/connections.py
+# WebSocket connection manager, for fanning chat turns out to every socket of a conversation.
+#
+# Each worker process keeps its own registry of the sockets connected to it. A turn is
+# published once, to the conversation's Redis channel (chat:conversation:<id>); every worker
+# with a socket on that conversation is subscribed to the channel and delivers the frame to
+# its own sockets. Without Redis (WS_FANOUT_REDIS_ENABLED off or REDIS_URL unset) delivery is
+# local to this worker, which is all a single-process deployment needs.
+#
+# Every socket has one writer task and a bounded queue of outgoing frames; handlers never
+# send on a socket directly, so replies and fanned-out frames can't interleave mid-write.
+# The writer sends whatever has queued up since its last write in one go: as a single
+# {"type": "batch", "frames": [...]} frame for clients that connected with ?batch=true,
+# back to back otherwise. A consumer that doesn't keep up (queue full, or one write taking
+# longer than WS_SEND_TIMEOUT_SECONDS) is evicted: closed with 1013 "try again later" and
+# dropped from the registry, instead of buffering without bound or stalling delivery.
+
+import asyncio
+import itertools
+import json
+import logging
+import os
+from typing import Any, Dict, Optional, Set
+
+from ..config import settings
+from .metrics import WS_SEND, Span
+
+logger = logging.getLogger(__name__)
+
+TRY_AGAIN_LATER = 1013 # WebSocket close code: server overloaded / client too slow
+
+
+class LocalConnection:
+    """One WebSocket on this worker, with its outgoing queue and writer task."""
+
+    def __init__(self, manager: "ConnectionManager", websocket, conversation_id: int, connection_id: str, batch: bool):
+        self.manager = manager
+        self.websocket = websocket
+        self.conversation_id = conversation_id
+        self.id = connection_id
+        self.batch = batch # Client accepts {"type": "batch"} frames
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=manager.send_queue_size)
+        self.closed = False
+        self._writer: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self._writer = asyncio.get_running_loop().create_task(self._write())
+
+    def enqueue(self, text: str) -> bool:
+        """Queues one serialized frame; evicts the connection if its queue is full."""
+        if self.closed:
+            return False
+        try:
+            self.queue.put_nowait(text)
+            return True
+        except asyncio.QueueFull:
+            self.manager.evict(self, "send queue full")
+            return False
+
+    async def send(self, frame: Dict[str, Any]) -> bool:
+        """Sends a frame to this socket only (replies, acks, errors). False if the socket was evicted."""
+        return self.enqueue(json.dumps(frame, default=str))
+
+    async def _write(self) -> None:
+        manager = self.manager
+        while True:
+            texts = [await self.queue.get()]
+            while len(texts) < manager.batch_max_frames and not self.queue.empty():
+                texts.append(self.queue.get_nowait())
+            if self.batch and len(texts) > 1:
+                # Frames are already JSON: the batch is assembled without re-serializing them
+                payloads = ['{"type": "batch", "frames": [' + ", ".join(texts) + "]}"]
+            else:
+                payloads = texts
+            try:
+                for payload in payloads:
+                    with Span(WS_SEND):
+                        await asyncio.wait_for(self.websocket.send_text(payload), manager.send_timeout)
+            except asyncio.TimeoutError:
+                manager.evict(self, "send timed out")
+                return
+            except Exception: # Socket already gone; the endpoint's receive loop cleans up
+                self.closed = True
+                return
+            finally:
+                for _ in texts:
+                    self.queue.task_done()
+            manager.frames_sent += len(texts)
+            manager.writes += len(payloads)
+
+    async def flush(self, timeout: float = 1.0) -> None:
+        """Waits (briefly) until every queued frame was written, e.g. a last error before the socket closes."""
+        if not self.closed:
+            try:
+                await asyncio.wait_for(self.queue.join(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def close(self, code: int = 1000) -> None:
+        self.closed = True
+        if self._writer is not None and self._writer is not asyncio.current_task():
+            self._writer.cancel()
+        try:
+            await self.websocket.close(code=code)
+        except Exception:
+            pass # Already closed by the client
+
+
+class ConnectionManager:
+    def __init__(
+        self,
+        redis_client=None, # redis.asyncio client; None = deliver to this worker's sockets only
+        channel_prefix: str = "chat:conversation:",
+        send_queue_size: int = 100,
+        batch_max_frames: int = 20,
+        send_timeout_seconds: float = 5.0,
+    ):
+        self.redis = redis_client
+        self.channel_prefix = channel_prefix
+        self.send_queue_size = max(1, send_queue_size)
+        self.batch_max_frames = max(1, batch_max_frames)
+        self.send_timeout = send_timeout_seconds
+        self.worker_id = f"{os.getpid()}-{id(self):x}" # Tags this worker's connection ids
+        self._ids = itertools.count(1)
+
+        self.connections: Dict[int, Set[LocalConnection]] = {} # conversation_id -> this worker's sockets
+        self._pubsub = None
+        self._listener: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._subscribe_lock: Optional[asyncio.Lock] = None
+
+        self.published = 0
+        self.received = 0 # Frames that came in over Redis
+        self.frames_sent = 0
+        self.writes = 0 # WebSocket writes; below frames_sent when frames were batched
+        self.evictions = 0
+        self.redis_errors = 0
+
+    def channel(self, conversation_id: int) -> str:
+        return f"{self.channel_prefix}{conversation_id}"
+
+    def _bind_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        # Like MicroBatcher: test clients and scripts may run on a fresh loop, so the
+        # subscription and listener start over on whichever loop uses the manager
+        if self._loop is not loop:
+            self._loop = loop
+            self._pubsub = None
+            self._listener = None
+            self._subscribe_lock = asyncio.Lock()
+            self.connections = {}
+
+    async def connect(self, websocket, conversation_id: int, batch: bool = False) -> LocalConnection:
+        """Registers an accepted WebSocket; subscribes this worker to the conversation on its first socket."""
+        self._bind_loop()
+        connection = LocalConnection(self, websocket, conversation_id, f"{self.worker_id}-{next(self._ids)}", batch)
+        connection.start()
+        first = conversation_id not in self.connections
+        self.connections.setdefault(conversation_id, set()).add(connection)
+        if first and self.redis is not None:
+            await self._subscribe(self.channel(conversation_id))
+        return connection
+
+    async def disconnect(self, connection: LocalConnection) -> None:
+        """Unregisters a socket (safe to call more than once); unsubscribes after the conversation's last one."""
+        connection.closed = True
+        if connection._writer is not None:
+            connection._writer.cancel()
+        sockets = self.connections.get(connection.conversation_id)
+        if sockets is None or connection not in sockets:
+            return
+        sockets.discard(connection)
+        if not sockets:
+            del self.connections[connection.conversation_id]
+            if self.redis is not None:
+                await self._unsubscribe(self.channel(connection.conversation_id))
+
+    def evict(self, connection: LocalConnection, reason: str) -> None:
+        if connection.closed:
+            return
+        self.evictions += 1
+        logger.warning("ConnectionManager: evicting slow consumer %s (conversation %s): %s", connection.id, connection.conversation_id, reason)
+        connection.closed = True # Gets nothing more; the endpoint's disconnect() unregisters it
+        # Closing makes the endpoint's receive loop end, and its finally calls disconnect()
+        asyncio.get_running_loop().create_task(connection.close(TRY_AGAIN_LATER))
+
+    def deliver_local(self, conversation_id: int, text: str, exclude: Optional[str] = None) -> int:
+        """Queues a serialized frame on this worker's sockets of a conversation; returns how many."""
+        delivered = 0
+        for connection in list(self.connections.get(conversation_id, ())):
+            if connection.id != exclude and connection.enqueue(text):
+                delivered += 1
+        return delivered
+
+    async def publish(self, conversation_id: int, frame: Dict[str, Any], origin: Optional[LocalConnection] = None) -> None:
+        """
+        Delivers a frame to every socket of the conversation on every worker, except `origin`
+        (the socket the turn came from, which already got its reply).
+        """
+        self.published += 1
+        text = json.dumps(frame, default=str)
+        exclude = origin.id if origin is not None else None
+        if self.redis is not None:
+            try:
+                # "<origin id>|<frame>": subscribers split once instead of decoding the frame
+                await self.redis.publish(self.channel(conversation_id), f"{exclude or ''}|{text}")
+                return
+            except Exception as e:
+                self.redis_errors += 1
+                logger.warning("ConnectionManager: publish to Redis failed, delivering locally only: %s", e)
+        self.deliver_local(conversation_id, text, exclude)
+
+    async def _subscribe(self, channel: str) -> None:
+        async with self._subscribe_lock:
+            try:
+                if self._pubsub is None:
+                    self._pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+                await self._pubsub.subscribe(channel)
+            except Exception as e: # The socket still gets its own replies, just not other workers' turns
+                self.redis_errors += 1
+                logger.warning("ConnectionManager: subscribe to %s failed: %s", channel, e)
+                return
+            if self._listener is None or self._listener.done():
+                self._listener = asyncio.get_running_loop().create_task(self._listen())
+
+    async def _unsubscribe(self, channel: str) -> None:
+        if self._pubsub is None:
+            return
+        async with self._subscribe_lock:
+            try:
+                await self._pubsub.unsubscribe(channel)
+            except Exception as e:
+                self.redis_errors += 1
+                logger.warning("ConnectionManager: unsubscribe from %s failed: %s", channel, e)
+
+    async def _listen(self) -> None:
+        prefix_length = len(self.channel_prefix)
+        while True:
+            try:
+                message = await self._pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                # Take everything already received in one pass before yielding to the writers
+                while message is not None:
+                    if message["type"] == "message":
+                        channel = message["channel"]
+                        data = message["data"]
+                        if isinstance(channel, bytes):
+                            channel, data = channel.decode(), data.decode()
+                        exclude, _, text = data.partition("|")
+                        self.received += 1
+                        self.deliver_local(int(channel[prefix_length:]), text, exclude or None)
+                    message = await self._pubsub.get_message(ignore_subscribe_messages=True, timeout=0)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e: # redis-py reconnects and resubscribes on the next read
+                self.redis_errors += 1
+                logger.warning("ConnectionManager: Redis subscription error: %s", e)
+                await asyncio.sleep(1.0)
+
+    async def close(self) -> None:
+        """Shutdown: stops the listener and closes this worker's sockets."""
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+        if self._pubsub is not None:
+            try:
+                await self._pubsub.aclose()
+            except Exception:
+                pass
+            self._pubsub = None
+        for sockets in list(self.connections.values()):
+            for connection in list(sockets):
+                await connection.close(1001) # Going away: clients reconnect to another worker
+        self.connections = {}
+
+    def local_connections(self) -> int:
+        return sum(len(sockets) for sockets in self.connections.values())
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "worker_id": self.worker_id,
+            "redis": self.redis is not None,
+            "local_connections": self.local_connections(),
+            "conversations": len(self.connections),
+            "published": self.published,
+            "received": self.received,
+            "frames_sent": self.frames_sent,
+            "writes": self.writes,
+            "evictions": self.evictions,
+            "redis_errors": self.redis_errors,
+        }
+
+
+def build_connection_manager() -> ConnectionManager:
+    redis_client = None
+    if settings.WS_FANOUT_REDIS_ENABLED:
+        from ..db.session import get_async_redis_client
+        redis_client = get_async_redis_client()
+        if redis_client is None:
+            logger.warning("ConnectionManager: WS_FANOUT_REDIS_ENABLED is set but REDIS_URL is not; delivering locally only")
+    return ConnectionManager(
+        redis_client,
+        send_queue_size=settings.WS_SEND_QUEUE_SIZE,
+        batch_max_frames=settings.WS_SEND_BATCH_MAX_FRAMES,
+        send_timeout_seconds=settings.WS_SEND_TIMEOUT_SECONDS,
+    )
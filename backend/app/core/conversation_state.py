@@ -0,0 +1,225 @@
+# backend/app/core/conversation_state.py
+# Hot state of the conversations in progress: the conversation row, its escalated flag and
+# the slots filled so far (last order ID, last product).
+#
+# Every HTTP turn used to SELECT its conversation (resolve_conversation) just to learn that it
+# exists, and every turn started from nothing: "where is order 12345" followed by "has it
+# shipped?" got "which order?" back, and the user had to repeat themselves in another turn.
+# ConversationStateStore keeps, per conversation id:
+#   - an in-process LRU tier, and optionally a shared Redis tier (other workers, restarts);
+#   - idle expiry: every turn writes the state back, so it lives CONVERSATION_STATE_IDLE_TTL_SECONDS
+#     after the conversation's last turn;
+#   - invalidation when the conversation escalates: an agent takes over, and the next turn
+#     reloads the row (escalated=True) from the database, with no slots.
+# With Redis, local copies live at most CONVERSATION_STATE_LOCAL_TTL_SECONDS, so another
+# worker's invalidation is seen within that time.
+#
+# A follow-up turn that doesn't name what it is about gets the remembered slot: an order
+# question without an order ID uses the last order, a product question whose product is only
+# "it" / "that one" uses the last product. Returns are never given a remembered item (they
+# change the order), only the order ID.
+
+import json
+import logging
+from typing import Any, Dict, NamedTuple, Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .entities import PRODUCT_INTENTS
+from ..config import settings
+from ..db import models
+from ..utils.cache import LRUTTLCache
+
+logger = logging.getLogger(__name__)
+
+ORDER_SLOT_INTENTS = ("track_order", "shipping_info", "request_return") # Answered from an order ID
+# Product queries that only refer back to something said before
+REFERRING_QUERIES = {"it", "its", "them", "they", "one", "that one", "this one", "same one", "same"}
+
+
+class ConversationState(NamedTuple):
+    conversation_id: int
+    user_id: Optional[str]
+    escalated: bool = False
+    slots: Dict[str, str] = {} # "order_id", "product_name_query", "item_sku"; never mutated in place
+
+    def fill(self, intent: str, entities: Dict[str, Any]) -> Dict[str, Any]:
+        """`entities` with what this turn leaves out taken from the slots (a new dict; {} slots change nothing)."""
+        filled = dict(entities)
+        if intent in ORDER_SLOT_INTENTS and not filled.get("order_id") and self.slots.get("order_id"):
+            filled["order_id"] = self.slots["order_id"]
+        if intent in PRODUCT_INTENTS and is_referring(filled.get("product_name_query")):
+            if self.slots.get("product_name_query"):
+                filled["product_name_query"] = self.slots["product_name_query"]
+                if self.slots.get("item_sku") and not filled.get("item_sku"):
+                    filled["item_sku"] = self.slots["item_sku"]
+        return filled
+
+    def remember(self, entities: Dict[str, Any]) -> "ConversationState":
+        """The state once a turn with `entities` (as filled) has been answered."""
+        slots = dict(self.slots)
+        if entities.get("order_id"):
+            slots["order_id"] = str(entities["order_id"])
+        if entities.get("product_name_query") and not is_referring(entities["product_name_query"]):
+            slots["product_name_query"] = entities["product_name_query"]
+            slots.pop("item_sku", None) # Belonged to the previous product
+            if entities.get("item_sku"):
+                slots["item_sku"] = entities["item_sku"]
+        return self._replace(slots=slots)
+
+    def to_json(self) -> str:
+        return json.dumps(self._asdict())
+
+    @classmethod
+    def from_json(cls, raw) -> "ConversationState":
+        return cls(**json.loads(raw))
+
+
+def is_referring(product_query: Optional[str]) -> bool:
+    """No product named: nothing left of the query, or only a word pointing back ("is it in stock?")."""
+    return not product_query or product_query in REFERRING_QUERIES
+
+
+class ConversationStateStore:
+    def __init__(
+        self,
+        maxsize: int = 10000,
+        idle_ttl: float = 1800.0,
+        redis_client=None, # A redis.asyncio client; None keeps the state in-process only
+        local_ttl: float = 5.0, # With Redis: how long a local copy is trusted
+    ):
+        self.idle_ttl = idle_ttl
+        self.redis = redis_client
+        self.local_ttl = min(local_ttl, idle_ttl) if redis_client is not None else idle_ttl
+        self.local = LRUTTLCache(maxsize=maxsize, ttl=self.local_ttl)
+
+        self.redis_hits = 0
+        self.redis_errors = 0
+        self.db_loads = 0 # Cache misses that read the conversation row
+        self.db_lookups_saved = 0 # Turns on a known conversation that skipped the SELECT
+        self.slots_filled = 0 # Turns answered from a remembered slot instead of asking again
+        self.invalidations = 0
+
+    @staticmethod
+    def _key(conversation_id: int) -> str:
+        return f"conv:state:{conversation_id}"
+
+    async def get(self, conversation_id: Optional[int]) -> Optional[ConversationState]:
+        """The cached state (local, then Redis), or None. Never touches the database."""
+        if not conversation_id:
+            return None
+        state = self.local.get(conversation_id)
+        if state is not None or self.redis is None:
+            return state
+        try:
+            raw = await self.redis.get(self._key(conversation_id))
+        except Exception as e: # Redis is an optimisation: the database still has the row
+            self.redis_errors += 1
+            logger.warning("ConversationStateStore: Redis lookup failed: %s", e)
+            return None
+        if raw is None:
+            return None
+        self.redis_hits += 1
+        state = ConversationState.from_json(raw)
+        self.local.set(conversation_id, state)
+        return state
+
+    async def lookup(self, db: AsyncSession, conversation_id: Optional[int]) -> Optional[ConversationState]:
+        """
+        State of an existing conversation: cached, else loaded from its row (and cached).
+        None when conversation_id is None or unknown - the turn starts a new conversation.
+        """
+        state = await self.get(conversation_id)
+        if state is not None:
+            self.db_lookups_saved += 1
+            return state
+        if not conversation_id:
+            return None
+        row = (await db.execute(
+            select(models.Conversation.id, models.Conversation.user_id, models.Conversation.escalated)
+            .where(models.Conversation.id == conversation_id)
+        )).one_or_none()
+        self.db_loads += 1
+        if row is None:
+            return None
+        state = ConversationState(row.id, row.user_id, bool(row.escalated))
+        await self.put(state)
+        return state
+
+    async def put(self, state: ConversationState) -> None:
+        """Stores `state`; its idle timer starts over."""
+        self.local.set(state.conversation_id, state)
+        if self.redis is None:
+            return
+        try:
+            await self.redis.set(self._key(state.conversation_id), state.to_json(), px=max(1, int(self.idle_ttl * 1000)))
+        except Exception as e:
+            self.redis_errors += 1
+            logger.warning("ConversationStateStore: Redis write failed: %s", e)
+
+    async def invalidate(self, conversation_id: int) -> None:
+        self.invalidations += 1
+        self.local.delete(conversation_id)
+        if self.redis is None:
+            return
+        try:
+            await self.redis.delete(self._key(conversation_id))
+        except Exception as e:
+            self.redis_errors += 1
+            logger.warning("ConversationStateStore: Redis invalidation failed: %s", e)
+
+    def clear(self) -> None:
+        """Drops this worker's copies (the Redis tier is left alone)."""
+        self.local.clear()
+
+    def fill(self, state: Optional[ConversationState], intent: str, entities: Dict[str, Any]) -> Dict[str, Any]:
+        """state.fill(), counted; `entities` unchanged without a state."""
+        if state is None:
+            return entities
+        filled = state.fill(intent, entities)
+        if filled != entities:
+            self.slots_filled += 1
+        return filled
+
+    async def after_turn(self, state: Optional[ConversationState], conversation_id: int, user_id: Optional[str],
+                         entities: Optional[Dict[str, Any]], escalate: bool) -> None:
+        """
+        Writes back a stored turn's state: its slots remembered, or dropped if it escalated.
+        entities None: the turn doesn't take part in slot memory (bulk API); only an escalation counts.
+        """
+        if escalate:
+            await self.invalidate(conversation_id)
+            return
+        if entities is None:
+            return
+        if state is None or state.conversation_id != conversation_id: # The turn started this conversation
+            state = ConversationState(conversation_id, user_id)
+        await self.put(state.remember(entities))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "local": self.local.stats(),
+            "redis": self.redis is not None,
+            "redis_hits": self.redis_hits,
+            "redis_errors": self.redis_errors,
+            "db_loads": self.db_loads,
+            "db_lookups_saved": self.db_lookups_saved,
+            "slots_filled": self.slots_filled,
+            "invalidations": self.invalidations,
+        }
+
+
+def build_conversation_state_store() -> Optional[ConversationStateStore]:
+    if not settings.CONVERSATION_STATE_ENABLED:
+        return None
+    redis_client = None
+    if settings.CONVERSATION_STATE_REDIS_ENABLED:
+        from ..db.session import get_async_redis_client
+        redis_client = get_async_redis_client()
+    return ConversationStateStore(
+        maxsize=settings.CONVERSATION_STATE_MAX_SIZE,
+        idle_ttl=settings.CONVERSATION_STATE_IDLE_TTL_SECONDS,
+        redis_client=redis_client,
+        local_ttl=settings.CONVERSATION_STATE_LOCAL_TTL_SECONDS,
+    )
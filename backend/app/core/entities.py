@@ -0,0 +1,162 @@
+# backend/app/core/entities.py
+# Entity extraction for classified messages: order IDs, SKUs and product-name queries.
+#
+# All patterns are compiled once. Product queries are found by stripping stop-phrases
+# ("tell me about", "in stock", "the", ...) in a single regex pass built from a token
+# trie of the phrases, longest phrase first. Matching whole words means "is" is removed
+# from "is it in stock" but not from "this", and "a" not from "Capacitor".
+
+import re
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional
+
+ORDER_ID_RE = re.compile(r'\b(\d{5,})\b') # 5 or more digits
+ALNUM_ORDER_ID_RE = re.compile(r'\b([a-zA-Z0-9]{6,}-[a-zA-Z0-9]{6,}|[a-zA-Z]{2,}\d{4,})\b') # e.g. ORD123XYZ-ABC123, ORD1234
+SKU_RE = re.compile(r'\b([A-Z]{2,4}\d{3})\b') # Catalog IDs such as SW001, HFC004
+
+PRODUCT_INTENTS = ("product_info", "price_query", "availability")
+ORDER_INTENTS = ("track_order", "shipping_info") # Answered from the order ID in the message
+
+# Phrases that frame a product question rather than name the product
+STOP_PHRASES = (
+    "tell me about", "info on", "product info for", "is", "in stock",
+    "how much is", "price of", "availability of", "check if", "available",
+    "the", "a", "an", "for",
+    "how much", "how much does", "how much do", "cost", "costs", "what is", "what's", "what does",
+    "do you have", "please", "this", "that",
+)
+
+
+def find_order_id_match(text: str) -> Optional[re.Match]:
+    return ORDER_ID_RE.search(text) or ALNUM_ORDER_ID_RE.search(text)
+
+
+def find_order_id(text: str) -> Optional[str]:
+    """The order ID an order question would be answered from; needs no intent (the lookup pre-pass uses it)."""
+    match = find_order_id_match(text)
+    return match.group(1) if match else None
+
+
+class EntitySpan(NamedTuple):
+    name: str
+    value: str
+    start: int # Character offsets into the original text
+    end: int
+
+
+class _PhraseTrie:
+    """
+    Token-level trie of stop-phrases, rendered into one regex whose alternations follow
+    the trie: shared prefixes are matched once and longer phrases win over their prefixes.
+    """
+
+    _END = ""
+
+    def __init__(self, phrases: Iterable[str]):
+        self.root: Dict[str, Any] = {}
+        for phrase in phrases:
+            node = self.root
+            for token in phrase.lower().split():
+                node = node.setdefault(token, {})
+            node[self._END] = {}
+
+    def _render(self, node: Dict[str, Any]) -> str:
+        branches = []
+        for token in sorted((t for t in node if t != self._END), key=len, reverse=True):
+            child = self._render(node[token])
+            if child:
+                optional = "?" if self._END in node[token] else "" # A phrase may also end at this token
+                branches.append(re.escape(token) + rf"(?:\s+{child}){optional}")
+            else:
+                branches.append(re.escape(token))
+        return "(?:" + "|".join(branches) + ")" if branches else ""
+
+    def pattern(self) -> str:
+        return self._render(self.root)
+
+
+class EntityExtractor:
+    def __init__(self, stop_phrases: Iterable[str] = STOP_PHRASES):
+        # One scan of the lowercased message: at each word either a whole stop-phrase
+        # matches (and is dropped) or the single word is captured. Punctuation is skipped.
+        # Every match consumes whole words, so the scan never resumes mid-word.
+        phrase = _PhraseTrie(stop_phrases).pattern()
+        self._scanner = re.compile(rf"{phrase}(?![\w'-])|([\w'-]+)")
+
+    @staticmethod
+    def _lower(text: str) -> str:
+        lowered = text.lower()
+        # A few non-ASCII characters change length when lowercased; keep span offsets valid for those
+        return lowered if len(lowered) == len(text) else "".join(c.lower()[0] for c in text)
+
+    def product_query(self, text: str) -> str:
+        """Lowercased words left once stop-phrases and punctuation are dropped ('' if none)."""
+        return " ".join(word for word in self._scanner.findall(self._lower(text)) if word)
+
+    def product_query_span(self, text: str) -> Optional[EntitySpan]:
+        """Same as product_query(), with the offsets of the first and last kept word."""
+        words = [match for match in self._scanner.finditer(self._lower(text)) if match.group(1)]
+        if not words:
+            return None
+        value = " ".join(match.group(1) for match in words)
+        return EntitySpan("product_name_query", value, words[0].start(1), words[-1].end(1))
+
+    def extract_spans(self, intent: str, text: str) -> List[EntitySpan]:
+        """Entities with their character offsets in `text`."""
+        spans: List[EntitySpan] = []
+
+        if intent in ORDER_INTENTS:
+            match = find_order_id_match(text)
+            if match:
+                spans.append(EntitySpan("order_id", match.group(1), *match.span(1)))
+
+        elif intent in PRODUCT_INTENTS:
+            sku = SKU_RE.search(text)
+            if sku:
+                spans.append(EntitySpan("item_sku", sku.group(1), *sku.span(1)))
+            query = self.product_query_span(text)
+            if query: # If anything is left, consider it a potential product name
+                spans.append(query)
+
+        elif intent == "request_return":
+            # Try to find an order ID if mentioned with return
+            match = ORDER_ID_RE.search(text)
+            if match:
+                spans.append(EntitySpan("order_id", match.group(1), *match.span(1)))
+            sku = SKU_RE.search(text)
+            if sku:
+                spans.append(EntitySpan("item_sku", sku.group(1), *sku.span(1)))
+
+        return spans
+
+    def extract(self, intent: str, text: str) -> Dict[str, Any]:
+        """
+        Entity values keyed by name, the shape returned in ChatResponse.entities.
+        Same result as extract_spans() without building the spans (this runs on every message).
+        """
+        entities: Dict[str, Any] = {}
+
+        if intent in ORDER_INTENTS:
+            order_id = find_order_id(text)
+            if order_id:
+                entities["order_id"] = order_id
+
+        elif intent in PRODUCT_INTENTS:
+            sku = SKU_RE.search(text)
+            if sku:
+                entities["item_sku"] = sku.group(1)
+            query = self.product_query(text)
+            if query:
+                entities["product_name_query"] = query
+
+        elif intent == "request_return":
+            match = ORDER_ID_RE.search(text)
+            if match:
+                entities["order_id"] = match.group(1)
+            sku = SKU_RE.search(text)
+            if sku:
+                entities["item_sku"] = sku.group(1)
+
+        return entities
+
+
+entity_extractor = EntityExtractor()
@@ -1,15 +1,41 @@
 # backend/app/core/escalations.py
-from sqlalchemy.orm import Session
+# Escalation tickets, and the Redis stream that hands them to agents and to notifications.
+#
+# A ticket is written to escalation_tickets with its turn (app/db/turns.py); once committed it
+# is also added to the stream ESCALATION_STREAM_KEY. Two consumer groups read that stream,
+# each getting every ticket:
+#   agents          agent tooling, through /api/v1/escalations: claim hands out the oldest
+#                   unclaimed tickets, ack marks one handled. A ticket claimed but not acked
+#                   within ESCALATION_CLAIM_TIMEOUT_SECONDS (agent closed the tab, crashed)
+#                   is handed out again by the next claim.
+#   notifications   EscalationNotifier, running in every API worker: sends the tickets it
+#                   read together as one send_escalation_notifications Celery task, then acks them.
+# Both are at-least-once; the database row stays the record of the ticket's status.
+
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from ..db import models, schemas # Assuming models.py and schemas.py are in backend/app/db/
 from ..config import settings
 from datetime import datetime
 
-def create_escalation_ticket(db: Session, conversation_id: int, user_id: str | None = None, initial_query: str | None = None) -> models.EscalationTicket:
+logger = logging.getLogger(__name__)
+
+
+async def create_escalation_ticket(db: AsyncSession, conversation_id: int, user_id: str | None = None, initial_query: str | None = None,
+                                   queue: Optional["EscalationQueue"] = None) -> models.EscalationTicket:
     """
     Creates and stores an escalation ticket.
     """
     # First, ensure the conversation exists and mark it as escalated
-    db_conversation = db.query(models.Conversation).filter(models.Conversation.id == conversation_id).first()
+    db_conversation = (await db.execute(
+        select(models.Conversation).where(models.Conversation.id == conversation_id)
+    )).scalar_one_or_none()
     if not db_conversation:
         pass
     if db_conversation:
@@ -24,17 +50,17 @@ def create_escalation_ticket(db: Session, conversation_id: int, user_id: str | N
     )
     db_ticket = models.EscalationTicket(**ticket_data.model_dump(), created_at=datetime.utcnow())
     db.add(db_ticket)
-    db.commit()
-    db.refresh(db_ticket)
+    await db.commit()
+    await db.refresh(db_ticket)
     
-    # Here  would also typically push this ticket ID or details to a Redis queue
-    # for human agents to pick up.
-    # Example (conceptual, actual Redis client usage would be here):
-    # print(f"LOG: Pushing ticket {db_ticket.id} for conversation {conversation_id} to Redis.")
+    # Hand the ticket to agents and notifications, now that it is committed
+    if queue is not None:
+        await queue.enqueue(db_ticket.id, conversation_id, user_id, initial_query)
 
     return db_ticket
 
-def handle_escalation(message_text: str, user_id: str | None, db: Session, conversation_id: int) -> models.EscalationTicket:
+async def handle_escalation(message_text: str, user_id: str | None, db: AsyncSession, conversation_id: int,
+                            queue: Optional["EscalationQueue"] = None) -> models.EscalationTicket:
     """
     Handles the escalation process for a given message.
     This would involve:
@@ -42,16 +68,297 @@ def handle_escalation(message_text: str, user_id: str | None, db: Session, conve
     2. Creating an escalation ticket.
     3. Notifying relevant systems (e.g., pushing to Redis queue).
     """
-    print(f"Escalation triggered for user '{user_id}' due to message: '{message_text}' in conversation {conversation_id}")
+    logger.info("Escalation triggered for user '%s' in conversation %s", user_id, conversation_id)
 
     # For simplicity, we'll directly create a ticket here.
     # In a real app,  might have more complex logic to decide if a new conversation
     # needs to be created or an existing one is used.
     
-    ticket = create_escalation_ticket(
+    ticket = await create_escalation_ticket(
         db=db,
         conversation_id=conversation_id,
         user_id=user_id,
-        initial_query=message_text
+        initial_query=message_text,
+        queue=queue,
+    )
+    return ticket
+
+
+def _decode(value) -> str:
+    return value.decode() if isinstance(value, bytes) else value
+
+
+def _percentile(values: List[float], q: float) -> Optional[float]:
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(q * len(values)))], 2) if values else None
+
+
+# Acks an entry only for the consumer it is pending with: 1 acked, 0 another consumer holds it,
+# -1 not pending (unknown id, already acked)
+_ACK_IF_HELD_SCRIPT = """
+local pending = redis.call("XPENDING", KEYS[1], ARGV[1], ARGV[2], ARGV[2], 1)
+if #pending == 0 then
+    return -1
+end
+if pending[1][2] ~= ARGV[3] then
+    return 0
+end
+return redis.call("XACK", KEYS[1], ARGV[1], ARGV[2])
+"""
+
+
+class EscalationQueue:
+    """The escalation stream and its consumer groups, over a redis.asyncio client."""
+
+    def __init__(
+        self,
+        redis_client,
+        stream: str = "chat:escalations",
+        agent_group: str = "agents",
+        notify_group: str = "notifications",
+        maxlen: int = 100000,
+        claim_timeout_seconds: float = 300.0,
+    ):
+        self.redis = redis_client
+        self.stream = stream
+        self.agent_group = agent_group
+        self.notify_group = notify_group
+        self.maxlen = maxlen
+        self.claim_timeout_ms = int(claim_timeout_seconds * 1000)
+        # Looking for stale claims costs a round-trip; once per tenth of the timeout finds them soon enough
+        self.reclaim_interval = min(claim_timeout_seconds / 10, 5.0)
+        self._next_reclaim = 0.0
+        self._groups_ready = False
+        self._ack_if_held = redis_client.register_script(_ACK_IF_HELD_SCRIPT)
+
+        self.enqueued = 0
+        self.enqueue_errors = 0
+        self.claimed = 0
+        self.reclaimed = 0 # Handed out again after ESCALATION_CLAIM_TIMEOUT_SECONDS without an ack
+        self.acked = 0
+        self.claim_latencies_ms: deque = deque(maxlen=1000) # Enqueue -> first claim, recent tickets
+
+    async def ensure_groups(self) -> None:
+        """Creates the stream and both groups (from the stream's start, so nothing enqueued earlier is missed)."""
+        if self._groups_ready:
+            return
+        for group in (self.agent_group, self.notify_group):
+            try:
+                await self.redis.xgroup_create(self.stream, group, id="0", mkstream=True)
+            except Exception as e:
+                if "BUSYGROUP" not in str(e): # Already exists
+                    raise
+        self._groups_ready = True
+
+    async def enqueue(self, ticket_id: int, conversation_id: int, user_id: Optional[str], message: Optional[str]) -> Optional[str]:
+        """
+        Adds a committed ticket to the stream; returns its entry id. A Redis failure is logged
+        and returns None: the ticket is still pending in the database, and the reply to the
+        user must not fail over it.
+        """
+        try:
+            await self.ensure_groups()
+            entry_id = await self.redis.xadd(
+                self.stream,
+                {
+                    "ticket_id": ticket_id,
+                    "conversation_id": conversation_id,
+                    "user_id": user_id or "",
+                    "message": (message or "")[:500],
+                    "enqueued_at": time.time(),
+                },
+                maxlen=self.maxlen, approximate=True, # Trimmed in whole nodes, which is cheap
+            )
+        except Exception as e:
+            self.enqueue_errors += 1
+            logger.warning("EscalationQueue: could not enqueue ticket %s: %s", ticket_id, e)
+            return None
+        self.enqueued += 1
+        return _decode(entry_id)
+
+    @staticmethod
+    def _ticket(entry_id, fields: Dict) -> Dict[str, Any]:
+        fields = {_decode(k): _decode(v) for k, v in fields.items()}
+        return {
+            "entry_id": _decode(entry_id),
+            "ticket_id": int(fields["ticket_id"]),
+            "conversation_id": int(fields["conversation_id"]),
+            "user_id": fields.get("user_id") or None,
+            "message": fields.get("message", ""),
+            "enqueued_at": float(fields["enqueued_at"]),
+        }
+
+    async def _reclaim(self, group: str, consumer: str, count: int) -> List[Dict[str, Any]]:
+        """Takes over entries another consumer of `group` was given but didn't ack in time."""
+        _, entries, *_ = await self.redis.xautoclaim(
+            self.stream, group, consumer, min_idle_time=self.claim_timeout_ms, start_id="0-0", count=count)
+        return [self._ticket(entry_id, fields) for entry_id, fields in entries if fields] # Trimmed entries come back empty
+
+    async def _read(self, group: str, consumer: str, count: int, block_ms: int) -> List[Dict[str, Any]]:
+        response = await self.redis.xreadgroup(group, consumer, {self.stream: ">"}, count=count, block=block_ms or None)
+        return [self._ticket(entry_id, fields) for _, entries in response or [] for entry_id, fields in entries]
+
+    async def claim(self, agent: str, count: int = 1, block_ms: int = 0) -> List[Dict[str, Any]]:
+        """
+        Up to `count` tickets for `agent`: stale claims of other agents first, then new tickets,
+        oldest first. With block_ms, waits up to that long for a new ticket when there is none.
+        """
+        await self.ensure_groups()
+        tickets = []
+        if time.monotonic() >= self._next_reclaim:
+            tickets = await self._reclaim(self.agent_group, agent, count)
+            self.reclaimed += len(tickets)
+            if len(tickets) < count: # None left over; otherwise the next claim looks again
+                self._next_reclaim = time.monotonic() + self.reclaim_interval
+        if len(tickets) < count:
+            fresh = await self._read(self.agent_group, agent, count - len(tickets), block_ms if not tickets else 0)
+            now = time.time()
+            for ticket in fresh:
+                self.claim_latencies_ms.append((now - ticket["enqueued_at"]) * 1000)
+            tickets += fresh
+        self.claimed += len(tickets)
+        return tickets
+
+    async def ack(self, group: str, entry_ids: List[str]) -> int:
+        """Marks entries handled in `group`; returns how many were pending (0 for an unknown or already acked id)."""
+        acked = await self.redis.xack(self.stream, group, *entry_ids) if entry_ids else 0
+        if group == self.agent_group:
+            self.acked += acked
+        return acked
+
+    async def ack_claim(self, agent: str, entry_id: str) -> Optional[bool]:
+        """
+        Acks a ticket `agent` claimed: True once acked, False when another agent holds it, None
+        when nobody does (unknown id, already acked). Checked and acked in one Lua call, so an
+        agent whose stale claim was handed to someone else can no longer ack it.
+        """
+        result = await self._ack_if_held(keys=[self.stream], args=[self.agent_group, entry_id, agent])
+        if result == 1:
+            self.acked += 1
+            return True
+        return False if result == 0 else None
+
+    async def entry(self, entry_id: str) -> Optional[Dict[str, Any]]:
+        entries = await self.redis.xrange(self.stream, min=entry_id, max=entry_id, count=1)
+        return self._ticket(*entries[0]) if entries else None
+
+    async def backlog(self) -> Dict[str, Any]:
+        """Per group: claimed-but-unacked entries and tickets not handed out yet."""
+        await self.ensure_groups()
+        groups = {}
+        for info in await self.redis.xinfo_groups(self.stream):
+            info = {_decode(k): v for k, v in info.items()}
+            groups[_decode(info["name"])] = {"pending": info["pending"], "lag": info.get("lag"), "consumers": info["consumers"]}
+        return {"stream_length": await self.redis.xlen(self.stream), "groups": groups}
+
+    def stats(self) -> Dict[str, Any]:
+        latencies = list(self.claim_latencies_ms)
+        return {
+            "enqueued": self.enqueued,
+            "enqueue_errors": self.enqueue_errors,
+            "claimed": self.claimed,
+            "reclaimed": self.reclaimed,
+            "acked": self.acked,
+            "enqueue_to_claim_ms": {"p50": _percentile(latencies, 0.5), "p95": _percentile(latencies, 0.95),
+                                    "max": _percentile(latencies, 1.0)},
+        }
+
+
+def notify_with_celery(tickets: List[Dict[str, Any]]) -> None:
+    """Default EscalationNotifier action: one send_escalation_notifications task (realtime queue) per batch."""
+    from .tasks import send_escalation_notifications
+    send_escalation_notifications.delay(tickets)
+
+
+class EscalationNotifier:
+    """
+    Reads the stream's notifications group and hands what it read to `notify_batch(tickets)`,
+    or to `notify(ticket)` one at a time, in a thread (sending a Celery task is a blocking
+    broker write), acking the tickets afterwards. Every API worker runs one, as one consumer
+    of the group; a ticket whose notifier died before the ack is picked up by another worker
+    after ESCALATION_CLAIM_TIMEOUT_SECONDS.
+    """
+
+    def __init__(self, queue: EscalationQueue, consumer: str, notify: Optional[Callable[[Dict[str, Any]], Any]] = None,
+                 block_ms: int = 1000, batch_size: int = 50,
+                 notify_batch: Optional[Callable[[List[Dict[str, Any]]], Any]] = None):
+        self.queue = queue
+        self.consumer = consumer
+        self.notify = notify
+        self.notify_batch = notify_batch if notify_batch is not None or notify is not None else notify_with_celery
+        self.block_ms = block_ms
+        self.batch_size = batch_size
+        self.notified = 0
+        self.failures = 0
+        self._task: Optional[asyncio.Task] = None
+
+    async def run_once(self) -> int:
+        """Handles one batch (stale entries first); returns how many tickets were notified."""
+        await self.queue.ensure_groups()
+        tickets = await self.queue._reclaim(self.queue.notify_group, self.consumer, self.batch_size)
+        if not tickets:
+            tickets = await self.queue._read(self.queue.notify_group, self.consumer, self.batch_size, self.block_ms)
+        done = []
+        if tickets and self.notify_batch is not None:
+            try:
+                await asyncio.to_thread(self.notify_batch, tickets)
+                done = [ticket["entry_id"] for ticket in tickets]
+            except Exception as e: # Not acked: retried once they're stale
+                self.failures += 1
+                logger.warning("EscalationNotifier: notification of %d tickets failed: %s", len(tickets), e)
+        elif tickets:
+            for ticket in tickets:
+                try:
+                    await asyncio.to_thread(self.notify, ticket)
+                    done.append(ticket["entry_id"])
+                except Exception as e:
+                    self.failures += 1
+                    logger.warning("EscalationNotifier: notification for ticket %s failed: %s", ticket['ticket_id'], e)
+        await self.queue.ack(self.queue.notify_group, done)
+        self.notified += len(done)
+        return len(done)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e: # Redis unavailable: try again shortly
+                logger.warning("EscalationNotifier: %s", e)
+                await asyncio.sleep(1.0)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+def build_escalation_queue() -> Optional[EscalationQueue]:
+    """The queue per settings; None when ESCALATION_QUEUE_ENABLED is off or REDIS_URL unset (tickets live in the database only)."""
+    if not settings.ESCALATION_QUEUE_ENABLED:
+        return None
+    if not settings.REDIS_URL:
+        logger.warning("EscalationQueue: ESCALATION_QUEUE_ENABLED is set but REDIS_URL is not; tickets stay in the database only")
+        return None
+    import redis.asyncio
+    # A client of its own: the shared one's REDIS_SOCKET_TIMEOUT is far shorter than a blocking claim
+    redis_client = redis.asyncio.Redis.from_url(
+        settings.REDIS_URL,
+        socket_timeout=settings.ESCALATION_MAX_BLOCK_SECONDS + 2,
+        socket_connect_timeout=settings.REDIS_SOCKET_TIMEOUT,
     )
-    return ticket
\ No newline at end of file
+    return EscalationQueue(
+        redis_client,
+        stream=settings.ESCALATION_STREAM_KEY,
+        maxlen=settings.ESCALATION_STREAM_MAXLEN,
+        claim_timeout_seconds=settings.ESCALATION_CLAIM_TIMEOUT_SECONDS,
+    )
\ No newline at end of file
@@ -0,0 +1,16 @@
+# backend/app/core/intents.py
+# Intent label set of the classifier, in model output order.
+# Kept free of torch/transformers imports so scripts and tools can use it cheaply.
+
+INTENT_LABELS = [
+    "track_order",
+    "request_return",
+    "product_info",
+    "shipping_info", # New intent based on common e-commerce queries
+    "price_query",   # New intent
+    "availability",  # New intent
+    "human_agent",   # User wants to speak to a human
+    "general_query", # A fallback or general question
+    "greet",         # Greeting intent
+    "goodbye"        # Goodbye intent
+]
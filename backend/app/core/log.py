@@ -0,0 +1,71 @@
+# backend/app/core/log.py
+# Non-blocking logging for the API worker and the Celery workers.
+#
+# Modules log through `logging.getLogger(__name__)` (loggers under "app"). configure_logging()
+# gives the "app" logger a single handler that only puts the record on a bounded queue; a
+# QueueListener thread formats it and does the actual write to stdout. A turn never waits on
+# a slow terminal or log pipe, and when the writer can't keep up, records are dropped (and
+# counted) rather than buffered without bound.
+
+import atexit
+import logging
+import os
+import queue
+import sys
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Dict, Optional
+
+from ..config import settings
+
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+
+class DroppingQueueHandler(QueueHandler):
+    """QueueHandler that drops the record when the queue is full instead of blocking or erroring."""
+
+    def __init__(self, records: queue.Queue):
+        super().__init__(records)
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_handler: Optional[DroppingQueueHandler] = None
+_listener: Optional[QueueListener] = None
+_pid: Optional[int] = None
+
+
+def configure_logging(level: str = settings.LOG_LEVEL, queue_size: int = settings.LOG_QUEUE_SIZE) -> None:
+    """Installs the queue handler on the "app" logger and starts its writer thread. Safe to call more than once."""
+    global _handler, _listener, _pid
+    logger = logging.getLogger("app")
+    if _listener is not None:
+        if _pid == os.getpid():
+            return
+        logger.removeHandler(_handler) # A forked (prefork Celery) child: the writer thread didn't come along
+    records: queue.Queue = queue.Queue(maxsize=max(1, queue_size))
+    # The real stdout: Celery workers replace sys.stdout with a proxy that logs what is printed
+    stream = logging.StreamHandler(sys.__stdout__ or sys.stdout)
+    stream.setFormatter(logging.Formatter(LOG_FORMAT))
+    _handler = DroppingQueueHandler(records)
+    _listener = QueueListener(records, stream, respect_handler_level=True)
+    _listener.start()
+    _pid = os.getpid()
+    atexit.register(_listener.stop) # Writes what is still queued
+
+    logger.addHandler(_handler)
+    logger.setLevel(level.upper())
+    logger.propagate = False # Uvicorn/Celery configure the root logger; don't write every record twice
+
+
+def stats() -> Dict[str, Any]:
+    return {
+        "configured": _listener is not None,
+        "level": logging.getLevelName(logging.getLogger("app").getEffectiveLevel()),
+        "queued": _handler.queue.qsize() if _handler is not None else 0,
+        "dropped": _handler.dropped if _handler is not None else 0,
+    }
@@ -0,0 +1,169 @@
+# backend/app/core/lookups.py
+# Upstream lookups of a turn, started before the model has classified the message.
+#
+# A turn used to classify, then make its e-commerce call(s) one after the other, so a
+# "where's my order 12345, has it shipped?" paid inference latency and upstream latency back
+# to back. Now, as soon as a message arrives, a cheap pre-pass (the order-ID patterns of
+# core/entities.py, no model) looks for an order ID and, if there is one, starts the order
+# and shipping lookups while inference runs. Once the intent is known:
+#
+#   fetch(intent, entities)   the lookups INTENT_LOOKUPS lists for the intent, all awaited
+#                             together (asyncio.gather); speculative ones already running for
+#                             the same argument are reused, the others are started now
+#   close()                   cancels speculative lookups the intent didn't need (and any
+#                             left if the turn escalated or failed)
+#
+# Only read-only lookups are speculative; request_return is never started before the intent
+# says so. With the read-through cache (services/ecommerce_cache.py) a cancelled lookup still
+# completes in the background and fills the cache.
+#
+# LookupStats keeps, per intent, how long the turn waited for its lookups after
+# classification against what it would have waited making them one by one after it
+# (the sum of their durations): that difference is the latency saved.
+
+import asyncio
+import time
+from collections import defaultdict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from .entities import find_order_id
+
+# Lookup name -> the service call, given its argument
+LOOKUP_CALLS: Dict[str, Callable[[Any, str], Awaitable[dict]]] = {
+    "order_details": lambda service, order_id: service.get_order_details(order_id),
+    "shipping_info": lambda service, order_id: service.check_shipping_info(order_id),
+    "product_info": lambda service, query: service.get_product_info(query),
+}
+
+# Intent -> (lookup name, entity holding its argument); lookups of one intent are independent
+INTENT_LOOKUPS: Dict[str, Tuple[Tuple[str, str], ...]] = {
+    "track_order": (("order_details", "order_id"), ("shipping_info", "order_id")),
+    "shipping_info": (("shipping_info", "order_id"),),
+    "product_info": (("product_info", "product_name_query"),),
+    "price_query": (("product_info", "product_name_query"),),
+    "availability": (("product_info", "product_name_query"),),
+}
+
+# Started from the pre-pass when it finds an order ID: read-only, and what order questions need
+SPECULATIVE_LOOKUPS = ("order_details", "shipping_info")
+
+
+class LookupStats:
+    """Per-intent lookup figures for this worker, in milliseconds."""
+
+    def __init__(self):
+        self.intents: Dict[str, Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+        self.speculated_turns = 0 # Turns whose pre-pass found an order ID
+
+    def record(self, intent: str, lookups: int, reused: int, cancelled: int, waited_ms: float, sequential_ms: float) -> None:
+        figures = self.intents[intent]
+        figures["turns"] += 1
+        figures["lookups"] += lookups
+        figures["speculative_used"] += reused
+        figures["speculative_cancelled"] += cancelled
+        figures["waited_ms"] += waited_ms
+        figures["sequential_ms"] += sequential_ms
+        figures["saved_ms"] += max(0.0, sequential_ms - waited_ms)
+
+    def stats(self) -> Dict[str, Any]:
+        intents = {}
+        for intent, figures in sorted(self.intents.items()):
+            turns = figures["turns"]
+            intents[intent] = {
+                "turns": int(turns),
+                "lookups": int(figures["lookups"]),
+                "speculative_used": int(figures["speculative_used"]),
+                "speculative_cancelled": int(figures["speculative_cancelled"]),
+                "avg_wait_ms": round(figures["waited_ms"] / turns, 2),
+                "avg_sequential_ms": round(figures["sequential_ms"] / turns, 2), # Lookups one by one, after classification
+                "avg_saved_ms": round(figures["saved_ms"] / turns, 2),
+                "total_saved_ms": round(figures["saved_ms"], 2),
+            }
+        return {"speculated_turns": self.speculated_turns, "intents": intents}
+
+
+class TurnLookups:
+    """The lookups of one turn: speculative ones from the pre-pass, then the intent's."""
+
+    def __init__(self, service, stats: Optional[LookupStats] = None):
+        self.service = service
+        self.stats = stats
+        self._tasks: Dict[Tuple[str, str], asyncio.Task] = {}
+        self._durations: Dict[Tuple[str, str], float] = {}
+
+    def _start(self, name: str, argument: str) -> asyncio.Task:
+        key = (name, argument)
+
+        async def timed():
+            started = time.perf_counter()
+            try:
+                return await LOOKUP_CALLS[name](self.service, argument)
+            finally:
+                self._durations[key] = (time.perf_counter() - started) * 1000
+
+        task = asyncio.get_running_loop().create_task(timed())
+        task.add_done_callback(_retrieve)
+        self._tasks[key] = task
+        return task
+
+    def speculate(self, text: str) -> None:
+        """The pre-pass: starts the order lookups if the message mentions an order ID."""
+        order_id = find_order_id(text)
+        if order_id is None:
+            return
+        for name in SPECULATIVE_LOOKUPS:
+            self._start(name, order_id)
+        if self.stats is not None:
+            self.stats.speculated_turns += 1
+
+    async def fetch(self, intent: str, entities: Dict[str, Any]) -> Dict[str, dict]:
+        """Results of the lookups `intent` needs, by lookup name ({} if it needs none or lacks the entities)."""
+        needed = {name: entities[entity] for name, entity in INTENT_LOOKUPS.get(intent, ()) if entities.get(entity)}
+        keys = list(needed.items())
+        cancelled = self._cancel(keep=set(keys))
+        reused = sum(1 for key in keys if key in self._tasks)
+        waiting_since = time.perf_counter()
+        results = await asyncio.gather(*(self._tasks.get(key) or self._start(*key) for key in keys))
+        waited_ms = (time.perf_counter() - waiting_since) * 1000
+        for key in keys:
+            self._tasks.pop(key, None)
+        if self.stats is not None and needed:
+            self.stats.record(intent, len(keys), reused, cancelled, waited_ms,
+                              sum(self._durations.get(key, 0.0) for key in keys))
+        elif self.stats is not None and cancelled:
+            self.stats.record(intent, 0, 0, cancelled, 0.0, 0.0)
+        return dict(zip(needed, results))
+
+    def _cancel(self, keep=frozenset()) -> int:
+        cancelled = 0
+        for key in list(self._tasks):
+            if key not in keep:
+                task = self._tasks.pop(key)
+                if not task.done():
+                    task.cancel()
+                cancelled += 1
+        return cancelled
+
+    def close(self, intent: Optional[str] = None) -> None:
+        """Cancels what is still pending (the turn escalated or failed); counted against `intent` if given."""
+        cancelled = self._cancel()
+        if cancelled and self.stats is not None and intent is not None:
+            self.stats.record(intent, 0, 0, cancelled, 0.0, 0.0)
+
+
+def _retrieve(task: asyncio.Task) -> None:
+    if not task.cancelled():
+        task.exception() # A speculative lookup nobody awaited must not be logged as an unhandled failure
+
+
+class LookupPlanner:
+    def __init__(self, speculate: bool = True):
+        self.speculate = speculate
+        self.stats = LookupStats()
+
+    def start(self, service, text: Optional[str] = None) -> TurnLookups:
+        """A turn's lookups against `service`; with `text`, its speculative ones are started right away."""
+        lookups = TurnLookups(service, self.stats)
+        if self.speculate and text:
+            lookups.speculate(text)
+        return lookups
@@ -1,107 +1,450 @@
 
-from transformers import AutoTokenizer, AutoModelForSequenceClassification
-import torch
-from typing import Tuple, Dict, Any, List # Added List
+# backend/app/core/nlp.py
+# Intent classification. torch/transformers are only imported when the model is actually
+# loaded (see ModelManager), so importing this module - from the API routers, the Celery
+# worker or tests - stays cheap.
+import asyncio
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Tuple, Dict, Any, List, Optional, Iterable # Added List
 from ..config import settings
+from ..utils.cache import LRUTTLCache
+from .batching import MicroBatcher
+from .entities import entity_extractor
+from .intents import INTENT_LABELS
+from .metrics import ENTITY_EXTRACTION, FALLBACK_CLASSIFICATIONS, INFERENCE_QUEUE_DEPTH, MODEL_FORWARD, TOKENIZE, Span
+from .tracing import TraceSpan
+
+logger = logging.getLogger(__name__)
+
+
+class InferenceUnavailable(Exception):
+    """Base for conditions where the chat endpoints should answer 503 and let the client retry."""
+    detail = "Chatbot is temporarily unavailable, please retry shortly" # Safe to show to clients
+
+
+class InferenceQueueFull(InferenceUnavailable):
+    """Raised when NLP_INFERENCE_MAX_QUEUE requests are already waiting for the model."""
+    detail = "Chatbot is busy, please retry shortly"
+
+
+class ModelNotReady(InferenceUnavailable):
+    """Raised while the model is still loading or warming up, or after loading failed."""
+    detail = "Chatbot is starting up, please retry shortly"
+
+_WHITESPACE_RE = re.compile(r"\s+")
+_DIGITS_RE = re.compile(r"\d+")
+
+
+def normalize_text(text: str) -> str:
+    """
+    Cache key for a message: lowercased, whitespace collapsed and digit runs masked, so
+    "Where is my order 12345" and "where is my  order 67890" share one prediction.
+    """
+    return _DIGITS_RE.sub("#", _WHITESPACE_RE.sub(" ", text.strip().lower()))
+
+
+class PredictionCache:
+    """
+    Caches (intent, confidence) per normalized text in front of the model.
+
+    The in-process LRU/TTL tier is always used; when a Redis client is given, misses
+    fall through to a shared tier so every worker benefits from the others' work.
+    Entities are never cached: they depend on the raw text (order IDs etc.).
+    """
+
+    def __init__(self, maxsize: int, ttl: float, redis_client=None, namespace: str = ""):
+        self.local = LRUTTLCache(maxsize=maxsize, ttl=ttl)
+        self.ttl = ttl
+        self.redis = redis_client
+        # Scope shared entries to the model so a model swap never serves stale predictions
+        self.redis_prefix = f"nlp:intent:{namespace}:"
+        self.redis_hits = 0
+        self.redis_errors = 0
+
+    def _redis_key(self, key: str) -> str:
+        return self.redis_prefix + hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Tuple[str, float]]:
+        found: Dict[str, Tuple[str, float]] = {}
+        missing = []
+        for key in keys:
+            value = self.local.get(key)
+            if value is None:
+                missing.append(key)
+            else:
+                found[key] = value
+
+        if missing and self.redis is not None:
+            try:
+                raw_values = self.redis.mget([self._redis_key(key) for key in missing])
+            except Exception as e: # Redis is an optimisation: never fail a prediction because of it
+                self.redis_errors += 1
+                logger.warning("PredictionCache: Redis lookup failed: %s", e)
+                raw_values = []
+            for key, raw in zip(missing, raw_values):
+                if raw is not None:
+                    intent, confidence = json.loads(raw)
+                    found[key] = (intent, confidence)
+                    self.local.set(key, (intent, confidence))
+                    self.redis_hits += 1
+        return found
+
+    def set_many(self, items: Dict[str, Tuple[str, float]]) -> None:
+        for key, value in items.items():
+            self.local.set(key, value)
+        if items and self.redis is not None:
+            try:
+                pipe = self.redis.pipeline(transaction=False)
+                for key, value in items.items():
+                    pipe.setex(self._redis_key(key), int(self.ttl), json.dumps(value))
+                pipe.execute()
+            except Exception as e:
+                self.redis_errors += 1
+                logger.warning("PredictionCache: Redis write failed: %s", e)
+
+    def stats(self) -> Dict[str, Any]:
+        stats = self.local.stats()
+        stats["redis_enabled"] = self.redis is not None
+        stats["redis_hits"] = self.redis_hits
+        stats["redis_errors"] = self.redis_errors
+        return stats
+
 
 class IntentClassifier:
-    def __init__(self):
-        self.tokenizer = AutoTokenizer.from_pretrained(settings.MODEL_NAME)
-        self.model = AutoModelForSequenceClassification.from_pretrained(
-            settings.MODEL_NAME,
-            num_labels=len(self.get_intent_labels())
+    def __init__(self, cache: Optional[PredictionCache] = None):
+        import torch
+        from transformers import AutoTokenizer
+        from .nlp_backends import load_backend
+        from .tokenization import LengthAwareTokenizer
+
+        self.cache = cache
+        if settings.NLP_TORCH_THREADS > 0:
+            # Several inference workers each spawning a full set of intra-op threads oversubscribes the CPU
+            torch.set_num_threads(settings.NLP_TORCH_THREADS)
+
+        self.tokenizer = AutoTokenizer.from_pretrained(settings.NLP_MODEL_NAME, use_fast=True)
+        self.length_tokenizer = LengthAwareTokenizer(
+            self.tokenizer,
+            max_length=settings.NLP_MAX_SEQ_LENGTH,
+            cap_percentile=settings.NLP_SEQ_LENGTH_PERCENTILE,
+            min_samples=settings.NLP_SEQ_LENGTH_MIN_SAMPLES,
+            buckets=settings.NLP_SEQ_LENGTH_BUCKETS,
         )
-        
         self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-        self.model.to(self.device)
-        self.model.eval() # Ensure model is in evaluation mode
+        self.backend = load_backend(
+            settings.NLP_BACKEND,
+            settings.NLP_MODEL_NAME,
+            num_labels=len(self.get_intent_labels()),
+            artifacts_dir=settings.NLP_BACKEND_ARTIFACTS_DIR,
+            device=self.device,
+            allow_untrained_head=settings.NLP_ALLOW_UNTRAINED_HEAD,
+        )
+        self.device = self.backend.device # Some backends (int8, onnx) are CPU-only
         
     @staticmethod
     def get_intent_labels() -> List[str]: # Added List type hint
-        return [
-            "track_order",
-            "request_return",
-            "product_info",
-            "shipping_info", # New intent based on common e-commerce queries
-            "price_query",   # New intent
-            "availability",  # New intent
-            "human_agent",   # User wants to speak to a human
-            "general_query", # A fallback or general question
-            "greet",         # Greeting intent
-            "goodbye"        # Goodbye intent
-        ]
+        return list(INTENT_LABELS)
     
     def predict(self, text: str) -> Tuple[str, float, Dict[str, Any]]:
-        inputs = self.tokenizer(
-            text,
-            truncation=True,
-            padding=True,
-            max_length=512, # Added max_length for robustness
-            return_tensors="pt"
-        ).to(self.device)
-        
-        with torch.no_grad():
-            outputs = self.model(**inputs)
-            probabilities = torch.softmax(outputs.logits, dim=1)
-            confidence_tensor, predicted_class_tensor = torch.max(probabilities, dim=1)
-            
-        intent = self.get_intent_labels()[predicted_class_tensor.item()]
-        confidence = confidence_tensor.item()
-        
-        entities = {}
-        text_lower = text.lower()
-
-        if intent == "track_order":
-            import re
-            match = re.search(r'\b(\d{5,})\b', text) # Look for 5 or more digits
-            if match:
-                entities["order_id"] = match.group(1)
-            else: # Try to find alphanumeric order IDs (e.g., ORD123XYZ)
-                match_alnum = re.search(r'\b([a-zA-Z0-9]{6,}-[a-zA-Z0-9]{6,}|[a-zA-Z]{2,}\d{4,})\b', text)
-                if match_alnum:
-                    entities["order_id"] = match_alnum.group(1)
-
-        elif intent == "product_info" or intent == "price_query" or intent == "availability":
-            # Very basic: assumes product name might be after certain phrases
-            keywords_to_remove = [
-                "tell me about", "info on", "product info for", "is", "in stock",
-                "how much is", "price of", "availability of", "check if", "available",
-                "the", "a", "an", "for"
-            ]
-
-            temp_message = text_lower
-            for kw in keywords_to_remove:
-                temp_message = temp_message.replace(kw, "")
-            # Remove question marks
-            temp_message = temp_message.replace("?","").strip()
-            if temp_message: # If anything is left, consider it a potential product name
-                entities["product_name_query"] = temp_message
-        
-        elif intent == "request_return":
-            import re
-            # Try to find an order ID if mentioned with return
-            match = re.search(r'\b(\d{5,})\b', text)
-            if match:
-                entities["order_id"] = match.group(1)
-            #  might also look for item names here if the query is complex
-
-        return intent, confidence, entities
-
-
-try:
-    classifier = IntentClassifier()
-    print("IntentClassifier initialized successfully.")
-except Exception as e:
-    print(f"Error initializing IntentClassifier: {e}")
-    print("NLP features will be severely limited. Check model name and availability.")
-    # Fallback classifier if initialization fails
-    class FallbackClassifier:
-        def predict(self, text: str) -> Tuple[str, float, Dict[str, Any]]:
-            return "general_query", 0.1, {} # Low confidence fallback
-    classifier = FallbackClassifier()
+        return self.predict_batch([text])[0]
+
+    def predict_batch(self, texts: List[str], use_cache: bool = True) -> List[Tuple[str, float, Dict[str, Any]]]:
+        """
+        Classifies several messages with a single padded forward pass.
+        Results are returned in the same order as `texts`.
+
+        With a cache, only messages whose normalized text hasn't been seen go through
+        the model (once per distinct key). Entities always come from the raw text.
+        use_cache=False runs every message through the model and leaves the cache alone.
+        """
+        if self.cache is None or not use_cache:
+            scores = self._classify(texts)
+        else:
+            keys = [normalize_text(text) for text in texts]
+            known = self.cache.get_many(set(keys))
+            # One representative raw text per uncached key
+            to_run = {}
+            for key, text in zip(keys, texts):
+                if key not in known and key not in to_run:
+                    to_run[key] = text
+            if to_run:
+                fresh = dict(zip(to_run.keys(), self._classify(list(to_run.values()))))
+                self.cache.set_many(fresh)
+                known.update(fresh)
+            scores = [known[key] for key in keys]
+
+        return [(intent, confidence, self.extract_entities(intent, text))
+                for text, (intent, confidence) in zip(texts, scores)]
+
+    def _classify(self, texts: List[str]) -> List[Tuple[str, float]]:
+        """
+        Runs the model itself: one forward pass per length bucket, so a short message
+        is never padded to the longest one in the batch. (intent, confidence) per text.
+        """
+        import torch
+        labels = self.get_intent_labels()
+        results: List[Any] = [None] * len(texts)
+        with Span(TOKENIZE):
+            encoded = self.length_tokenizer.encode(texts)
+        for indices, input_ids, attention_mask in encoded:
+            with torch.no_grad(), Span(MODEL_FORWARD):
+                logits = self.backend.logits(input_ids.to(self.device), attention_mask.to(self.device))
+                probabilities = torch.softmax(logits, dim=1)
+                confidence_tensor, predicted_class_tensor = torch.max(probabilities, dim=1)
+            for i, class_idx, confidence in zip(indices, predicted_class_tensor.tolist(), confidence_tensor.tolist()):
+                results[i] = (labels[class_idx], confidence)
+        return results
+
+    @staticmethod
+    def extract_entities(intent: str, text: str) -> Dict[str, Any]:
+        # Precompiled patterns + one-pass stop-phrase stripping, see core/entities.py
+        with Span(ENTITY_EXTRACTION):
+            return entity_extractor.extract(intent, text)
+
+
+def build_prediction_cache() -> Optional[PredictionCache]:
+    if not settings.NLP_CACHE_ENABLED:
+        return None
+    redis_client = None
+    if settings.NLP_CACHE_REDIS_ENABLED:
+        from ..db.session import get_redis_client
+        redis_client = get_redis_client()
+    return PredictionCache(
+        maxsize=settings.NLP_CACHE_MAX_SIZE,
+        ttl=settings.NLP_CACHE_TTL_SECONDS,
+        redis_client=redis_client,
+        namespace=settings.NLP_MODEL_NAME,
+    )
+
+
+class FallbackClassifier:
+    """Sends everything to escalation. Only used when NLP_FALLBACK_ON_LOAD_ERROR is set."""
+    def predict(self, text: str) -> Tuple[str, float, Dict[str, Any]]:
+        FALLBACK_CLASSIFICATIONS.inc()
+        return "general_query", 0.1, {} # Low confidence fallback
+
+    def predict_batch(self, texts: List[str]) -> List[Tuple[str, float, Dict[str, Any]]]:
+        return [self.predict(text) for text in texts]
+
+
+# Messages of different lengths, so warm-up touches several tokenizer buckets
+WARMUP_TEXTS = [
+    "hi",
+    "where is my order 12345",
+    "I want to return the SuperWidget from order 67890, it arrived damaged and doesn't turn on",
+    "is the AwesomeGadget in stock",
+]
+
+
+class ModelManager:
+    """
+    Owns the classifier's lifecycle: started from main.py's startup hook, loads the
+    model and runs warm-up inferences in the background, and only then reports ready.
+    Nothing is served from a half-loaded model: until `ready`, get() raises ModelNotReady.
+    """
+
+    NOT_STARTED, LOADING, READY, FAILED = "not_started", "loading", "ready", "failed"
+
+    def __init__(self):
+        self.state = self.NOT_STARTED
+        self.classifier: Any = None
+        self.error: Optional[str] = None
+        self.degraded = False # True when serving FallbackClassifier after a failed load
+        self.load_seconds: Optional[float] = None
+        self.warmup_seconds: Optional[float] = None
+        self.cold_start_seconds: Optional[float] = None
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Future] = None
+
+    @property
+    def ready(self) -> bool:
+        return self.state == self.READY
+
+    def get(self):
+        if self.state != self.READY:
+            raise ModelNotReady(f"NLP model is {self.state.replace('_', ' ')}")
+        return self.classifier
+
+    def use(self, classifier) -> None:
+        """Installs an already-built classifier (scripts and tests)."""
+        with self._lock:
+            self.classifier = classifier
+            self.degraded = isinstance(classifier, FallbackClassifier)
+            self.error = None
+            self.state = self.READY
+
+    def load(self) -> None:
+        """Loads and warms up the model synchronously. Safe to call more than once."""
+        with self._lock:
+            if self.state in (self.READY, self.LOADING):
+                return
+            self.state = self.LOADING
+            self.error = None
+        started = time.perf_counter()
+        try:
+            classifier = IntentClassifier(cache=build_prediction_cache())
+            self.load_seconds = time.perf_counter() - started
+
+            warmup_started = time.perf_counter()
+            for _ in range(max(0, settings.NLP_WARMUP_ROUNDS)):
+                classifier._classify(WARMUP_TEXTS) # Straight to the model: the cache must not short-circuit warm-up
+                classifier._classify(WARMUP_TEXTS[:1])
+            classifier.length_tokenizer.reset_stats() # The token-length histogram should only reflect real traffic
+            self.warmup_seconds = time.perf_counter() - warmup_started
+        except Exception as e:
+            self.error = f"{type(e).__name__}: {e}"
+            logger.error("Error initializing IntentClassifier: %s", self.error)
+            if not settings.NLP_FALLBACK_ON_LOAD_ERROR:
+                self.state = self.FAILED
+                return
+            logger.warning("NLP_FALLBACK_ON_LOAD_ERROR is set: serving FallbackClassifier (every message escalates).")
+            classifier = FallbackClassifier()
+            self.degraded = True
+
+        self.cold_start_seconds = time.perf_counter() - started
+        self.classifier = classifier
+        self.state = self.READY
+        logger.info("IntentClassifier ready in %.2fs (load %.2fs, warm-up %.2fs).",
+                    self.cold_start_seconds, self.load_seconds or 0, self.warmup_seconds or 0)
+
+    def start(self) -> asyncio.Future:
+        """Starts loading in the background (on the inference executor) and returns immediately."""
+        if self._task is None or (self._task.done() and self.state == self.FAILED):
+            loop = asyncio.get_running_loop()
+            self._task = loop.run_in_executor(inference_executor, self.load)
+        return self._task
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "ready": self.ready,
+            "degraded": self.degraded,
+            "model": settings.NLP_MODEL_NAME,
+            "backend": settings.NLP_BACKEND,
+            "load_seconds": _round(self.load_seconds),
+            "warmup_seconds": _round(self.warmup_seconds),
+            "cold_start_seconds": _round(self.cold_start_seconds),
+            "error": self.error,
+        }
+
+
+def _round(value: Optional[float]) -> Optional[float]:
+    return round(value, 3) if value is not None else None
+
+
+model_manager = ModelManager()
+
+
+def get_classifier():
+    """The loaded classifier; raises ModelNotReady until model_manager reports ready."""
+    return model_manager.get()
 
 
 def process_message(text: str) -> Tuple[str, float, Dict[str, Any]]:
     if not text or not text.strip():
         return "empty_message", 1.0, {} # Handle empty input gracefully
-    return classifier.predict(text)
\ No newline at end of file
+    return get_classifier().predict(text)
+
+
+def process_messages(texts: List[str]) -> List[Tuple[str, float, Dict[str, Any]]]:
+    """Batch counterpart of process_message: empty texts short-circuit, the rest share one forward pass."""
+    results: List[Any] = [None] * len(texts)
+    pending = []
+    for i, text in enumerate(texts):
+        if not text or not text.strip():
+            results[i] = ("empty_message", 1.0, {})
+        else:
+            pending.append(i)
+    if pending:
+        for i, prediction in zip(pending, get_classifier().predict_batch([texts[i] for i in pending])):
+            results[i] = prediction
+    return results
+
+
+# Dedicated, bounded pool for forward passes so they never run on the event loop
+inference_executor = ThreadPoolExecutor(
+    max_workers=max(1, settings.NLP_INFERENCE_WORKERS),
+    thread_name_prefix="nlp-inference",
+)
+
+# Shared batcher for the chat endpoints; its worker starts lazily on first use
+intent_batcher = MicroBatcher(
+    process_messages,
+    max_batch_size=settings.NLP_BATCH_MAX_SIZE,
+    max_wait_ms=settings.NLP_BATCH_MAX_WAIT_MS,
+    executor=inference_executor,
+)
+
+# Requests admitted to the executor (queued or running). Only touched from the event loop.
+_pending_inferences = 0
+
+
+def pending_inferences() -> int:
+    return _pending_inferences
+
+
+INFERENCE_QUEUE_DEPTH.set_function(pending_inferences) # Read at scrape time
+
+
+async def process_message_async(text: str) -> Tuple[str, float, Dict[str, Any]]:
+    """
+    Non-blocking version of process_message for async handlers.
+
+    The forward pass runs on `inference_executor` (through the micro-batcher when
+    NLP_BATCHING_ENABLED is set). Raises InferenceQueueFull instead of queueing
+    without bound once NLP_INFERENCE_MAX_QUEUE requests are pending, and
+    ModelNotReady while the model is still loading.
+    """
+    global _pending_inferences
+    if not text or not text.strip():
+        return "empty_message", 1.0, {}
+    if not model_manager.ready:
+        model_manager.get() # Raises ModelNotReady with the current state
+    if _pending_inferences >= settings.NLP_INFERENCE_MAX_QUEUE:
+        raise InferenceQueueFull(f"{_pending_inferences} inference requests already pending")
+
+    _pending_inferences += 1
+    try:
+        with TraceSpan("nlp.classify", {"nlp.batched": settings.NLP_BATCHING_ENABLED}): # Batching wait included
+            if settings.NLP_BATCHING_ENABLED:
+                return await intent_batcher.submit(text)
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(inference_executor, process_message, text)
+    finally:
+        _pending_inferences -= 1
+
+
+async def process_messages_async(texts: List[str]) -> List[Tuple[str, float, Dict[str, Any]]]:
+    """
+    Classifies a list of messages with one forward pass, for bulk callers (/chat/batch) that
+    already hold many messages: they skip the micro-batcher's wait. Each message counts
+    against NLP_INFERENCE_MAX_QUEUE like a single request would, and the whole list is
+    refused with InferenceQueueFull if it doesn't fit.
+    """
+    global _pending_inferences
+    if not model_manager.ready:
+        model_manager.get() # Raises ModelNotReady with the current state
+    if _pending_inferences + len(texts) > settings.NLP_INFERENCE_MAX_QUEUE:
+        raise InferenceQueueFull(f"{_pending_inferences} inference requests already pending")
+
+    _pending_inferences += len(texts)
+    try:
+        with TraceSpan("nlp.classify", {"nlp.messages": len(texts)}):
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(inference_executor, process_messages, texts)
+    finally:
+        _pending_inferences -= len(texts)
+
+
+async def shutdown_inference() -> None:
+    """
+    Stops the batcher. The executor itself is left running: forward passes already
+    submitted finish on their own and concurrent.futures joins the threads at exit.
+    """
+    await intent_batcher.stop()
@@ -0,0 +1,226 @@
+# backend/app/core/nlp_backends.py
+# Pluggable inference backends for the intent model, selected with settings.NLP_BACKEND.
+#
+#   torch        eager fp32 AutoModelForSequenceClassification (default, no export needed)
+#   torch_int8   dynamic int8 quantization of the Linear layers   (scripts/export_quantized.py)
+#   torchscript  traced TorchScript module                        (scripts/export_torchscript.py)
+#   onnx         ONNX Runtime session, CPU                        (scripts/export_onnx.py)
+#
+# Every backend takes the tokenizer's input_ids / attention_mask and returns logits as a
+# torch tensor, so IntentClassifier doesn't care which one is running. The non-eager
+# backends read artifacts written once by their export script into NLP_BACKEND_ARTIFACTS_DIR.
+# The onnx backend is optional: it needs `pip install onnxruntime` (plus `onnx` to export).
+#
+# NLP_MODEL_NAME must be a checkpoint fine-tuned on INTENT_LABELS. A base checkpoint (the
+# default distilbert-base-uncased) has no classifier head: transformers would initialise a
+# random one on every load, so each worker and each export would answer differently. Loading
+# one raises UntrainedHeadError unless NLP_ALLOW_UNTRAINED_HEAD is set (latency benchmarks).
+# The export scripts all start from one copy of the model saved under
+# NLP_BACKEND_ARTIFACTS_DIR/checkpoint, so the exported backends share the same weights; run
+# the eager torch backend from that directory too when comparing them.
+
+import inspect
+import logging
+import os
+from typing import Dict, Type
+
+import torch
+from transformers import AutoConfig, AutoModelForSequenceClassification
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_DIR = "checkpoint"
+INT8_STATE_FILE = "model.int8.pt"
+TORCHSCRIPT_FILE = "model.torchscript.pt"
+ONNX_FILE = "model.onnx"
+
+
+class UntrainedHeadError(RuntimeError):
+    """The checkpoint has no (or a differently shaped) classifier head: its predictions would be random."""
+
+
+class InferenceBackend:
+    name = "base"
+
+    def __init__(self, model_name: str, num_labels: int, artifacts_dir: str, device: torch.device,
+                 allow_untrained_head: bool = False):
+        self.model_name = model_name
+        self.num_labels = num_labels
+        self.artifacts_dir = artifacts_dir
+        self.device = device
+        self.allow_untrained_head = allow_untrained_head
+
+    def logits(self, input_ids: torch.Tensor, attention_mask: torch.Tensor) -> torch.Tensor:
+        raise NotImplementedError
+
+    def _artifact(self, filename: str) -> str:
+        path = os.path.join(self.artifacts_dir, filename)
+        if not os.path.exists(path):
+            raise FileNotFoundError(
+                f"NLP backend '{self.name}' needs {path}. Run its export script under backend/scripts/ first."
+            )
+        return path
+
+
+def load_eager_model(model_name: str, num_labels: int, allow_untrained_head: bool = False) -> torch.nn.Module:
+    model, info = AutoModelForSequenceClassification.from_pretrained(
+        model_name, num_labels=num_labels, output_loading_info=True)
+    untrained = sorted(info["missing_keys"]) + sorted(key for key, *_ in info["mismatched_keys"])
+    if untrained:
+        message = (f"{model_name} is not fine-tuned for these {num_labels} intents: {', '.join(untrained)} "
+                   f"were initialised at random, so its predictions are noise")
+        if not allow_untrained_head:
+            raise UntrainedHeadError(f"{message}. Point NLP_MODEL_NAME at a fine-tuned checkpoint "
+                                     f"(or set NLP_ALLOW_UNTRAINED_HEAD=true to measure latency only).")
+        logger.warning("%s. NLP_ALLOW_UNTRAINED_HEAD is set: serving it anyway.", message)
+    model.eval()
+    return model
+
+
+def quantize_dynamic_int8(model: torch.nn.Module) -> torch.nn.Module:
+    # Transformer encoders spend nearly all CPU time in nn.Linear, which is what dynamic quantization covers
+    return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+class EagerTorchBackend(InferenceBackend):
+    name = "torch"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.model = load_eager_model(self.model_name, self.num_labels, self.allow_untrained_head).to(self.device)
+
+    def logits(self, input_ids, attention_mask):
+        return self.model(input_ids=input_ids, attention_mask=attention_mask).logits
+
+
+class QuantizedTorchBackend(InferenceBackend):
+    name = "torch_int8"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Rebuild the (untrained) architecture, quantize it, then load the exported int8 weights
+        config = AutoConfig.from_pretrained(self.model_name, num_labels=self.num_labels)
+        model = AutoModelForSequenceClassification.from_config(config)
+        model.eval()
+        self.model = quantize_dynamic_int8(model)
+        self.model.load_state_dict(torch.load(self._artifact(INT8_STATE_FILE), map_location="cpu"))
+        self.device = torch.device("cpu")  # Quantized kernels are CPU-only
+
+    def logits(self, input_ids, attention_mask):
+        return self.model(input_ids=input_ids.cpu(), attention_mask=attention_mask.cpu()).logits
+
+
+class TorchScriptBackend(InferenceBackend):
+    name = "torchscript"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.model = torch.jit.load(self._artifact(TORCHSCRIPT_FILE), map_location=self.device)
+        self.model.eval()
+
+    def logits(self, input_ids, attention_mask):
+        # Traced with return_dict=False, so the module returns a tuple whose first item is the logits
+        return self.model(input_ids, attention_mask)[0]
+
+
+class OnnxRuntimeBackend(InferenceBackend):
+    name = "onnx"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        try:
+            import onnxruntime
+        except ImportError as e:
+            raise RuntimeError("NLP_BACKEND=onnx requires the 'onnxruntime' package") from e
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if torch.get_num_threads() > 0:
+            options.intra_op_num_threads = torch.get_num_threads() # Respect NLP_TORCH_THREADS
+        self.session = onnxruntime.InferenceSession(
+            self._artifact(ONNX_FILE), options, providers=["CPUExecutionProvider"]
+        )
+        self.device = torch.device("cpu")
+
+    def logits(self, input_ids, attention_mask):
+        outputs = self.session.run(
+            ["logits"],
+            {"input_ids": input_ids.cpu().numpy(), "attention_mask": attention_mask.cpu().numpy()},
+        )
+        return torch.from_numpy(outputs[0])
+
+
+BACKENDS: Dict[str, Type[InferenceBackend]] = {
+    backend.name: backend
+    for backend in (EagerTorchBackend, QuantizedTorchBackend, TorchScriptBackend, OnnxRuntimeBackend)
+}
+
+
+def load_backend(name: str, model_name: str, num_labels: int, artifacts_dir: str, device: torch.device,
+                 allow_untrained_head: bool = False) -> InferenceBackend:
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown NLP backend '{name}'. Choose one of: {', '.join(BACKENDS)}")
+    return BACKENDS[name](model_name, num_labels, artifacts_dir, device, allow_untrained_head)
+
+
+# --- One-time export helpers, used by the scripts under backend/scripts/ ---
+
+def _example_inputs(tokenizer):
+    encoded = tokenizer(["where is my order 12345", "hi"], padding=True, return_tensors="pt")
+    return encoded["input_ids"], encoded["attention_mask"]
+
+
+def save_checkpoint(model_name: str, num_labels: int, artifacts_dir: str, tokenizer,
+                    allow_untrained_head: bool = False) -> str:
+    """
+    The checkpoint every backend is exported from: artifacts_dir/checkpoint, saved from
+    `model_name` by the first export and reused by the others.
+    """
+    path = os.path.join(artifacts_dir, CHECKPOINT_DIR)
+    if not os.path.exists(os.path.join(path, "config.json")):
+        os.makedirs(path, exist_ok=True)
+        load_eager_model(model_name, num_labels, allow_untrained_head).save_pretrained(path)
+        tokenizer.save_pretrained(path)
+    return path
+
+
+def export_quantized(checkpoint: str, num_labels: int, artifacts_dir: str) -> str:
+    os.makedirs(artifacts_dir, exist_ok=True)
+    model = quantize_dynamic_int8(load_eager_model(checkpoint, num_labels))
+    path = os.path.join(artifacts_dir, INT8_STATE_FILE)
+    torch.save(model.state_dict(), path)
+    return path
+
+
+def export_torchscript(checkpoint: str, num_labels: int, artifacts_dir: str, tokenizer) -> str:
+    os.makedirs(artifacts_dir, exist_ok=True)
+    model = load_eager_model(checkpoint, num_labels)
+    model.config.return_dict = False # Tuple outputs are what torch.jit.trace can record
+    with torch.no_grad():
+        traced = torch.jit.trace(model, _example_inputs(tokenizer), strict=False)
+    path = os.path.join(artifacts_dir, TORCHSCRIPT_FILE)
+    torch.jit.save(traced, path)
+    return path
+
+
+def export_onnx(checkpoint: str, num_labels: int, artifacts_dir: str, tokenizer, opset: int = 17) -> str:
+    os.makedirs(artifacts_dir, exist_ok=True)
+    model = load_eager_model(checkpoint, num_labels)
+    model.config.return_dict = False
+    path = os.path.join(artifacts_dir, ONNX_FILE)
+    dynamic = {0: "batch", 1: "sequence"}
+    export_kwargs = {}
+    if "dynamo" in inspect.signature(torch.onnx.export).parameters:
+        export_kwargs["dynamo"] = False # The TorchScript-based exporter handles HF models without extra deps
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            _example_inputs(tokenizer),
+            path,
+            input_names=["input_ids", "attention_mask"],
+            output_names=["logits"],
+            dynamic_axes={"input_ids": dynamic, "attention_mask": dynamic, "logits": {0: "batch"}},
+            opset_version=opset,
+            **export_kwargs,
+        )
+    return path
@@ -0,0 +1,208 @@
+# backend/app/core/pipeline.py
+# Per-connection pipeline for WebSocket chat turns.
+#
+# A WebSocket used to handle one message at a time: receive, classify, look up, persist,
+# send, and only then receive the next one. With TurnPipeline the receive loop only hands
+# messages over (and can answer pings meanwhile), and the stages of consecutive turns overlap:
+#
+#   prepare  (NLP, then the business lookup)   one task per turn, turns run concurrently
+#   commit   (persistence, then the reply)     one task per connection, strictly in arrival order
+#
+# So a client sending three messages quickly gets its three classifications in one
+# micro-batch and the three lookups concurrently, while messages are still stored and
+# answered in the order they were sent. At most `max_pending` turns are in flight per
+# connection; submit() refuses more, and the endpoint tells the client to retry.
+#
+# Stages may also emit partial frames while they run (streaming mode: the intent as soon as
+# it is known, reply chunks as lookups complete). A turn's partial frames go out right away
+# when it is the oldest turn in flight; a later turn's are held back until the turns before
+# it were answered, so frames of different turns never interleave.
+#
+# Every turn is timed per stage (queue wait, nlp, lookup, persist, total); the timings go
+# out with the reply and into a StageTimings aggregate for /admin/connections/stats. With a
+# tracer, each turn also gets a trace (core/tracing.py): the stages are its spans, it is
+# current while the turn's own code runs (so upstream calls and commits add theirs), and it
+# is finished - kept if slow - once the reply is sent.
+
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from .tracing import Tracer, current_trace
+
+logger = logging.getLogger(__name__)
+
+STAGES = ("queued", "nlp", "lookup", "persist", "total")
+
+
+class StageTimings:
+    """Per-stage latency totals and maxima over every turn of this worker, in milliseconds."""
+
+    def __init__(self):
+        self.turns = 0
+        self.total_ms = {stage: 0.0 for stage in STAGES}
+        self.max_ms = {stage: 0.0 for stage in STAGES}
+
+    def record(self, timings: Dict[str, float]) -> None:
+        self.turns += 1
+        for stage, value in timings.items():
+            self.total_ms[stage] += value
+            self.max_ms[stage] = max(self.max_ms[stage], value)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "turns": self.turns,
+            "avg_ms": {stage: round(self.total_ms[stage] / self.turns, 2) if self.turns else 0.0 for stage in STAGES},
+            "max_ms": {stage: round(self.max_ms[stage], 2) for stage in STAGES},
+        }
+
+
+class Turn:
+    def __init__(self, pipeline: "TurnPipeline", message: Dict[str, Any]):
+        self.pipeline = pipeline
+        self.message = message
+        self.received_at = time.perf_counter()
+        self.timings: Dict[str, float] = {}
+        self.task: Optional[asyncio.Task] = None
+        self.head = False # Oldest turn in flight: partial frames are sent, not held back
+        self.held: List[Dict[str, Any]] = []
+        self.trace = None # TurnTrace when the pipeline has a tracer
+        self.prepared_at: Optional[float] = None
+
+    async def emit(self, frame: Dict[str, Any]) -> None:
+        """Sends a partial frame of this turn, or holds it until the turns before it were answered."""
+        if self.head:
+            await self.pipeline.send_partial(frame)
+        else:
+            self.held.append(frame)
+
+    def lap(self, stage: str, started: float) -> float:
+        now = time.perf_counter()
+        self.timings[stage] = round((now - started) * 1000, 2)
+        if self.trace is not None:
+            self.trace.add_span(f"ws.{stage}", started, now)
+        return now
+
+
+class TurnPipeline:
+    def __init__(
+        self,
+        classify: Callable[[Dict[str, Any]], Awaitable[Any]],
+        lookup: Callable[[Dict[str, Any], Any, Callable[[Dict[str, Any]], Awaitable[None]]], Awaitable[Any]],
+        persist: Callable[[Dict[str, Any], Any, Any], Awaitable[Dict[str, Any]]],
+        send: Callable[[Dict[str, Any]], Awaitable[Any]],
+        on_error: Callable[[Turn, Exception], Awaitable[None]],
+        max_pending: int = 8,
+        timings: Optional[StageTimings] = None,
+        send_partial: Optional[Callable[[Dict[str, Any]], Awaitable[Any]]] = None,
+        tracer: Optional[Tracer] = None,
+        trace_attributes: Optional[Dict[str, Any]] = None,
+    ):
+        """
+        classify(message) -> classification                  e.g. (intent, confidence, entities)
+        lookup(message, classification, emit) -> prepared    the bot's reply, before it is stored;
+                                                             emit(frame) sends a partial frame
+        persist(message, classification, prepared) -> frame  stores the turn; called in arrival order
+        send(frame)                                          the reply, with "timings" added
+        send_partial(frame)                                  partial frames (default: send)
+        on_error(turn, exc)                                  a stage failed; also called in order
+        tracer, trace_attributes                             a "ws.turn" trace per turn, with these attributes
+
+        The prepare stages of different turns run concurrently, so they must not share
+        per-turn state (a database session, say); commit runs one turn at a time.
+        """
+        self.classify = classify
+        self.lookup = lookup
+        self.persist = persist
+        self.send = send
+        self.send_partial = send_partial or send
+        self.on_error = on_error
+        self.max_pending = max(1, max_pending)
+        self.timings = timings
+        self.tracer = tracer
+        self.trace_attributes = trace_attributes or {}
+        self._pending: asyncio.Queue = asyncio.Queue()
+        self._in_flight = 0
+        self._committer: Optional[asyncio.Task] = None
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    def submit(self, message: Dict[str, Any]) -> bool:
+        """Starts a turn; False (nothing started) when max_pending turns are already in flight."""
+        if self._in_flight >= self.max_pending:
+            return False
+        self._in_flight += 1
+        trace = self.tracer.begin("ws.turn", **self.trace_attributes) if self.tracer is not None else None
+        turn = Turn(self, message)
+        turn.trace = trace
+        loop = asyncio.get_running_loop()
+        turn.task = loop.create_task(self._prepare(turn))
+        self._pending.put_nowait(turn)
+        if self._committer is None:
+            self._committer = loop.create_task(self._commit_in_order())
+        return True
+
+    async def _prepare(self, turn: Turn) -> Any:
+        current_trace.set(turn.trace) # This task's context only; the lookups it starts inherit it
+        started = turn.received_at
+        classification = await self.classify(turn.message)
+        started = turn.lap("nlp", started)
+        prepared = await self.lookup(turn.message, classification, turn.emit)
+        turn.prepared_at = turn.lap("lookup", started)
+        return classification, prepared
+
+    async def _commit_in_order(self) -> None:
+        while True:
+            turn = await self._pending.get()
+            error = None
+            token = current_trace.set(turn.trace) # Commits and sends of this turn go into its trace
+            try:
+                while turn.held: # Emitted while earlier turns were being answered
+                    await self.send_partial(turn.held.pop(0))
+                turn.head = True
+                classification, prepared = await turn.task
+                # Time spent prepared but waiting behind earlier turns
+                turn.timings["queued"] = round(
+                    (time.perf_counter() - turn.received_at) * 1000 - turn.timings["nlp"] - turn.timings["lookup"], 2)
+                started = time.perf_counter()
+                if turn.trace is not None:
+                    turn.trace.add_span("ws.queued", turn.prepared_at, started)
+                frame = await self.persist(turn.message, classification, prepared)
+                turn.lap("persist", started)
+                turn.timings["total"] = round((time.perf_counter() - turn.received_at) * 1000, 2)
+                frame["timings"] = turn.timings
+                await self.send(frame)
+                if self.timings is not None:
+                    self.timings.record(turn.timings)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e: # A failed turn must not stop the turns behind it
+                error = e
+                try:
+                    await self.on_error(turn, e)
+                except Exception as report_error:
+                    logger.warning("TurnPipeline: could not report a failed turn: %s", report_error)
+            finally:
+                current_trace.reset(token)
+                if self.tracer is not None:
+                    self.tracer.finish(turn.trace, error)
+                self._in_flight -= 1
+                self._pending.task_done()
+
+    async def close(self, timeout: float = 10.0) -> None:
+        """Finishes the turns already accepted (they're persisted even if the client left), then stops."""
+        if self._committer is None:
+            return
+        try:
+            await asyncio.wait_for(self._pending.join(), timeout)
+        except asyncio.TimeoutError:
+            while not self._pending.empty():
+                self._pending.get_nowait().task.cancel()
+        self._committer.cancel()
+        try:
+            await self._committer
+        except asyncio.CancelledError:
+            pass
@@ -0,0 +1,102 @@
+# backend/app/core/profiler.py
+# Built-in sampling profiler, toggled at runtime (POST /api/v1/admin/profiler).
+#
+# While running, a daemon thread wakes every `interval_ms` (MIN_INTERVAL_MS at least), takes
+# the current stack of every other thread (sys._current_frames(): the event loop, the
+# inference executor, the flush threads) and appends it, timestamped, to a ring buffer of
+# `max_samples`. Nothing is instrumented and nothing runs on the event loop: the cost is the
+# sampling thread holding the GIL for a few tens of microseconds per sample. Off by default.
+#
+# collapsed(since, until) folds the samples of a time window into "thread;outer;...;inner"
+# -> count, the collapsed-stack format flame graph tools read. The tracer attaches the
+# window of a slow turn to its trace (core/tracing.py), which shows what the event loop was
+# doing while that turn waited.
+
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from typing import Any, Dict, Optional
+
+MIN_INTERVAL_MS = 5.0 # Each sample walks every thread's stack holding the GIL; faster would tax the event loop
+
+
+class SamplingProfiler:
+    def __init__(self, interval_ms: float = 10.0, max_samples: int = 10000, max_depth: int = 64):
+        self.interval_ms = max(MIN_INTERVAL_MS, interval_ms)
+        self.max_depth = max_depth
+        self.samples: deque = deque(maxlen=max(1, max_samples)) # (perf_counter, thread ident, stack)
+        self.samples_taken = 0
+        self.sampling_seconds = 0.0 # Time the sampler itself spent, i.e. its overhead
+        self.started_at: Optional[float] = None
+        self._labels: Dict[Any, str] = {} # code object -> "file.py:function"
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, interval_ms: Optional[float] = None) -> None:
+        with self._lock:
+            if interval_ms is not None:
+                self.interval_ms = max(MIN_INTERVAL_MS, interval_ms) # Picked up by the next sleep
+            if self.running:
+                return
+            self._stop.clear()
+            self.started_at = time.perf_counter()
+            self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        with self._lock:
+            thread, self._thread = self._thread, None
+            self._stop.set()
+        if thread is not None:
+            thread.join(timeout=1.0)
+
+    def _label(self, code) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = f"{os.path.basename(code.co_filename)}:{code.co_name}"
+        return label
+
+    def _stack(self, frame) -> str:
+        labels = []
+        while frame is not None and len(labels) < self.max_depth:
+            labels.append(self._label(frame.f_code))
+            frame = frame.f_back
+        labels.reverse() # Outermost first
+        return ";".join(labels)
+
+    def _run(self) -> None:
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval_ms / 1000.0):
+            started = time.perf_counter()
+            for ident, frame in sys._current_frames().items():
+                if ident != own:
+                    self.samples.append((started, ident, self._stack(frame)))
+            self.samples_taken += 1
+            self.sampling_seconds += time.perf_counter() - started
+
+    def collapsed(self, since: float, until: Optional[float] = None) -> Dict[str, int]:
+        """Stacks sampled between the two perf_counter() times, prefixed with the thread name, with their counts."""
+        until = until if until is not None else time.perf_counter()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        counts: Counter = Counter()
+        for taken, ident, stack in self.samples.copy(): # copy() is atomic; the sampler keeps appending
+            if since <= taken <= until:
+                counts[f"{names.get(ident, ident)};{stack}"] += 1
+        return dict(counts.most_common())
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "running": self.running,
+            "interval_ms": self.interval_ms,
+            "samples_buffered": len(self.samples),
+            "max_samples": self.samples.maxlen,
+            "samples_taken": self.samples_taken,
+            "avg_sample_us": round(self.sampling_seconds / self.samples_taken * 1e6, 1) if self.samples_taken else None,
+        }
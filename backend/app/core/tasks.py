@@ -1,10 +1,27 @@
 # backend/app/core/tasks.py
 # Defines Celery tasks for background processing.
+#
+# Queues, most urgent first; give them separate workers so bulk work never delays a
+# notification (a worker takes its queues' messages in order, not by priority):
+#   realtime     escalation notifications          celery -A app.core.tasks worker -Q realtime -c 4
+#   default      anything unrouted
+#   analytics    batched turn analytics            celery -A app.core.tasks worker -Q analytics,reclassify
+#   reclassify   low-priority re-classification        -c 2 --prefetch-multiplier 1
+# The batched tasks take a list of items (app/core/background.py sends one task per batch).
 
-from celery import Celery
-from kombu.utils.url import safe_url # For safely displaying URLs in logs
+import logging
+import time
+from collections import defaultdict
+from datetime import datetime
+
+from celery import Celery, signals
+from kombu import Queue
+from kombu.utils.url import maybe_sanitize_url # For safely displaying URLs in logs (hides the password)
 
 from app.config import settings # Import your application settings
+from app.core.log import configure_logging
+
+logger = logging.getLogger(__name__)
 
 # Initialize Celery
 # The first argument to Celery is the name of the current module.
@@ -34,15 +51,56 @@ celery_app.conf.update(
     # task_soft_time_limit=290,
     # Configure broker connection pool (if needed, defaults are usually fine)
     # broker_pool_limit=10, # Default is 10 for Redis
+    # Each queue with its own routing key: queues sharing the default key would each get a copy of every task
+    task_queues=tuple(Queue(name, routing_key=name) for name in ("realtime", "default", "analytics", "reclassify")),
+    task_default_routing_key="default",
+    task_default_queue="default",
+    task_routes={
+        "send_escalation_notification": {"queue": "realtime"},
+        "send_escalation_notifications": {"queue": "realtime"},
+        "record_turn_analytics": {"queue": "analytics"},
+        "reclassify_messages": {"queue": "reclassify"},
+        "process_long_nlp_job": {"queue": "reclassify"},
+    },
+    # Priorities within a queue on the Redis transport (0 = first); re-classification is sent with 9
+    broker_transport_options={"priority_steps": list(range(10)), "queue_order_strategy": "priority"},
+    # Tasks are short and batched: a few prefetched per process keeps the workers busy without
+    # parking messages behind a slow task. Workers on the reclassify queue run with 1.
+    worker_prefetch_multiplier=settings.CELERY_WORKER_PREFETCH_MULTIPLIER,
+    # Acknowledged after they ran: a task whose worker died is delivered again. record_turn_analytics
+    # skips a batch (task id) it already applied and reclassify_messages only ever raises a stored
+    # confidence, so running them twice is harmless; a notification may go out twice.
+    task_acks_late=True,
+    task_reject_on_worker_lost=True,
+    task_time_limit=settings.CELERY_TASK_TIME_LIMIT,
+    task_soft_time_limit=int(settings.CELERY_TASK_TIME_LIMIT * 0.9),
+    result_expires=3600, # The batched tasks' results are only read by tests and benchmarks
 )
 
-# Example: Print broker and backend URLs for verification (optional, good for debugging)
-# Be careful with logging sensitive parts of URLs if they contain passwords directly
-# and are not managed via environment variables properly.
-if settings.CELERY_BROKER_URL:
-    print(f"Celery Worker: Connecting to broker at {safe_url(settings.CELERY_BROKER_URL)}")
-if settings.CELERY_RESULT_BACKEND:
-    print(f"Celery Worker: Using result backend at {safe_url(settings.CELERY_RESULT_BACKEND)}")
+# Periodic tasks (run `celery -A app.core.tasks beat` next to the workers)
+celery_app.conf.beat_schedule = {
+    "ensure-message-partitions": {
+        "task": "ensure_message_partitions",
+        "schedule": 24 * 60 * 60, # Daily; partitions are created MESSAGE_PARTITIONS_AHEAD months ahead
+    },
+}
+
+# Task logging goes through the same non-blocking queue handler as the API (app/core/log.py),
+# set up in the worker's main process and again in each prefork child (a forked child doesn't
+# get the writer thread).
+@signals.worker_init.connect
+def on_worker_init(**kwargs):
+    configure_logging()
+    # Broker and backend URLs for verification; maybe_sanitize_url hides passwords
+    if settings.CELERY_BROKER_URL:
+        logger.info("Celery Worker: Connecting to broker at %s", maybe_sanitize_url(settings.CELERY_BROKER_URL))
+    if settings.CELERY_RESULT_BACKEND:
+        logger.info("Celery Worker: Using result backend at %s", maybe_sanitize_url(settings.CELERY_RESULT_BACKEND))
+
+
+@signals.worker_process_init.connect
+def on_worker_process_init(**kwargs):
+    configure_logging()
 
 
 # --- Define Your Celery Tasks Below ---
@@ -53,39 +111,155 @@ def example_background_task(x: int, y: int) -> int:
     An example background task that adds two numbers.
     """
     result = x + y
-    print(f"Example task: Adding {x} + {y} = {result}")
+    logger.info("Example task: Adding %s + %s = %s", x, y, result)
     return result
 
-@celery_app.task(name="process_long_nlp_job")
+def _worker_classifier():
+    """
+    The worker's own model, loaded on first use. It is whatever NLP_MODEL_NAME the worker's
+    environment sets, which may be a larger model than the API serves: latency doesn't matter here.
+    """
+    from app.core import nlp
+    if not nlp.model_manager.ready:
+        nlp.model_manager.load()
+    return nlp
+
+
+@celery_app.task(name="process_long_nlp_job", time_limit=600, soft_time_limit=540)
 def process_long_nlp_job(text_to_process: str, user_id: int | None = None):
     """
-    A placeholder for a potentially long-running NLP job.
+    Classifies a long text (a transcript, an email) with the worker's model, sentence by
+    sentence in one batch, and returns the intents found in it.
+    """
+    logger.info("Starting NLP job for user '%s' (%d characters)", user_id, len(text_to_process))
+    nlp = _worker_classifier()
+    sentences = [s.strip() for s in text_to_process.replace("?", ".").replace("!", ".").split(".") if s.strip()]
+    predictions = nlp.process_messages(sentences) if sentences else []
+    intents = defaultdict(int)
+    for intent, _, _ in predictions:
+        intents[intent] += 1
+    result_summary = f"{len(sentences)} sentences, intents: {dict(intents)}"
+    logger.info("Finished NLP job for user '%s'. Result: %s", user_id, result_summary)
+    return {"user_id": user_id, "summary": result_summary, "intents": dict(intents), "status": "completed"}
+
+@celery_app.task(name="ensure_message_partitions")
+def ensure_message_partitions_task() -> int:
     """
-    print(f"Starting NLP job for user '{user_id}' with text: '{text_to_process[:50]}...'")
-    # Simulate work
-    import time
-    time.sleep(10) # Simulate a 10-second task
-    result_summary = f"Processed text starting with: {text_to_process[:20]}"
-    print(f"Finished NLP job for user '{user_id}'. Result: {result_summary}")
-    return {"user_id": user_id, "summary": result_summary, "status": "completed"}
-
-@celery_app.task(name="send_escalation_notification")
+    Creates upcoming monthly partitions of the messages table (PostgreSQL).
+    """
+    from app.db.partitions import ensure_message_partitions
+    from app.db.session import engine
+    created = ensure_message_partitions(engine)
+    logger.info("Messages partitions: %d created", created)
+    return created
+
+@celery_app.task(name="send_escalation_notification", time_limit=30, soft_time_limit=25)
 def send_escalation_notification(session_id: int, message_snippet: str, user_email: str | None = None):
     """
     Task to send a notification when a chat is escalated.
     This would typically involve sending an email or calling a third-party API.
     """
-    print(f"Escalation Triggered: Session ID {session_id}, Message: '{message_snippet}'")
+    logger.info("Escalation Triggered: Session ID %s, Message: '%s'", session_id, message_snippet)
     if user_email:
-        print(f"Sending notification to user: {user_email} (simulation)")
+        logger.info("Sending notification to user: %s (simulation)", user_email)
         # In a real app, you'd use an email library here:
         # from app.utils.email_sender import send_email
         # send_email(to=user_email, subject="Chat Escalation", body=f"...")
     else:
-        print("No user email provided for notification.")
+        logger.info("No user email provided for notification.")
     
     # Simulate notifying an internal team/system
-    print("Notifying internal support team (simulation).")
+    logger.info("Notifying internal support team (simulation).")
     # E.g., call a helpdesk API, send a Slack message, etc.
     
     return {"status": "escalation_notified", "session_id": session_id}
+
+
+@celery_app.task(name="send_escalation_notifications", time_limit=60, soft_time_limit=50)
+def send_escalation_notifications(tickets: list):
+    """Batched send_escalation_notification: one task for the tickets an EscalationNotifier read together."""
+    for ticket in tickets:
+        send_escalation_notification(ticket["conversation_id"], ticket["message"][:100])
+    return {"status": "escalations_notified", "tickets": len(tickets)}
+
+
+@celery_app.task(name="record_turn_analytics", bind=True, time_limit=60, soft_time_limit=50)
+def record_turn_analytics(self, events: list):
+    """
+    Aggregates a batch of turn events into hourly counters in Redis, one pipeline round-trip:
+    hash analytics:turns:<YYYYMMDDHH>, fields "<intent>:<counter>" (turns, escalated,
+    confidence_sum) and "channel:<channel>". Kept ANALYTICS_RETENTION_DAYS days.
+
+    A redelivered batch keeps its task id: analytics:applied:<task id> is set (NX) before the
+    counters are incremented, and a batch whose id is already there is skipped. A worker
+    dying between the two loses that batch's counts rather than adding them twice.
+    """
+    from app.db.session import get_redis_client
+    counters = defaultdict(lambda: defaultdict(float))
+    for event in events:
+        hour = datetime.utcfromtimestamp(event["ts"]).strftime("%Y%m%d%H")
+        bucket = counters[f"analytics:turns:{hour}"]
+        intent = event.get("intent") or "unknown"
+        bucket[f"{intent}:turns"] += 1
+        bucket[f"{intent}:escalated"] += 1 if event.get("escalated") else 0
+        bucket[f"{intent}:confidence_sum"] += event.get("confidence") or 0.0
+        bucket[f"channel:{event.get('channel', 'unknown')}"] += 1
+    redis_client = get_redis_client()
+    if redis_client is None:
+        logger.warning("record_turn_analytics: REDIS_URL is not set, dropping %d events", len(events))
+        return {"events": len(events), "stored": False}
+    retention = settings.ANALYTICS_RETENTION_DAYS * 24 * 3600
+    if not redis_client.set(f"analytics:applied:{self.request.id}", 1, nx=True, ex=retention):
+        logger.info("record_turn_analytics: batch %s was already applied, skipping", self.request.id)
+        return {"events": len(events), "stored": False, "duplicate": True}
+    pipe = redis_client.pipeline(transaction=False)
+    for key, fields in counters.items():
+        for field, value in fields.items():
+            if value:
+                pipe.hincrbyfloat(key, field, value)
+        pipe.expire(key, retention)
+    pipe.execute()
+    return {"events": len(events), "stored": True, "hours": len(counters)}
+
+
+@celery_app.task(name="reclassify_messages", time_limit=600, soft_time_limit=540)
+def reclassify_messages(items: list):
+    """
+    Runs the worker's model over user messages the API answered with low confidence (one
+    forward pass for the batch) and stores the new intent and confidence on the rows where
+    it is more confident than the stored answer. Items: {"message_id", "text", "intent", "confidence"}.
+
+    The prediction cache is skipped: with the API's model and the shared Redis tier it would
+    only hand back the answer being re-checked.
+    """
+    from sqlalchemy import bindparam, or_, update
+    from app.db import models, session
+    nlp = _worker_classifier()
+    classifier = nlp.get_classifier()
+    started = time.perf_counter()
+    texts = [item["text"] for item in items]
+    if isinstance(classifier, nlp.IntentClassifier):
+        predictions = classifier.predict_batch(texts, use_cache=False)
+    else:
+        predictions = classifier.predict_batch(texts)
+    changed = [
+        {"message_id": item["message_id"], "new_intent": intent, "new_confidence": confidence}
+        for item, (intent, confidence, _) in zip(items, predictions)
+        if confidence > item["confidence"]
+    ]
+    updated = 0
+    if changed:
+        messages = models.Message.__table__
+        with session.SessionLocal() as db:
+            result = db.execute(
+                update(messages)
+                # Against the row itself too: it may have been re-classified since (a redelivered task)
+                .where(messages.c.id == bindparam("message_id"),
+                       or_(messages.c.confidence.is_(None), messages.c.confidence < bindparam("new_confidence")))
+                .values(intent=bindparam("new_intent"), confidence=bindparam("new_confidence")),
+                changed,
+            )
+            db.commit()
+            updated = result.rowcount
+    return {"items": len(items), "changed": len(changed), "updated": updated,
+            "seconds": round(time.perf_counter() - started, 3)}
@@ -0,0 +1,188 @@
+# backend/app/core/tokenization.py
+# Length-aware tokenization for the intent classifier.
+#
+# Chat messages are usually well under 30 tokens, so padding/truncating everything to
+# 512 wastes most of each forward pass. LengthAwareTokenizer
+#   - caps sequence length at a configurable percentile of the lengths actually seen,
+#   - groups a batch into length buckets so short messages aren't padded to the longest one,
+#   - reuses one fast tokenizer and per-thread preallocated input tensors,
+#   - keeps a histogram of observed token lengths so the cap can be tuned.
+
+import bisect
+import threading
+from typing import Dict, List, Sequence, Tuple
+
+import torch
+
+DEFAULT_BUCKETS = (8, 16, 24, 32, 48, 64, 96, 128, 256, 512)
+
+
+class TokenLengthHistogram:
+    """Exact per-length counts (lengths are bounded by the model's max length)."""
+
+    def __init__(self, max_length: int):
+        self.max_length = max_length
+        self._counts = [0] * (max_length + 1)
+        self.total = 0
+        self._lock = threading.Lock()
+
+    def observe_many(self, lengths: Sequence[int]) -> None:
+        with self._lock:
+            for length in lengths:
+                self._counts[min(length, self.max_length)] += 1
+            self.total += len(lengths)
+
+    def percentile(self, pct: float) -> int:
+        """Smallest length L such that at least pct% of observations are <= L (0 if empty)."""
+        if self.total == 0:
+            return 0
+        threshold = pct / 100.0 * self.total
+        running = 0
+        for length, count in enumerate(self._counts):
+            running += count
+            if running >= threshold and running > 0:
+                return length
+        return self.max_length
+
+    def snapshot(self, buckets: Sequence[int]) -> Dict[str, object]:
+        """Cumulative counts per bucket upper bound (Prometheus-style 'le' buckets) plus percentiles."""
+        with self._lock:
+            counts = list(self._counts)
+            total = self.total
+        cumulative, running, start = {}, 0, 0
+        for bound in buckets:
+            running += sum(counts[start:bound + 1])
+            cumulative[str(bound)] = running
+            start = bound + 1
+        observed_max = max((length for length, count in enumerate(counts) if count), default=0)
+        return {
+            "count": total,
+            "buckets_le": cumulative,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+            "max": observed_max,
+        }
+
+
+class LengthAwareTokenizer:
+    def __init__(
+        self,
+        tokenizer,
+        max_length: int = 512,
+        cap_percentile: float = 99.0,
+        min_samples: int = 1000,
+        buckets: Sequence[int] = DEFAULT_BUCKETS,
+        recompute_every: int = 100,
+    ):
+        """
+        tokenizer: a Hugging Face tokenizer, loaded once and reused for every call.
+        max_length: hard ceiling (the model's position limit).
+        cap_percentile: once `min_samples` lengths are seen, sequences are truncated at this
+                        percentile of observed lengths (rounded up to a bucket). 100 disables it.
+        buckets: padded widths; each message is padded up to the smallest bucket that fits it.
+        """
+        self.tokenizer = tokenizer
+        self.max_length = max_length
+        self.cap_percentile = cap_percentile
+        self.min_samples = min_samples
+        self.recompute_every = max(1, recompute_every)
+        self.buckets = sorted({b for b in buckets if b < max_length} | {max_length})
+        self.pad_token_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else 0
+
+        self.histogram = TokenLengthHistogram(max_length)
+        self.current_cap = max_length
+        self.truncated = 0
+        self._since_recompute = self.recompute_every  # First eligible call computes the cap
+        self._local = threading.local()  # Per-thread tensor buffers, see _buffers()
+
+        # Fast tokenizers expose the Rust tokenizer directly. We take a private copy (the HF
+        # wrapper re-configures padding/truncation on its own instance on every __call__),
+        # configure it once and never mutate it again, so concurrent inference threads can
+        # share it without "Already borrowed" errors.
+        self._fast = None
+        if getattr(tokenizer, "is_fast", False):
+            from tokenizers import Tokenizer
+            self._fast = Tokenizer.from_str(tokenizer.backend_tokenizer.to_str())
+            self._fast.no_padding()
+            self._fast.enable_truncation(max_length)
+        self._slow_lock = threading.Lock()
+
+    def _token_ids(self, texts: List[str]) -> List[List[int]]:
+        if self._fast is not None:
+            return [encoding.ids for encoding in self._fast.encode_batch(texts)]
+        with self._slow_lock:
+            return self.tokenizer(texts, truncation=True, max_length=self.max_length)["input_ids"]
+
+    def _bucket_for(self, length: int) -> int:
+        return self.buckets[min(bisect.bisect_left(self.buckets, length), len(self.buckets) - 1)]
+
+    def _maybe_recompute_cap(self, observed: int) -> None:
+        if self.cap_percentile >= 100 or self.histogram.total < self.min_samples:
+            return
+        self._since_recompute += observed
+        if self._since_recompute < self.recompute_every:
+            return
+        self._since_recompute = 0
+        self.current_cap = self._bucket_for(max(self.histogram.percentile(self.cap_percentile), 1))
+
+    def _buffers(self, width: int, rows: int) -> Tuple[torch.Tensor, torch.Tensor]:
+        # Allocated once per (thread, width) and grown only if a bigger batch shows up
+        buffers = getattr(self._local, "buffers", None)
+        if buffers is None:
+            buffers = self._local.buffers = {}
+        pair = buffers.get(width)
+        if pair is None or pair[0].shape[0] < rows:
+            pair = (torch.empty((rows, width), dtype=torch.long), torch.empty((rows, width), dtype=torch.long))
+            buffers[width] = pair
+        return pair[0][:rows], pair[1][:rows]
+
+    def encode(self, texts: List[str]) -> List[Tuple[List[int], torch.Tensor, torch.Tensor]]:
+        """
+        Tokenizes `texts` and groups them by length bucket.
+
+        Returns (indices, input_ids, attention_mask) per bucket, where `indices` are the
+        positions in `texts`. The tensors are views into reusable per-thread buffers:
+        consume them (run the forward pass) before calling encode() again on this thread.
+        """
+        all_ids = self._token_ids(texts)
+        self.histogram.observe_many([len(ids) for ids in all_ids])
+        self._maybe_recompute_cap(len(all_ids))
+
+        cap = self.current_cap
+        groups: Dict[int, List[int]] = {}
+        for i, ids in enumerate(all_ids):
+            if len(ids) > cap:
+                # Keep the final special token ([SEP]/</s>) so the sequence stays well-formed
+                all_ids[i] = ids[:cap - 1] + ids[-1:]
+                self.truncated += 1
+            groups.setdefault(self._bucket_for(len(all_ids[i])), []).append(i)
+
+        encoded = []
+        for width in sorted(groups):
+            indices = groups[width]
+            input_ids, attention_mask = self._buffers(width, len(indices))
+            input_ids.fill_(self.pad_token_id)
+            attention_mask.zero_()
+            for row, i in enumerate(indices):
+                ids = all_ids[i]
+                input_ids[row, :len(ids)] = torch.tensor(ids, dtype=torch.long)
+                attention_mask[row, :len(ids)] = 1
+            encoded.append((indices, input_ids, attention_mask))
+        return encoded
+
+    def reset_stats(self) -> None:
+        self.histogram = TokenLengthHistogram(self.max_length)
+        self.current_cap = self.max_length
+        self.truncated = 0
+        self._since_recompute = self.recompute_every
+
+    def stats(self) -> Dict[str, object]:
+        stats = self.histogram.snapshot(self.buckets)
+        stats.update({
+            "current_cap": self.current_cap,
+            "max_length": self.max_length,
+            "cap_percentile": self.cap_percentile,
+            "truncated": self.truncated,
+        })
+        return stats
@@ -0,0 +1,327 @@
+# backend/app/core/tracing.py
+# Per-turn trace spans, tail-sampled: only slow turns (and an optional sample of the others)
+# leave the process, as OTLP-compatible JSON.
+#
+# A turn's trace is held in a context variable while the turn runs: the HTTP chat routes get
+# it from TraceMiddleware (main.py), WebSocket turns from TurnPipeline. Code running for the
+# turn - in its task or in tasks it starts, e.g. speculative lookups - adds spans to it:
+#   - metrics.Span / @upstream_call record each DB commit and upstream call they time;
+#   - TraceSpan("name") for anything else (classification, including the batching wait);
+#   - the pipeline's stages (ws.nlp, ws.lookup, ws.queued, ws.persist).
+# Work on the inference executor has no trace (contextvars don't cross run_in_executor, and
+# one forward pass serves several turns); its time shows in the nlp.classify span.
+#
+# Tail sampling: when the turn ends, its duration is known. Turns of TRACE_SLOW_TURN_MS or
+# more are kept, with the sampling profiler's stacks of that time window attached when the
+# profiler is running (core/profiler.py); faster turns are kept with probability
+# TRACE_SAMPLE_RATIO and the rest are discarded. Kept traces go to a bounded queue that a
+# daemon thread drains in batches: appended to TRACE_EXPORT_FILE as one
+# ExportTraceServiceRequest per line (what the collector's otlpjsonfile receiver reads),
+# and/or POSTed to TRACE_OTLP_ENDPOINT + /v1/traces (OTLP/HTTP, JSON encoding). The last
+# few are also kept in memory for GET /api/v1/admin/traces/slow. The event loop only ever
+# appends to lists and does a put_nowait(); a full queue drops the trace (counted).
+
+import contextvars
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+from ..config import settings
+
+logger = logging.getLogger(__name__)
+
+current_trace: contextvars.ContextVar = contextvars.ContextVar("current_trace", default=None)
+
+SERVER, INTERNAL, CLIENT = 2, 1, 3 # OTLP span kinds
+STATUS_ERROR = 2
+
+
+class TurnTrace:
+    """The spans of one turn. Spans are (name, started, ended, attributes) with perf_counter() times."""
+    __slots__ = ("name", "attributes", "trace_id", "span_id", "started", "started_ns", "ended", "spans", "error", "profile")
+
+    def __init__(self, name: str, attributes: Optional[Dict[str, Any]] = None):
+        self.name = name
+        self.attributes = dict(attributes or {})
+        self.trace_id = os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.started = time.perf_counter()
+        self.started_ns = time.time_ns()
+        self.ended: Optional[float] = None
+        self.spans: List[tuple] = []
+        self.error: Optional[str] = None
+        self.profile: Optional[Dict[str, int]] = None
+
+    def add_span(self, name: str, started: float, ended: float, attributes: Optional[Dict[str, Any]] = None) -> None:
+        if self.ended is None: # A speculative lookup finishing after the turn doesn't belong to it
+            self.spans.append((name, started, ended, attributes))
+
+    @property
+    def duration_ms(self) -> float:
+        return ((self.ended or time.perf_counter()) - self.started) * 1000
+
+
+class TraceSpan:
+    """`with TraceSpan("nlp.classify"): ...` adds a span to the current turn's trace; does nothing outside a turn."""
+    __slots__ = ("name", "attributes", "trace", "started")
+
+    def __init__(self, name: str, attributes: Optional[Dict[str, Any]] = None):
+        self.name = name
+        self.attributes = attributes
+
+    def __enter__(self) -> "TraceSpan":
+        self.trace = current_trace.get()
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if self.trace is not None:
+            attributes = self.attributes
+            if exc_type is not None:
+                attributes = {**(attributes or {}), "error": exc_type.__name__}
+            self.trace.add_span(self.name, self.started, time.perf_counter(), attributes)
+
+
+def annotate(**attributes: Any) -> None:
+    """Adds attributes (intent, conversation id, ...) to the current turn's trace, if any."""
+    trace = current_trace.get()
+    if trace is not None:
+        trace.attributes.update(attributes)
+
+
+def _value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)} # int64 is a string in the protobuf JSON mapping
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _attributes(attributes: Optional[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    return [{"key": key, "value": _value(value)} for key, value in (attributes or {}).items() if value is not None]
+
+
+def to_otlp_spans(trace: TurnTrace) -> List[Dict[str, Any]]:
+    def unix_ns(perf: float) -> str:
+        return str(trace.started_ns + int((perf - trace.started) * 1e9))
+
+    root: Dict[str, Any] = {
+        "traceId": trace.trace_id, "spanId": trace.span_id, "name": trace.name, "kind": SERVER,
+        "startTimeUnixNano": unix_ns(trace.started), "endTimeUnixNano": unix_ns(trace.ended or trace.started),
+        "attributes": _attributes({**trace.attributes, "turn.duration_ms": round(trace.duration_ms, 2)}),
+    }
+    if trace.error is not None:
+        root["status"] = {"code": STATUS_ERROR, "message": trace.error}
+    if trace.profile is not None:
+        root["events"] = [{
+            "timeUnixNano": unix_ns(trace.ended or trace.started), "name": "profile",
+            "attributes": _attributes({
+                "profile.format": "collapsed",
+                "profile.samples": sum(trace.profile.values()),
+                "profile.stacks": "\n".join(f"{stack} {count}" for stack, count in trace.profile.items()),
+            }),
+        }]
+    spans = [root]
+    for name, started, ended, attributes in list(trace.spans):
+        span = {
+            "traceId": trace.trace_id, "spanId": os.urandom(8).hex(), "parentSpanId": trace.span_id, "name": name,
+            "kind": CLIENT if name.startswith("upstream.") else INTERNAL,
+            "startTimeUnixNano": unix_ns(started), "endTimeUnixNano": unix_ns(ended), "attributes": _attributes(attributes),
+        }
+        if attributes and "error" in attributes:
+            span["status"] = {"code": STATUS_ERROR, "message": str(attributes["error"])}
+        spans.append(span)
+    return spans
+
+
+def to_otlp(traces: List[TurnTrace], service_name: str) -> Dict[str, Any]:
+    """An OTLP ExportTraceServiceRequest (JSON encoding) holding `traces`."""
+    return {"resourceSpans": [{
+        "resource": {"attributes": _attributes({"service.name": service_name, "process.pid": os.getpid()})},
+        "scopeSpans": [{"scope": {"name": __name__}, "spans": [span for trace in traces for span in to_otlp_spans(trace)]}],
+    }]}
+
+
+class TraceExporter:
+    """Writes kept traces from a bounded queue, on its own thread, to a file and/or an OTLP/HTTP collector."""
+
+    def __init__(self, file_path: str = "", endpoint: str = "", service_name: str = "intentchatbot-api",
+                 max_queue: int = 1000, batch_size: int = 64, flush_interval: float = 1.0, timeout: float = 5.0):
+        self.file_path = file_path
+        self.endpoint = endpoint.rstrip("/") + "/v1/traces" if endpoint else ""
+        self.service_name = service_name
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.timeout = timeout
+        self._queue: queue.Queue = queue.Queue(maxsize=max(1, max_queue))
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+        self.exported = 0
+        self.dropped = 0 # Queue full: the exporter can't keep up
+        self.export_errors = 0
+
+    @property
+    def configured(self) -> bool:
+        return bool(self.file_path or self.endpoint)
+
+    def submit(self, trace: TurnTrace) -> bool:
+        if not self.configured:
+            return False
+        self._ensure_thread()
+        try:
+            self._queue.put_nowait(trace)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def _ensure_thread(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+                    self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while batch[-1] is not None and len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            stopping = batch[-1] is None
+            traces = [trace for trace in batch if trace is not None]
+            if traces:
+                self.export(traces)
+            if stopping:
+                return
+
+    def export(self, traces: List[TurnTrace]) -> None:
+        payload = to_otlp(traces, self.service_name)
+        try:
+            if self.file_path:
+                with open(self.file_path, "a") as f:
+                    f.write(json.dumps(payload, separators=(",", ":")) + "\n")
+            if self.endpoint:
+                import httpx
+                httpx.post(self.endpoint, json=payload, timeout=self.timeout).raise_for_status()
+            self.exported += len(traces)
+        except Exception as e: # Tracing must never take the worker down
+            self.export_errors += 1
+            logger.warning("TraceExporter: exporting %d traces failed: %s", len(traces), e)
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """Exports what is queued, then stops the thread. Blocking: call it off the event loop."""
+        if self._thread is None or not self._thread.is_alive():
+            return
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            return
+        self._thread.join(timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"file": self.file_path or None, "endpoint": self.endpoint or None, "queued": self._queue.qsize(),
+                "exported": self.exported, "dropped": self.dropped, "export_errors": self.export_errors}
+
+
+class Tracer:
+    def __init__(self, exporter: TraceExporter, slow_turn_ms: float = 1000.0, sample_ratio: float = 0.0,
+                 profiler=None, keep_recent: int = 20):
+        self.exporter = exporter
+        self.slow_turn_ms = slow_turn_ms
+        self.sample_ratio = sample_ratio
+        self.profiler = profiler # A SamplingProfiler; its stacks are attached to slow turns while it runs
+        self.recent: deque = deque(maxlen=max(1, keep_recent)) # Kept traces, newest last
+
+        self.turns = 0
+        self.slow_turns = 0
+        self.sampled_turns = 0
+
+    def begin(self, name: str, **attributes: Any) -> TurnTrace:
+        """A new turn's trace. The caller makes it current (current_trace.set) where the turn's code runs."""
+        return TurnTrace(name, attributes)
+
+    def finish(self, trace: Optional[TurnTrace], error: Optional[BaseException] = None) -> bool:
+        """Ends the turn and decides whether to keep it; True if kept."""
+        if trace is None or trace.ended is not None:
+            return False
+        trace.ended = time.perf_counter()
+        if error is not None:
+            trace.error = f"{type(error).__name__}: {error}"
+        self.turns += 1
+        if trace.duration_ms >= self.slow_turn_ms:
+            self.slow_turns += 1
+            if self.profiler is not None and self.profiler.running:
+                trace.profile = self.profiler.collapsed(trace.started, trace.ended)
+        elif self.sample_ratio > 0 and random.random() < self.sample_ratio:
+            self.sampled_turns += 1
+        else:
+            return False
+        self.recent.append(trace)
+        self.exporter.submit(trace)
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "slow_turn_ms": self.slow_turn_ms,
+            "sample_ratio": self.sample_ratio,
+            "turns": self.turns,
+            "slow_turns": self.slow_turns,
+            "sampled_turns": self.sampled_turns,
+            "exporter": self.exporter.stats(),
+        }
+
+
+class TraceMiddleware:
+    """ASGI middleware: one trace per HTTP request under `prefix` (the chat routes), current while it is handled."""
+
+    def __init__(self, app, tracer: Optional[Tracer], prefix: str):
+        self.app = app
+        self.tracer = tracer
+        self.prefix = prefix
+
+    async def __call__(self, scope, receive, send):
+        if self.tracer is None or scope["type"] != "http" or not scope["path"].startswith(self.prefix):
+            await self.app(scope, receive, send)
+            return
+        trace = self.tracer.begin(f"{scope['method']} {scope['path']}", **{"http.route": scope["path"]})
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                trace.attributes["http.status_code"] = message["status"]
+            await send(message)
+
+        token = current_trace.set(trace)
+        error = None
+        try:
+            await self.app(scope, receive, send_with_status)
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            current_trace.reset(token)
+            self.tracer.finish(trace, error) # Streamed responses: after the last chunk
+
+
+def build_tracer(profiler=None) -> Optional[Tracer]:
+    if not settings.TRACING_ENABLED:
+        return None
+    exporter = TraceExporter(
+        file_path=settings.TRACE_EXPORT_FILE,
+        endpoint=settings.TRACE_OTLP_ENDPOINT,
+        service_name=settings.TRACE_SERVICE_NAME,
+        max_queue=settings.TRACE_EXPORT_QUEUE_SIZE,
+    )
+    return Tracer(exporter, settings.TRACE_SLOW_TURN_MS, settings.TRACE_SAMPLE_RATIO, profiler=profiler)
@@ -0,0 +1,362 @@
+# backend/app/db/message_log.py
+# Optional write-behind log for chat messages (MESSAGE_WRITE_BEHIND_ENABLED).
+#
+# The client only needs the reply text and the message ids, so in this mode a turn's
+# two messages are not written on the request path. Instead:
+#   - ids are handed out from blocks pre-allocated from the messages id sequence
+#     (IdAllocator), so ChatResponse still carries real ids;
+#   - rows go into a buffer, in-process or a Redis list shared with nothing else;
+#   - a background task flushes the buffer with one multi-row INSERT every
+#     MESSAGE_WRITE_BEHIND_FLUSH_MS, or sooner once MESSAGE_WRITE_BEHIND_MAX_ROWS are waiting.
+#
+# Delivery is at-least-once: rows leave the buffer only after their INSERT committed,
+# failed flushes are retried, shutdown drains the buffer, and with the Redis buffer rows
+# survive a crash. Re-inserting a row is harmless because inserts skip ids that already
+# exist (ON CONFLICT DO NOTHING). Turns that open an escalation ticket are still written
+# synchronously by persist_turn, since the ticket id is part of the reply.
+#
+# Flushes and id-block reservations use the synchronous engine from a worker thread;
+# the request handlers themselves are on the async engine, and hand Redis round-trips
+# (enqueue_turn_async) to a thread too.
+
+import asyncio
+import json
+import logging
+import threading
+import uuid
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import func, select, text
+from sqlalchemy.orm import Session, sessionmaker
+
+from ..config import settings
+from ..core.metrics import COMMIT_MESSAGE_LOG, Span
+from . import models
+from .session import SessionLocal, get_redis_client
+
+logger = logging.getLogger(__name__)
+
+
+class IdAllocator:
+    """
+    Hands out message ids from blocks reserved in one round-trip each.
+
+    PostgreSQL: the block is `block_size` nextval() calls on the messages id sequence, so
+    ids are unique across every worker. Other databases have no shareable sequence; the
+    allocator continues from MAX(id), which is only safe with a single writer process
+    (development and tests on SQLite).
+    """
+
+    def __init__(self, session_factory: sessionmaker, block_size: int = 1000):
+        self.session_factory = session_factory
+        self.block_size = max(1, block_size)
+        self._ids: List[int] = []
+        self._next_local: Optional[int] = None
+        self._lock = threading.Lock()
+        self.blocks_reserved = 0
+
+    def _reserve_block(self, count: int) -> List[int]:
+        self.blocks_reserved += 1
+        with self.session_factory() as db:
+            if db.get_bind().dialect.name == "postgresql":
+                rows = db.execute(
+                    text("SELECT nextval(pg_get_serial_sequence('messages', 'id')) FROM generate_series(1, :n)"),
+                    {"n": count},
+                )
+                return [row[0] for row in rows]
+            if self._next_local is None:
+                self._next_local = (db.execute(select(func.max(models.Message.id))).scalar() or 0) + 1
+        start, self._next_local = self._next_local, self._next_local + count
+        return list(range(start, start + count))
+
+    def allocate(self, count: int) -> List[int]:
+        with self._lock:
+            while len(self._ids) < count:
+                self._ids.extend(self._reserve_block(max(self.block_size, count)))
+            ids, self._ids = self._ids[:count], self._ids[count:]
+            return ids
+
+    async def allocate_async(self, count: int) -> List[int]:
+        """allocate() for the event loop: only a block refill (a DB round-trip) goes to a thread."""
+        with self._lock:
+            if len(self._ids) >= count:
+                ids, self._ids = self._ids[:count], self._ids[count:]
+                return ids
+        return await asyncio.to_thread(self.allocate, count)
+
+
+class _MemoryBuffer:
+    def __init__(self):
+        self._rows: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    def push(self, rows: List[Dict[str, Any]]) -> None:
+        with self._lock:
+            self._rows.extend(rows)
+
+    def acquire(self) -> bool:
+        return True # Only this process flushes it (MessageWriteBehind holds a thread lock)
+
+    def release(self) -> None:
+        pass
+
+    def peek(self, limit: int) -> List[Dict[str, Any]]:
+        with self._lock:
+            return self._rows[:limit]
+
+    def ack(self, count: int) -> bool:
+        with self._lock:
+            del self._rows[:count]
+        return True
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+
+# Trims the flushed rows only if this flush still holds the lock
+_ACK_SCRIPT = """
+if redis.call("GET", KEYS[1]) == ARGV[1] then
+    redis.call("LTRIM", KEYS[2], ARGV[2], -1)
+    return 1
+end
+return 0
+"""
+# Deletes the lock only if it is still this flush's
+_RELEASE_SCRIPT = """
+if redis.call("GET", KEYS[1]) == ARGV[1] then
+    return redis.call("DEL", KEYS[1])
+end
+return 0
+"""
+
+
+class _RedisBuffer:
+    """
+    A Redis list shared by every worker; rows are trimmed off the head only after they were
+    committed. One worker at a time flushes it (a lock key with an expiry), otherwise two
+    workers would insert the same head rows and each trim them, dropping the rows behind.
+
+    The lock holds a token of the flush that took it. A flush outliving the expiry (slow
+    database) may find the lock taken over by another worker, which peeked the same head
+    rows: it then must not trim (the other flush trims them once they are in) nor delete the
+    other flush's lock, so ack and release check the token, atomically, in Lua.
+    """
+
+    def __init__(self, redis_client, key: str = "chat:message_log", lock_ms: int = 10000):
+        self.redis = redis_client
+        self.key = key
+        self.lock_key = f"{key}:flush_lock"
+        self.lock_ms = lock_ms
+        self._token: Optional[str] = None # Set while this process holds the lock
+        self._ack = redis_client.register_script(_ACK_SCRIPT)
+        self._release = redis_client.register_script(_RELEASE_SCRIPT)
+
+    def acquire(self) -> bool:
+        token = uuid.uuid4().hex
+        if not self.redis.set(self.lock_key, token, nx=True, px=self.lock_ms):
+            return False
+        self._token = token
+        return True
+
+    def release(self) -> None:
+        if self._token is not None:
+            self._release(keys=[self.lock_key], args=[self._token])
+            self._token = None
+
+    def push(self, rows: List[Dict[str, Any]]) -> None:
+        self.redis.rpush(self.key, *(json.dumps(row, default=str) for row in rows))
+
+    def peek(self, limit: int) -> List[Dict[str, Any]]:
+        rows = [json.loads(raw) for raw in self.redis.lrange(self.key, 0, limit - 1)]
+        for row in rows:
+            row["timestamp"] = datetime.fromisoformat(row["timestamp"])
+        return rows
+
+    def ack(self, count: int) -> bool:
+        """False (nothing trimmed) if the lock expired and another worker has taken it over."""
+        return bool(self._ack(keys=[self.lock_key, self.key], args=[self._token, count]))
+
+    def __len__(self) -> int:
+        return self.redis.llen(self.key)
+
+
+def _age_ms(row: Dict[str, Any]) -> float:
+    """Milliseconds since a buffered row was enqueued (its message timestamp, UTC)."""
+    return max(0.0, (datetime.utcnow() - row["timestamp"]).total_seconds() * 1000)
+
+
+class MessageWriteBehind:
+    def __init__(
+        self,
+        session_factory: sessionmaker,
+        flush_interval_ms: float = 200,
+        max_rows: int = 500,
+        id_block_size: int = 1000,
+        redis_client=None, # Buffer in Redis instead of process memory
+    ):
+        self.session_factory = session_factory
+        self.flush_interval = flush_interval_ms / 1000.0
+        self.max_rows = max(1, max_rows)
+        self.ids = IdAllocator(session_factory, id_block_size)
+        self.buffer = _RedisBuffer(redis_client) if redis_client is not None else _MemoryBuffer()
+        self._pushed_rows = 0 # Rows this process buffered since its last flush: wakes the flusher early
+        self._flush_lock = threading.Lock()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+        self.rows_written = 0
+        self.flushes = 0
+        self.flush_errors = 0
+        self.lock_lost = 0 # Flushes that outlived the Redis lock; their rows are written again by the next one
+        # Enqueue -> commit of the oldest row in the last flush, from the rows' timestamps, so
+        # with the shared Redis buffer it covers every worker's rows
+        self.last_flush_lag_ms = 0.0
+        self.max_flush_lag_ms = 0.0
+
+    def enqueue_turn(self, conversation_id: int, user_text: str, intent: Optional[str], confidence: Optional[float],
+                     bot_text: str, bot_intent: Optional[str], message_ids: Optional[List[int]] = None) -> List[int]:
+        """Buffers the user and bot messages of one turn; returns their (pre-allocated) ids."""
+        user_id, bot_id = message_ids or self.ids.allocate(2)
+        now = datetime.utcnow()
+        self.buffer.push([
+            {"id": user_id, "conversation_id": conversation_id, "content": user_text, "sender": "user",
+             "intent": intent, "confidence": confidence, "timestamp": now},
+            {"id": bot_id, "conversation_id": conversation_id, "content": bot_text, "sender": "bot",
+             "intent": bot_intent, "confidence": 1.0, "timestamp": now},
+        ])
+        self._pushed_rows += 2
+        return [user_id, bot_id]
+
+    async def enqueue_turn_async(self, conversation_id: int, user_text: str, intent: Optional[str],
+                                 confidence: Optional[float], bot_text: str, bot_intent: Optional[str],
+                                 message_ids: Optional[List[int]] = None) -> List[int]:
+        """enqueue_turn for the event loop: the Redis buffer's RPUSH (a network round-trip) goes to a thread."""
+        if message_ids is None:
+            message_ids = await self.ids.allocate_async(2)
+        args = (conversation_id, user_text, intent, confidence, bot_text, bot_intent, message_ids)
+        if isinstance(self.buffer, _RedisBuffer):
+            ids = await asyncio.to_thread(self.enqueue_turn, *args)
+        else:
+            ids = self.enqueue_turn(*args)
+        if self._wakeup is not None and self._pushed_rows >= self.max_rows:
+            self._wakeup.set() # Don't wait for the timer
+        return ids
+
+    def _insert(self, db: Session, rows: List[Dict[str, Any]]) -> None:
+        dialect = db.get_bind().dialect.name
+        if dialect == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert
+        elif dialect == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            from sqlalchemy import insert # No upsert syntax: a replayed row would fail the flush
+        statement = insert(models.Message)
+        if dialect in ("postgresql", "sqlite"):
+            # No conflict target: on the partitioned PostgreSQL table the key is (id, timestamp)
+            statement = statement.on_conflict_do_nothing()
+        db.execute(statement, rows) # executemany -> batched multi-row INSERT
+        with Span(COMMIT_MESSAGE_LOG):
+            db.commit()
+
+    def flush(self) -> int:
+        """Writes up to max_rows buffered rows; returns how many. Safe to call from any thread."""
+        with self._flush_lock:
+            if not self.buffer.acquire():
+                return 0 # Another worker is flushing the shared buffer
+            try:
+                rows = self.buffer.peek(self.max_rows)
+                if not rows:
+                    return 0
+                try:
+                    with self.session_factory() as db:
+                        self._insert(db, rows)
+                except Exception as e:
+                    self.flush_errors += 1
+                    logger.warning("MessageWriteBehind: flush of %d rows failed, will retry: %s", len(rows), e)
+                    raise
+                if not self.buffer.ack(len(rows)):
+                    self.lock_lost += 1
+                    logger.warning("MessageWriteBehind: flush lock expired during a flush of %d rows; "
+                                   "the worker holding it now writes them again", len(rows))
+                    return 0
+            finally:
+                self.buffer.release()
+            self.flushes += 1
+            self.rows_written += len(rows)
+            self._pushed_rows = 0
+            self.last_flush_lag_ms = _age_ms(rows[0])
+            self.max_flush_lag_ms = max(self.max_flush_lag_ms, self.last_flush_lag_ms)
+            return len(rows)
+
+    def drain(self) -> int:
+        """Flushes until the buffer is empty (graceful shutdown)."""
+        written = 0
+        while True:
+            count = self.flush()
+            if not count:
+                return written
+            written += count
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                while await asyncio.to_thread(self.flush) >= self.max_rows:
+                    pass # A full batch came out; more may be waiting
+            except Exception:
+                await asyncio.sleep(self.flush_interval) # Rows stay buffered; back off, then retry
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stops the flusher and drains the buffer so no acknowledged turn is lost."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await asyncio.to_thread(self.drain)
+
+    def stats(self) -> Dict[str, Any]:
+        """Reads the buffer (Redis round-trips with the Redis buffer): call it off the event loop."""
+        oldest = self.buffer.peek(1)
+        return {
+            "buffered_rows": len(self.buffer),
+            "rows_written": self.rows_written,
+            "flushes": self.flushes,
+            "flush_errors": self.flush_errors,
+            "id_blocks_reserved": self.ids.blocks_reserved,
+            # Flush lag: how far the database trails acknowledged turns
+            "current_lag_ms": round(_age_ms(oldest[0]), 1) if oldest else 0.0,
+            "lock_lost": self.lock_lost,
+            "last_flush_lag_ms": round(self.last_flush_lag_ms, 1),
+            "max_flush_lag_ms": round(self.max_flush_lag_ms, 1),
+        }
+
+
+def build_message_log() -> Optional[MessageWriteBehind]:
+    """The configured write-behind log, or None when messages are written synchronously."""
+    if not settings.MESSAGE_WRITE_BEHIND_ENABLED:
+        return None
+    redis_client = None
+    if settings.MESSAGE_WRITE_BEHIND_BACKEND == "redis":
+        redis_client = get_redis_client()
+        if redis_client is None:
+            logger.warning("MessageWriteBehind: MESSAGE_WRITE_BEHIND_BACKEND=redis but REDIS_URL is not set; buffering in memory")
+    return MessageWriteBehind(
+        SessionLocal,
+        flush_interval_ms=settings.MESSAGE_WRITE_BEHIND_FLUSH_MS,
+        max_rows=settings.MESSAGE_WRITE_BEHIND_MAX_ROWS,
+        id_block_size=settings.MESSAGE_ID_BLOCK_SIZE,
+        redis_client=redis_client,
+    )
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, Float, ForeignKey
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, Float, ForeignKey, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from datetime import datetime
@@ -17,19 +17,29 @@ class Conversation(Base):
     messages = relationship("Message", back_populates="conversation")
     ticket = relationship("EscalationTicket", back_populates="conversation", uselist=False)
 
+    # Indexes (and the partitioning of messages) are created by alembic/versions/0002
+    __table_args__ = (
+        Index("ix_conversations_user_id_start_time", "user_id", "start_time"), # A user's conversations
+    )
+
 class Message(Base):
     __tablename__ = "messages"
     
     id = Column(Integer, primary_key=True)
     conversation_id = Column(Integer, ForeignKey("conversations.id"))
     content = Column(String)
-    timestamp = Column(DateTime, default=datetime.utcnow)
+    timestamp = Column(DateTime, default=datetime.utcnow, nullable=False) # Partition key on PostgreSQL
     sender = Column(String)
     intent = Column(String, nullable=True)
     confidence = Column(Float, nullable=True)
     
     conversation = relationship("Conversation", back_populates="messages")
 
+    __table_args__ = (
+        Index("ix_messages_conversation_id_timestamp", "conversation_id", "timestamp"), # Conversation history, in order
+        Index("ix_messages_timestamp", "timestamp", postgresql_using="brin"), # Time windows; BRIN on PostgreSQL
+    )
+
 class EscalationTicket(Base):
     __tablename__ = "escalation_tickets"
     
@@ -39,4 +49,9 @@ class EscalationTicket(Base):
     status = Column(String)
     assigned_agent = Column(String, nullable=True)
     
-    conversation = relationship("Conversation", back_populates="ticket")
\ No newline at end of file
+    conversation = relationship("Conversation", back_populates="ticket")
+
+    __table_args__ = (
+        Index("ix_escalation_tickets_conversation_id", "conversation_id"),
+        Index("ix_escalation_tickets_status_created_at", "status", "created_at"), # Pending queue, oldest first
+    )
\ No newline at end of file
@@ -0,0 +1,23 @@
+# backend/app/db/partitions.py
+# Keeps monthly partitions of `messages` created ahead of time (PostgreSQL only).
+#
+# The partitioning itself and the ensure_messages_partitions() SQL function come from
+# alembic/versions/0002. This calls the function: at app startup and daily from Celery
+# beat (app/core/tasks.py). It's idempotent and serialised with an advisory lock, so
+# every worker may call it.
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+from ..config import settings
+
+
+def ensure_message_partitions(engine: Engine, months_ahead: int = settings.MESSAGE_PARTITIONS_AHEAD) -> int:
+    """Creates missing monthly partitions up to `months_ahead` months out; returns how many were created."""
+    if engine.dialect.name != "postgresql":
+        return 0
+    with engine.begin() as connection:
+        installed = connection.execute(text("SELECT to_regprocedure('ensure_messages_partitions(integer, timestamp)')")).scalar()
+        if installed is None: # Database not migrated to 0002 yet
+            return 0
+        return connection.execute(text("SELECT ensure_messages_partitions(:months)"), {"months": months_ahead}).scalar()
@@ -2,24 +2,39 @@
 # Database session management for SQLAlchemy.
 
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
+from fastapi import Depends
+
 from app.config import settings # Import settings to get DATABASE_URL
 
 # Create a SQLAlchemy engine
 # The connect_args is specific to SQLite for enabling foreign key constraints.
 # For PostgreSQL, it's usually not needed.
 # For production with PostgreSQL, you might want to configure pool size, etc.
-engine_args = {}
+def pool_args(database_url: str) -> dict:
+    """Pool settings from Settings; SQLite has no server connections to size a pool for."""
+    args = {"pool_pre_ping": settings.DB_POOL_PRE_PING, "pool_recycle": settings.DB_POOL_RECYCLE_SECONDS}
+    if "sqlite" not in database_url:
+        args.update(
+            pool_size=settings.DB_POOL_SIZE,
+            max_overflow=settings.DB_MAX_OVERFLOW,
+            pool_timeout=settings.DB_POOL_TIMEOUT_SECONDS,
+        )
+    return args
+
+
+engine_args = pool_args(settings.DATABASE_URL)
 if "sqlite" in settings.DATABASE_URL:
     engine_args["connect_args"] = {"check_same_thread": False} # Required for SQLite
 
+# The synchronous engine stays for code that runs outside the event loop: Celery tasks,
+# the message log's flush thread, scripts and Alembic. Request handlers use the async one.
 engine = create_engine(
     settings.DATABASE_URL,
     **engine_args
-    # For production, you might add:
-    # pool_pre_ping=True,
-    # pool_recycle=3600, # Recycle connections every hour
 )
 
 # Create a SessionLocal class to generate database sessions
@@ -29,7 +44,7 @@ SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 # All your database models should inherit from this Base.
 Base = declarative_base()
 
-# Dependency to get DB session in FastAPI path operations
+# Dependency to get a (synchronous) DB session, for code that isn't on the event loop
 def get_db():
     """
     FastAPI dependency that provides a SQLAlchemy database session.
@@ -40,3 +55,84 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+# Async engine for the request handlers: asyncpg for PostgreSQL, aiosqlite for SQLite.
+# Created on first use, like the Redis clients below, so importing this module never
+# needs the async driver installed.
+ASYNC_DRIVERS = {"postgresql": "postgresql+asyncpg", "sqlite": "sqlite+aiosqlite"}
+
+
+def async_database_url(database_url: str) -> str:
+    url = make_url(database_url)
+    backend = url.get_backend_name()
+    if url.drivername == backend and backend in ASYNC_DRIVERS: # No explicit driver: pick the async one
+        url = url.set(drivername=ASYNC_DRIVERS[backend])
+    elif url.drivername in ("postgresql+psycopg2", "sqlite+pysqlite"): # Sync drivers set explicitly
+        url = url.set(drivername=ASYNC_DRIVERS[backend])
+    return url.render_as_string(hide_password=False)
+
+
+_async_engine = None
+_async_session_factory = None
+
+def get_async_engine():
+    global _async_engine
+    if _async_engine is None:
+        _async_engine = create_async_engine(async_database_url(settings.DATABASE_URL), **pool_args(settings.DATABASE_URL))
+    return _async_engine
+
+
+def get_async_session_factory() -> async_sessionmaker:
+    """
+    FastAPI dependency returning the AsyncSession factory. The WebSocket endpoint checks a
+    session out of it for each turn instead of holding one for the whole connection.
+    """
+    global _async_session_factory
+    if _async_session_factory is None:
+        # Rows stay usable after commit without a reload round-trip
+        _async_session_factory = async_sessionmaker(get_async_engine(), expire_on_commit=False, autoflush=False)
+    return _async_session_factory
+
+
+async def get_async_db(session_factory: async_sessionmaker = Depends(get_async_session_factory)):
+    """FastAPI dependency that provides an AsyncSession for one request."""
+    async with session_factory() as db:
+        yield db
+
+
+async def dispose_async_engine() -> None:
+    if _async_engine is not None:
+        await _async_engine.dispose()
+
+
+# Redis client shared by the cache tiers. Created on first use so that importing this
+# module never needs a reachable Redis; returns None when REDIS_URL isn't configured.
+_redis_client = None
+
+def get_redis_client():
+    global _redis_client
+    if _redis_client is None and settings.REDIS_URL:
+        import redis
+        _redis_client = redis.Redis.from_url(
+            settings.REDIS_URL,
+            socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+            socket_connect_timeout=settings.REDIS_SOCKET_TIMEOUT,
+        )
+    return _redis_client
+
+
+# asyncio flavour of the same Redis, for cache tiers consulted on the event loop (an
+# occasional 100ms socket timeout must never block other connections' turns).
+_async_redis_client = None
+
+def get_async_redis_client():
+    global _async_redis_client
+    if _async_redis_client is None and settings.REDIS_URL:
+        import redis.asyncio
+        _async_redis_client = redis.asyncio.Redis.from_url(
+            settings.REDIS_URL,
+            socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+            socket_connect_timeout=settings.REDIS_SOCKET_TIMEOUT,
+        )
+    return _async_redis_client
@@ -0,0 +1,248 @@
+# backend/app/db/turns.py
+# Persistence of one chat turn (user message, bot reply, optional escalation) in a
+# single transaction.
+#
+# The previous path committed and refreshed after every step: user message, its NLP
+# update, bot message, conversation update and ticket - each commit followed by a
+# SELECT to reload the row. Here every row is written with INSERT ... RETURNING, so
+# ids come back from the write itself, and there is one COMMIT per turn.
+#
+# record_turn is what the endpoints call: with the write-behind log enabled
+# (app/db/message_log.py) ordinary turns only buffer their messages. persist_turns is the
+# bulk path (/chat/batch): a whole group of turns in a handful of statements and one COMMIT.
+# All of it runs on an AsyncSession, so a turn's queries never block the event loop.
+
+import logging
+from datetime import datetime
+from typing import List, NamedTuple, Optional
+
+from sqlalchemy import insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import models
+from ..core.metrics import COMMIT_CONVERSATION, COMMIT_TURN, COMMIT_TURN_BATCH, Span
+
+logger = logging.getLogger(__name__)
+
+
+class TurnRecord(NamedTuple):
+    conversation_id: int
+    user_message_id: int
+    bot_message_id: int
+    bot_text: str
+    escalation_ticket_id: Optional[int] = None
+
+
+class TurnInput(NamedTuple):
+    """One turn for persist_turns; the fields are persist_turn's arguments."""
+    conversation_id: Optional[int]
+    user_id: Optional[str]
+    user_text: str
+    intent: Optional[str]
+    confidence: Optional[float]
+    bot_text: str
+    bot_intent: Optional[str]
+    escalate: bool = False
+
+
+async def resolve_conversation(db: AsyncSession, user_id: Optional[str], conversation_id: Optional[int]) -> int:
+    """Id of `conversation_id` if it exists, else of a new conversation. Does not commit."""
+    if conversation_id:
+        existing = (await db.execute(
+            select(models.Conversation.id).where(models.Conversation.id == conversation_id)
+        )).scalar()
+        if existing is not None:
+            return existing
+    return (await db.execute(
+        insert(models.Conversation)
+        .values(user_id=user_id, start_time=datetime.utcnow(), escalated=False)
+        .returning(models.Conversation.id)
+    )).scalar_one()
+
+
+async def add_escalation_ticket(db: AsyncSession, conversation_id: int, now: Optional[datetime] = None) -> int:
+    """Marks the conversation escalated and opens a pending ticket; returns its id. Does not commit."""
+    now = now or datetime.utcnow()
+    await db.execute(
+        update(models.Conversation)
+        .where(models.Conversation.id == conversation_id)
+        .values(escalated=True, end_time=now)
+    )
+    return (await db.execute(
+        insert(models.EscalationTicket)
+        .values(conversation_id=conversation_id, status="pending", created_at=now)
+        .returning(models.EscalationTicket.id)
+    )).scalar_one()
+
+
+async def persist_turn(
+    db: AsyncSession,
+    conversation_id: Optional[int],
+    user_id: Optional[str],
+    user_text: str,
+    intent: Optional[str],
+    confidence: Optional[float],
+    bot_text: str,
+    bot_intent: Optional[str],
+    escalate: bool = False,
+    conversation_verified: bool = False,
+    message_ids: Optional[List[int]] = None,
+) -> TurnRecord:
+    """
+    Writes the turn and commits once.
+
+    conversation_id: an existing conversation, or None/unknown to start one in the same transaction.
+    bot_text: when `escalate` is set it may contain "{ticket_id}", filled in with the new ticket's id.
+    conversation_verified: the caller knows conversation_id exists (the WebSocket endpoint
+                           created it at connect), which saves the lookup.
+    message_ids: explicit ids for the two messages (pre-allocated by the write-behind log,
+                 whose ids the database's own autoincrement doesn't know about).
+    """
+    now = datetime.utcnow()
+    try:
+        if not conversation_verified:
+            conversation_id = await resolve_conversation(db, user_id, conversation_id)
+        ticket_id = None
+        if escalate:
+            ticket_id = await add_escalation_ticket(db, conversation_id, now)
+            bot_text = bot_text.format(ticket_id=ticket_id)
+
+        messages = [
+            {"conversation_id": conversation_id, "content": user_text, "sender": "user",
+             "intent": intent, "confidence": confidence, "timestamp": now},
+            {"conversation_id": conversation_id, "content": bot_text, "sender": "bot",
+             "intent": bot_intent, "confidence": 1.0, "timestamp": now},
+        ]
+        if message_ids:
+            for message, message_id in zip(messages, message_ids):
+                message["id"] = message_id
+        # Both messages in one multi-row INSERT; ids come back in parameter order
+        rows = (await db.execute(
+            insert(models.Message).returning(models.Message.id, sort_by_parameter_order=True),
+            messages,
+        )).scalars().all()
+        with Span(COMMIT_TURN):
+            await db.commit()
+    except Exception:
+        await db.rollback()
+        raise
+    return TurnRecord(conversation_id, rows[0], rows[1], bot_text, ticket_id)
+
+
+async def record_turn(
+    db: AsyncSession,
+    conversation_id: Optional[int],
+    user_id: Optional[str],
+    user_text: str,
+    intent: Optional[str],
+    confidence: Optional[float],
+    bot_text: str,
+    bot_intent: Optional[str],
+    escalate: bool = False,
+    conversation_verified: bool = False,
+    message_log=None, # A MessageWriteBehind; None writes the turn synchronously
+) -> TurnRecord:
+    """
+    persist_turn, or with `message_log` set: only the conversation (when new) is written
+    now and the two messages are buffered for the next bulk flush. Escalating turns are
+    always written synchronously - their reply carries the new ticket's id.
+    """
+    if message_log is None:
+        return await persist_turn(db, conversation_id, user_id, user_text, intent, confidence, bot_text, bot_intent,
+                                  escalate=escalate, conversation_verified=conversation_verified)
+    if escalate:
+        return await persist_turn(db, conversation_id, user_id, user_text, intent, confidence, bot_text, bot_intent,
+                                  escalate=True, conversation_verified=conversation_verified,
+                                  message_ids=await message_log.ids.allocate_async(2))
+
+    if not conversation_verified:
+        try:
+            resolved = await resolve_conversation(db, user_id, conversation_id)
+            if resolved != conversation_id:
+                with Span(COMMIT_CONVERSATION):
+                    await db.commit() # A new conversation must exist before its messages are flushed
+            conversation_id = resolved
+        except Exception:
+            await db.rollback()
+            raise
+    message_ids = await message_log.ids.allocate_async(2)
+    try:
+        user_message_id, bot_message_id = await message_log.enqueue_turn_async(
+            conversation_id, user_text, intent, confidence, bot_text, bot_intent, message_ids
+        )
+    except Exception as e: # Buffer unavailable (Redis down): don't lose the turn, write it now
+        logger.warning("record_turn: write-behind buffer failed, writing synchronously: %s", e)
+        return await persist_turn(db, conversation_id, user_id, user_text, intent, confidence, bot_text, bot_intent,
+                                  conversation_verified=True, message_ids=message_ids)
+    return TurnRecord(conversation_id, user_message_id, bot_message_id, bot_text)
+
+
+async def persist_turns(db: AsyncSession, turns: List[TurnInput], message_ids: Optional[List[int]] = None) -> List[TurnRecord]:
+    """
+    persist_turn for many turns at once, in one transaction: one SELECT for the existing
+    conversations, one multi-row INSERT each for new conversations, tickets and messages,
+    and one COMMIT. Each turn is stored exactly as persist_turn would store it (a turn with
+    no or an unknown conversation_id starts its own conversation).
+
+    message_ids: 2 * len(turns) explicit ids, user then bot message per turn (see persist_turn).
+    Returns the records in the order of `turns`.
+    """
+    if not turns:
+        return []
+    now = datetime.utcnow()
+    try:
+        conversation_ids = [turn.conversation_id for turn in turns]
+        requested = {cid for cid in conversation_ids if cid}
+        existing = set()
+        if requested:
+            existing = set((await db.execute(
+                select(models.Conversation.id).where(models.Conversation.id.in_(requested))
+            )).scalars())
+        new = [i for i, cid in enumerate(conversation_ids) if cid not in existing]
+        if new:
+            created = (await db.execute(
+                insert(models.Conversation).returning(models.Conversation.id, sort_by_parameter_order=True),
+                [{"user_id": turns[i].user_id, "start_time": now, "escalated": False} for i in new],
+            )).scalars().all()
+            for i, conversation_id in zip(new, created):
+                conversation_ids[i] = conversation_id
+
+        bot_texts = [turn.bot_text for turn in turns]
+        ticket_ids: List[Optional[int]] = [None] * len(turns)
+        escalating = [i for i, turn in enumerate(turns) if turn.escalate]
+        if escalating:
+            await db.execute(
+                update(models.Conversation)
+                .where(models.Conversation.id.in_({conversation_ids[i] for i in escalating}))
+                .values(escalated=True, end_time=now)
+            )
+            tickets = (await db.execute(
+                insert(models.EscalationTicket).returning(models.EscalationTicket.id, sort_by_parameter_order=True),
+                [{"conversation_id": conversation_ids[i], "status": "pending", "created_at": now} for i in escalating],
+            )).scalars().all()
+            for i, ticket_id in zip(escalating, tickets):
+                ticket_ids[i] = ticket_id
+                bot_texts[i] = bot_texts[i].format(ticket_id=ticket_id)
+
+        messages = []
+        for turn, conversation_id, bot_text in zip(turns, conversation_ids, bot_texts):
+            messages.append({"conversation_id": conversation_id, "content": turn.user_text, "sender": "user",
+                             "intent": turn.intent, "confidence": turn.confidence, "timestamp": now})
+            messages.append({"conversation_id": conversation_id, "content": bot_text, "sender": "bot",
+                             "intent": turn.bot_intent, "confidence": 1.0, "timestamp": now})
+        if message_ids:
+            for message, message_id in zip(messages, message_ids):
+                message["id"] = message_id
+        rows = (await db.execute(
+            insert(models.Message).returning(models.Message.id, sort_by_parameter_order=True),
+            messages,
+        )).scalars().all()
+        with Span(COMMIT_TURN_BATCH):
+            await db.commit()
+    except Exception:
+        await db.rollback()
+        raise
+    return [
+        TurnRecord(conversation_ids[i], rows[2 * i], rows[2 * i + 1], bot_texts[i], ticket_ids[i])
+        for i in range(len(turns))
+    ]
@@ -1,10 +1,26 @@
 # backend/app/main.py
+import asyncio
+import logging
+
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 
 # Import your API router (assuming it's defined in chatbot.py and exposed via api.v1.__init__)
 from .api.v1 import api_router_v1 # Adjusted import path
 from .config import settings # Your application settings
+from .api.v1.chatbot import (connection_manager, ecommerce_service, escalation_notifier, escalation_queue, message_log, profiler,
+                             task_batchers, tracer)
+from .core import metrics
+from .core.log import configure_logging
+from .core.nlp import model_manager, shutdown_inference
+from .db.partitions import ensure_message_partitions
+from .core.tracing import TraceMiddleware
+from .db.session import dispose_async_engine, engine
+
+configure_logging() # Before anything logs: records go through a queue, written by a background thread
+logger = logging.getLogger(__name__)
+
 # from .db.session import engine # If you need direct access to engine for some reason
 # from .db import models # If you are using SQLAlchemy Base for create_all (usually for dev/testing)
 
@@ -30,6 +46,8 @@ app.add_middleware(
     allow_methods=["*"], # Allows all methods
     allow_headers=["*"], # Allows all headers
 )
+# One trace per HTTP chat turn (/chat, /chat/stream, /chat/batch); WebSocket turns are traced by their pipeline
+app.add_middleware(TraceMiddleware, tracer=tracer, prefix="/api/v1/chat")
 
 # Include your versioned API router
 # The prefix here means all routes in api_router_v1 will start with /api/v1
@@ -38,8 +56,25 @@ app.include_router(api_router_v1, prefix="/api/v1")
 
 @app.get("/health", tags=["Health Check"])
 async def health_check():
-    # You can expand this to check DB connection, Redis, NLP model status etc.
-    return {"status": "ok", "message": "API is healthy"}
+    # Readiness: 503 until the NLP model is loaded and warmed up, so no traffic is routed
+    # to a worker that would have to answer from a half-loaded model.
+    # You can expand this to check DB connection, Redis etc.
+    nlp_status = model_manager.status()
+    if not model_manager.ready:
+        return JSONResponse(status_code=503, content={"status": "unavailable", "message": "NLP model is not ready", "nlp": nlp_status})
+    return {"status": "ok", "message": "API is healthy", "nlp": nlp_status}
+
+@app.get("/health/live", tags=["Health Check"])
+async def liveness_check():
+    # Liveness: the process is up and serving, even while the model is still loading
+    return {"status": "ok"}
+
+if settings.METRICS_ENABLED:
+    @app.get("/metrics", tags=["Health Check"], include_in_schema=False)
+    async def metrics_endpoint():
+        # Prometheus scrape target: per-stage latency histograms, turn/escalation counters and
+        # connection/queue gauges of this worker (see core/metrics.py)
+        return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
 
 # If you have other routers or specific event handlers (startup/shutdown), add them here.
 # For example, if you have a more complex NLP model loading or DB connection pool setup:
@@ -48,19 +83,46 @@ async def health_check():
 
 @app.on_event("startup")
 async def startup_event():
-    print("Application startup complete.")
-    # Initialize NLP model if not done elsewhere, connect to Redis, etc.
-    # (This is often handled within the modules themselves or via dependency injection)
-    # Example:
-    # if not classifier.model_loaded: # Hypothetical check
-    #     classifier.load_model()
+    logger.info("Application startup complete.")
+    # Load the NLP model in the background: the server accepts connections right away and
+    # /health flips to ready once the model is loaded and warmed up.
+    if settings.NLP_LOAD_ON_STARTUP:
+        model_manager.start()
+    if settings.PROFILER_ENABLED:
+        profiler.start()
+    if message_log is not None:
+        message_log.start() # Background bulk flushes of buffered chat messages
+    if escalation_notifier is not None:
+        escalation_notifier.start() # Celery notifications for tickets on the escalation stream
+    for batcher in task_batchers.values():
+        batcher.start() # Batched Celery tasks: analytics, re-classification
+    try:
+        created = await asyncio.to_thread(ensure_message_partitions, engine) # PostgreSQL only; no-op elsewhere
+        if created:
+            logger.info("Created %d messages partition(s).", created)
+    except Exception as e: # The daily beat task retries; never keep the API from starting over it
+        logger.warning("Could not ensure messages partitions: %s", e)
     # if not redis_client.is_connected():
     #     await redis_client.connect()
-    pass
 
 @app.on_event("shutdown")
 async def shutdown_event():
-    print("Application shutdown.")
+    logger.info("Application shutdown.")
+    await shutdown_inference() # Cancel requests still waiting for a batch
+    await connection_manager.close() # Close this worker's WebSockets; clients reconnect elsewhere
+    if escalation_notifier is not None:
+        await escalation_notifier.stop() # Tickets it hadn't acked are picked up by another worker
+    if escalation_queue is not None:
+        await escalation_queue.redis.aclose()
+    for batcher in task_batchers.values():
+        await batcher.stop() # Send what is still buffered
+    await ecommerce_service.aclose() # Close pooled upstream connections
+    if message_log is not None:
+        await message_log.stop() # Drain buffered messages: every acknowledged turn reaches the database
+    await dispose_async_engine() # Close pooled database connections
+    await asyncio.to_thread(profiler.stop)
+    if tracer is not None:
+        await asyncio.to_thread(tracer.exporter.stop) # Export the traces still queued
     # Clean up resources, e.g., close Redis connection pool
     # if redis_client and redis_client.is_connected():
     #     await redis_client.close()
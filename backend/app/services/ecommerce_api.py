@@ -1,14 +1,30 @@
 # backend/app/services/ecommerce_api.py
-# Mocked client for interacting with an external e-commerce platform's API.
+# Clients for the external e-commerce platform's API: MockEcommerceAPI (in-memory data)
+# and EcommerceAPI (HTTP, used when ECOMMERCE_API_BASE_URL is set). Both expose the same
+# coroutines and report failures as {"error": ...} dicts rather than raising.
 import asyncio # For simulating async behavior
+import logging
 import random # Ensure random is imported at the top level
+import uuid
+from typing import Any, Dict, Optional
+from urllib.parse import quote
+
+import httpx
+
+from ..config import settings
+from ..core.metrics import upstream_call
+from ..utils.circuit_breaker import CircuitBreaker, CircuitOpenError
+from .product_index import ProductIndex
+
+logger = logging.getLogger(__name__)
 
 class MockEcommerceAPI:
-    def __init__(self, api_key: str = "test_api_key_from_settings_or_default"):
+    def __init__(self, api_key: str = "test_api_key_from_settings_or_default", simulate_latency: bool = True):
         # In a real scenario, you might get the api_key from settings
         # from ..config import settings
         # self.api_key = api_key or settings.ECOMMERCE_API_KEY
         self.api_key = api_key
+        self.simulate_latency = simulate_latency # The stub server turns this off and injects its own
         
         self._mock_orders = {
             "12345": {"id": "12345", "status": "Shipped", "estimated_delivery": "2025-06-10", "items": ["SuperWidget", "MegaDongle"], "shipping_address": "123 Main St, Anytown, USA"},
@@ -23,25 +39,37 @@ class MockEcommerceAPI:
             "HyperFlux Capacitor": {"id": "HFC004", "name": "HyperFlux Capacitor", "price": 1210.00, "in_stock": True, "description": "Powers time travel (theoretically).", "category": "Advanced Tech"},
             "Generic Product": {"id": "GP005", "name": "Generic Product", "price": 10.00, "in_stock": True, "description": "A standard product.", "category": "General"},
         }
+        # Built once; lookups touch only the products sharing the query's rarest trigrams
+        self._product_index = ProductIndex.from_catalog(self._mock_products)
+
+    async def _latency(self, seconds: float) -> None:
+        if self.simulate_latency:
+            await asyncio.sleep(seconds) # Simulate network latency
+
+    async def aclose(self) -> None:
+        pass # Nothing to release; same interface as EcommerceAPI
 
+    @upstream_call("mock")
     async def get_order_details(self, order_id: str) -> dict:
-        print(f"MockEcommerceAPI: Fetching order details for '{order_id}' (API Key: {self.api_key})")
-        await asyncio.sleep(0.15) # Simulate network latency
+        logger.debug("MockEcommerceAPI: Fetching order details for '%s'", order_id)
+        await self._latency(0.15)
         if order_id in self._mock_orders:
             return self._mock_orders[order_id]
         return {"error": "Order not found", "order_id": order_id}
 
+    @upstream_call("mock")
     async def get_product_info(self, product_name_query: str) -> dict:
-        print(f"MockEcommerceAPI: Fetching product info for query '{product_name_query}'")
-        await asyncio.sleep(0.1)
-        for name, info in self._mock_products.items():
-            if product_name_query.lower() in name.lower():
-                return info
+        logger.debug("MockEcommerceAPI: Fetching product info for query '%s'", product_name_query)
+        await self._latency(0.1)
+        match = self._product_index.best(product_name_query) # Exact, then substring, then typo-tolerant
+        if match:
+            return self._mock_products[match.key]
         return {"error": "Product not found", "query": product_name_query}
 
+    @upstream_call("mock")
     async def request_return(self, order_id: str, item_name_or_sku: str, reason: str) -> dict:
-        print(f"MockEcommerceAPI: Requesting return for item '{item_name_or_sku}' from order '{order_id}' due to '{reason}'")
-        await asyncio.sleep(0.2)
+        logger.debug("MockEcommerceAPI: Requesting return for item '%s' from order '%s' due to '%s'", item_name_or_sku, order_id, reason)
+        await self._latency(0.2)
         
         order = self._mock_orders.get(order_id)
         if not order or "error" in order:
@@ -69,9 +97,10 @@ class MockEcommerceAPI:
             "message": "Please check your email for a return shipping label and further instructions."
         }
 
+    @upstream_call("mock")
     async def check_shipping_info(self, order_id: str) -> dict:
-        print(f"MockEcommerceAPI: Checking shipping info for order '{order_id}'")
-        await asyncio.sleep(0.1)
+        logger.debug("MockEcommerceAPI: Checking shipping info for order '%s'", order_id)
+        await self._latency(0.1)
         order_details = self._mock_orders.get(order_id)
         if order_details and "error" not in order_details:
             if order_details["status"] == "Shipped":
@@ -82,6 +111,174 @@ class MockEcommerceAPI:
                 return {"order_id": order_id, "status": order_details["status"], "message": "Shipping information will be available once the order is shipped."}
         return {"error": "Order not found or shipping info unavailable.", "order_id": order_id}
 
+
+class UpstreamUnavailable(Exception):
+    """The upstream call failed after retries, timed out, or its circuit is open."""
+
+
+class _RetryableStatus(Exception):
+    def __init__(self, status_code: int):
+        super().__init__(f"upstream answered {status_code}")
+        self.status_code = status_code
+
+
+RETRYABLE_STATUSES = {502, 503, 504}
+
+
+class EcommerceAPI:
+    """
+    HTTP client for the e-commerce platform, with the same coroutines as MockEcommerceAPI.
+
+    One pooled httpx.AsyncClient is shared by every chat turn (keep-alive connections are
+    reused instead of a TCP/TLS handshake per lookup). Each attempt has its own timeout and
+    each call an overall deadline; connection errors, timeouts and 502/503/504 are retried
+    with jittered exponential backoff; and a circuit breaker fails calls fast while the
+    upstream keeps failing, so a sick upstream costs a chat turn milliseconds, not seconds.
+    """
+
+    UNAVAILABLE_MESSAGE = "The store service is temporarily unavailable. Please try again in a moment."
+
+    def __init__(
+        self,
+        base_url: str,
+        api_key: Optional[str] = None,
+        timeout: float = settings.ECOMMERCE_API_TIMEOUT_SECONDS,
+        connect_timeout: float = settings.ECOMMERCE_API_CONNECT_TIMEOUT_SECONDS,
+        deadline: float = settings.ECOMMERCE_API_DEADLINE_SECONDS,
+        max_retries: int = settings.ECOMMERCE_API_MAX_RETRIES,
+        retry_backoff_ms: float = settings.ECOMMERCE_API_RETRY_BACKOFF_MS,
+        max_connections: int = settings.ECOMMERCE_API_MAX_CONNECTIONS,
+        max_keepalive: int = settings.ECOMMERCE_API_MAX_KEEPALIVE,
+        breaker: Optional[CircuitBreaker] = None,
+        transport: Optional[httpx.AsyncBaseTransport] = None, # Tests pass httpx.ASGITransport(stub app)
+    ):
+        headers = {"Accept": "application/json"}
+        if api_key:
+            headers["Authorization"] = f"Bearer {api_key}"
+        self.client = httpx.AsyncClient(
+            base_url=base_url,
+            headers=headers,
+            timeout=httpx.Timeout(timeout, connect=connect_timeout),
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive),
+            transport=transport,
+        )
+        self.deadline = deadline
+        self.max_retries = max(0, max_retries)
+        self.retry_backoff = retry_backoff_ms / 1000.0
+        self.breaker = breaker or CircuitBreaker(
+            settings.ECOMMERCE_API_BREAKER_FAILURES, settings.ECOMMERCE_API_BREAKER_RESET_SECONDS, name="ecommerce_api"
+        )
+
+        self.calls = 0
+        self.retries = 0
+        self.failures = 0
+
+    async def aclose(self) -> None:
+        await self.client.aclose()
+
+    async def _attempts(self, method: str, path: str, **kwargs) -> httpx.Response:
+        last_error: Exception = RuntimeError("no attempt made")
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                self.retries += 1
+                # Full jitter: concurrent turns that failed together don't retry together
+                await asyncio.sleep(random.uniform(0, self.retry_backoff * 2 ** (attempt - 1)))
+            try:
+                response = await self.client.request(method, path, **kwargs)
+            except httpx.TransportError as e: # Connect/read timeouts, refused or reset connections
+                last_error = e
+                continue
+            if response.status_code not in RETRYABLE_STATUSES:
+                return response
+            last_error = _RetryableStatus(response.status_code)
+        raise last_error
+
+    async def _request(self, method: str, path: str, **kwargs) -> httpx.Response:
+        self.calls += 1
+        try:
+            self.breaker.before_call()
+        except CircuitOpenError as e:
+            self.failures += 1
+            raise UpstreamUnavailable(str(e)) from e
+        try:
+            response = await asyncio.wait_for(self._attempts(method, path, **kwargs), self.deadline)
+        except (httpx.HTTPError, _RetryableStatus, asyncio.TimeoutError) as e:
+            self.failures += 1
+            self.breaker.record_failure()
+            raise UpstreamUnavailable(f"{method} {path} failed: {e!r}") from e
+        except BaseException: # Cancelled (speculative lookup no longer needed, client gone): no verdict on the upstream
+            self.breaker.record_abandoned()
+            raise
+        if response.status_code >= 500:
+            self.failures += 1
+            self.breaker.record_failure()
+            raise UpstreamUnavailable(f"{method} {path} answered {response.status_code}")
+        self.breaker.record_success() # 4xx means the upstream is healthy, the request wasn't
+        return response
+
+    async def _call(self, method: str, path: str, not_found: Dict[str, Any], **kwargs) -> dict:
+        """Performs the request and maps the outcome onto the {"error": ...} convention."""
+        try:
+            response = await self._request(method, path, **kwargs)
+        except UpstreamUnavailable as e:
+            logger.warning("EcommerceAPI: %s", e)
+            return {**not_found, "error": self.UNAVAILABLE_MESSAGE, "retryable": True} # Never cached
+        try:
+            body = response.json()
+        except ValueError:
+            body = {}
+        if response.is_error: # 404 and other 4xx; 5xx were already turned into UpstreamUnavailable
+            fallback = not_found["error"] if response.status_code == 404 else f"Request failed ({response.status_code})."
+            return {**not_found, "error": body.get("error") or fallback}
+        return body
+
+    @upstream_call("http")
+    async def get_order_details(self, order_id: str) -> dict:
+        return await self._call("GET", f"/orders/{quote(order_id, safe='')}",
+                                {"error": "Order not found", "order_id": order_id})
+
+    @upstream_call("http")
+    async def get_product_info(self, product_name_query: str) -> dict:
+        return await self._call("GET", "/products/search", {"error": "Product not found", "query": product_name_query},
+                                params={"q": product_name_query})
+
+    @upstream_call("http")
+    async def request_return(self, order_id: str, item_name_or_sku: str, reason: str) -> dict:
+        # The idempotency key makes retrying this POST safe: the upstream creates one return
+        return await self._call(
+            "POST", f"/orders/{quote(order_id, safe='')}/returns",
+            {"error": "Order not found for return request.", "order_id": order_id},
+            json={"item": item_name_or_sku, "reason": reason},
+            headers={"Idempotency-Key": str(uuid.uuid4())},
+        )
+
+    @upstream_call("http")
+    async def check_shipping_info(self, order_id: str) -> dict:
+        return await self._call("GET", f"/orders/{quote(order_id, safe='')}/shipping",
+                                {"error": "Order not found or shipping info unavailable.", "order_id": order_id})
+
+    def stats(self) -> Dict[str, Any]:
+        return {"calls": self.calls, "retries": self.retries, "failures": self.failures, "breaker": self.breaker.stats()}
+
+
+def build_ecommerce_service():
+    """
+    EcommerceAPI when ECOMMERCE_API_BASE_URL is configured, otherwise the in-memory mock,
+    behind the read-through cache unless ECOMMERCE_CACHE_ENABLED is off.
+    """
+    if settings.ECOMMERCE_API_BASE_URL:
+        service = EcommerceAPI(settings.ECOMMERCE_API_BASE_URL, settings.ECOMMERCE_API_KEY)
+    else:
+        service = MockEcommerceAPI(settings.ECOMMERCE_API_KEY or "test_api_key_from_settings_or_default")
+    if not settings.ECOMMERCE_CACHE_ENABLED:
+        return service
+
+    from ..db.session import get_async_redis_client
+    from .ecommerce_cache import CachedEcommerceService
+    redis_client = get_async_redis_client() if settings.ECOMMERCE_CACHE_REDIS_ENABLED else None
+    return CachedEcommerceService(service, redis_client=redis_client)
+
+
 # For direct testing of this module (optional)
 if __name__ == '__main__':
     # import random # No longer needed here as it's at the top
@@ -96,6 +293,7 @@ if __name__ == '__main__':
         print("\n--- Testing Product Info ---")
         print(await mock_api.get_product_info("SuperWidget"))
         print(await mock_api.get_product_info("Flux Capacitor")) # Partial match
+        print(await mock_api.get_product_info("megadongel")) # Typo
         print(await mock_api.get_product_info("NonExistent"))
         
         print("\n--- Testing Return Request ---")
@@ -0,0 +1,178 @@
+# backend/app/services/ecommerce_cache.py
+# Read-through cache in front of the e-commerce service.
+#
+# "where is order 12345" followed by "what's the tracking for 12345" used to pay the
+# upstream latency twice. CachedEcommerceService wraps MockEcommerceAPI / EcommerceAPI
+# with the same coroutines and
+#   - a per-endpoint TTL (orders change faster than product descriptions),
+#   - negative caching: "not found" answers are kept for a shorter TTL,
+#   - request coalescing: concurrent identical lookups share one in-flight upstream call,
+#   - an in-process LRU tier plus an optional shared Redis tier,
+#   - invalidation of an order's entries after request_return changes it.
+# With Redis, an invalidation reaches the other workers only through Redis: their local
+# copies are kept for local_ttl (a few seconds) at most, not the endpoint's TTL.
+# Upstream outages ({"retryable": True} results) are never cached.
+
+import asyncio
+import json
+import logging
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from ..config import settings
+from ..utils.cache import LRUTTLCache
+
+logger = logging.getLogger(__name__)
+
+
+class CachedEcommerceService:
+    ORDER, SHIPPING, PRODUCT = "order", "shipping", "product"
+
+    def __init__(
+        self,
+        service,
+        ttls: Optional[Dict[str, float]] = None,
+        negative_ttl: float = settings.ECOMMERCE_CACHE_NEGATIVE_TTL_SECONDS,
+        maxsize: int = settings.ECOMMERCE_CACHE_MAX_SIZE,
+        redis_client=None, # A redis.asyncio client; None keeps the cache in-process only
+        local_ttl: float = settings.ECOMMERCE_CACHE_LOCAL_TTL_SECONDS, # With Redis: how long a local copy is trusted
+    ):
+        self.service = service
+        self.ttls = ttls or {
+            self.ORDER: settings.ECOMMERCE_CACHE_ORDER_TTL_SECONDS,
+            self.SHIPPING: settings.ECOMMERCE_CACHE_SHIPPING_TTL_SECONDS,
+            self.PRODUCT: settings.ECOMMERCE_CACHE_PRODUCT_TTL_SECONDS,
+        }
+        self.negative_ttl = negative_ttl
+        self.local = LRUTTLCache(maxsize=maxsize)
+        self.redis = redis_client
+        self.local_ttl = local_ttl if redis_client is not None else None
+        self._in_flight: Dict[str, asyncio.Task] = {}
+        # Bumped on every invalidation; a fetch that started before one isn't stored, so a
+        # lookup racing request_return can't put the pre-return order back in the cache
+        self._epoch = 0
+
+        self.upstream_calls = 0
+        self.coalesced = 0
+        self.redis_hits = 0
+        self.redis_errors = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def _key(endpoint: str, argument: str) -> str:
+        argument = " ".join(argument.lower().split()) if endpoint == "product" else argument.strip()
+        return f"ecom:{endpoint}:{argument}"
+
+    def _ttl_for(self, endpoint: str, result: dict) -> Optional[float]:
+        """None means: don't cache this result."""
+        if result.get("retryable"):
+            return None
+        return self.negative_ttl if "error" in result else self.ttls[endpoint]
+
+    async def _redis_get(self, key: str) -> Optional[dict]:
+        if self.redis is None:
+            return None
+        try:
+            raw = await self.redis.get(key)
+        except Exception as e: # Redis is an optimisation: never fail a lookup because of it
+            self.redis_errors += 1
+            logger.warning("CachedEcommerceService: Redis lookup failed: %s", e)
+            return None
+        if raw is None:
+            return None
+        self.redis_hits += 1
+        return json.loads(raw)
+
+    async def _redis_set(self, key: str, value: dict, ttl: float) -> None:
+        if self.redis is None:
+            return
+        try:
+            await self.redis.set(key, json.dumps(value), px=max(1, int(ttl * 1000)))
+        except Exception as e:
+            self.redis_errors += 1
+            logger.warning("CachedEcommerceService: Redis write failed: %s", e)
+
+    async def _load(self, endpoint: str, key: str, fetch: Callable[[], Awaitable[dict]]) -> dict:
+        epoch = self._epoch
+        result = await self._redis_get(key)
+        ttl = self.ttls[endpoint]
+        if result is None:
+            self.upstream_calls += 1
+            result = await fetch()
+            ttl = self._ttl_for(endpoint, result)
+            if ttl is not None and epoch == self._epoch:
+                await self._redis_set(key, result, ttl)
+        elif "error" in result:
+            ttl = self.negative_ttl
+        if ttl is not None and epoch == self._epoch:
+            # Capped with Redis: remaining Redis TTL isn't tracked, and another worker's invalidation doesn't reach us
+            self.local.set(key, result, ttl=min(ttl, self.local_ttl) if self.local_ttl is not None else ttl)
+        return result
+
+    def _load_done(self, key: str, task: asyncio.Task) -> None:
+        if self._in_flight.get(key) is task: # Not if an invalidation replaced it with a newer fetch
+            del self._in_flight[key]
+        if not task.cancelled():
+            task.exception() # Retrieved here so a failure whose callers all went away isn't logged as unhandled
+
+    async def _read_through(self, endpoint: str, argument: str, fetch: Callable[[], Awaitable[dict]]) -> dict:
+        key = self._key(endpoint, argument)
+        cached = self.local.get(key)
+        if cached is not None:
+            return cached
+
+        task = self._in_flight.get(key)
+        if task is None:
+            # The fetch runs as its own task: a caller that disconnects mid-lookup doesn't
+            # cancel it for the others waiting on the same key
+            task = asyncio.ensure_future(self._load(endpoint, key, fetch))
+            self._in_flight[key] = task
+            task.add_done_callback(lambda done: self._load_done(key, done))
+        else: # Someone is already fetching this; share their answer
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    async def get_order_details(self, order_id: str) -> dict:
+        return await self._read_through(self.ORDER, order_id, lambda: self.service.get_order_details(order_id))
+
+    async def check_shipping_info(self, order_id: str) -> dict:
+        return await self._read_through(self.SHIPPING, order_id, lambda: self.service.check_shipping_info(order_id))
+
+    async def get_product_info(self, product_name_query: str) -> dict:
+        return await self._read_through(self.PRODUCT, product_name_query, lambda: self.service.get_product_info(product_name_query))
+
+    async def request_return(self, order_id: str, item_name_or_sku: str, reason: str) -> dict:
+        result = await self.service.request_return(order_id, item_name_or_sku, reason)
+        if "error" not in result:
+            await self.invalidate_order(order_id) # Its status/items just changed upstream
+        return result
+
+    async def invalidate_order(self, order_id: str) -> None:
+        keys = [self._key(self.ORDER, order_id), self._key(self.SHIPPING, order_id)]
+        self._epoch += 1
+        self.invalidations += 1
+        for key in keys:
+            self.local.delete(key)
+            # A fetch that started before the change may still be running: later lookups mustn't join it
+            self._in_flight.pop(key, None)
+        if self.redis is not None:
+            try:
+                await self.redis.delete(*keys)
+            except Exception as e:
+                self.redis_errors += 1
+                logger.warning("CachedEcommerceService: Redis invalidation failed: %s", e)
+
+    async def aclose(self) -> None:
+        await self.service.aclose()
+
+    def stats(self) -> Dict[str, Any]:
+        stats = self.local.stats()
+        stats.update({
+            "upstream_calls": self.upstream_calls,
+            "coalesced": self.coalesced,
+            "invalidations": self.invalidations,
+            "redis_enabled": self.redis is not None,
+            "redis_hits": self.redis_hits,
+            "redis_errors": self.redis_errors,
+        })
+        inner_stats = getattr(self.service, "stats", None)
+        return {"cache": stats, "upstream": inner_stats() if inner_stats else None}
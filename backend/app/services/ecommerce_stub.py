@@ -0,0 +1,77 @@
+# backend/app/services/ecommerce_stub.py
+# Local stand-in for the e-commerce platform's HTTP API, serving MockEcommerceAPI's data.
+#
+# Used by the tests (through httpx.ASGITransport, no sockets) and for local runs:
+#   uvicorn app.services.ecommerce_stub:app --port 8081
+#   ECOMMERCE_API_BASE_URL=http://localhost:8081 uvicorn app.main:app
+#
+# Faults can be injected to exercise timeouts, retries and the circuit breaker, either
+# per app instance (create_stub_app(latency=..., fail_first=...)) or at runtime through
+# PUT /_faults {"latency": 0.5, "fail_first": 3, "fail_status": 503}.
+
+import asyncio
+from typing import Any, Dict, Optional
+
+from fastapi import Body, FastAPI, Header
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+from .ecommerce_api import MockEcommerceAPI
+
+
+class ReturnRequest(BaseModel):
+    item: str
+    reason: str = ""
+
+
+def create_stub_app(latency: float = 0.0, fail_first: int = 0, fail_status: int = 503) -> FastAPI:
+    """
+    latency: seconds added to every response.
+    fail_first: the next N requests answer `fail_status` instead of their data.
+    """
+    stub = FastAPI(title="E-commerce API stub")
+    backend = MockEcommerceAPI(simulate_latency=False)
+    faults: Dict[str, Any] = {"latency": latency, "fail_first": fail_first, "fail_status": fail_status}
+    stub.state.faults = faults
+    stub.state.requests = 0
+    stub.state.idempotency_keys = {} # Idempotency-Key -> return response, so retried POSTs create one return
+
+    async def respond(result: dict) -> JSONResponse:
+        stub.state.requests += 1
+        if faults["latency"]:
+            await asyncio.sleep(faults["latency"])
+        if faults["fail_first"] > 0:
+            faults["fail_first"] -= 1
+            return JSONResponse(status_code=faults["fail_status"], content={"error": "Injected failure"})
+        return JSONResponse(status_code=404 if "error" in result else 200, content=result)
+
+    @stub.get("/orders/{order_id}")
+    async def order_details(order_id: str):
+        return await respond(await backend.get_order_details(order_id))
+
+    @stub.get("/orders/{order_id}/shipping")
+    async def shipping_info(order_id: str):
+        return await respond(await backend.check_shipping_info(order_id))
+
+    @stub.get("/products/search")
+    async def product_search(q: str):
+        return await respond(await backend.get_product_info(q))
+
+    @stub.post("/orders/{order_id}/returns")
+    async def create_return(order_id: str, payload: ReturnRequest, idempotency_key: Optional[str] = Header(None)):
+        if idempotency_key and idempotency_key in stub.state.idempotency_keys:
+            return await respond(stub.state.idempotency_keys[idempotency_key])
+        result = await backend.request_return(order_id, payload.item, payload.reason)
+        if idempotency_key:
+            stub.state.idempotency_keys[idempotency_key] = result
+        return await respond(result)
+
+    @stub.put("/_faults")
+    async def set_faults(update: Dict[str, Any] = Body(...)):
+        faults.update({key: value for key, value in update.items() if key in faults})
+        return faults
+
+    return stub
+
+
+app = create_stub_app()
@@ -0,0 +1,159 @@
+# backend/app/services/product_index.py
+# In-memory product-name index used for product lookups from chat messages.
+#
+# Built once from the catalog. Every name is normalized (lowercased, punctuation and
+# spaces dropped, so "Super Widget" == "SuperWidget") and split into character trigrams,
+# and each trigram maps to the products containing it (an inverted index). A query then
+# only looks at products sharing its rarest trigrams instead of scanning the catalog:
+#   1. exact normalized name (or alias such as a SKU)   score 1.0
+#   2. query contained in the name                      score 0.5-1.0, shorter names first
+#   3. optional typo tolerance: trigram Dice similarity  score < 0.5, above min_similarity
+# Results are ranked candidates; callers usually take the first one.
+
+import heapq
+import re
+from array import array
+from collections import Counter
+from itertools import chain
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence
+
+_NON_ALNUM_RE = re.compile(r"[\W_]+")
+
+
+def normalize_product_name(name: str) -> str:
+    return _NON_ALNUM_RE.sub("", name.lower())
+
+
+def trigrams(normalized: str) -> List[str]:
+    return [normalized[i:i + 3] for i in range(len(normalized) - 2)]
+
+
+class ProductMatch(NamedTuple):
+    key: str # Catalog key passed to add()
+    name: str
+    score: float
+
+
+class ProductIndex:
+    def __init__(
+        self,
+        fuzzy: bool = True,
+        min_similarity: float = 0.5,
+        max_candidates: int = 500,
+        fuzzy_budget: int = 5000,
+    ):
+        """
+        fuzzy: also return near matches for misspelled queries ("megadongel").
+        min_similarity: trigram Dice similarity a fuzzy match needs (0-1).
+        max_candidates: upper bound on products substring-checked per query, which keeps
+                        very common queries ("pro") from degrading into a catalog scan;
+                        the shortest names are the ones checked.
+        fuzzy_budget: postings read per fuzzy lookup (rarest trigrams first); the knob
+                      between typo recall and latency on very large catalogs.
+        """
+        self.fuzzy = fuzzy
+        self.min_similarity = min_similarity
+        self.max_candidates = max_candidates
+        self.fuzzy_budget = fuzzy_budget
+        self._keys: List[str] = []
+        self._names: List[str] = []
+        self._normalized: List[str] = []
+        self._exact: Dict[str, List[int]] = {}
+        self._postings: Dict[str, Sequence[int]] = {} # Trigram -> sorted doc ids
+
+    @classmethod
+    def from_catalog(cls, products: Dict[str, dict], **kwargs) -> "ProductIndex":
+        """Index a {key: {"name": ..., "id": ...}} catalog; the product id is also an exact alias."""
+        index = cls(**kwargs)
+        for key, info in products.items():
+            index.add(key, info.get("name", key), aliases=[info["id"]] if info.get("id") else ())
+        index.freeze()
+        return index
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def add(self, key: str, name: str, aliases: Iterable[str] = ()) -> None:
+        doc_id = len(self._keys)
+        normalized = normalize_product_name(name)
+        self._keys.append(key)
+        self._names.append(name)
+        self._normalized.append(normalized)
+        for exact in [normalized, *(normalize_product_name(alias) for alias in aliases)]:
+            self._exact.setdefault(exact, []).append(doc_id)
+        for gram in set(trigrams(normalized)):
+            self._postings.setdefault(gram, []).append(doc_id)
+
+    def freeze(self) -> None:
+        """
+        Compacts posting lists into 4-byte arrays; call once after bulk loading. A 1M-name
+        catalog has ~10M postings, so this is the difference between ~80MB and ~40MB.
+        add() keeps working afterwards (arrays support append too).
+        """
+        for gram, postings in self._postings.items():
+            if not isinstance(postings, array):
+                self._postings[gram] = array("I", postings)
+
+    def _match(self, doc_id: int, score: float) -> ProductMatch:
+        return ProductMatch(self._keys[doc_id], self._names[doc_id], round(score, 4))
+
+    def search(self, query: str, limit: int = 5) -> List[ProductMatch]:
+        normalized = normalize_product_name(query)
+        if not normalized:
+            return []
+
+        scores: Dict[int, float] = {doc_id: 1.0 for doc_id in self._exact.get(normalized, ())}
+        grams = list(set(trigrams(normalized)))
+        if grams and len(scores) < limit: # Exact hits already outrank everything else
+            postings = sorted((self._postings.get(gram, ()) for gram in grams), key=len)
+
+            # Containment: every trigram of the query must be in the name. Intersect the
+            # rarest lists until few candidates are left, then confirm with a substring test -
+            # on the shortest names if there are still too many, as those score highest.
+            candidates = set(postings[0])
+            for doc_postings in postings[1:]:
+                if len(candidates) <= self.max_candidates:
+                    break
+                candidates.intersection_update(doc_postings)
+            if len(candidates) > self.max_candidates:
+                candidates = heapq.nsmallest(self.max_candidates, candidates,
+                                             key=lambda doc_id: (len(self._normalized[doc_id]), doc_id))
+            for doc_id in candidates:
+                name = self._normalized[doc_id]
+                if doc_id not in scores and normalized in name:
+                    scores[doc_id] = 0.5 + 0.5 * len(normalized) / len(name)
+
+            if self.fuzzy and len(scores) < limit:
+                self._add_fuzzy_matches(grams, postings, scores, limit)
+
+        best = heapq.nlargest(limit, scores.items(), key=lambda item: (item[1], -item[0]))
+        seen, results = set(), []
+        for doc_id, score in best: # A product indexed under several names is listed once
+            if self._keys[doc_id] not in seen:
+                seen.add(self._keys[doc_id])
+                results.append(self._match(doc_id, score))
+        return results
+
+    def _add_fuzzy_matches(self, grams: List[str], postings: List[Sequence[int]], scores: Dict[int, float], limit: int) -> None:
+        # Count shared trigrams over the rarest lists that fit in the budget (the rare
+        # trigrams are the selective ones), then score the best-sharing products exactly.
+        selected, total = [], 0
+        for doc_postings in postings:
+            if selected and total + len(doc_postings) > self.fuzzy_budget:
+                break
+            selected.append(doc_postings)
+            total += len(doc_postings)
+        shared = Counter(chain.from_iterable(selected))
+
+        query_grams = set(grams)
+        for doc_id, _ in shared.most_common(max(4 * limit, 20)):
+            if doc_id in scores:
+                continue
+            name_grams = set(trigrams(self._normalized[doc_id]))
+            dice = 2 * len(query_grams & name_grams) / (len(query_grams) + len(name_grams))
+            if dice >= self.min_similarity:
+                scores[doc_id] = 0.5 * dice # Always ranked below exact and containment matches
+
+    def best(self, query: str) -> Optional[ProductMatch]:
+        matches = self.search(query, limit=1)
+        return matches[0] if matches else None
@@ -0,0 +1,6 @@
+# backend/app/tests/conftest.py
+# Settings the app reads at import time, set before any test module imports it.
+import os
+
+os.environ.setdefault("ADMIN_API_ENABLED", "true") # Mounts /admin and /escalations (api/v1/__init__.py)
+os.environ.setdefault("ADMIN_API_TOKEN", "test-admin-token")
@@ -0,0 +1,1300 @@
+# backend/app/tests/test_api.py
+import asyncio
+import gc
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+import httpx
+import pytest
+from alembic import command
+from alembic.config import Config
+from fastapi.testclient import TestClient
+from prometheus_client import CollectorRegistry, Histogram
+from sqlalchemy import create_engine, event, inspect
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from app.api.v1 import batch, chatbot
+from app.api.v1.chatbot import ChatPayload
+from app.config import settings
+from app.core import metrics, nlp
+from app.core.background import TaskBatcher, build_task_batchers, celery_sender
+from app.core.connections import TRY_AGAIN_LATER, ConnectionManager
+from app.core.conversation_state import ConversationState, ConversationStateStore
+from app.core.escalations import EscalationNotifier, EscalationQueue
+from app.core.log import DroppingQueueHandler
+from app.core.lookups import LookupPlanner, LookupStats
+from app.db import models
+from app.db.message_log import MessageWriteBehind
+from app.db.session import get_async_session_factory
+from app.db.turns import record_turn
+from app.main import app
+from app.services.ecommerce_api import EcommerceAPI, MockEcommerceAPI
+from app.services.ecommerce_cache import CachedEcommerceService
+from app.services.ecommerce_stub import create_stub_app
+from app.services.product_index import ProductIndex
+from app.utils.circuit_breaker import CircuitBreaker
+
+
+class KeywordClassifier:
+    """Deterministic stand-in for IntentClassifier so API tests don't need model weights."""
+    RULES = [
+        ("human", "human_agent"),
+        ("return", "request_return"),
+        ("order", "track_order"),
+        ("price", "price_query"),
+        ("hi", "greet"),
+    ]
+
+    def predict(self, text):
+        lowered = text.lower()
+        intent = next((intent for keyword, intent in self.RULES if keyword in lowered), "general_query")
+        return intent, 0.95, nlp.IntentClassifier.extract_entities(intent, text)
+
+    def predict_batch(self, texts):
+        return [self.predict(text) for text in texts]
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path / 'chat.db'}")
+    models.Base.metadata.create_all(bind=engine)
+    engine.dispose()
+    # A real pool on every SQLAlchemy version (2.0 defaults file-backed aiosqlite to NullPool), so
+    # tests can check that connections go back to it
+    async_engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'chat.db'}", poolclass=AsyncAdaptedQueuePool)
+    TestingSession = async_sessionmaker(async_engine, expire_on_commit=False, autoflush=False)
+
+    monkeypatch.setattr(settings, "NLP_LOAD_ON_STARTUP", False)
+    app.dependency_overrides[get_async_session_factory] = lambda: TestingSession
+    if chatbot.conversation_states is not None: # Conversation ids start over with every test database
+        chatbot.conversation_states.clear()
+    nlp.model_manager.use(KeywordClassifier())
+    try:
+        with TestClient(app, headers={"Authorization": f"Bearer {settings.ADMIN_API_TOKEN}"}) as test_client:
+            test_client.db_engine = async_engine
+            yield test_client
+    finally:
+        app.dependency_overrides.clear()
+        nlp.model_manager.state = nlp.ModelManager.NOT_STARTED
+        nlp.model_manager.classifier = None
+        asyncio.run(async_engine.dispose())
+
+
+def test_health_reports_not_ready_until_model_is_loaded(client):
+    assert client.get("/health").status_code == 200
+
+    nlp.model_manager.state = nlp.ModelManager.LOADING
+    response = client.get("/health")
+    assert response.status_code == 503
+    assert response.json()["nlp"]["state"] == "loading"
+    assert client.get("/health/live").status_code == 200
+
+
+def test_chat_returns_503_while_model_is_loading(client):
+    nlp.model_manager.state = nlp.ModelManager.LOADING
+    response = client.post("/api/v1/chat/chat", json={"text": "where is my order 12345"})
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "1"
+
+
+def test_http_chat_tracks_order(client):
+    response = client.post("/api/v1/chat/chat", json={"text": "where is my order 12345", "user_id": "u1"})
+    assert response.status_code == 200
+    body = response.json()
+    assert body["intent"] == "track_order"
+    assert body["entities"] == {"order_id": "12345"}
+    assert "Shipped" in body["response"]
+    assert body["user_message_id"] and body["bot_message_id"]
+    assert body["requires_human_escalation"] is False
+
+
+def test_http_chat_escalates_to_human(client):
+    body = client.post("/api/v1/chat/chat", json={"text": "let me talk to a human"}).json()
+    assert body["requires_human_escalation"] is True
+    assert body["escalation_ticket_id"] is not None
+
+
+def test_metrics_endpoint_reports_stages_turns_and_gauges(client):
+    def sample(name, **labels):
+        return metrics.registry.get_sample_value(name, labels) or 0.0
+
+    before = {
+        "track_order": sample("chatbot_turns_total", channel="http", intent="track_order"),
+        "escalations": sample("chatbot_escalations_total", channel="http"),
+        "entities": sample("chatbot_stage_seconds_count", stage="entity_extraction"),
+        "commits": sample("chatbot_db_commit_seconds_count", operation="turn"),
+        "sends": sample("chatbot_stage_seconds_count", stage="ws_send"),
+        "fallback": sample("chatbot_fallback_classifications_total"),
+    }
+    client.post("/api/v1/chat/chat", json={"text": "where is my order 12345"})
+    client.post("/api/v1/chat/chat", json={"text": "a human please"})
+    with client.websocket_connect("/api/v1/chat/ws?user_id=m1") as ws:
+        ws.receive_json()
+        assert sample("chatbot_websocket_connections") == 1
+        nlp.model_manager.use(nlp.FallbackClassifier()) # Model failed to load: everything escalates
+        ws.send_json({"text": "hello"})
+        assert ws.receive_json()["requires_human_escalation"] is True
+
+    response = client.get("/metrics")
+    assert response.status_code == 200 and response.headers["content-type"].startswith("text/plain")
+    assert 'chatbot_turns_total{channel="http",intent="track_order"}' in response.text
+    assert "chatbot_inference_queue_depth 0.0" in response.text
+    assert sample("chatbot_turns_total", channel="http", intent="track_order") == before["track_order"] + 1
+    assert sample("chatbot_escalations_total", channel="http") == before["escalations"] + 1
+    assert sample("chatbot_stage_seconds_count", stage="entity_extraction") >= before["entities"] + 2
+    assert sample("chatbot_db_commit_seconds_count", operation="turn") == before["commits"] + 3
+    assert sample("chatbot_stage_seconds_count", stage="ws_send") >= before["sends"] + 2 # connection_ack, reply
+    assert sample("chatbot_fallback_classifications_total") == before["fallback"] + 1
+    assert sample("chatbot_websocket_connections") == 0
+
+
+def test_upstream_calls_are_timed_and_spans_stay_cheap():
+    def count(call):
+        return metrics.registry.get_sample_value("chatbot_upstream_call_seconds_count", {"backend": "mock", "call": call}) or 0.0
+
+    before = count("get_order_details")
+    asyncio.run(MockEcommerceAPI(simulate_latency=False).get_order_details("12345"))
+    assert count("get_order_details") == before + 1
+
+    series = Histogram("test_span_seconds", "Span overhead", registry=CollectorRegistry())
+    spans = 20000
+    started = time.perf_counter()
+    for _ in range(spans):
+        with metrics.Span(series):
+            pass
+    per_span_us = (time.perf_counter() - started) / spans * 1e6
+    assert per_span_us < 25 # A few microseconds; loose so a busy CI machine doesn't fail it
+
+
+def test_admin_routes_need_the_admin_token(client, monkeypatch):
+    assert client.get("/api/v1/admin/tracing/stats").status_code == 200
+    assert client.get("/api/v1/admin/tracing/stats", headers={"Authorization": ""}).status_code == 401
+    assert client.post("/api/v1/admin/profiler", json={"enabled": True},
+                       headers={"Authorization": "Bearer guessed"}).status_code == 401
+    assert client.post("/api/v1/admin/profiler", json={"enabled": True, "interval_ms": 1}).status_code == 422
+    assert not chatbot.profiler.running
+    monkeypatch.setattr(settings, "ADMIN_API_TOKEN", "") # No token configured: nobody gets in
+    assert client.get("/api/v1/admin/traces/slow", headers={"Authorization": "Bearer "}).status_code == 401
+
+
+class SlowKeywordClassifier(KeywordClassifier):
+    def predict(self, text):
+        time.sleep(0.05) # A slow forward pass, for the profiler to catch
+        return super().predict(text)
+
+
+def test_slow_turns_are_exported_with_their_spans_and_profile(client, monkeypatch, tmp_path):
+    export_file = tmp_path / "traces.jsonl"
+    monkeypatch.setattr(chatbot.tracer, "slow_turn_ms", 60000.0)
+    monkeypatch.setattr(chatbot.tracer.exporter, "file_path", str(export_file))
+    assert client.post("/api/v1/admin/profiler", json={"enabled": True, "interval_ms": 5}).json()["running"] is True
+    try:
+        kept, traced = chatbot.tracer.slow_turns, chatbot.tracer.turns
+        client.post("/api/v1/chat/chat", json={"text": "hi there"}) # Under the threshold: traced, then dropped
+        assert chatbot.tracer.turns == traced + 1 and chatbot.tracer.slow_turns == kept
+        monkeypatch.setattr(chatbot.tracer, "slow_turn_ms", 30.0)
+        nlp.model_manager.use(SlowKeywordClassifier())
+        assert client.post("/api/v1/chat/chat", json={"text": "where is my order 24680"}).status_code == 200 # Not cached by another test
+        assert chatbot.tracer.slow_turns == kept + 1
+        assert client.get("/api/v1/admin/profiler", params={"seconds": 5}).json()["stacks"]
+    finally:
+        assert client.post("/api/v1/admin/profiler", json={"enabled": False}).json()["running"] is False
+    chatbot.tracer.exporter.stop() # Writes what is queued
+
+    exported = [json.loads(line) for line in export_file.read_text().splitlines()]
+    spans = [span for request in exported for span in request["resourceSpans"][0]["scopeSpans"][0]["spans"]]
+    root = next(span for span in spans if span["name"] == "POST /api/v1/chat/chat")
+    attributes = {item["key"]: item["value"] for item in root["attributes"]}
+    assert attributes["intent"] == {"stringValue": "track_order"}
+    assert attributes["http.status_code"] == {"intValue": "200"}
+    children = {span["name"] for span in spans if span.get("parentSpanId") == root["spanId"]}
+    assert {"nlp.classify", "upstream.get_order_details", "db.commit.turn"} <= children
+    profile = {item["key"]: item["value"] for item in root["events"][0]["attributes"]}
+    assert "test_api.py:predict" in profile["profile.stacks"]["stringValue"]
+    assert client.get("/api/v1/admin/traces/slow").json()["resourceSpans"][0]["scopeSpans"][0]["spans"][0]["name"] == root["name"]
+
+
+def test_websocket_turns_are_traced_by_stage(client, monkeypatch):
+    monkeypatch.setattr(chatbot.tracer, "slow_turn_ms", 0.0) # Keep every turn
+    with client.websocket_connect("/api/v1/chat/ws?user_id=t1") as ws:
+        ws.receive_json()
+        ws.send_json({"text": "where is my order 12345"})
+        reply = ws.receive_json()
+    trace = chatbot.tracer.recent[-1]
+    assert trace.name == "ws.turn" and trace.error is None
+    assert trace.attributes["conversation_id"] == reply["conversation_id"]
+    assert {"ws.nlp", "ws.lookup", "ws.queued", "ws.persist", "nlp.classify", "db.commit.turn"} <= {span[0] for span in trace.spans}
+    assert client.get("/api/v1/admin/tracing/stats").json()["tracer"]["slow_turns"] >= 1
+
+
+def test_log_records_are_dropped_not_waited_for_when_the_queue_is_full():
+    handler = DroppingQueueHandler(queue.Queue(maxsize=2))
+    logger = logging.getLogger("app.tests.dropping")
+    logger.addHandler(handler)
+    logger.propagate = False
+    try:
+        for i in range(5):
+            logger.warning("record %d", i)
+    finally:
+        logger.removeHandler(handler)
+    assert handler.queue.qsize() == 2 and handler.dropped == 3
+    assert handler.queue.get_nowait().getMessage() == "record 0"
+
+
+class BlockingKeywordClassifier(KeywordClassifier):
+    """Holds every forward pass until `release` is set, so the inference queue stays occupied."""
+
+    def __init__(self):
+        self.entered = threading.Event()
+        self.release = threading.Event()
+
+    def predict(self, text):
+        self.entered.set()
+        self.release.wait(5)
+        return super().predict(text)
+
+
+def test_full_inference_queue_refuses_turns_with_retry_and_stores_nothing(client, monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, "NLP_INFERENCE_MAX_QUEUE", 1)
+    monkeypatch.setattr(settings, "NLP_BATCHING_ENABLED", False)
+    classifier = BlockingKeywordClassifier()
+    nlp.model_manager.use(classifier)
+    try:
+        with client.websocket_connect("/api/v1/chat/ws?user_id=q1") as busy, \
+                client.websocket_connect("/api/v1/chat/ws?user_id=q2") as refused_ws:
+            busy.receive_json()
+            refused_ws.receive_json()
+            busy.send_json({"text": "where is my order 12345"}) # Takes the only slot...
+            assert classifier.entered.wait(5)
+
+            response = client.post("/api/v1/chat/chat", json={"text": "refused over http", "user_id": "q3"})
+            assert response.status_code == 503 and response.headers["Retry-After"] == "1"
+            assert response.json()["detail"] == nlp.InferenceQueueFull.detail
+
+            refused_ws.send_json({"text": "refused over ws"})
+            frame = refused_ws.receive_json()
+            assert frame["type"] == "error" and frame["retry_after"] == 1
+            assert frame["error"] == nlp.InferenceQueueFull.detail and frame["text_received"] == "refused over ws"
+
+            classifier.release.set() # ...and still gets its answer once the model catches up
+            assert busy.receive_json()["intent"] == "track_order"
+    finally:
+        classifier.release.set()
+
+    engine = create_engine(f"sqlite:///{tmp_path / 'chat.db'}")
+    with sessionmaker(bind=engine)() as db:
+        contents = {m.content for m in db.query(models.Message)}
+    engine.dispose()
+    assert "where is my order 12345" in contents
+    assert not {"refused over http", "refused over ws"} & contents # Refused turns are not persisted
+
+
+def test_websocket_chat_round_trip(client):
+    with client.websocket_connect("/api/v1/chat/ws?user_id=u2") as ws:
+        ack = ws.receive_json()
+        assert ack["type"] == "connection_ack"
+        ws.send_json({"text": "hi there"})
+        reply = ws.receive_json()
+    assert reply["conversation_id"] == ack["conversation_id"]
+    assert reply["intent"] == "greet"
+    assert reply["bot_message_id"] is not None
+
+
+def test_websocket_holds_no_db_connection_between_turns(client):
+    with client.websocket_connect("/api/v1/chat/ws?user_id=u3") as ws:
+        ws.receive_json()
+        ws.send_json({"text": "where is my order 12345"})
+        assert ws.receive_json()["intent"] == "track_order"
+        assert client.db_engine.pool.checkedout() == 0 # The turn's session went back to the pool
+
+
+def test_websocket_pipelines_turns_and_replies_in_order(client, monkeypatch):
+    from app.api.v1 import chatbot
+    delays = {"first hi": 0.3, "second hi": 0.1, "third hi": 0.0} # The first lookup finishes last
+
+    async def slow_response(intent, confidence, message_text, entities, db, conversation_id, user_id=None, lookups=None):
+        await asyncio.sleep(delays[message_text])
+        return f"reply to {message_text}"
+
+    monkeypatch.setattr(chatbot, "generate_bot_response", slow_response)
+    with client.websocket_connect("/api/v1/chat/ws?user_id=u5") as ws:
+        ws.receive_json()
+        for n, text in enumerate(delays):
+            ws.send_json({"text": text, "client_message_id": n})
+        ws.send_json({"type": "ping", "ts": 1})
+        pong = ws.receive_json() # Not stuck behind the turns
+        assert pong["type"] == "pong" and pong["ts"] == 1
+        replies = [ws.receive_json() for _ in delays]
+    assert [reply["client_message_id"] for reply in replies] == [0, 1, 2]
+    assert [reply["response"] for reply in replies] == [f"reply to {text}" for text in delays]
+    assert replies[0]["user_message_id"] < replies[1]["user_message_id"] < replies[2]["user_message_id"]
+    assert set(replies[0]["timings"]) == {"nlp", "lookup", "queued", "persist", "total"}
+    assert replies[2]["timings"]["queued"] > 100 # Ready early, waited for the first turn
+    assert replies[0]["timings"]["total"] < 600 # The lookups overlapped (0.4s one after the other)
+    assert client.get("/api/v1/admin/connections/stats").json()["turn_timings"]["turns"] >= 3
+
+
+def test_websocket_refuses_messages_beyond_the_pending_limit(client, monkeypatch):
+    from app.api.v1 import chatbot
+
+    async def slow_response(*args, **kwargs):
+        await asyncio.sleep(0.2)
+        return "done"
+
+    monkeypatch.setattr(chatbot, "generate_bot_response", slow_response)
+    monkeypatch.setattr(settings, "WS_MAX_PENDING_TURNS", 1)
+    with client.websocket_connect("/api/v1/chat/ws?user_id=u6") as ws:
+        ws.receive_json()
+        ws.send_json({"text": "hi once"})
+        ws.send_json({"text": "hi twice"})
+        refused = ws.receive_json()
+        assert refused["type"] == "error" and refused["retry_after"] == 1 and refused["text_received"] == "hi twice"
+        assert ws.receive_json()["response"] == "done"
+
+
+def test_websocket_streams_intent_chunks_then_final_frame(client):
+    with client.websocket_connect("/api/v1/chat/ws?user_id=u7&stream=true") as ws:
+        ws.receive_json()
+        ws.send_json({"text": "where is my order 12345", "client_message_id": "m1"})
+        ack, chunk, tracking, final = ws.receive_json(), ws.receive_json(), ws.receive_json(), ws.receive_json()
+    assert ack["type"] == "ack" and ack["intent"] == "track_order" and "response" not in ack
+    assert chunk["type"] == "chunk" and "Shipped" in chunk["text"]
+    assert tracking["type"] == "chunk" and tracking["index"] == 1 and "1Z12345" in tracking["text"] # Shipping info, looked up alongside
+    assert final["type"] == "final" and final["response"] == chunk["text"] + tracking["text"] and final["bot_message_id"]
+    assert ack["client_message_id"] == chunk["client_message_id"] == final["client_message_id"] == "m1"
+
+
+def test_order_lookups_run_while_the_message_is_classified(client, monkeypatch):
+    from app.api.v1 import chatbot
+
+    class SlowClassifier(KeywordClassifier): # Inference as slow as the slowest upstream call
+        def predict(self, text):
+            time.sleep(0.15)
+            return super().predict(text)
+
+    nlp.model_manager.use(SlowClassifier())
+    monkeypatch.setattr(settings, "NLP_CACHE_ENABLED", False)
+    monkeypatch.setattr(chatbot, "ecommerce_service", MockEcommerceAPI(simulate_latency=True)) # Order 150 ms, shipping 100 ms
+    monkeypatch.setattr(chatbot.lookup_planner, "stats", LookupStats())
+
+    tracked = client.post("/api/v1/chat/chat", json={"text": "where is my order 12345, has it shipped?"}).json()
+    assert tracked["intent"] == "track_order"
+    assert "Status is 'Shipped'" in tracked["response"] and "Tracking: 1Z12345FAKETRACK" in tracked["response"]
+    client.post("/api/v1/chat/chat", json={"text": "I want to return the SuperWidget from order 12345"})
+    client.post("/api/v1/chat/chat", json={"text": "a human for order 12345 please"}) # Escalated
+
+    stats = client.get("/api/v1/admin/lookups/stats").json()
+    assert stats["speculated_turns"] == 3
+    track = stats["intents"]["track_order"]
+    assert track["lookups"] == 2 and track["speculative_used"] == 2
+    # Both lookups were done by the time the intent was known: ~250 ms one by one, hardly any wait
+    assert track["avg_sequential_ms"] >= 240 and track["avg_saved_ms"] >= 150
+    assert stats["intents"]["request_return"]["speculative_cancelled"] == 2 # A return isn't answered from the lookups
+    assert stats["intents"]["human_agent"]["speculative_cancelled"] == 2
+
+
+def test_turn_lookups_gather_an_intents_lookups_and_cancel_the_rest():
+    calls = []
+
+    class Upstream:
+        async def get_order_details(self, order_id):
+            calls.append(("order", order_id))
+            await asyncio.sleep(0.1)
+            return {"id": order_id, "status": "Shipped"}
+
+        async def check_shipping_info(self, order_id):
+            calls.append(("shipping", order_id))
+            await asyncio.sleep(0.1)
+            return {"order_id": order_id, "tracking_number": "T1"}
+
+    async def run():
+        stats = LookupStats()
+        planner = LookupPlanner()
+        planner.stats = stats
+        cold = planner.start(Upstream()) # No pre-pass: both lookups start at fetch(), together
+        started = time.perf_counter()
+        found = await cold.fetch("track_order", {"order_id": "55555"})
+        together_seconds = time.perf_counter() - started
+
+        other_order = planner.start(Upstream(), "order 12345 please") # Speculates on 12345...
+        await asyncio.sleep(0)
+        shipping = await other_order.fetch("shipping_info", {"order_id": "12345"}) # ...and only shipping is needed
+        return found, together_seconds, shipping, stats.stats()
+
+    found, together_seconds, shipping, stats = asyncio.run(run())
+    assert found == {"order_details": {"id": "55555", "status": "Shipped"}, "shipping_info": {"order_id": "55555", "tracking_number": "T1"}}
+    assert together_seconds < 0.19
+    assert shipping == {"shipping_info": {"order_id": "12345", "tracking_number": "T1"}}
+    assert stats["intents"]["shipping_info"] == {**stats["intents"]["shipping_info"], "speculative_used": 1, "speculative_cancelled": 1}
+    assert calls.count(("shipping", "12345")) == 1 # Reused, not fetched twice
+
+
+def test_follow_up_turns_reuse_the_conversation_and_its_slots(client):
+    statements = []
+    event.listen(client.db_engine.sync_engine, "before_cursor_execute",
+                 lambda conn, cursor, statement, *args: statements.append(statement))
+
+    before = chatbot.conversation_states.stats() # Shared by every test of this worker
+    first = client.post("/api/v1/chat/chat", json={"text": "where is my order 12345", "user_id": "u9"}).json()
+    conversation_id = first["conversation_id"]
+    statements.clear()
+    follow_up = client.post("/api/v1/chat/chat", json={"text": "is my order there yet?", "conversation_id": conversation_id}).json()
+    assert follow_up["entities"] == {"order_id": "12345"} # Not asked "What is the order ID?" again
+    assert "Order 12345: Status is 'Shipped'" in follow_up["response"]
+    assert not [s for s in statements if s.lstrip().upper().startswith("SELECT")] # Conversation known: no lookup
+
+    client.post("/api/v1/chat/chat", json={"text": "price of the SuperWidget", "conversation_id": conversation_id})
+    price = client.post("/api/v1/chat/chat", json={"text": "what is the price of it?", "conversation_id": conversation_id}).json()
+    assert price["entities"]["product_name_query"] == "superwidget" and "$" in price["response"]
+
+    client.post("/api/v1/chat/chat", json={"text": "a human please", "conversation_id": conversation_id})
+    assert asyncio.run(chatbot.conversation_states.get(conversation_id)) is None # Dropped on escalation
+    after = client.post("/api/v1/chat/chat", json={"text": "is my order there yet?", "conversation_id": conversation_id}).json()
+    assert after["conversation_id"] == conversation_id and "What is the order ID" in after["response"]
+    assert asyncio.run(chatbot.conversation_states.get(conversation_id)).escalated # Reloaded from the row
+
+    stats = client.get("/api/v1/admin/conversation-state/stats").json()["stats"]
+    counted = {key: stats[key] - before[key] for key in ("slots_filled", "invalidations", "db_loads", "db_lookups_saved")}
+    assert counted == {"slots_filled": 2, "invalidations": 1, "db_loads": 1, "db_lookups_saved": 4}
+
+
+def test_conversation_state_expires_when_idle_and_is_shared_through_redis():
+    fakeredis = pytest.importorskip("fakeredis")
+
+    async def run():
+        local_only = ConversationStateStore(idle_ttl=0.05)
+        await local_only.put(ConversationState(1, "u1", slots={"order_id": "12345"}))
+        assert (await local_only.get(1)).slots == {"order_id": "12345"}
+        await asyncio.sleep(0.08)
+        expired = await local_only.get(1)
+
+        redis_client = fakeredis.aioredis.FakeRedis()
+        worker_a = ConversationStateStore(redis_client=redis_client, local_ttl=0.05)
+        worker_b = ConversationStateStore(redis_client=redis_client, local_ttl=0.05)
+        await worker_a.put(ConversationState(2, "u2").remember({"order_id": "67890"}))
+        seen_by_b = await worker_b.get(2)
+        await worker_a.invalidate(2) # Escalated on worker A
+        cached_by_b = await worker_b.get(2) # B's local copy...
+        await asyncio.sleep(0.08)
+        return expired, seen_by_b, cached_by_b, await worker_b.get(2), worker_b.stats()
+
+    expired, seen_by_b, cached_by_b, after_local_ttl, stats = asyncio.run(run())
+    assert expired is None
+    assert seen_by_b.slots == {"order_id": "67890"} and cached_by_b == seen_by_b
+    assert after_local_ttl is None # ...is only trusted for local_ttl
+    assert stats["redis_hits"] == 1
+
+
+def _sse_events(body):
+    events = []
+    for block in body.strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((fields["event"], json.loads(fields["data"])))
+    return events
+
+
+def test_chat_stream_sends_server_sent_events(client):
+    response = client.post("/api/v1/chat/chat/stream", json={"text": "where is my order 12345", "user_id": "u8"})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = _sse_events(response.text)
+    assert [name for name, _ in events] == ["ack", "chunk", "chunk", "final"] # Order status, then its tracking
+    assert events[0][1]["intent"] == "track_order"
+    final = events[3][1]
+    assert final["response"] == events[1][1]["text"] + events[2][1]["text"] and final["user_message_id"] and final["bot_message_id"]
+
+    escalated = _sse_events(client.post("/api/v1/chat/chat/stream", json={"text": "a human please"}).text)
+    assert [name for name, _ in escalated] == ["ack", "final"]
+    assert str(escalated[1][1]["escalation_ticket_id"]) in escalated[1][1]["response"]
+
+
+def test_chat_batch_answers_every_item_in_input_order(client, monkeypatch):
+    monkeypatch.setattr(settings, "CHAT_BATCH_NLP_CHUNK", 2)
+    monkeypatch.setattr(settings, "CHAT_BATCH_PERSIST_SIZE", 2)
+    conversation_id = client.post("/api/v1/chat/chat", json={"text": "hi", "user_id": "u9"}).json()["conversation_id"]
+    items = [
+        {"text": "where is my order 12345", "user_id": "u9", "conversation_id": conversation_id},
+        {"text": "a human please", "user_id": "u9", "conversation_id": conversation_id},
+        {"text": "", "user_id": "u9"},
+        {"text": "hi there", "user_id": "u10"},
+        {"text": "price of the SuperWidget", "user_id": "u10"},
+    ]
+    response = client.post("/api/v1/chat/batch", json={"items": items})
+    assert response.status_code == 200
+    body = response.json()
+    assert body["count"] == 5 and body["errors"] == 1
+    results = body["results"]
+    assert [r["index"] for r in results] == [0, 1, 2, 3, 4]
+    assert results[0]["intent"] == "track_order" and "Shipped" in results[0]["response"]
+    assert results[1]["requires_human_escalation"] and str(results[1]["escalation_ticket_id"]) in results[1]["response"]
+    assert results[2] == {"index": 2, "error": "Text input cannot be empty"}
+    assert results[0]["conversation_id"] == results[1]["conversation_id"] == conversation_id
+    assert results[3]["conversation_id"] != results[4]["conversation_id"] # No conversation_id: a new one each, like /chat
+    message_ids = [r[key] for r in results if "error" not in r for key in ("user_message_id", "bot_message_id")]
+    assert len(set(message_ids)) == 8
+
+
+def test_chat_batch_stops_reading_while_classification_lags(monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, "CHAT_BATCH_NLP_CHUNK", 4)
+    monkeypatch.setattr(settings, "CHAT_BATCH_PERSIST_SIZE", 4)
+    _, AsyncSession = _message_log_sessions(tmp_path)
+    classifier = KeywordClassifier()
+
+    async def run():
+        gate = asyncio.Event()
+        read = 0
+
+        async def slow_classify(texts):
+            await gate.wait() # The model falls behind the upload
+            return classifier.predict_batch(texts)
+
+        async def items():
+            nonlocal read
+            for index in range(200):
+                read += 1
+                yield index, ChatPayload(text="hi there", user_id="u1")
+
+        monkeypatch.setattr(batch, "_classify", slow_classify)
+        results = batch.run_chat_batch(items(), AsyncSession)
+        first = asyncio.ensure_future(results.__anext__())
+        await asyncio.sleep(0.1)
+        read_while_stalled = read
+        gate.set()
+        collected = [await first] + [result async for result in results]
+        return read_while_stalled, collected
+
+    read_while_stalled, results = asyncio.run(run())
+    assert read_while_stalled <= 4 + 2 * 4 + 1 # The chunk being classified, a full queue, the item waiting to go in
+    assert sorted(result["index"] for result in results) == list(range(200))
+    assert not any("error" in result for result in results)
+
+
+def test_chat_batch_stream_takes_and_returns_ndjson(client):
+    body = "\n".join([json.dumps({"text": "where is my order 12345"}), "not json", "", json.dumps({"text": "hi"})]) + "\n"
+    response = client.post("/api/v1/chat/batch/stream", content=body, headers={"Content-Type": "application/x-ndjson"})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    results = {r["index"]: r for r in map(json.loads, response.text.splitlines())}
+    assert sorted(results) == [0, 1, 2] # The blank line is not an item
+    assert results[0]["intent"] == "track_order" and results[0]["bot_message_id"]
+    assert results[1]["error"].startswith("Invalid item")
+    assert results[2]["intent"] == "greet"
+
+    nlp.model_manager.state = nlp.ModelManager.LOADING
+    assert client.post("/api/v1/chat/batch/stream", content=body).status_code == 503
+
+
+def test_chat_batch_stream_stops_reading_past_the_item_limit(monkeypatch):
+    monkeypatch.setattr(settings, "CHAT_BATCH_MAX_ITEMS", 3)
+    chunks_read = 0
+
+    class EndlessUpload:
+        async def stream(self):
+            nonlocal chunks_read
+            while True:
+                chunks_read += 1
+                yield json.dumps({"text": "hi"}).encode() + b"\n"
+
+    async def run():
+        return [item async for item in batch._ndjson_items(EndlessUpload())]
+
+    items = asyncio.run(run())
+    assert [index for index, _ in items] == [0, 1, 2, 3]
+    assert all(isinstance(item, ChatPayload) for _, item in items[:3])
+    assert items[3][1].startswith("At most 3 items per batch")
+    assert chunks_read == 4
+
+
+def test_websocket_turns_fan_out_to_the_conversations_other_sockets(client):
+    with client.websocket_connect("/api/v1/chat/ws?user_id=u4") as first:
+        conversation_id = first.receive_json()["conversation_id"]
+        with client.websocket_connect(f"/api/v1/chat/ws?user_id=u4&conversationId={conversation_id}") as second:
+            second.receive_json()
+            first.send_json({"text": "hi there"})
+            reply = first.receive_json()
+            mirrored = second.receive_json()
+            assert "type" not in reply and mirrored["type"] == "conversation_turn"
+            assert mirrored["bot_message_id"] == reply["bot_message_id"]
+
+            client.post("/api/v1/chat/chat", json={"text": "where is my order 12345", "conversation_id": conversation_id})
+            assert first.receive_json()["intent"] == second.receive_json()["intent"] == "track_order"
+
+
+class FakeSocket:
+    def __init__(self, stall=False):
+        self.sent, self.closed_with, self.stall = [], None, stall
+
+    async def send_text(self, text):
+        if self.stall:
+            await asyncio.sleep(3600) # A client that stopped reading
+        self.sent.append(json.loads(text))
+
+    async def close(self, code=1000):
+        self.closed_with = code
+
+
+def test_connection_manager_fans_out_across_workers_through_redis():
+    fakeredis = pytest.importorskip("fakeredis")
+
+    async def run():
+        server = fakeredis.FakeServer()
+        worker_a = ConnectionManager(fakeredis.FakeAsyncRedis(server=server))
+        worker_b = ConnectionManager(fakeredis.FakeAsyncRedis(server=server))
+        sender, local_peer, remote_peer, other_conversation = FakeSocket(), FakeSocket(), FakeSocket(), FakeSocket()
+        origin = await worker_a.connect(sender, 1)
+        await worker_a.connect(local_peer, 1)
+        remote = await worker_b.connect(remote_peer, 1, batch=True)
+        await worker_b.connect(other_conversation, 2)
+
+        for n in range(3):
+            await worker_a.publish(1, {"type": "conversation_turn", "n": n}, origin=origin)
+        for _ in range(100):
+            if len(local_peer.sent) == 3 and sum(len(f.get("frames", [f])) for f in remote_peer.sent) == 3:
+                break
+            await asyncio.sleep(0.01)
+        await worker_b.disconnect(remote)
+        stats = worker_b.stats()
+        await worker_a.close()
+        await worker_b.close()
+        return sender, local_peer, remote_peer, other_conversation, stats
+
+    sender, local_peer, remote_peer, other_conversation, stats = asyncio.run(run())
+    assert sender.sent == [] and other_conversation.sent == [] # Not echoed to the origin; other conversations untouched
+    assert [frame["n"] for frame in local_peer.sent] == [0, 1, 2]
+    # The batching client may get the three as one {"type": "batch"} frame
+    remote_frames = [f for frame in remote_peer.sent for f in (frame["frames"] if frame["type"] == "batch" else [frame])]
+    assert [frame["n"] for frame in remote_frames] == [0, 1, 2]
+    assert stats["received"] == 3 and stats["local_connections"] == 1
+
+
+def test_connection_manager_batches_queued_frames_and_evicts_slow_consumers():
+    async def run():
+        manager = ConnectionManager(send_queue_size=5, batch_max_frames=10, send_timeout_seconds=0.05)
+        batching, slow = FakeSocket(), FakeSocket(stall=True)
+        await manager.connect(batching, 1, batch=True)
+        slow_connection = await manager.connect(slow, 1)
+        for n in range(4): # Queued before either writer runs
+            await manager.publish(1, {"n": n})
+        await asyncio.sleep(0.1) # The slow socket's first write times out
+        for n in range(4, 9): # Fills the queue (5) exactly
+            await manager.publish(1, {"n": n})
+        await asyncio.sleep(0.05)
+        await manager.disconnect(slow_connection)
+        return manager, batching, slow
+
+    manager, batching, slow = asyncio.run(run())
+    assert batching.sent[0] == {"type": "batch", "frames": [{"n": n} for n in range(4)]}
+    assert batching.sent[1] == {"type": "batch", "frames": [{"n": n} for n in range(4, 9)]}
+    assert slow.closed_with == TRY_AGAIN_LATER and manager.evictions == 1
+    assert manager.stats()["local_connections"] == 1
+
+
+def test_escalation_queue_claims_acks_and_reclaims_stale_tickets():
+    fakeredis = pytest.importorskip("fakeredis")
+
+    async def run():
+        queue = EscalationQueue(fakeredis.FakeAsyncRedis(), claim_timeout_seconds=0.05)
+        for ticket_id in (1, 2, 3):
+            await queue.enqueue(ticket_id, 100 + ticket_id, "u1", f"help {ticket_id}")
+        first = await queue.claim("alice", count=2)
+        second = await queue.claim("bob", count=2) # Only ticket 3 is unclaimed; alice's aren't stale yet
+        assert await queue.ack(queue.agent_group, [first[0]["entry_id"]]) == 1
+        assert await queue.ack(queue.agent_group, [first[0]["entry_id"]]) == 0 # Already acked
+        await asyncio.sleep(0.1) # alice never acks ticket 2, nor bob ticket 3
+        reclaimed = await queue.claim("carol", count=5)
+        empty = await queue.claim("dave", block_ms=10)
+        return first, second, reclaimed, empty, queue.stats(), await queue.backlog()
+
+    first, second, reclaimed, empty, stats, backlog = asyncio.run(run())
+    assert [t["ticket_id"] for t in first] == [1, 2] and first[0]["conversation_id"] == 101
+    assert [t["ticket_id"] for t in second] == [3]
+    assert sorted(t["ticket_id"] for t in reclaimed) == [2, 3]
+    assert empty == []
+    assert stats["claimed"] == 5 and stats["reclaimed"] == 2 and stats["acked"] == 1
+    assert stats["enqueue_to_claim_ms"]["p50"] is not None
+    assert backlog["stream_length"] == 3
+    assert backlog["groups"]["agents"]["pending"] == 2
+    assert backlog["groups"]["notifications"]["lag"] == 3 # The notifier's group sees every ticket too
+
+
+def test_escalation_notifier_triggers_a_notification_per_ticket():
+    fakeredis = pytest.importorskip("fakeredis")
+    notified, failing = [], {2}
+
+    def notify(ticket):
+        if ticket["ticket_id"] in failing:
+            failing.clear() # Fails once, then succeeds when retried
+            raise RuntimeError("broker down")
+        notified.append(ticket["ticket_id"])
+
+    async def run():
+        queue = EscalationQueue(fakeredis.FakeAsyncRedis(), claim_timeout_seconds=0.05)
+        notifier = EscalationNotifier(queue, "worker-1", notify=notify, block_ms=10)
+        for ticket_id in (1, 2, 3):
+            await queue.enqueue(ticket_id, ticket_id, None, "a human please")
+        assert await notifier.run_once() == 2
+        await asyncio.sleep(0.1)
+        assert await notifier.run_once() == 1 # The failed one, once stale
+        return (await queue.backlog())["groups"], notifier.failures
+
+    groups, failures = asyncio.run(run())
+    assert notified == [1, 3, 2] and failures == 1
+    assert groups["notifications"]["pending"] == 0
+    assert groups["agents"]["pending"] == 0 # Notifications don't claim tickets for agents
+
+
+def test_escalated_turns_reach_agents_through_the_stream(client, monkeypatch):
+    fakeredis = pytest.importorskip("fakeredis")
+    from app.api.v1 import chatbot
+
+    assert client.post("/api/v1/escalations/claim", json={"agent": "alice"}).status_code == 503 # Not enabled
+    monkeypatch.setattr(chatbot, "escalation_queue", EscalationQueue(fakeredis.FakeAsyncRedis()))
+    turn = client.post("/api/v1/chat/chat", json={"text": "a human please", "user_id": "u11"}).json()
+    client.post("/api/v1/chat/chat", json={"text": "hi"}) # Not escalated: not queued
+
+    claimed = client.post("/api/v1/escalations/claim", json={"agent": "alice", "count": 5}).json()["tickets"]
+    assert [t["ticket_id"] for t in claimed] == [turn["escalation_ticket_id"]]
+    assert claimed[0]["conversation_id"] == turn["conversation_id"] and claimed[0]["message"] == "a human please"
+
+    entry_id = claimed[0]["entry_id"]
+    assert client.post("/api/v1/escalations/ack", json={"agent": "mallory", "entry_id": entry_id}).status_code == 403
+    assert client.post("/api/v1/escalations/ack", json={"agent": "alice", "entry_id": entry_id,
+                                                        "status": "<script>"}).status_code == 422
+    assert client.post("/api/v1/escalations/ack", json={"agent": "alice", "entry_id": entry_id},
+                       headers={"Authorization": ""}).status_code == 401
+    ack = client.post("/api/v1/escalations/ack", json={"agent": "alice", "entry_id": entry_id})
+    assert ack.json() == {"ticket_id": turn["escalation_ticket_id"], "status": "resolved"}
+    assert client.post("/api/v1/escalations/ack", json={"agent": "alice", "entry_id": claimed[0]["entry_id"]}).status_code == 409
+
+    async def ticket_row():
+        async with async_sessionmaker(client.db_engine)() as db:
+            return await db.get(models.EscalationTicket, turn["escalation_ticket_id"])
+
+    row = asyncio.run(ticket_row())
+    assert (row.status, row.assigned_agent) == ("resolved", "alice")
+    stats = client.get("/api/v1/escalations/stats").json()
+    assert stats["enqueued"] == 1 and stats["groups"]["agents"]["pending"] == 0
+
+
+@pytest.fixture
+def celery_eager(monkeypatch):
+    """Celery tasks run in-process when sent (task_always_eager): the background layer without a broker or worker."""
+    from app.core.tasks import celery_app
+    monkeypatch.setattr(celery_app.conf, "task_always_eager", True)
+    monkeypatch.setattr(celery_app.conf, "task_eager_propagates", True)
+    return celery_app
+
+
+def test_task_batcher_sends_one_celery_task_per_batch(celery_eager, monkeypatch):
+    fakeredis = pytest.importorskip("fakeredis")
+    redis_client = fakeredis.FakeRedis()
+    monkeypatch.setattr("app.db.session.get_redis_client", lambda: redis_client)
+    tasks_sent = []
+    send = celery_sender("record_turn_analytics")
+
+    async def run():
+        batcher = TaskBatcher(lambda items: tasks_sent.append(len(items)) or send(items), max_items=200, max_wait_seconds=0.05)
+        batcher.start()
+        now = time.time()
+        for n in range(450):
+            batcher.add({"ts": now, "channel": "http", "intent": "greet" if n % 3 else "track_order",
+                         "confidence": 0.9, "escalated": n % 10 == 0})
+        await asyncio.sleep(0.2) # Two full batches went out right away, the rest after max_wait
+        batcher.add({"ts": now, "channel": "ws", "intent": "greet", "confidence": 0.9, "escalated": False})
+        await batcher.stop() # Sends the leftover
+        return batcher.stats()
+
+    gc.collect() # A full collection inside the 0.2 s window would hold up the timed batches
+    stats = asyncio.run(run())
+    assert tasks_sent == [200, 200, 50, 1]
+    assert stats["items_sent"] == 451 and stats["dropped"] == 0
+    hour = datetime.utcnow().strftime("%Y%m%d%H")
+    counters = {k.decode(): float(v) for k, v in redis_client.hgetall(f"analytics:turns:{hour}").items()}
+    assert counters["track_order:turns"] == 150 and counters["greet:turns"] == 301
+    assert counters["track_order:escalated"] + counters["greet:escalated"] == 45
+    assert counters["channel:http"] == 450 and counters["channel:ws"] == 1
+    assert redis_client.ttl(f"analytics:turns:{hour}") > 0
+
+
+def test_redelivered_analytics_batch_is_counted_once(celery_eager, monkeypatch):
+    fakeredis = pytest.importorskip("fakeredis")
+    from app.core.tasks import record_turn_analytics
+    redis_client = fakeredis.FakeRedis()
+    monkeypatch.setattr("app.db.session.get_redis_client", lambda: redis_client)
+    events = [{"ts": time.time(), "channel": "http", "intent": "greet", "confidence": 0.9, "escalated": False}] * 3
+
+    assert record_turn_analytics.apply(args=[events], task_id="batch-1").get()["stored"]
+    assert record_turn_analytics.apply(args=[events], task_id="batch-1").get()["duplicate"] # Worker lost, sent again
+    record_turn_analytics.apply(args=[events], task_id="batch-2")
+    hour = datetime.utcnow().strftime("%Y%m%d%H")
+    assert float(redis_client.hget(f"analytics:turns:{hour}", "greet:turns")) == 6
+
+
+def test_task_batcher_drops_batches_it_cannot_send():
+    def broker_down(items):
+        raise ConnectionError("broker unreachable")
+
+    async def run():
+        batcher = TaskBatcher(broker_down, max_items=2, max_buffer=3)
+        for n in range(5):
+            batcher.add(n) # Never blocks the turn, even with nothing draining the buffer
+        assert batcher.stats()["buffered"] == 3
+        await batcher.flush()
+        return batcher.stats()
+
+    stats = asyncio.run(run())
+    assert stats["dropped"] == 5 and stats["send_errors"] == 2 and stats["buffered"] == 0
+
+
+def test_turns_queue_analytics_and_low_confidence_reclassification(client, celery_eager, monkeypatch, tmp_path):
+    fakeredis = pytest.importorskip("fakeredis")
+    from app.api.v1 import chatbot
+    monkeypatch.setattr(settings, "BACKGROUND_TASKS_ENABLED", True)
+    monkeypatch.setattr(settings, "RECLASSIFY_BELOW_CONFIDENCE", 0.99) # Every answered turn counts as unsure
+    batchers = build_task_batchers()
+    for name, batcher in batchers.items(): # The dict itself is shared with the admin router
+        monkeypatch.setitem(chatbot.task_batchers, name, batcher)
+    monkeypatch.setattr("app.db.session.get_redis_client", fakeredis.FakeRedis)
+    worker_engine = create_engine(f"sqlite:///{tmp_path / 'chat.db'}")
+    monkeypatch.setattr("app.db.session.SessionLocal", sessionmaker(bind=worker_engine))
+
+    greeting = client.post("/api/v1/chat/chat", json={"text": "hi there"}).json()
+    client.post("/api/v1/chat/chat", json={"text": "a human please"}) # Escalated: not re-classified
+    assert batchers["record_turn_analytics"].stats()["buffered"] == 2
+    assert batchers["reclassify_messages"].stats()["buffered"] == 1
+
+    class WorkerModel(KeywordClassifier): # The worker's (bigger) model disagrees
+        def predict(self, text):
+            return "goodbye", 0.97, {}
+
+    nlp.model_manager.use(WorkerModel())
+    asyncio.run(batchers["reclassify_messages"].flush())
+    asyncio.run(batchers["record_turn_analytics"].flush())
+    with worker_engine.connect() as connection:
+        row = connection.execute(
+            models.Message.__table__.select().where(models.Message.id == greeting["user_message_id"])).one()
+    assert (row.intent, row.confidence) == ("goodbye", 0.97)
+    assert batchers["record_turn_analytics"].stats()["items_sent"] == 2
+    stats = client.get("/api/v1/admin/background/stats").json()
+    assert stats["enabled"] and stats["batchers"]["reclassify_messages"]["batches_sent"] == 1
+
+
+def test_reclassification_only_replaces_a_less_confident_intent(client, celery_eager, monkeypatch, tmp_path):
+    from app.core.tasks import reclassify_messages
+    worker_engine = create_engine(f"sqlite:///{tmp_path / 'chat.db'}")
+    monkeypatch.setattr("app.db.session.SessionLocal", sessionmaker(bind=worker_engine))
+    order = client.post("/api/v1/chat/chat", json={"text": "where is my order"}).json()
+    greeting = client.post("/api/v1/chat/chat", json={"text": "hi there"}).json()
+
+    class WorkerModel(KeywordClassifier): # Sure about orders only, e.g. an untrained head elsewhere
+        def predict(self, text):
+            return ("request_return", 0.97, {}) if "order" in text else ("goodbye", 0.3, {})
+
+    nlp.model_manager.use(WorkerModel())
+    items = [{"message_id": order["user_message_id"], "text": "where is my order", "intent": "track_order", "confidence": 0.95},
+             {"message_id": greeting["user_message_id"], "text": "hi there", "intent": "greet", "confidence": 0.95}]
+    assert reclassify_messages.apply(args=[items]).get()["updated"] == 1
+
+    class LessSure(KeywordClassifier):
+        def predict(self, text):
+            return "greet", 0.9, {}
+
+    nlp.model_manager.use(LessSure()) # Queued before the first write: the item still says 0.5, the row 0.97
+    stale = [{**items[0], "confidence": 0.5}]
+    assert reclassify_messages.apply(args=[stale]).get()["updated"] == 0
+    with worker_engine.connect() as connection:
+        rows = {row.id: (row.intent, row.confidence) for row in connection.execute(models.Message.__table__.select())}
+    assert rows[order["user_message_id"]] == ("request_return", 0.97)
+    assert rows[greeting["user_message_id"]] == ("greet", 0.95)
+
+
+def test_product_index_ranks_exact_then_partial_then_typo():
+    index = ProductIndex()
+    for name in ["Super Widget", "Super Widget Pro", "MegaDongle", "HyperFlux Capacitor"]:
+        index.add(name, name, aliases=["SW001"] if name == "Super Widget" else ())
+
+    assert [match.name for match in index.search("superwidget")] == ["Super Widget", "Super Widget Pro"]
+    assert index.search("superwidget")[0].score == 1.0
+    assert index.best("sw001").name == "Super Widget"
+    assert index.best("flux capacitor").name == "HyperFlux Capacitor"
+    assert index.best("megadongel").name == "MegaDongle"
+    assert index.best("completely different") is None
+    assert ProductIndex(fuzzy=False).best("megadongel") is None
+
+
+def test_product_index_keeps_the_shortest_names_when_candidates_are_capped():
+    index = ProductIndex(fuzzy=False, max_candidates=5)
+    for n in range(50):
+        index.add(f"long{n}", f"Widget Deluxe Edition Model {n:03d}")
+    index.add("short", "Widget Pro") # Added last: not among the first candidates a set yields
+
+    assert [match.key for match in index.search("widget", limit=2)] == ["short", "long0"]
+
+
+def test_product_lookup_uses_the_index():
+    api = MockEcommerceAPI()
+    assert asyncio.run(api.get_product_info("hyperflux capaciter"))["id"] == "HFC004"
+    assert "error" in asyncio.run(api.get_product_info("toaster"))
+
+
+def _stub_client(stub, **kwargs):
+    kwargs.setdefault("retry_backoff_ms", 1)
+    return EcommerceAPI("http://stub", api_key="k", transport=httpx.ASGITransport(app=stub), **kwargs)
+
+
+def test_ecommerce_client_against_stub_server():
+    async def run():
+        api = _stub_client(create_stub_app())
+        try:
+            return (
+                await api.get_order_details("12345"),
+                await api.get_order_details("00000"),
+                await api.get_product_info("flux capacitor"),
+                await api.check_shipping_info("12345"),
+                await api.request_return("12345", "SuperWidget", "Defective"),
+            )
+        finally:
+            await api.aclose()
+
+    order, missing, product, shipping, returned = asyncio.run(run())
+    assert order["status"] == "Shipped"
+    assert missing == {"error": "Order not found", "order_id": "00000"}
+    assert product["id"] == "HFC004"
+    assert shipping["tracking_number"].startswith("1Z12345")
+    assert returned["status"] == "Return initiated"
+
+
+def test_ecommerce_client_retries_then_opens_the_circuit():
+    async def run():
+        stub = create_stub_app(fail_first=2)
+        api = _stub_client(stub, max_retries=2, breaker=CircuitBreaker(failure_threshold=2, reset_timeout=60))
+        recovered = await api.get_order_details("12345") # Two 503s, then success
+        retries = api.retries
+
+        stub.state.faults["fail_first"] = 100
+        failures = [await api.get_order_details("12345") for _ in range(3)]
+        requests_before = stub.state.requests
+        rejected = await api.get_order_details("12345") # Circuit is open: no request is made
+        await api.aclose()
+        return recovered, retries, failures, rejected, stub.state.requests - requests_before, api.breaker.state
+
+    recovered, retries, failures, rejected, new_requests, state = asyncio.run(run())
+    assert recovered["status"] == "Shipped" and retries == 2
+    assert all(result["error"] == EcommerceAPI.UNAVAILABLE_MESSAGE for result in failures)
+    assert rejected["error"] == EcommerceAPI.UNAVAILABLE_MESSAGE
+    assert new_requests == 0
+    assert state == "open"
+
+
+def test_cancelled_half_open_trial_lets_the_next_call_probe():
+    async def run():
+        stub = create_stub_app(fail_first=1)
+        api = _stub_client(stub, max_retries=0, breaker=CircuitBreaker(failure_threshold=1, reset_timeout=0.05))
+        await api.get_order_details("12345") # 503: the circuit opens
+        await asyncio.sleep(0.06)
+        stub.state.faults["latency"] = 1.0
+        trial = asyncio.create_task(api.get_order_details("12345")) # The half-open trial...
+        await asyncio.sleep(0.05)
+        trial.cancel() # ...is cancelled, e.g. a speculative lookup that wasn't needed
+        with pytest.raises(asyncio.CancelledError):
+            await trial
+        state_after_cancel = api.breaker.state
+        stub.state.faults["latency"] = 0.0
+        probe = await api.get_order_details("12345")
+        await api.aclose()
+        return state_after_cancel, probe, api.breaker.state, stub.state.requests
+
+    state_after_cancel, probe, state, requests = asyncio.run(run())
+    assert state_after_cancel == "half_open"
+    assert probe["status"] == "Shipped" # Probed the upstream instead of failing as "half-open"
+    assert state == "closed" and requests == 3
+
+
+def test_ecommerce_client_gives_up_at_the_deadline():
+    async def run():
+        api = _stub_client(create_stub_app(latency=1.0), deadline=0.1)
+        start = time.perf_counter()
+        result = await api.get_order_details("12345")
+        await api.aclose()
+        return result, time.perf_counter() - start
+
+    result, elapsed = asyncio.run(run())
+    assert result["error"] == EcommerceAPI.UNAVAILABLE_MESSAGE
+    assert elapsed < 0.5
+
+
+class CountingService:
+    """Upstream stand-in that counts calls and answers after a short delay."""
+
+    def __init__(self):
+        self.calls = []
+        self.unavailable = False
+
+    async def _answer(self, name, argument, result):
+        self.calls.append((name, argument))
+        await asyncio.sleep(0.01)
+        if self.unavailable:
+            return {"error": "down", "retryable": True}
+        return result
+
+    async def get_order_details(self, order_id):
+        status = "Return requested" if ("request_return", order_id) in self.calls else "Shipped"
+        return await self._answer("get_order_details", order_id,
+                                  {"id": order_id, "status": status} if order_id == "12345" else {"error": "Order not found"})
+
+    async def check_shipping_info(self, order_id):
+        return await self._answer("check_shipping_info", order_id, {"order_id": order_id, "status": "Shipped"})
+
+    async def get_product_info(self, query):
+        return await self._answer("get_product_info", query, {"name": "MegaDongle"})
+
+    async def request_return(self, order_id, item, reason):
+        return await self._answer("request_return", order_id, {"status": "Return initiated"})
+
+    async def aclose(self):
+        pass
+
+
+def test_ecommerce_cache_coalesces_and_caches_positive_and_negative_results():
+    upstream = CountingService()
+    cache = CachedEcommerceService(upstream)
+
+    async def run():
+        first = await asyncio.gather(*(cache.get_order_details("12345") for _ in range(5)))
+        again = await cache.get_order_details("12345")
+        await cache.get_order_details("99999")
+        missing = await cache.get_order_details("99999")
+        await cache.get_product_info("MegaDongle")
+        await cache.get_product_info("  megadongle ")
+        return first, again, missing
+
+    first, again, missing = asyncio.run(run())
+    assert all(result["status"] == "Shipped" for result in first + [again])
+    assert missing["error"] == "Order not found"
+    assert upstream.calls == [("get_order_details", "12345"), ("get_order_details", "99999"), ("get_product_info", "MegaDongle")]
+    assert cache.stats()["cache"]["coalesced"] == 4
+
+
+def test_ecommerce_cache_skips_outages_and_invalidates_after_return():
+    upstream = CountingService()
+    cache = CachedEcommerceService(upstream)
+
+    async def run():
+        upstream.unavailable = True
+        await cache.check_shipping_info("12345")
+        upstream.unavailable = False
+        await cache.check_shipping_info("12345") # The outage answer was not cached
+        before = await cache.get_order_details("12345")
+        await cache.request_return("12345", "MegaDongle", "broken")
+        after = await cache.get_order_details("12345")
+        return before, after
+
+    before, after = asyncio.run(run())
+    assert upstream.calls.count(("check_shipping_info", "12345")) == 2
+    assert before["status"] == "Shipped" and after["status"] == "Return requested"
+
+
+def test_ecommerce_cache_lookup_after_a_return_does_not_join_an_older_fetch():
+    class SlowOrders(CountingService):
+        async def get_order_details(self, order_id):
+            result = await super().get_order_details(order_id) # Status as of the call's start
+            await asyncio.sleep(0.05)
+            return result
+
+    upstream = SlowOrders()
+    cache = CachedEcommerceService(upstream)
+
+    async def run():
+        before = asyncio.ensure_future(cache.get_order_details("12345"))
+        await asyncio.sleep(0.005) # The upstream call is under way
+        await cache.request_return("12345", "MegaDongle", "broken")
+        after = await cache.get_order_details("12345")
+        return await before, after, await cache.get_order_details("12345")
+
+    before, after, cached = asyncio.run(run())
+    assert before["status"] == "Shipped"
+    assert after["status"] == cached["status"] == "Return requested"
+    assert upstream.calls.count(("get_order_details", "12345")) == 2
+
+
+def test_ecommerce_cache_local_copies_expire_soon_with_redis():
+    fakeredis = pytest.importorskip("fakeredis")
+    upstream = CountingService()
+
+    async def run():
+        redis_client = fakeredis.FakeAsyncRedis()
+        worker_a = CachedEcommerceService(upstream, redis_client=redis_client, local_ttl=0.05)
+        worker_b = CachedEcommerceService(upstream, redis_client=redis_client, local_ttl=0.05)
+        await worker_b.get_order_details("12345") # Cached locally on b
+        await worker_a.request_return("12345", "MegaDongle", "broken") # Invalidated on a and in Redis only
+        stale = await worker_b.get_order_details("12345")
+        await asyncio.sleep(0.1)
+        return stale, await worker_b.get_order_details("12345")
+
+    stale, fresh = asyncio.run(run())
+    assert stale["status"] == "Shipped" # For local_ttl, not the order TTL
+    assert fresh["status"] == "Return requested"
+
+
+def test_ecommerce_cache_shares_entries_through_redis():
+    fakeredis = pytest.importorskip("fakeredis")
+    upstream = CountingService()
+
+    async def run():
+        redis_client = fakeredis.FakeAsyncRedis()
+        worker_a = CachedEcommerceService(upstream, redis_client=redis_client)
+        worker_b = CachedEcommerceService(upstream, redis_client=redis_client)
+        await worker_a.get_order_details("12345")
+        result = await worker_b.get_order_details("12345")
+        return result, worker_b.redis_hits
+
+    result, redis_hits = asyncio.run(run())
+    assert result["status"] == "Shipped" and redis_hits == 1
+    assert upstream.calls.count(("get_order_details", "12345")) == 1
+
+
+def _message_log_sessions(tmp_path):
+    """Sync sessions for the flusher and assertions, async ones for record_turn - same SQLite file."""
+    path = tmp_path / "log.db"
+    engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+    models.Base.metadata.create_all(bind=engine)
+    async_engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+    return (sessionmaker(autocommit=False, autoflush=False, bind=engine),
+            async_sessionmaker(async_engine, expire_on_commit=False))
+
+
+def test_write_behind_returns_ids_and_flushes_in_bulk(tmp_path):
+    Session, AsyncSession = _message_log_sessions(tmp_path)
+    log = MessageWriteBehind(Session, max_rows=3, id_block_size=4)
+
+    async def run():
+        async with AsyncSession() as db:
+            first = await record_turn(db, None, "u1", "where is my order 12345", "track_order", 0.95, "Shipped.", "track_order", message_log=log)
+            second = await record_turn(db, first.conversation_id, "u1", "thanks", "general_query", 0.9, "Welcome.", "general_query", message_log=log)
+            ticket = await record_turn(db, first.conversation_id, "u1", "human please", "human_agent", 0.95,
+                                       "Ticket {ticket_id}", "bot_response", escalate=True, message_log=log)
+        return first, second, ticket
+
+    first, second, ticket = asyncio.run(run())
+    with Session() as db:
+        # The escalating turn was written synchronously; the two ordinary ones are still buffered
+        assert db.query(models.Message).count() == 2
+    assert ticket.bot_text == f"Ticket {ticket.escalation_ticket_id}"
+
+    ids = [first.user_message_id, first.bot_message_id, second.user_message_id, second.bot_message_id,
+           ticket.user_message_id, ticket.bot_message_id]
+    assert ids == sorted(set(ids))
+    assert log.stats()["buffered_rows"] == 4
+    assert log.drain() == 4
+    assert log.flushes == 2 # max_rows=3 per INSERT
+
+    with Session() as db:
+        stored = {m.id: m for m in db.query(models.Message)}
+    assert sorted(stored) == sorted(ids)
+    assert stored[second.bot_message_id].content == "Welcome."
+    assert stored[first.user_message_id].conversation_id == first.conversation_id
+    stats = log.stats()
+    assert stats["buffered_rows"] == 0 and stats["rows_written"] == 4 and stats["last_flush_lag_ms"] >= 0
+
+
+def test_write_behind_redis_buffer_survives_restart_and_replays_idempotently(tmp_path):
+    fakeredis = pytest.importorskip("fakeredis")
+    Session, AsyncSession = _message_log_sessions(tmp_path)
+    redis_client = fakeredis.FakeRedis()
+    crashed = MessageWriteBehind(Session, redis_client=redis_client)
+
+    async def run():
+        async with AsyncSession() as db:
+            return await record_turn(db, None, "u1", "hi", "greet", 0.95, "Hello!", "greet", message_log=crashed)
+
+    turn = asyncio.run(run())
+    pending = redis_client.lrange("chat:message_log", 0, -1)
+
+    restarted = MessageWriteBehind(Session, redis_client=redis_client) # The next worker picks the rows up
+    assert restarted.drain() == 2
+    redis_client.rpush("chat:message_log", *pending) # A flush that committed but died before trimming
+    assert restarted.drain() == 2
+    with Session() as db:
+        assert sorted(m.id for m in db.query(models.Message)) == [turn.user_message_id, turn.bot_message_id]
+
+
+def test_write_behind_redis_flush_that_outlives_its_lock_neither_trims_nor_unlocks(tmp_path):
+    fakeredis = pytest.importorskip("fakeredis")
+    Session, AsyncSession = _message_log_sessions(tmp_path)
+    loop_thread = threading.get_ident()
+    pushed_from = []
+
+    class RecordingRedis(fakeredis.FakeRedis):
+        def rpush(self, *args):
+            pushed_from.append(threading.get_ident())
+            return super().rpush(*args)
+
+    redis_client = RecordingRedis()
+    slow = MessageWriteBehind(Session, max_rows=2, redis_client=redis_client)
+    other = MessageWriteBehind(Session, max_rows=2, redis_client=redis_client)
+
+    async def run():
+        async with AsyncSession() as db:
+            first = await record_turn(db, None, "u1", "hi", "greet", 0.95, "Hello!", "greet", message_log=slow)
+            second = await record_turn(db, first.conversation_id, "u1", "thanks", "general_query", 0.9, "Welcome.",
+                                       "general_query", message_log=slow)
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert pushed_from and loop_thread not in pushed_from # RPUSH ran in a worker thread, not on the event loop
+
+    insert = slow._insert
+
+    def insert_past_the_lock_expiry(db, rows):
+        insert(db, rows)
+        redis_client.delete("chat:message_log:flush_lock") # The lock expired meanwhile...
+        assert other.flush() == 2 # ...another worker flushed the same head rows...
+        redis_client.set("chat:message_log:flush_lock", "someone-else") # ...and the next flush holds the lock now
+
+    slow._insert = insert_past_the_lock_expiry
+    assert slow.flush() == 0 # Not acknowledged: the second turn's rows must stay buffered
+    assert slow.lock_lost == 1 and redis_client.llen("chat:message_log") == 2
+    assert redis_client.get("chat:message_log:flush_lock") == b"someone-else" # Not released on its behalf
+
+    redis_client.delete("chat:message_log:flush_lock")
+    assert other.drain() == 2
+    with Session() as db:
+        stored = sorted(m.id for m in db.query(models.Message))
+    assert stored == sorted([first.user_message_id, first.bot_message_id, second.user_message_id, second.bot_message_id])
+    assert other.stats()["current_lag_ms"] == 0.0 and other.last_flush_lag_ms >= 0
+
+
+def test_write_behind_flusher_drains_on_stop(tmp_path):
+    Session, AsyncSession = _message_log_sessions(tmp_path)
+    log = MessageWriteBehind(Session, flush_interval_ms=10000)
+
+    async def run():
+        log.start()
+        async with AsyncSession() as db:
+            await record_turn(db, None, "u1", "hi", "greet", 0.95, "Hello!", "greet", message_log=log)
+        await log.stop() # Well before the timer would have fired
+
+    asyncio.run(run())
+    with Session() as db:
+        assert db.query(models.Message).count() == 2
+
+
+def test_migrations_create_the_model_indexes(tmp_path, monkeypatch):
+    backend_dir = os.path.join(os.path.dirname(__file__), "..", "..")
+    monkeypatch.setattr(settings, "DATABASE_URL", f"sqlite:///{tmp_path / 'migrated.db'}")
+    config = Config() # No ini file: env.py then leaves logging configuration alone
+    config.set_main_option("script_location", os.path.join(backend_dir, "alembic"))
+    command.upgrade(config, "head")
+
+    inspector = inspect(create_engine(settings.DATABASE_URL))
+    for table in models.Base.metadata.sorted_tables:
+        migrated = {index["name"]: index["column_names"] for index in inspector.get_indexes(table.name)}
+        assert migrated == {index.name: [column.name for column in index.columns] for index in table.indexes}
+    assert not next(c for c in inspector.get_columns("messages") if c["name"] == "timestamp")["nullable"]
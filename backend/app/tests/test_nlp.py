@@ -0,0 +1,284 @@
+# backend/app/tests/test_nlp.py
+import asyncio
+import logging
+import time
+
+import pytest
+
+from app.core.batching import MicroBatcher
+from app.core.entities import EntityExtractor, EntitySpan
+from app.core.nlp import ModelManager, ModelNotReady, PredictionCache, normalize_text
+from app.core.tokenization import LengthAwareTokenizer, TokenLengthHistogram
+from app.utils.cache import LRUTTLCache
+
+
+def _fake_predict_batch(calls):
+    def predict_batch(texts):
+        calls.append(list(texts))
+        return [(f"intent:{text}", 0.9, {"len": len(text)}) for text in texts]
+    return predict_batch
+
+
+def test_micro_batcher_groups_concurrent_requests_into_one_pass():
+    calls = []
+    batcher = MicroBatcher(_fake_predict_batch(calls), max_batch_size=8, max_wait_ms=20)
+
+    async def run():
+        results = await asyncio.gather(*(batcher.submit(f"msg{i}") for i in range(5)))
+        await batcher.stop()
+        return results
+
+    results = asyncio.run(run())
+    assert calls == [["msg0", "msg1", "msg2", "msg3", "msg4"]]
+    # Every caller gets its own prediction back
+    assert [r[0] for r in results] == [f"intent:msg{i}" for i in range(5)]
+    assert results[2][2] == {"len": 4}
+
+
+def test_micro_batcher_respects_max_batch_size():
+    calls = []
+    batcher = MicroBatcher(_fake_predict_batch(calls), max_batch_size=3, max_wait_ms=20)
+
+    async def run():
+        await asyncio.gather(*(batcher.submit(str(i)) for i in range(7)))
+        await batcher.stop()
+
+    asyncio.run(run())
+    assert [len(batch) for batch in calls] == [3, 3, 1]
+    assert batcher.items_processed == 7
+
+
+def test_micro_batcher_propagates_errors_to_every_caller():
+    def failing(texts):
+        raise ValueError("model exploded")
+
+    batcher = MicroBatcher(failing, max_batch_size=4, max_wait_ms=5)
+
+    async def run():
+        results = await asyncio.gather(batcher.submit("a"), batcher.submit("b"), return_exceptions=True)
+        await batcher.stop()
+        return results
+
+    results = asyncio.run(run())
+    assert all(isinstance(r, ValueError) for r in results)
+
+
+def test_micro_batcher_rejects_invalid_batch_size():
+    with pytest.raises(ValueError):
+        MicroBatcher(lambda texts: [], max_batch_size=0)
+
+
+def test_lru_ttl_cache_evicts_least_recently_used():
+    cache = LRUTTLCache(maxsize=2)
+    cache.set("hi", ("greet", 0.9))
+    cache.set("bye", ("goodbye", 0.8))
+    assert cache.get("hi") == ("greet", 0.9)  # "hi" is now the most recently used
+    cache.set("order", ("track_order", 0.7))
+
+    assert "bye" not in cache
+    assert cache.get("hi") == ("greet", 0.9)
+    assert cache.evictions == 1
+
+
+def test_lru_ttl_cache_expires_entries_and_counts_lookups():
+    cache = LRUTTLCache(maxsize=10, ttl=0.01)
+    cache.set("hi", ("greet", 0.9))
+    assert cache.get("hi") == ("greet", 0.9)
+    time.sleep(0.02)
+    assert cache.get("hi") is None
+
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"]) == (1, 1)
+    assert stats["size"] == 0
+
+
+class _WordTokenizer:
+    """Stand-in for a slow HF tokenizer: [CLS] + one id per word + [SEP]."""
+    is_fast = False
+    pad_token_id = 0
+
+    def __call__(self, texts, truncation=True, max_length=512):
+        ids = [[101] + [7] * len(text.split()) + [102] for text in texts]
+        return {"input_ids": [seq[:max_length - 1] + seq[-1:] if len(seq) > max_length else seq for seq in ids]}
+
+
+def test_token_length_histogram_percentiles():
+    histogram = TokenLengthHistogram(max_length=64)
+    histogram.observe_many([3] * 90 + [40] * 10)
+    assert histogram.percentile(50) == 3
+    assert histogram.percentile(95) == 40
+    snapshot = histogram.snapshot([8, 64])
+    assert snapshot["buckets_le"] == {"8": 90, "64": 100}
+    assert snapshot["max"] == 40
+
+
+def test_length_aware_tokenizer_buckets_short_and_long_messages_separately():
+    tokenizer = LengthAwareTokenizer(_WordTokenizer(), max_length=64, buckets=(8, 16, 32), min_samples=10**6)
+    groups = tokenizer.encode(["hi", "where is my order " + "please " * 10, "hello there"])
+
+    shapes = {tuple(indices): tuple(input_ids.shape) for indices, input_ids, _ in groups}
+    # The two short messages are padded to 8 tokens, not to the long one's 16
+    assert shapes == {(0, 2): (2, 8), (1,): (1, 16)}
+    indices, input_ids, attention_mask = groups[0]
+    assert input_ids[0, :3].tolist() == [101, 7, 102]
+    assert attention_mask[0].tolist() == [1, 1, 1, 0, 0, 0, 0, 0]
+
+
+def test_length_aware_tokenizer_caps_at_observed_percentile():
+    tokenizer = LengthAwareTokenizer(
+        _WordTokenizer(), max_length=64, buckets=(8, 16, 32), cap_percentile=90, min_samples=10, recompute_every=1
+    )
+    tokenizer.encode(["hi there"] * 20)  # 4 tokens each -> cap rounds up to the 8-token bucket
+    assert tokenizer.current_cap == 8
+
+    (indices, input_ids, _), = tokenizer.encode(["word " * 30])
+    assert input_ids.shape == (1, 8)
+    assert input_ids[0, -1].item() == 102  # Closing special token survives truncation
+    assert tokenizer.truncated == 1
+
+
+def test_normalize_text_masks_digits_and_whitespace():
+    assert normalize_text("  Where is my   ORDER 12345 ") == "where is my order #"
+    assert normalize_text("where is my order 67890") == normalize_text("Where is my order 12345")
+
+
+def test_prediction_cache_round_trip_without_redis():
+    cache = PredictionCache(maxsize=10, ttl=60)
+    cache.set_many({"hi": ("greet", 0.9)})
+    assert cache.get_many(["hi", "bye"]) == {"hi": ("greet", 0.9)}
+    assert cache.stats()["redis_enabled"] is False
+
+
+def test_model_manager_refuses_to_serve_until_ready():
+    manager = ModelManager()
+    with pytest.raises(ModelNotReady):
+        manager.get()
+    stub = object()
+    manager.use(stub)
+    assert manager.ready and manager.get() is stub
+
+
+def _tiny_checkpoint(path, head=True):
+    """A one-layer DistilBERT saved to `path`, with (head=True) or without a classifier head."""
+    from transformers import DistilBertConfig, DistilBertForSequenceClassification, DistilBertModel, DistilBertTokenizerFast
+    from app.core.intents import INTENT_LABELS
+    tokens = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]", "where", "is", "my", "order", "hi", "#", "1", "2", "3"]
+    path.mkdir()
+    (path / "vocab.txt").write_text("\n".join(tokens))
+    config = DistilBertConfig(vocab_size=len(tokens), dim=16, n_layers=1, n_heads=2, hidden_dim=32,
+                              max_position_embeddings=64, num_labels=len(INTENT_LABELS))
+    (DistilBertForSequenceClassification if head else DistilBertModel)(config).save_pretrained(path)
+    tokenizer = DistilBertTokenizerFast(vocab_file=str(path / "vocab.txt"))
+    tokenizer.save_pretrained(path)
+    return str(path), tokenizer
+
+
+def _encode(tokenizer):
+    encoded = tokenizer(["where is my order 123", "hi"], padding=True, return_tensors="pt")
+    return encoded["input_ids"], encoded["attention_mask"]
+
+
+def test_load_backend_picks_the_backend_by_name(tmp_path):
+    torch = pytest.importorskip("torch")
+    from app.core.intents import INTENT_LABELS
+    from app.core.nlp_backends import EagerTorchBackend, load_backend
+    checkpoint, tokenizer = _tiny_checkpoint(tmp_path / "model")
+
+    backend = load_backend("torch", checkpoint, len(INTENT_LABELS), str(tmp_path / "artifacts"), torch.device("cpu"))
+    assert isinstance(backend, EagerTorchBackend)
+    assert backend.logits(*_encode(tokenizer)).shape == (2, len(INTENT_LABELS))
+    with pytest.raises(ValueError, match="Unknown NLP backend 'tensorrt'"):
+        load_backend("tensorrt", checkpoint, len(INTENT_LABELS), str(tmp_path / "artifacts"), torch.device("cpu"))
+
+
+@pytest.mark.parametrize("name, artifact", [("torch_int8", "model.int8.pt"), ("torchscript", "model.torchscript.pt"),
+                                            ("onnx", "model.onnx")])
+def test_exported_backends_fail_clearly_without_their_artifact(tmp_path, name, artifact):
+    torch = pytest.importorskip("torch")
+    if name == "onnx":
+        pytest.importorskip("onnxruntime")
+    from app.core.intents import INTENT_LABELS
+    from app.core.nlp_backends import load_backend
+    checkpoint, _ = _tiny_checkpoint(tmp_path / "model")
+
+    with pytest.raises(FileNotFoundError, match=f"{artifact}. Run its export script"):
+        load_backend(name, checkpoint, len(INTENT_LABELS), str(tmp_path / "artifacts"), torch.device("cpu"))
+
+
+def test_base_checkpoint_without_a_classifier_head_is_refused(tmp_path, caplog, monkeypatch):
+    pytest.importorskip("torch")
+    monkeypatch.setattr(logging.getLogger("app"), "propagate", True) # configure_logging turns it off; caplog listens on the root
+    from app.core.intents import INTENT_LABELS
+    from app.core.nlp_backends import UntrainedHeadError, load_eager_model
+    checkpoint, _ = _tiny_checkpoint(tmp_path / "base", head=False)
+
+    with pytest.raises(UntrainedHeadError, match="classifier.weight"):
+        load_eager_model(checkpoint, len(INTENT_LABELS))
+    with caplog.at_level("WARNING", logger="app.core.nlp_backends"):
+        load_eager_model(checkpoint, len(INTENT_LABELS), allow_untrained_head=True)
+    assert "predictions are noise" in caplog.text
+
+
+def test_exports_share_one_saved_checkpoint(tmp_path):
+    torch = pytest.importorskip("torch")
+    from app.core.intents import INTENT_LABELS
+    from app.core.nlp_backends import export_torchscript, load_backend, save_checkpoint
+    base, tokenizer = _tiny_checkpoint(tmp_path / "base", head=False)
+    artifacts = str(tmp_path / "artifacts")
+
+    # Even a random head, once saved, is the same head for every backend
+    checkpoint = save_checkpoint(base, len(INTENT_LABELS), artifacts, tokenizer, allow_untrained_head=True)
+    export_torchscript(checkpoint, len(INTENT_LABELS), artifacts, tokenizer)
+    assert save_checkpoint(base, len(INTENT_LABELS), artifacts, tokenizer, allow_untrained_head=True) == checkpoint
+    inputs = _encode(tokenizer)
+    with torch.no_grad():
+        eager = load_backend("torch", checkpoint, len(INTENT_LABELS), artifacts, torch.device("cpu")).logits(*inputs)
+        traced = load_backend("torchscript", checkpoint, len(INTENT_LABELS), artifacts, torch.device("cpu")).logits(*inputs)
+    assert torch.allclose(eager, traced, atol=1e-5)
+
+
+# (intent, message, expected entities). The product cases used to come out corrupted,
+# e.g. "th superwidget" and "hyperflux cpcitor", because stop-phrases were removed as substrings.
+ENTITY_CORPUS = [
+    ("track_order", "where is my order 12345", {"order_id": "12345"}),
+    ("track_order", "status of ORD1234 please", {"order_id": "ORD1234"}),
+    ("track_order", "track ORD123XYZ-ABC123", {"order_id": "ORD123XYZ-ABC123"}),
+    ("track_order", "where is my stuff", {}),
+    ("shipping_info", "has order 12345 shipped yet?", {"order_id": "12345"}),
+    ("request_return", "return order 67890", {"order_id": "67890"}),
+    ("request_return", "I want to return SW001 from order 67890", {"order_id": "67890", "item_sku": "SW001"}),
+    ("availability", "is this SuperWidget available?", {"product_name_query": "superwidget"}),
+    ("price_query", "how much is the MegaDongle", {"product_name_query": "megadongle"}),
+    ("price_query", "how much for a Generic Product?", {"product_name_query": "generic product"}),
+    ("product_info", "tell me about the HyperFlux Capacitor", {"product_name_query": "hyperflux capacitor"}),
+    ("availability", "availability of AwesomeGadget", {"product_name_query": "awesomegadget"}),
+    ("availability", "is the AwesomeGadget in stock", {"product_name_query": "awesomegadget"}),
+    ("price_query", "price of HFC004", {"item_sku": "HFC004", "product_name_query": "hfc004"}),
+    ("product_info", "is the?", {}),
+    ("greet", "hi there 12345", {}),
+]
+
+
+@pytest.mark.parametrize("intent,text,expected", ENTITY_CORPUS)
+def test_entity_extractor_corpus(intent, text, expected):
+    extractor = EntityExtractor()
+    assert extractor.extract(intent, text) == expected
+    spans = extractor.extract_spans(intent, text)
+    assert {span.name: span.value for span in spans} == expected
+
+
+def test_entity_extractor_spans_point_into_the_original_text():
+    text = "Tell me about the HyperFlux Capacitor, please!"
+    spans = EntityExtractor().extract_spans("product_info", text)
+    assert spans == [EntitySpan("product_name_query", "hyperflux capacitor", 18, 37)]
+    assert text[18:37] == "HyperFlux Capacitor"
+
+    order = EntityExtractor().extract_spans("track_order", "order 12345 is late")[0]
+    assert (order.start, order.end) == (6, 11)
+
+
+def test_entity_extractor_prefers_the_longest_stop_phrase():
+    extractor = EntityExtractor(stop_phrases=["how much", "how much is", "is"])
+    assert extractor.product_query("how much is it") == "it"
+    assert extractor.product_query("how much wood") == "wood"
+    assert extractor.product_query("this island") == "this island"
@@ -0,0 +1,76 @@
+# backend/app/utils/circuit_breaker.py
+# Minimal circuit breaker for calls to upstream services.
+#
+#   closed     calls go through; `failure_threshold` consecutive failures open the circuit
+#   open       calls fail fast with CircuitOpenError for `reset_timeout` seconds
+#   half_open  one trial call is let through; success closes the circuit, failure re-opens it
+#
+# Every before_call() that doesn't raise must be followed by exactly one of record_success(),
+# record_failure() or record_abandoned() (a cancelled call), or a half-open circuit would wait
+# for its trial forever.
+
+import time
+from typing import Dict
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an upstream whose circuit is open."""
+
+
+class CircuitBreaker:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0, name: str = "upstream"):
+        if failure_threshold < 1:
+            raise ValueError("failure_threshold must be at least 1")
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.name = name
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self._trial_in_flight = False
+
+        self.rejected = 0 # Calls refused while open
+        self.times_opened = 0
+
+    def before_call(self) -> None:
+        """Raises CircuitOpenError if the call must not be made right now."""
+        if self.state == self.OPEN:
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                self.rejected += 1
+                raise CircuitOpenError(f"{self.name} circuit is open")
+            self.state = self.HALF_OPEN
+        if self.state == self.HALF_OPEN:
+            if self._trial_in_flight: # Only one probe at a time while half-open
+                self.rejected += 1
+                raise CircuitOpenError(f"{self.name} circuit is half-open")
+            self._trial_in_flight = True
+
+    def record_success(self) -> None:
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self._trial_in_flight = False
+
+    def record_abandoned(self) -> None:
+        """The call ended without an outcome (cancelled): the state stays, a half-open circuit lets the next call probe."""
+        self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        self._trial_in_flight = False
+        self.consecutive_failures += 1
+        if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                self.times_opened += 1
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "rejected": self.rejected,
+            "times_opened": self.times_opened,
+        }
@@ -0,0 +1,114 @@
+# backend/scripts/bench_batching.py
+# Compares the per-message inference path against the MicroBatcher under concurrent load.
+#
+# Usage (from backend/):
+#   python scripts/bench_batching.py --rate 40 --requests 400
+#   NLP_MODEL_NAME=/path/to/local/model python scripts/bench_batching.py
+#
+# Messages arrive open-loop (Poisson arrivals at --rate per second), and latency is
+# measured from each message's scheduled arrival, so time spent stuck behind a
+# blocking forward pass is counted. Reports throughput and p50/p99 latency as JSON.
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+
+# Make 'app' importable when run as a plain script
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from app.config import settings  # noqa: E402
+from app.core.batching import MicroBatcher  # noqa: E402
+from app.core.nlp import model_manager, process_messages  # noqa: E402
+
+SAMPLE_MESSAGES = [
+    "hi",
+    "where is my order 12345",
+    "has order 67890 shipped yet?",
+    "I want to return the SuperWidget from order 12345",
+    "how much is the MegaDongle",
+    "is the AwesomeGadget in stock",
+    "tell me about the HyperFlux Capacitor",
+    "talk to a human please",
+    "what are your shipping times",
+    "thanks, bye",
+]
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    k = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1)))))
+    return ordered[k]
+
+
+def summarize(name, latencies, elapsed, extra=None):
+    result = {
+        "path": name,
+        "requests": len(latencies),
+        "throughput_rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "mean_ms": round(statistics.mean(latencies) * 1000, 2),
+    }
+    if extra:
+        result.update(extra)
+    return result
+
+
+async def run_open_loop(classify, rate, total_requests, seed=42):
+    rng = random.Random(seed)
+    arrivals, t = [], 0.0
+    for _ in range(total_requests):
+        t += rng.expovariate(rate)
+        arrivals.append((t, rng.choice(SAMPLE_MESSAGES)))
+
+    latencies = []
+    loop = asyncio.get_running_loop()
+    origin = loop.time()
+
+    async def request(offset, text):
+        await asyncio.sleep(max(0.0, origin + offset - loop.time()))
+        await classify(text)
+        latencies.append(loop.time() - (origin + offset))
+
+    await asyncio.gather(*(request(offset, text) for offset, text in arrivals))
+    return latencies, loop.time() - origin
+
+
+async def bench_per_message(rate, total_requests):
+    async def classify(text):
+        # The pre-batching behaviour: a blocking batch-of-1 forward pass on the event loop
+        return model_manager.get().predict(text)
+
+    latencies, elapsed = await run_open_loop(classify, rate, total_requests)
+    return summarize("per_message", latencies, elapsed)
+
+
+async def bench_batched(rate, total_requests, max_batch_size, max_wait_ms):
+    batcher = MicroBatcher(process_messages, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms)
+    latencies, elapsed = await run_open_loop(batcher.submit, rate, total_requests)
+    extra = {"max_batch_size": max_batch_size, "max_wait_ms": max_wait_ms,
+             "avg_batch_size": round(batcher.average_batch_size, 2)}
+    await batcher.stop()
+    return summarize("batched", latencies, elapsed, extra)
+
+
+async def main(args):
+    settings.NLP_CACHE_ENABLED = False  # Measure the model, not prediction-cache hits on repeated samples
+    model_manager.load()  # Includes warm-up, so lazy allocations don't land in the first measurement
+    results = [await bench_per_message(args.rate, args.requests)]
+    for max_wait_ms in args.max_wait_ms:
+        results.append(await bench_batched(args.rate, args.requests, args.max_batch_size, max_wait_ms))
+    print(json.dumps({"offered_rate_rps": args.rate, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-message vs micro-batched inference benchmark")
+    parser.add_argument("--rate", type=float, default=40.0, help="Offered load in messages per second")
+    parser.add_argument("--requests", type=int, default=400, help="Total requests per path")
+    parser.add_argument("--max-batch-size", type=int, default=16)
+    parser.add_argument("--max-wait-ms", type=float, nargs="+", default=[2.0, 5.0])
+    asyncio.run(main(parser.parse_args()))
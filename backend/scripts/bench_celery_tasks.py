@@ -0,0 +1,99 @@
+# backend/scripts/bench_celery_tasks.py
+# Throughput of the background analytics work (app/core/background.py, record_turn_analytics
+# in app/core/tasks.py): one Celery task per turn vs one task per TASK_BATCH_MAX_ITEMS turns.
+#
+# Usage (from backend/, with a Redis running locally):
+#   python scripts/bench_celery_tasks.py [--redis-url redis://localhost:6379/0] [--events 5000]
+#       [--batch-sizes 1,50,200] [--concurrency 1]
+#
+# Starts a real worker on the analytics queue (celery -A app.core.tasks worker -Q analytics),
+# with the broker, result backend and REDIS_URL all on --redis-url. For each batch size it
+# sends --events analytics events as tasks of that many events, then waits until the worker
+# has counted every one of them (the bench channel's counter in the analytics hash).
+# Reported per batch size: seconds to send (the cost the API pays), seconds until the worker
+# was done, and events per second end to end.
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+# Make 'app' importable when run as a plain script
+BACKEND = os.path.join(os.path.dirname(__file__), '..')
+sys.path.append(BACKEND)
+
+
+def run(args):
+    # Set before app.config is imported: the worker subprocess reads the same variables
+    os.environ.update({
+        "CELERY_BROKER_URL": args.redis_url,
+        "CELERY_RESULT_BACKEND": args.redis_url,
+        "REDIS_URL": args.redis_url,
+    })
+    from app.core.tasks import celery_app  # noqa: E402
+    from app.db.session import get_redis_client  # noqa: E402
+
+    worker = subprocess.Popen(
+        [sys.executable, "-m", "celery", "-A", "app.core.tasks", "worker", "-Q", "analytics",
+         "-P", args.pool, "-c", str(args.concurrency), "--loglevel", "WARNING", "-n", f"bench-{os.getpid()}@%h"],
+        cwd=BACKEND, env=os.environ.copy(),
+    )
+    redis_client = get_redis_client()
+    task = celery_app.tasks["record_turn_analytics"]
+
+    def send_and_wait(count, batch_size):
+        """Sends count events, batch_size per task; returns (seconds sending, seconds until all were counted)."""
+        channel = f"bench-{batch_size}-{time.time_ns()}"
+        now = time.time()
+        key = f"analytics:turns:{datetime.utcfromtimestamp(now).strftime('%Y%m%d%H')}"
+        events = [{"ts": now, "channel": channel, "intent": "track_order", "confidence": 0.9, "escalated": False}
+                  for _ in range(count)]
+        began = time.perf_counter()
+        for start in range(0, len(events), batch_size):
+            task.apply_async(args=[events[start:start + batch_size]], ignore_result=True)
+        sent = time.perf_counter() - began
+        deadline = time.time() + args.timeout
+        while float(redis_client.hget(key, f"channel:{channel}") or 0) < count:
+            if worker.poll() is not None:
+                raise RuntimeError("The worker exited; see its output above")
+            if time.time() > deadline:
+                raise TimeoutError(f"Worker did not finish batch size {batch_size} within {args.timeout}s")
+            time.sleep(0.02)
+        redis_client.hdel(key, f"channel:{channel}")
+        return sent, time.perf_counter() - began
+
+    results = []
+    try:
+        send_and_wait(1, 1) # Worker started and consuming
+        for batch_size in [int(size) for size in args.batch_sizes.split(",")]:
+            sent, done = send_and_wait(args.events, batch_size)
+            results.append({
+                "batch_size": batch_size,
+                "tasks": -(-args.events // batch_size),
+                "send_seconds": round(sent, 3),
+                "done_seconds": round(done, 3),
+                "events_per_second": round(args.events / done, 1),
+            })
+    finally:
+        worker.terminate()
+        worker.wait(timeout=30)
+
+    print(json.dumps({"events": args.events, "pool": args.pool, "concurrency": args.concurrency, "runs": results}, indent=2))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Celery analytics tasks: per-turn vs batched throughput")
+    parser.add_argument("--redis-url", default=os.getenv("REDIS_URL", "redis://localhost:6379/0"))
+    parser.add_argument("--events", type=int, default=5000)
+    parser.add_argument("--batch-sizes", default="1,50,200", help="Events per task, comma separated")
+    parser.add_argument("--pool", default="prefork", help="Worker pool (prefork, solo, threads)")
+    parser.add_argument("--concurrency", type=int, default=1, help="Worker processes")
+    parser.add_argument("--timeout", type=float, default=300.0)
+    run(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+# backend/scripts/bench_entities.py
+# Microbenchmark of entity extraction: the previous str.replace implementation vs EntityExtractor.
+#
+# Usage (from backend/):
+#   python scripts/bench_entities.py [--iterations 2000]
+#
+# Runs both over the labeled sample in scripts/data/intent_sample.jsonl (each message with
+# its gold intent) and reports microseconds per call plus every message where the two
+# disagree, so behaviour changes are visible next to the speedup.
+
+import argparse
+import json
+import os
+import re
+import sys
+import time
+
+# Make 'app' importable when run as a plain script
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from app.core.entities import entity_extractor  # noqa: E402
+
+SAMPLE_PATH = os.path.join(os.path.dirname(__file__), "data", "intent_sample.jsonl")
+
+
+def legacy_extract_entities(intent, text):
+    """The pre-EntityExtractor implementation of IntentClassifier.extract_entities, kept for comparison."""
+    entities = {}
+    text_lower = text.lower()
+    if intent == "track_order":
+        match = re.search(r'\b(\d{5,})\b', text)
+        if match:
+            entities["order_id"] = match.group(1)
+        else:
+            match_alnum = re.search(r'\b([a-zA-Z0-9]{6,}-[a-zA-Z0-9]{6,}|[a-zA-Z]{2,}\d{4,})\b', text)
+            if match_alnum:
+                entities["order_id"] = match_alnum.group(1)
+    elif intent in ("product_info", "price_query", "availability"):
+        keywords_to_remove = [
+            "tell me about", "info on", "product info for", "is", "in stock",
+            "how much is", "price of", "availability of", "check if", "available",
+            "the", "a", "an", "for"
+        ]
+        temp_message = text_lower
+        for kw in keywords_to_remove:
+            temp_message = temp_message.replace(kw, "")
+        temp_message = temp_message.replace("?", "").strip()
+        if temp_message:
+            entities["product_name_query"] = temp_message
+    elif intent == "request_return":
+        match = re.search(r'\b(\d{5,})\b', text)
+        if match:
+            entities["order_id"] = match.group(1)
+    return entities
+
+
+def time_per_call_us(extract, sample, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for item in sample:
+            extract(item["intent"], item["text"])
+    return (time.perf_counter() - start) / (iterations * len(sample)) * 1e6
+
+
+def main(iterations):
+    with open(SAMPLE_PATH) as f:
+        sample = [json.loads(line) for line in f if line.strip()]
+
+    legacy_us = time_per_call_us(legacy_extract_entities, sample, iterations)
+    new_us = time_per_call_us(entity_extractor.extract, sample, iterations)
+
+    differences = []
+    for item in sample:
+        old, new = legacy_extract_entities(item["intent"], item["text"]), entity_extractor.extract(item["intent"], item["text"])
+        if old != new:
+            differences.append({"intent": item["intent"], "text": item["text"], "legacy": old, "new": new})
+
+    print(json.dumps({
+        "messages": len(sample),
+        "iterations": iterations,
+        "legacy_us_per_call": round(legacy_us, 2),
+        "extractor_us_per_call": round(new_us, 2),
+        "speedup": round(legacy_us / new_us, 2),
+        "differences": differences,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark entity extraction")
+    parser.add_argument("--iterations", type=int, default=2000)
+    main(parser.parse_args().iterations)
@@ -0,0 +1,138 @@
+# backend/scripts/bench_escalation_queue.py
+# Enqueue -> claim latency of the escalation stream (app/core/escalations.py) under a burst.
+#
+# Usage (from backend/, with a Redis running locally):
+#   python scripts/bench_escalation_queue.py [--redis-url redis://localhost:6379/0] [--tickets 2000]
+#       [--agents 10] [--stalled-agents 2] [--claim-timeout 2]
+#
+# What it does, on a fresh stream key:
+#   - --agents agent loops claim one ticket at a time (long-polling --block-ms, like the agent UI
+#     calling POST /escalations/claim with block_seconds) and ack it after --handle-ms;
+#   - --stalled-agents claim tickets and never ack them, so those tickets are handed out
+#     again once --claim-timeout has passed;
+#   - an EscalationNotifier consumes the notifications group, with a no-op standing in for
+#     the Celery task;
+#   - --tickets tickets are enqueued in one burst, --concurrency XADDs at a time.
+# Reported: enqueue throughput; enqueue -> claim latency (p50/p95/p99/max) of first claims and
+# of re-claims; time until every ticket was acked by an agent and notified.
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+import redis.asyncio
+
+# Make 'app' importable when run as a plain script
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from app.core.escalations import EscalationNotifier, EscalationQueue  # noqa: E402
+
+
+def percentiles(values):
+    values = sorted(values)
+    pick = lambda q: round(values[min(len(values) - 1, int(q * len(values)))], 2) if values else None  # noqa: E731
+    return {"count": len(values), "p50": pick(0.5), "p95": pick(0.95), "p99": pick(0.99), "max": pick(1.0)}
+
+
+async def run(args):
+    client = redis.asyncio.Redis.from_url(args.redis_url, max_connections=args.agents + args.stalled_agents + args.concurrency + 4)
+    stream = f"bench:escalations:{int(time.time() * 1000)}"
+    queue = EscalationQueue(client, stream=stream, claim_timeout_seconds=args.claim_timeout)
+    await queue.ensure_groups()
+
+    first_claims, reclaims, acked, stalled_held = [], [], set(), []
+    seen = set()
+    notified = []
+    notifier = EscalationNotifier(queue, "bench-notifier", notify=lambda ticket: notified.append(ticket["ticket_id"]), block_ms=200)
+    done = asyncio.Event()
+
+    async def agent(name):
+        while not done.is_set():
+            tickets = await queue.claim(name, count=1, block_ms=args.block_ms)
+            now = time.time()
+            for ticket in tickets:
+                latency = (now - ticket["enqueued_at"]) * 1000
+                (reclaims if ticket["ticket_id"] in seen else first_claims).append(latency)
+                seen.add(ticket["ticket_id"])
+                await asyncio.sleep(args.handle_ms / 1000)
+                await queue.ack(queue.agent_group, [ticket["entry_id"]])
+                acked.add(ticket["ticket_id"])
+            if len(acked) >= args.tickets:
+                done.set()
+
+    async def stalled_agent(name):
+        held = 0
+        while held < args.stalled_claims and not done.is_set(): # Then the tab is closed: never acked
+            tickets = await queue.claim(name, count=args.stalled_claims - held, block_ms=args.block_ms)
+            now = time.time()
+            for ticket in tickets:
+                first_claims.append((now - ticket["enqueued_at"]) * 1000)
+                seen.add(ticket["ticket_id"])
+            stalled_held.extend(tickets)
+            held += len(tickets)
+
+    async def notify_until_done():
+        while len(set(notified)) < args.tickets:
+            await notifier.run_once()
+
+    # Stalled agents go first so they are guaranteed to hold some tickets
+    stalled = [asyncio.create_task(stalled_agent(f"stalled-{i}")) for i in range(args.stalled_agents)]
+    agents = [asyncio.create_task(agent(f"agent-{i}")) for i in range(args.agents)]
+    notifying = asyncio.create_task(notify_until_done())
+    await asyncio.sleep(0.2) # Everyone is blocked in XREADGROUP before the burst
+
+    began = time.perf_counter()
+    for start in range(0, args.tickets, args.concurrency):
+        await asyncio.gather(*(
+            queue.enqueue(ticket_id, ticket_id, f"user{ticket_id}", "I want to talk to a human")
+            for ticket_id in range(start + 1, min(start + args.concurrency, args.tickets) + 1)
+        ))
+    enqueue_seconds = time.perf_counter() - began
+
+    await asyncio.wait_for(done.wait(), args.timeout)
+    agents_done = time.perf_counter() - began
+    await asyncio.wait_for(notifying, args.timeout)
+    notified_done = time.perf_counter() - began
+    for task in agents + stalled:
+        task.cancel()
+    backlog = await queue.backlog()
+    await client.delete(stream)
+    await client.aclose()
+
+    print(json.dumps({
+        "tickets": args.tickets,
+        "agents": args.agents,
+        "stalled_agents": args.stalled_agents,
+        "claim_timeout_seconds": args.claim_timeout,
+        "enqueue_seconds": round(enqueue_seconds, 3),
+        "enqueue_per_second": round(args.tickets / enqueue_seconds, 1),
+        "enqueue_to_first_claim_ms": percentiles(first_claims),
+        "enqueue_to_reclaim_ms": percentiles(reclaims),
+        "held_by_stalled_agents": len(stalled_held),
+        "all_acked_seconds": round(agents_done, 3),
+        "all_notified_seconds": round(notified_done, 3),
+        "enqueue_errors": queue.enqueue_errors,
+        "groups": backlog["groups"],
+    }, indent=2))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Escalation stream: enqueue -> claim latency under a burst")
+    parser.add_argument("--redis-url", default=os.getenv("REDIS_URL", "redis://localhost:6379/0"))
+    parser.add_argument("--tickets", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50, help="XADDs in flight during the burst")
+    parser.add_argument("--agents", type=int, default=10)
+    parser.add_argument("--block-ms", type=int, default=1000, help="How long an agent's claim long-polls")
+    parser.add_argument("--handle-ms", type=float, default=0, help="Time an agent spends on a ticket before acking")
+    parser.add_argument("--stalled-agents", type=int, default=2, help="Agents that claim and never ack")
+    parser.add_argument("--stalled-claims", type=int, default=5, help="Tickets each stalled agent holds")
+    parser.add_argument("--claim-timeout", type=float, default=2.0, help="ESCALATION_CLAIM_TIMEOUT_SECONDS for the run")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
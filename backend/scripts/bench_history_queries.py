@@ -0,0 +1,110 @@
+# backend/scripts/bench_history_queries.py
+# Times the conversation-history, per-user and ticket queries against a database filled by
+# scripts/generate_chat_data.py, and shows how each one is executed.
+#
+# Usage (from backend/), before and after `alembic upgrade head`:
+#   python scripts/bench_history_queries.py --database-url postgresql://... [--runs 50]
+#
+# Per query: p50/p95 latency over --runs random parameters, and a plan summary (scan
+# types and, on PostgreSQL, how many partitions of `messages` were read).
+
+import argparse
+import json
+import os
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, text
+
+QUERIES = {
+    # Conversation history, latest 50 messages
+    "conversation_history": (
+        'SELECT id, content, sender, "timestamp" FROM messages WHERE conversation_id = :conversation_id '
+        'ORDER BY "timestamp" DESC LIMIT 50'
+    ),
+    # The same, but only the last day (a WebSocket re-attaching to a live conversation)
+    "recent_conversation_history": (
+        'SELECT id, content, sender, "timestamp" FROM messages WHERE conversation_id = :conversation_id '
+        'AND "timestamp" >= :since ORDER BY "timestamp"'
+    ),
+    # A user's conversations, newest first
+    "user_conversations": (
+        "SELECT id, start_time, escalated FROM conversations WHERE user_id = :user_id "
+        "ORDER BY start_time DESC LIMIT 20"
+    ),
+    "conversation_ticket": "SELECT id, status FROM escalation_tickets WHERE conversation_id = :conversation_id",
+    # Agent dashboard: the pending queue, oldest first
+    "pending_tickets": (
+        "SELECT id, conversation_id, created_at FROM escalation_tickets WHERE status = 'pending' "
+        "ORDER BY created_at LIMIT 50"
+    ),
+    # Message volume of the last hour
+    "messages_last_hour": 'SELECT count(*) FROM messages WHERE "timestamp" >= :last_hour',
+}
+
+
+def plan_summary(connection, sql, params):
+    if connection.dialect.name == "postgresql":
+        plan = connection.execute(text(f"EXPLAIN (FORMAT JSON) {sql}"), params).scalar()
+        nodes, relations = [], set()
+
+        def walk(node):
+            nodes.append(node["Node Type"])
+            if "Relation Name" in node:
+                relations.add(node["Relation Name"])
+            for child in node.get("Plans", []):
+                walk(child)
+
+        walk(plan[0]["Plan"])
+        return {
+            "scans": sorted({n for n in nodes if "Scan" in n}),
+            "message_partitions_read": len([r for r in relations if r.startswith("messages")]),
+        }
+    rows = connection.execute(text(f"EXPLAIN QUERY PLAN {sql}"), params).all()
+    return {"plan": [row[-1] for row in rows]}
+
+
+def main(database_url, runs):
+    engine = create_engine(database_url)
+    rng = random.Random(11)
+    with engine.connect() as connection:
+        max_conversation = connection.execute(text("SELECT MAX(id) FROM conversations")).scalar()
+        max_user = connection.execute(text("SELECT COUNT(DISTINCT user_id) FROM conversations")).scalar()
+        newest = connection.execute(text("SELECT MAX(start_time) FROM conversations")).scalar() or datetime.utcnow()
+        message_count = connection.execute(text("SELECT COUNT(*) FROM messages")).scalar()
+
+        def params():
+            conversation_id = rng.randint(max(1, max_conversation - 1000), max_conversation) if rng.random() < 0.5 \
+                else rng.randint(1, max_conversation) # Half recent, half anywhere in the history
+            return {
+                "conversation_id": conversation_id,
+                "user_id": f"user{rng.randrange(max_user)}",
+                "since": newest - timedelta(days=1),
+                "last_hour": newest - timedelta(hours=1),
+            }
+
+        results = {}
+        for name, sql in QUERIES.items():
+            connection.execute(text(sql), params()).all() # Warm-up
+            timings = []
+            for _ in range(runs):
+                started = time.perf_counter()
+                connection.execute(text(sql), params()).all()
+                timings.append((time.perf_counter() - started) * 1000)
+            timings.sort()
+            results[name] = {
+                "p50_ms": round(statistics.median(timings), 3),
+                "p95_ms": round(timings[int(0.95 * (len(timings) - 1))], 3),
+                **plan_summary(connection, sql, params()),
+            }
+    print(json.dumps({"database": engine.dialect.name, "messages": message_count, "runs": runs, "queries": results}, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark chat history queries")
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL", "sqlite:////tmp/chat_history.db"))
+    parser.add_argument("--runs", type=int, default=50)
+    args = parser.parse_args()
+    main(args.database_url, args.runs)
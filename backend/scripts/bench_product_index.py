@@ -0,0 +1,118 @@
+# backend/scripts/bench_product_index.py
+# Build time, memory and lookup latency of ProductIndex vs the old linear substring scan.
+#
+# Usage (from backend/):
+#   python scripts/bench_product_index.py [--sizes 1000 10000 100000 1000000] [--queries 300]
+#
+# Catalogs are synthetic ("Ultra Quantum Widget X123"-style names, fixed seed). For each
+# size three query mixes are timed: exact names, partial names ("quantum widget") and
+# names with one typo. The linear scan is the previous MockEcommerceAPI.get_product_info
+# loop and is only timed on a few queries for large catalogs, since it is O(catalog).
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+# Make 'app' importable when run as a plain script
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from app.services.product_index import ProductIndex  # noqa: E402
+
+PREFIXES = ["Ultra", "Mega", "Super", "Hyper", "Micro", "Awesome", "Smart", "Eco", "Pro", "Nano", "Turbo", "Quantum"]
+NOUNS = ["Widget", "Dongle", "Gadget", "Capacitor", "Blender", "Speaker", "Charger", "Lamp", "Router", "Kettle", "Drone", "Camera"]
+SERIES = ["Lite", "Max", "Plus", "Mini", "Air", "One", "Neo", "Flux", "Core", "Edge"]
+
+
+def make_catalog(size, rng):
+    names = set()
+    while len(names) < size:
+        names.add(f"{rng.choice(PREFIXES)} {rng.choice(SERIES)} {rng.choice(NOUNS)} {rng.choice('ABCDEFGHKLMNPRSTXZ')}{rng.randint(1, 99999)}")
+    return sorted(names)
+
+
+def with_typo(name, rng):
+    i = rng.randrange(1, len(name) - 1)
+    return name[:i] + name[i + 1] + name[i] + name[i + 2:] # Swap two adjacent characters
+
+
+def current_rss_mb():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024.0 * 1024.0)
+    except (OSError, ValueError):
+        return 0.0
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[max(0, min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1)))))]
+
+
+def linear_scan(names, query):
+    for name in names:
+        if query.lower() in name.lower():
+            return name
+    return None
+
+
+def time_queries(lookup, queries, expected):
+    """lookup(query) returns the matched product name or None; accuracy is top-1 == intended product."""
+    latencies, correct = [], 0
+    for query, want in zip(queries, expected):
+        start = time.perf_counter()
+        found = lookup(query)
+        latencies.append(time.perf_counter() - start)
+        correct += found == want
+    return {
+        "p50_us": round(percentile(latencies, 50) * 1e6, 1),
+        "p99_us": round(percentile(latencies, 99) * 1e6, 1),
+        "top1_accuracy": round(correct / len(queries), 3),
+    }
+
+
+def bench_size(size, query_count, rng):
+    names = make_catalog(size, rng)
+
+    rss_before = current_rss_mb()
+    start = time.perf_counter()
+    index = ProductIndex()
+    for name in names:
+        index.add(name, name)
+    index.freeze()
+    build_seconds = time.perf_counter() - start
+
+    picked = [rng.choice(names) for _ in range(query_count)]
+    mixes = {
+        "exact": picked,
+        "partial": [" ".join(name.split()[1:]) for name in picked], # Drop the first word
+        "typo": [with_typo(name, rng) for name in picked],
+    }
+
+    report = {
+        "catalog_size": size,
+        "build_seconds": round(build_seconds, 2),
+        "index_rss_mb": round(current_rss_mb() - rss_before, 1),
+        "trigrams": len(index._postings),
+    }
+    def index_lookup(query):
+        match = index.best(query)
+        return match.name if match else None
+
+    for mix, queries in mixes.items():
+        report[f"index_{mix}"] = time_queries(index_lookup, queries, picked)
+    scan_count = max(3, query_count * 1000 // size)
+    report["linear_scan_partial"] = time_queries(lambda query: linear_scan(names, query), mixes["partial"][:scan_count], picked)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the product-name index")
+    parser.add_argument("--sizes", nargs="+", type=int, default=[1000, 10000, 100000, 1000000])
+    parser.add_argument("--queries", type=int, default=300)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+    print(json.dumps([bench_size(size, args.queries, rng) for size in args.sizes], indent=2))
@@ -0,0 +1,162 @@
+# backend/scripts/compare_backends.py
+# Accuracy-parity, latency and memory comparison of the NLP inference backends.
+#
+# Usage (from backend/), after running the export scripts:
+#   python scripts/compare_backends.py [--backends torch torch_int8 torchscript onnx]
+#
+# Each backend runs in its own subprocess so its memory is measured in isolation. All of
+# them classify the fixed labeled sample in scripts/data/intent_sample.jsonl; parity is
+# reported against the eager torch backend (label agreement, max probability drift)
+# and accuracy against the sample's gold labels. Every backend, eager torch included, is
+# loaded from the checkpoint the exports were made from (NLP_BACKEND_ARTIFACTS_DIR/checkpoint).
+
+import argparse
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import time
+
+# Make 'app' importable when run as a plain script
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from app.core.intents import INTENT_LABELS  # noqa: E402
+
+SAMPLE_PATH = os.path.join(os.path.dirname(__file__), "data", "intent_sample.jsonl")
+
+
+def load_sample():
+    with open(SAMPLE_PATH) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0  # ru_maxrss is KiB on Linux
+
+
+def current_rss_mb():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024.0 * 1024.0)
+    except (OSError, ValueError):
+        return peak_rss_mb()  # Non-Linux: peak is the best we have
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[max(0, min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1)))))]
+
+
+def run_worker(backend_name, repeats, batch_size):
+    """Measures one backend in this process and prints a JSON report."""
+    import torch
+    from transformers import AutoTokenizer
+
+    from app.config import settings
+    from app.core.nlp_backends import CHECKPOINT_DIR, load_backend
+
+    if settings.NLP_TORCH_THREADS > 0:
+        torch.set_num_threads(settings.NLP_TORCH_THREADS)
+
+    rss_before = current_rss_mb()
+    load_start = time.perf_counter()
+    checkpoint = os.path.join(settings.NLP_BACKEND_ARTIFACTS_DIR, CHECKPOINT_DIR)
+    if not os.path.isdir(checkpoint):
+        raise SystemExit(f"No exported checkpoint in {checkpoint}: run an export script first")
+    tokenizer = AutoTokenizer.from_pretrained(checkpoint)
+    backend = load_backend(backend_name, checkpoint, len(INTENT_LABELS),
+                           settings.NLP_BACKEND_ARTIFACTS_DIR, torch.device("cpu"))
+    load_seconds = time.perf_counter() - load_start
+
+    texts = [item["text"] for item in load_sample()]
+
+    def probabilities(batch):
+        encoded = tokenizer(batch, truncation=True, padding=True, max_length=512, return_tensors="pt")
+        with torch.no_grad():
+            return torch.softmax(backend.logits(encoded["input_ids"], encoded["attention_mask"]), dim=1)
+
+    probabilities(texts[:batch_size])  # Warm-up
+
+    single = []
+    for _ in range(repeats):
+        for text in texts:
+            start = time.perf_counter()
+            probabilities([text])
+            single.append(time.perf_counter() - start)
+
+    batched = []
+    for _ in range(repeats):
+        for i in range(0, len(texts), batch_size):
+            start = time.perf_counter()
+            probabilities(texts[i:i + batch_size])
+            batched.append(time.perf_counter() - start)
+
+    probs = probabilities(texts).tolist()
+    print(json.dumps({
+        "backend": backend_name,
+        "load_seconds": round(load_seconds, 3),
+        "rss_mb": round(current_rss_mb(), 1),
+        "model_rss_mb": round(current_rss_mb() - rss_before, 1),  # Steady-state cost of the loaded backend
+        "peak_rss_mb": round(peak_rss_mb(), 1),  # Includes transient load/convert memory
+        "single_p50_ms": round(percentile(single, 50) * 1000, 3),
+        "single_p99_ms": round(percentile(single, 99) * 1000, 3),
+        "single_mean_ms": round(statistics.mean(single) * 1000, 3),
+        f"batch{batch_size}_p50_ms": round(percentile(batched, 50) * 1000, 3),
+        "probabilities": probs,
+    }))
+
+
+def argmax_labels(probs):
+    return [INTENT_LABELS[max(range(len(row)), key=row.__getitem__)] for row in probs]
+
+
+def compare(backends, repeats, batch_size):
+    from app.core.nlp_backends import BACKENDS
+
+    sample = load_sample()
+    gold = [item["intent"] for item in sample]
+
+    reports = {}
+    for name in backends:
+        if name not in BACKENDS:
+            raise SystemExit(f"Unknown backend '{name}'")
+        proc = subprocess.run(
+            [sys.executable, __file__, "--worker", name, "--repeats", str(repeats), "--batch-size", str(batch_size)],
+            capture_output=True, text=True,
+        )
+        if proc.returncode != 0:
+            # Typically a missing export; keep going so the other backends are still reported
+            reports[name] = {"backend": name, "error": proc.stderr.strip().splitlines()[-1] if proc.stderr else "failed"}
+            continue
+        reports[name] = json.loads(proc.stdout.strip().splitlines()[-1])
+
+    reference = reports.get("torch", {}).get("probabilities")
+    results = []
+    for report in reports.values():
+        probs = report.pop("probabilities", None)
+        if probs is not None:
+            predicted = argmax_labels(probs)
+            report["accuracy_vs_gold"] = round(sum(p == g for p, g in zip(predicted, gold)) / len(gold), 4)
+            if reference is not None:
+                ref_predicted = argmax_labels(reference)
+                report["label_agreement_vs_torch"] = round(
+                    sum(a == b for a, b in zip(predicted, ref_predicted)) / len(predicted), 4)
+                report["max_prob_diff_vs_torch"] = round(max(
+                    abs(a - b) for row, ref_row in zip(probs, reference) for a, b in zip(row, ref_row)), 6)
+        results.append(report)
+    print(json.dumps({"sample_size": len(sample), "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare NLP inference backends")
+    parser.add_argument("--backends", nargs="+", default=["torch", "torch_int8", "torchscript", "onnx"])
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.worker:
+        run_worker(args.worker, args.repeats, args.batch_size)
+    else:
+        compare(args.backends, args.repeats, args.batch_size)
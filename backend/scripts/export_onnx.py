@@ -0,0 +1,34 @@
+# backend/scripts/export_onnx.py
+# One-time export of the intent model to an ONNX graph for ONNX Runtime (NLP_BACKEND=onnx).
+#
+# Exports from NLP_BACKEND_ARTIFACTS_DIR/checkpoint, which the first export script run saves
+# from NLP_MODEL_NAME (app/core/nlp_backends.py), so every backend gets the same weights.
+#
+# Usage (from backend/):
+#   python scripts/export_onnx.py [--output-dir models/intent]
+# then run the app with NLP_BACKEND=onnx and the same NLP_BACKEND_ARTIFACTS_DIR.
+
+import argparse
+import os
+import sys
+
+# Make 'app' importable when run as a plain script
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from transformers import AutoTokenizer  # noqa: E402
+
+from app.config import settings  # noqa: E402
+from app.core.intents import INTENT_LABELS  # noqa: E402
+from app.core.nlp_backends import export_onnx, save_checkpoint  # noqa: E402
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the intent model for NLP_BACKEND=onnx")
+    parser.add_argument("--output-dir", default=settings.NLP_BACKEND_ARTIFACTS_DIR)
+    args = parser.parse_args()
+
+    tokenizer = AutoTokenizer.from_pretrained(settings.NLP_MODEL_NAME)
+    checkpoint = save_checkpoint(settings.NLP_MODEL_NAME, len(INTENT_LABELS), args.output_dir, tokenizer,
+                                 settings.NLP_ALLOW_UNTRAINED_HEAD)
+    path = export_onnx(checkpoint, len(INTENT_LABELS), args.output_dir, tokenizer)
+    print(f"Exported {checkpoint} for NLP_BACKEND=onnx to {path}")
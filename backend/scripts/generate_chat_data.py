@@ -0,0 +1,148 @@
+# backend/scripts/generate_chat_data.py
+# Fills the database with synthetic conversations, messages and escalation tickets, for
+# scripts/bench_history_queries.py.
+#
+# Usage (from backend/):
+#   python scripts/generate_chat_data.py --database-url postgresql://... --messages 10000000
+#
+# On PostgreSQL the rows are generated server-side (INSERT ... SELECT generate_series),
+# which loads 10M messages in minutes. Elsewhere (SQLite) they're inserted in batches
+# from Python, which is fine for a few million rows.
+#
+# Shape of the data: --conversations conversations spread evenly over the last --months
+# months, owned by --users users; each conversation's messages are consecutive, 30 seconds
+# apart. Five percent of the conversations have a ticket (a third of those pending).
+#
+# If the schema is at Alembic head on an empty database, the monthly partitions for the
+# whole history are created first so the rows land in them rather than messages_default.
+
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, insert, text
+
+# Make 'app' importable when run as a plain script
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from app.db import models  # noqa: E402
+
+PG_CONVERSATIONS = """
+INSERT INTO conversations (user_id, start_time, end_time, escalated)
+SELECT 'user' || (c % :users),
+       CAST(:start AS timestamp) + (c - 1) * CAST(:conversation_step AS interval),
+       CAST(:start AS timestamp) + (c - 1) * CAST(:conversation_step AS interval) + :per_conversation * interval '30 seconds',
+       c % 20 = 0
+FROM generate_series(1, :conversations) AS c
+"""
+
+# Message m belongs to the ((m - 1) / per_conversation)-th conversation (ids assigned in
+# start_time order above, so offset by the first id this run created)
+PG_MESSAGES = """
+INSERT INTO messages (conversation_id, content, "timestamp", sender, intent, confidence)
+SELECT :first_conversation + (m - 1) / :per_conversation,
+       'synthetic message ' || m,
+       CAST(:start AS timestamp) + ((m - 1) / :per_conversation) * CAST(:conversation_step AS interval) + ((m - 1) % :per_conversation) * interval '30 seconds',
+       CASE WHEN m % 2 = 0 THEN 'bot' ELSE 'user' END,
+       (ARRAY['track_order', 'product_info', 'request_return', 'greet', 'shipping_info'])[1 + m % 5],
+       0.5 + (m % 50) / 100.0
+FROM generate_series(1, :messages) AS m
+"""
+
+PG_TICKETS = """
+INSERT INTO escalation_tickets (conversation_id, created_at, status, assigned_agent)
+SELECT id, end_time,
+       (ARRAY['pending', 'assigned', 'resolved'])[1 + id % 3],
+       CASE WHEN id % 3 = 0 THEN NULL ELSE 'agent' || (id % 50) END
+FROM conversations
+WHERE escalated AND id >= :first_conversation
+"""
+
+
+def generate_postgresql(engine, conversations, messages, users, start, end):
+    per_conversation = max(1, messages // conversations)
+    conversation_step = (end - start) / conversations
+    with engine.begin() as connection:
+        partitioned = connection.execute(text("SELECT to_regprocedure('ensure_messages_partitions(integer, timestamp)')")).scalar()
+        if partitioned is not None:
+            created = connection.execute(text("SELECT ensure_messages_partitions(1, CAST(:start AS timestamp))"), {"start": start}).scalar()
+            print(f"created {created} monthly partitions for the history")
+        first_conversation = connection.execute(text("SELECT COALESCE(MAX(id), 0) + 1 FROM conversations")).scalar()
+        params = {
+            "users": users, "start": start, "conversation_step": conversation_step, "conversations": conversations,
+            "per_conversation": per_conversation, "messages": messages, "first_conversation": first_conversation,
+        }
+        for label, statement in (("conversations", PG_CONVERSATIONS), ("messages", PG_MESSAGES), ("tickets", PG_TICKETS)):
+            began = time.perf_counter()
+            count = connection.execute(text(statement), params).rowcount
+            print(f"{label}: {count} rows in {time.perf_counter() - began:.1f}s")
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        connection.execute(text("ANALYZE")) # Fresh statistics, so the benchmark gets representative plans
+
+
+def generate_batched(engine, conversations, messages, users, start, end, batch_size=20000):
+    per_conversation = max(1, messages // conversations)
+    conversation_step = (end - start) / conversations
+    intents = ["track_order", "product_info", "request_return", "greet", "shipping_info"]
+    rng = random.Random(7)
+    with engine.begin() as connection:
+        first_conversation = connection.execute(text("SELECT COALESCE(MAX(id), 0) + 1 FROM conversations")).scalar()
+        rows = []
+        for c in range(conversations):
+            started = start + c * conversation_step
+            rows.append({"id": first_conversation + c, "user_id": f"user{c % users}", "start_time": started,
+                         "end_time": started + timedelta(seconds=30 * per_conversation), "escalated": c % 20 == 0})
+            if len(rows) >= batch_size:
+                connection.execute(insert(models.Conversation), rows)
+                rows = []
+        if rows:
+            connection.execute(insert(models.Conversation), rows)
+
+        rows = []
+        for m in range(messages):
+            c = m // per_conversation
+            rows.append({"conversation_id": first_conversation + c, "content": f"synthetic message {m}",
+                         "timestamp": start + c * conversation_step + timedelta(seconds=30 * (m % per_conversation)),
+                         "sender": "bot" if m % 2 else "user", "intent": intents[m % 5], "confidence": rng.random()})
+            if len(rows) >= batch_size:
+                connection.execute(insert(models.Message), rows)
+                rows = []
+        if rows:
+            connection.execute(insert(models.Message), rows)
+
+        statuses = ["pending", "assigned", "resolved"]
+        tickets = [{"conversation_id": first_conversation + c, "status": statuses[c % 3],
+                    "created_at": start + c * conversation_step} for c in range(0, conversations, 20)]
+        if tickets:
+            connection.execute(insert(models.EscalationTicket), tickets)
+    with engine.connect() as connection:
+        connection.execute(text("ANALYZE"))
+
+
+def main(database_url, conversations, messages, users, months):
+    engine = create_engine(database_url)
+    if engine.dialect.name != "postgresql": # On PostgreSQL the schema comes from Alembic
+        models.Base.metadata.create_all(bind=engine)
+    end = datetime.utcnow()
+    start = end - timedelta(days=30 * months)
+    began = time.perf_counter()
+    if engine.dialect.name == "postgresql":
+        generate_postgresql(engine, conversations, messages, users, start, end)
+    else:
+        generate_batched(engine, conversations, messages, users, start, end)
+    print(f"generated {conversations} conversations / {messages} messages in {time.perf_counter() - began:.1f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic chat history")
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL", "sqlite:////tmp/chat_history.db"))
+    parser.add_argument("--messages", type=int, default=10_000_000)
+    parser.add_argument("--conversations", type=int, default=None, help="Default: one per 10 messages")
+    parser.add_argument("--users", type=int, default=None, help="Default: one per 5 conversations")
+    parser.add_argument("--months", type=int, default=12)
+    args = parser.parse_args()
+    conversations = args.conversations or max(1, args.messages // 10)
+    main(args.database_url, conversations, args.messages, args.users or max(1, conversations // 5), args.months)
@@ -0,0 +1,446 @@
+# backend/scripts/load_test_chat.py
+# Load generator for the chat endpoints: how many concurrent conversations one API worker
+# sustains over HTTP (/chat) and WebSocket (/ws), and where it saturates.
+#
+# Usage (from backend/):
+#   python scripts/load_test_chat.py [seed.jsonl] [--text-field text] [--mode both]
+#       [--http-concurrency 5,10,25,50,100] [--ws-sockets 100,500,1000,2000] [--stage-seconds 15]
+#       [--database-url postgresql://...] [--upstream-latency lognormal] [--upstream-scale 1.0]
+#       [--nlp-ms 20] [--seed 1] [--output report.json]
+#
+# Traffic: messages are drawn from the seed file (default scripts/data/intent_sample.jsonl;
+# the repository's requests.jsonl works too, with --text-field title). When the records have
+# an "intent", draws follow --mix (intent=weight, default a support-desk mix: mostly order
+# tracking, then products, returns and small talk), otherwise they are uniform. Every
+# virtual user has its own random generator derived from --seed, so two runs with the same
+# flags send the same messages in the same order.
+#
+# Server: unless --base-url points at a running API, the script starts one worker
+# (uvicorn, in a subprocess so the load generator doesn't share its event loop) with
+#   - the database at --database-url (default: a throwaway SQLite file), tables created;
+#   - the mock e-commerce service, each call's latency drawn from --upstream-latency
+#     (fixed | uniform | lognormal | exponential) around its nominal 100-200 ms times
+#     --upstream-scale, and no cache in front unless --upstream-cache;
+#   - a stub model: seed texts get their labelled intent, anything else a keyword guess,
+#     after --nlp-ms per forward pass plus --nlp-item-ms per message (time.sleep on the
+#     inference executor, which like torch leaves the GIL to the event loop).
+# The server's output goes to a log file (the mock prints every call).
+#
+# Load: closed-loop stages. HTTP: --http-concurrency users at a time, each sending turns back
+# to back (plus --think-ms) and starting a new conversation every --turns-per-conversation
+# turns. WebSocket: sockets are added up to each --ws-sockets count and kept open; each sends
+# a message, waits for its reply, thinks (exponential, mean --ws-think-ms) and repeats.
+# Each stage runs --stage-seconds; the first --warmup-seconds of it aren't counted.
+#
+# Report (JSON, stdout and --output): per stage the throughput, p50/p95/p99/max latency,
+# error rate and status counts; per mode the saturation point - the first stage whose error
+# rate exceeds --max-error-rate, whose p95 exceeds --slo-p95-ms, or whose throughput grew
+# less than --min-gain over the stage before - and the last stage before it; and the
+# server's own per-stage averages from /metrics.
+#
+# Run the client and server on separate machines (--base-url) for figures that aren't
+# bounded by the load generator's own CPU.
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+import websockets
+
+BACKEND_DIR = os.path.join(os.path.dirname(__file__), '..')
+DEFAULT_SEED_FILE = os.path.join(os.path.dirname(__file__), 'data', 'intent_sample.jsonl')
+DEFAULT_MIX = "track_order=25,shipping_info=15,product_info=10,price_query=10,availability=10,request_return=8,greet=8,goodbye=5,general_query=5,human_agent=4"
+LATENCY_DISTRIBUTIONS = ("fixed", "uniform", "lognormal", "exponential")
+
+
+def raise_fd_limit():
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if soft < hard:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard)) # Thousands of sockets, on both ends
+    except (ImportError, ValueError, OSError):
+        pass
+
+
+def load_seed(path, text_field):
+    records = []
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                text = str(record.get(text_field) or "").strip()
+                if text:
+                    records.append({"text": text, "intent": record.get("intent")})
+    if not records:
+        raise SystemExit(f"No '{text_field}' values in {path}")
+    return records
+
+
+# --- Server side (run with --serve, in its own process) ---
+
+def serve(args):
+    raise_fd_limit()
+    os.environ["DATABASE_URL"] = args.database_url # Before app.config reads it
+    os.environ["NLP_LOAD_ON_STARTUP"] = "false"
+    os.environ["ECOMMERCE_CACHE_ENABLED"] = "true" if args.upstream_cache else "false"
+    sys.path.append(BACKEND_DIR)
+
+    import uvicorn
+    from sqlalchemy import create_engine
+    from app.api.v1 import chatbot
+    from app.core import nlp
+    from app.db import models
+    from app.main import app
+    from app.services.ecommerce_api import MockEcommerceAPI
+    from app.services.ecommerce_cache import CachedEcommerceService
+
+    labels = {record["text"].lower(): record["intent"] for record in load_seed(args.seed_file, args.text_field) if record["intent"]}
+    rules = [("human", "human_agent"), ("return", "request_return"), ("shipped", "shipping_info"),
+             ("order", "track_order"), ("price", "price_query"), ("stock", "availability"), ("hi", "greet")]
+
+    class StubClassifier:
+        def __init__(self, call_ms, item_ms):
+            self.call = call_ms / 1000.0
+            self.item = item_ms / 1000.0
+
+        def classify(self, text):
+            lowered = text.lower()
+            intent = labels.get(lowered) or next((intent for keyword, intent in rules if keyword in lowered), "general_query")
+            return intent, 0.95, nlp.IntentClassifier.extract_entities(intent, text)
+
+        def predict(self, text):
+            time.sleep(self.call + self.item) # Runs on the inference executor, like a forward pass
+            return self.classify(text)
+
+        def predict_batch(self, texts):
+            time.sleep(self.call + self.item * len(texts))
+            return [self.classify(text) for text in texts]
+
+    rng = random.Random(args.seed)
+
+    class LatencyMock(MockEcommerceAPI):
+        async def _latency(self, seconds):
+            nominal = seconds * args.upstream_scale
+            if args.upstream_latency == "uniform":
+                seconds = rng.uniform(0.5 * nominal, 1.5 * nominal)
+            elif args.upstream_latency == "lognormal":
+                seconds = nominal * rng.lognormvariate(0.0, args.upstream_sigma) # Median = nominal, long right tail
+            elif args.upstream_latency == "exponential":
+                seconds = rng.expovariate(1.0 / nominal) if nominal > 0 else 0.0
+            else:
+                seconds = nominal
+            await asyncio.sleep(seconds)
+
+    if args.database_url.startswith("sqlite"):
+        engine = create_engine(args.database_url)
+        models.Base.metadata.create_all(bind=engine)
+        engine.dispose()
+    else: # An existing database: the schema comes from Alembic
+        subprocess.run([sys.executable, "-m", "alembic", "upgrade", "head"], cwd=BACKEND_DIR, check=True)
+    nlp.model_manager.use(StubClassifier(args.nlp_ms, args.nlp_item_ms))
+    upstream = LatencyMock()
+    chatbot.ecommerce_service = CachedEcommerceService(upstream) if args.upstream_cache else upstream
+
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning", backlog=4096)
+
+
+def start_server(args):
+    log_path = args.server_log or os.path.join(tempfile.mkdtemp(), "server.log")
+    command = [sys.executable, os.path.abspath(__file__), os.path.abspath(args.seed_file), "--serve", "--port", str(args.port)]
+    for flag in ("text_field", "database_url", "upstream_latency", "upstream_scale", "upstream_sigma",
+                 "nlp_ms", "nlp_item_ms", "seed"):
+        command += ["--" + flag.replace("_", "-"), str(getattr(args, flag))]
+    if args.upstream_cache:
+        command.append("--upstream-cache")
+    log = open(log_path, "w")
+    process = subprocess.Popen(command, cwd=BACKEND_DIR, stdout=log, stderr=subprocess.STDOUT)
+    base = f"http://127.0.0.1:{args.port}"
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise SystemExit(f"Server exited with {process.returncode}, see {log_path}")
+        try:
+            if httpx.get(f"{base}/health", timeout=1).status_code == 200:
+                return process, base, log_path
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    raise SystemExit(f"Server not ready after 60s, see {log_path}")
+
+
+# --- Load generation ---
+
+class MessagePicker:
+    def __init__(self, records, mix):
+        self.by_intent = {}
+        for record in records:
+            self.by_intent.setdefault(record["intent"], []).append(record["text"])
+        weights = {intent: weight for intent, weight in mix.items() if intent in self.by_intent}
+        if None in self.by_intent or not weights: # Unlabelled seed: uniform over the records
+            self.intents, self.weights = [None], [1]
+            self.by_intent = {None: [record["text"] for record in records]}
+        else:
+            self.intents, self.weights = list(weights), list(weights.values())
+
+    def pick(self, rng):
+        intent = rng.choices(self.intents, self.weights)[0] if len(self.intents) > 1 else self.intents[0]
+        return rng.choice(self.by_intent[intent])
+
+
+class Stage:
+    """Samples of one load stage; only those recorded inside its measuring window count."""
+
+    def __init__(self, load, warmup, duration):
+        now = time.perf_counter()
+        self.load = load
+        self.measure_from = now + warmup
+        self.ends_at = now + warmup + duration
+        self.latencies = []
+        self.statuses = {}
+        self.connect_errors = 0
+
+    def record(self, started, latency_ms, status):
+        if self.measure_from <= started < self.ends_at:
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+            if status == "ok":
+                self.latencies.append(latency_ms)
+
+    def report(self, load_key, window):
+        total = sum(self.statuses.values())
+        errors = total - self.statuses.get("ok", 0)
+        latencies = sorted(self.latencies)
+
+        def pct(p):
+            return round(latencies[min(len(latencies) - 1, int(p / 100 * len(latencies)))], 1) if latencies else None
+        return {
+            load_key: self.load,
+            "requests": total,
+            "throughput_per_s": round(self.statuses.get("ok", 0) / window, 1),
+            "error_rate": round(errors / total, 4) if total else 0.0,
+            "statuses": dict(sorted(self.statuses.items())),
+            "connect_errors": self.connect_errors,
+            "latency_ms": {"p50": pct(50), "p95": pct(95), "p99": pct(99), "max": pct(100)},
+        }
+
+
+async def http_user(client, base, picker, rng, user, stage_ref, stop, args):
+    conversation_id, turns = None, 0
+    while not stop.is_set():
+        payload = {"text": picker.pick(rng), "user_id": f"load-http-{user}"}
+        if conversation_id is not None:
+            payload["conversation_id"] = conversation_id
+        started = time.perf_counter()
+        try:
+            response = await client.post(f"{base}/api/v1/chat/chat", json=payload)
+            status = "ok" if response.status_code == 200 else str(response.status_code)
+            if status == "ok":
+                conversation_id = response.json()["conversation_id"]
+        except httpx.HTTPError as e:
+            status = type(e).__name__
+        stage_ref[0].record(started, (time.perf_counter() - started) * 1000, status)
+        turns += 1
+        if turns % args.turns_per_conversation == 0:
+            conversation_id = None
+        if args.think_ms:
+            await asyncio.sleep(rng.expovariate(1000.0 / args.think_ms))
+
+
+async def run_http(base, picker, args):
+    stage_ref, stop, users, stages = [None], asyncio.Event(), [], []
+    limits = httpx.Limits(max_connections=max(args.http_concurrency), max_keepalive_connections=max(args.http_concurrency))
+    async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as client:
+        for concurrency in args.http_concurrency:
+            stage_ref[0] = Stage(concurrency, args.warmup_seconds, args.stage_seconds)
+            while len(users) < concurrency:
+                rng = random.Random(f"{args.seed}-http-{len(users)}")
+                users.append(asyncio.create_task(http_user(client, base, picker, rng, len(users), stage_ref, stop, args)))
+            await asyncio.sleep(args.warmup_seconds + args.stage_seconds)
+            stages.append(stage_ref[0].report("concurrency", args.stage_seconds))
+            print(f"http concurrency={concurrency}: {stages[-1]['throughput_per_s']}/s p95={stages[-1]['latency_ms']['p95']} ms", file=sys.stderr)
+        stop.set()
+        await asyncio.gather(*users, return_exceptions=True)
+    return stages
+
+
+async def ws_user(url, picker, rng, stage_ref, stop, args):
+    try:
+        websocket = await websockets.connect(url, ping_interval=None, open_timeout=args.timeout, max_queue=None)
+    except Exception:
+        stage_ref[0].connect_errors += 1
+        return
+    try:
+        json.loads(await asyncio.wait_for(websocket.recv(), args.timeout)) # connection_ack
+        await asyncio.sleep(rng.uniform(0, args.ws_think_ms / 1000.0)) # Spread the sockets' first messages
+        sent = 0
+        while not stop.is_set():
+            sent += 1
+            started = time.perf_counter()
+            await websocket.send(json.dumps({"text": picker.pick(rng), "client_message_id": sent}))
+            status = "timeout"
+            try:
+                while True: # Skip frames that aren't this message's reply (other sockets' turns)
+                    frame = json.loads(await asyncio.wait_for(websocket.recv(), args.timeout))
+                    if frame.get("client_message_id") == sent:
+                        status = "ok" if "response" in frame else ("busy" if frame.get("retry_after") else "error")
+                        break
+            except asyncio.TimeoutError:
+                pass
+            stage_ref[0].record(started, (time.perf_counter() - started) * 1000, status)
+            if status == "timeout":
+                break # The reply may still come; don't pair it with the next message
+            await asyncio.sleep(rng.expovariate(1000.0 / args.ws_think_ms) if args.ws_think_ms else 0)
+    except websockets.ConnectionClosed:
+        stage_ref[0].record(time.perf_counter(), 0.0, "closed")
+    finally:
+        await websocket.close()
+
+
+async def run_ws(base, picker, args):
+    url = base.replace("http", "ws", 1) + "/api/v1/chat/ws"
+    stage_ref, stop, sockets, stages = [None], asyncio.Event(), [], []
+    for count in args.ws_sockets:
+        stage_ref[0] = Stage(count, args.warmup_seconds, args.stage_seconds)
+        while len(sockets) < count:
+            rng = random.Random(f"{args.seed}-ws-{len(sockets)}")
+            sockets.append(asyncio.create_task(ws_user(f"{url}?user_id=load-ws-{len(sockets)}", picker, rng, stage_ref, stop, args)))
+            if len(sockets) % 50 == 0:
+                await asyncio.sleep(0.01) # Let the handshakes proceed instead of queueing thousands at once
+        await asyncio.sleep(args.warmup_seconds + args.stage_seconds)
+        report = stage_ref[0].report("sockets", args.stage_seconds)
+        report["open_sockets"] = sum(1 for task in sockets if not task.done())
+        stages.append(report)
+        print(f"ws sockets={count}: {report['throughput_per_s']}/s p95={report['latency_ms']['p95']} ms", file=sys.stderr)
+    stop.set()
+    await asyncio.wait(sockets, timeout=args.timeout + 5)
+    for task in sockets:
+        task.cancel()
+    await asyncio.gather(*sockets, return_exceptions=True)
+    return stages
+
+
+def saturation(stages, load_key, args):
+    """The first stage past the worker's capacity, and the last one within it."""
+    previous = None
+    for stage in stages:
+        reason = None
+        if stage["error_rate"] > args.max_error_rate:
+            reason = "error_rate"
+        elif stage["latency_ms"]["p95"] is None or stage["latency_ms"]["p95"] > args.slo_p95_ms:
+            reason = "p95_latency"
+        elif previous is not None and stage["throughput_per_s"] < previous["throughput_per_s"] * (1 + args.min_gain):
+            reason = "throughput_plateau"
+        if reason:
+            return {"reached": True, "at": stage[load_key], "reason": reason,
+                    "max_sustained": previous[load_key] if previous else None,
+                    "max_sustained_throughput_per_s": previous["throughput_per_s"] if previous else None}
+        previous = stage
+    return {"reached": False, "max_sustained": previous[load_key] if previous else None,
+            "max_sustained_throughput_per_s": previous["throughput_per_s"] if previous else None}
+
+
+def server_figures(base):
+    """Average per-stage / upstream / commit durations from the worker's /metrics, in ms."""
+    from prometheus_client.parser import text_string_to_metric_families
+    try:
+        text = httpx.get(f"{base}/metrics", timeout=10).text
+    except httpx.HTTPError as e:
+        return {"error": str(e)}
+    sums, counts = {}, {}
+    for family in text_string_to_metric_families(text):
+        for sample in family.samples:
+            if sample.name.endswith("_seconds_sum") or sample.name.endswith("_seconds_count"):
+                key = "/".join([family.name] + [sample.labels[k] for k in sorted(sample.labels)])
+                (sums if sample.name.endswith("_sum") else counts)[key] = sample.value
+    return {key: {"count": int(counts[key]), "avg_ms": round(sums[key] / counts[key] * 1000, 3)}
+            for key in sorted(sums) if counts.get(key)}
+
+
+def parse_counts(value):
+    return [int(part) for part in value.split(",") if part.strip()]
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(","):
+        intent, _, weight = part.partition("=")
+        mix[intent.strip()] = float(weight or 1)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test /chat and /ws; reports throughput, latency, errors and saturation as JSON")
+    parser.add_argument("seed_file", nargs="?", default=DEFAULT_SEED_FILE, help="JSONL of messages (default: scripts/data/intent_sample.jsonl)")
+    parser.add_argument("--text-field", default="text", help="Field holding the message (title for requests.jsonl)")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="intent=weight,... for labelled seeds")
+    parser.add_argument("--mode", choices=("http", "ws", "both"), default="both")
+    parser.add_argument("--http-concurrency", type=parse_counts, default=parse_counts("5,10,25,50,100"))
+    parser.add_argument("--ws-sockets", type=parse_counts, default=parse_counts("100,500,1000,2000"))
+    parser.add_argument("--stage-seconds", type=float, default=15)
+    parser.add_argument("--warmup-seconds", type=float, default=3)
+    parser.add_argument("--think-ms", type=float, default=0, help="HTTP users' mean pause between turns")
+    parser.add_argument("--ws-think-ms", type=float, default=2000, help="WebSocket users' mean pause between turns")
+    parser.add_argument("--turns-per-conversation", type=int, default=5)
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--slo-p95-ms", type=float, default=1000, help="Saturated once p95 exceeds this")
+    parser.add_argument("--max-error-rate", type=float, default=0.01, help="Saturated once errors exceed this share")
+    parser.add_argument("--min-gain", type=float, default=0.05, help="Saturated once throughput grows less than this")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="Also write the report to this file")
+    parser.add_argument("--base-url", help="Load an already running API instead of starting one")
+    parser.add_argument("--port", type=int, default=8170)
+    parser.add_argument("--server-log")
+    parser.add_argument("--database-url", default=None, help="Default: a throwaway SQLite database")
+    parser.add_argument("--upstream-latency", choices=LATENCY_DISTRIBUTIONS, default="lognormal")
+    parser.add_argument("--upstream-scale", type=float, default=1.0, help="Multiplier on the mock's nominal latencies")
+    parser.add_argument("--upstream-sigma", type=float, default=0.5, help="Spread of the lognormal distribution")
+    parser.add_argument("--upstream-cache", action="store_true", help="Keep the read-through cache in front of the mock")
+    parser.add_argument("--nlp-ms", type=float, default=20, help="Fixed cost of one forward pass of the stub model")
+    parser.add_argument("--nlp-item-ms", type=float, default=1, help="Added cost per message in a forward pass")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS) # The server subprocess
+    args = parser.parse_args()
+    args.database_url = args.database_url or f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'load.db')}"
+
+    if args.serve:
+        serve(args)
+        return
+
+    raise_fd_limit()
+    picker = MessagePicker(load_seed(args.seed_file, args.text_field), parse_mix(args.mix))
+    process, log_path = None, None
+    base = args.base_url
+    if base is None:
+        process, base, log_path = start_server(args)
+    try:
+        report = {
+            "config": {key: value for key, value in vars(args).items() if key not in ("serve", "output")},
+            "server_log": log_path,
+        }
+        if args.mode in ("http", "both"):
+            stages = asyncio.run(run_http(base, picker, args))
+            report["http"] = {"stages": stages, "saturation": saturation(stages, "concurrency", args)}
+        if args.mode in ("ws", "both"):
+            stages = asyncio.run(run_ws(base, picker, args))
+            report["ws"] = {"stages": stages, "saturation": saturation(stages, "sockets", args)}
+        report["server"] = server_figures(base)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=30)
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,269 @@
+# backend/scripts/load_test_ws_fanout.py
+# Load test for the WebSocket fan-out (app/core/connections.py): thousands of sockets spread
+# over several API worker processes, all sharing one Redis.
+#
+# Usage (from backend/, with a Redis running locally):
+#   python scripts/load_test_ws_fanout.py [--redis-url redis://localhost:6379/0] [--workers 4]
+#       [--sockets 2000] [--sockets-per-conversation 10] [--turns 20] [--slow-sockets 20]
+#
+# What it does:
+#   - starts --workers uvicorn processes on consecutive ports (like pods behind a load
+#     balancer), with WS_FANOUT_REDIS_ENABLED=true and a throwaway SQLite database;
+#   - opens --sockets WebSockets round-robin over the workers, --sockets-per-conversation
+#     per conversation, so every conversation has sockets on several workers;
+#   - publishes --turns frames per conversation through Redis exactly as a worker does after
+#     a turn (ConnectionManager.publish), each stamped with its send time;
+#   - --slow-sockets of the sockets stop reading after the handshake. They are evicted once
+#     the backlog outgrows the socket buffers (a few MB each on loopback), e.g. with
+#     --turns 100 --padding 65536; at the default volume they just hold buffered frames.
+# The workers run uvicorn's `websockets` protocol implementation (what uvicorn 0.15 picks):
+# its sends wait for the socket to drain, which is what lets WS_SEND_TIMEOUT_SECONDS notice a
+# stalled client.
+# Reported: connect time, frames delivered vs expected, publish -> delivery latency
+# (p50/p95/p99) and each worker's /api/v1/admin/connections/stats.
+#
+# The frames don't go through the NLP model, so no model weights are needed: this measures
+# the registry, the Redis hop and the per-socket writers, not turn processing.
+
+import argparse
+import asyncio
+import json
+import os
+import secrets
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+import websockets
+from sqlalchemy import create_engine
+
+# Make 'app' importable when run as a plain script
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from app.core.connections import ConnectionManager  # noqa: E402
+from app.db import models  # noqa: E402
+
+BACKEND_DIR = os.path.join(os.path.dirname(__file__), '..')
+ADMIN_TOKEN = secrets.token_hex(16) # The workers' ADMIN_API_TOKEN, for this run only
+
+
+def start_workers(count, base_port, redis_url, database_url, send_queue_size):
+    env = dict(
+        os.environ,
+        REDIS_URL=redis_url,
+        WS_FANOUT_REDIS_ENABLED="true",
+        WS_SEND_QUEUE_SIZE=str(send_queue_size),
+        DATABASE_URL=database_url,
+        NLP_LOAD_ON_STARTUP="false", # Not needed: the frames are published directly
+        ADMIN_API_ENABLED="true", # For /admin/connections/stats
+        ADMIN_API_TOKEN=ADMIN_TOKEN,
+    )
+    return [
+        subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(base_port + i),
+             "--log-level", "warning", "--ws", "websockets"],
+            cwd=BACKEND_DIR, env=env,
+        )
+        for i in range(count)
+    ]
+
+
+async def wait_until_live(ports, timeout=60):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        for port in ports:
+            while True:
+                try:
+                    if (await client.get(f"http://127.0.0.1:{port}/health/live")).status_code == 200:
+                        break
+                except httpx.HTTPError:
+                    pass
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"worker on port {port} did not start")
+                await asyncio.sleep(0.2)
+
+
+class Client:
+    def __init__(self, url):
+        self.url = url
+        self.slow = False
+        self.latencies_ms = []
+        self.frames = 0
+        self.websocket = None
+        self.conversation_id = None
+
+    async def connect(self):
+        self.websocket = await websockets.connect(self.url, max_queue=16, ping_interval=None, open_timeout=60)
+        self.conversation_id = json.loads(await self.websocket.recv())["conversation_id"]
+
+    async def read(self):
+        try:
+            async for raw in self.websocket:
+                now = time.time()
+                frame = json.loads(raw)
+                for item in frame["frames"] if frame.get("type") == "batch" else [frame]:
+                    self.latencies_ms.append((now - item["sent_at"]) * 1000)
+                    self.frames += 1
+        except websockets.ConnectionClosed:
+            pass
+
+    async def close(self):
+        await self.websocket.close()
+
+
+class StalledClient:
+    """
+    Completes the handshake and never reads again, over a socket with a 4 KB receive window:
+    the worker's writes back up the way they do for a client on a stalled mobile connection.
+    (A WebSocket library client keeps draining the socket into its own buffers.)
+    """
+
+    def __init__(self, url):
+        self.url = url
+        self.slow = True
+        self.latencies_ms = []
+        self.frames = 0
+        self.writer = None
+
+    async def connect(self):
+        host, port = self.url.split("/")[2].split(":")
+        path = "/" + self.url.split("/", 3)[3]
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096) # Before connecting, so it is what the kernel advertises
+        sock.setblocking(False)
+        await asyncio.get_running_loop().sock_connect(sock, (host, int(port)))
+        reader, self.writer = await asyncio.open_connection(sock=sock, limit=4096)
+        self.writer.write(
+            f"GET {path} HTTP/1.1\r\nHost: {host}:{port}\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+            "Sec-WebSocket-Key: dGhlIHNhbXBsZSBub25jZQ==\r\nSec-WebSocket-Version: 13\r\n\r\n".encode()
+        )
+        await reader.readuntil(b"\r\n\r\n")
+
+    async def read(self):
+        pass
+
+    async def close(self):
+        self.writer.close()
+
+
+async def open_sockets(ports, sockets, per_conversation, slow_sockets, batch):
+    clients, conversations = [], []
+    started = time.perf_counter()
+    query = "&batch=true" if batch else ""
+    slow_every = sockets // slow_sockets if slow_sockets else 0
+    for index in range(sockets):
+        port = ports[index % len(ports)]
+        if index % per_conversation == 0: # First socket of a conversation creates it
+            client = Client(f"ws://127.0.0.1:{port}/api/v1/chat/ws?user_id=load{index}{query}")
+            await client.connect()
+            conversations.append(client.conversation_id)
+            clients.append(client)
+        else:
+            slow = bool(slow_every) and index % slow_every == slow_every - 1
+            clients.append((StalledClient if slow else Client)(
+                f"ws://127.0.0.1:{port}/api/v1/chat/ws?user_id=load{index}&conversationId={conversations[-1]}{query}"))
+    # The remaining sockets connect concurrently, in waves
+    pending = [c for index, c in enumerate(clients) if index % per_conversation]
+    for start in range(0, len(pending), 200):
+        await asyncio.gather(*(c.connect() for c in pending[start:start + 200]))
+    return clients, conversations, time.perf_counter() - started
+
+
+async def publish_turns(redis_url, conversations, turns, padding, concurrency=50):
+    import redis.asyncio
+    publisher = ConnectionManager(redis.asyncio.Redis.from_url(redis_url))
+    body = "x" * padding
+    for turn in range(turns):
+        for start in range(0, len(conversations), concurrency): # As many in flight as a busy worker would have
+            await asyncio.gather(*(
+                publisher.publish(conversation_id, {"type": "conversation_turn", "turn": turn, "response": body, "sent_at": time.time()})
+                for conversation_id in conversations[start:start + concurrency]
+            ))
+        await asyncio.sleep(0.05)
+    await publisher.redis.aclose()
+    return publisher.redis_errors
+
+
+def percentile(values, q):
+    return round(values[min(len(values) - 1, int(q * len(values)))], 2) if values else None
+
+
+async def run(args):
+    ports = [args.base_port + i for i in range(args.workers)]
+    await wait_until_live(ports)
+    clients, conversations, connect_seconds = await open_sockets(
+        ports, args.sockets, args.sockets_per_conversation, args.slow_sockets, args.batch)
+    print(f"{len(clients)} sockets / {len(conversations)} conversations connected in {connect_seconds:.1f}s")
+
+    readers = [asyncio.create_task(c.read()) for c in clients]
+    began = time.perf_counter()
+    publish_errors = await publish_turns(args.redis_url, conversations, args.turns, args.padding)
+    publish_seconds = time.perf_counter() - began
+    await asyncio.sleep(args.settle)
+
+    async with httpx.AsyncClient(headers={"Authorization": f"Bearer {ADMIN_TOKEN}"}) as http:
+        worker_stats = [(await http.get(f"http://127.0.0.1:{port}/api/v1/admin/connections/stats")).json() for port in ports]
+    for client in clients:
+        await client.close()
+    for reader in readers:
+        reader.cancel()
+
+    readers_count = sum(not c.slow for c in clients)
+    latencies = sorted(l for c in clients for l in c.latencies_ms)
+    delivered = sum(c.frames for c in clients)
+    expected = readers_count * args.turns
+    print(json.dumps({
+        "workers": args.workers,
+        "sockets": len(clients),
+        "conversations": len(conversations),
+        "connect_seconds": round(connect_seconds, 2),
+        "frames_published": len(conversations) * args.turns,
+        "publish_errors": publish_errors,
+        "frames_expected": expected,
+        "frames_delivered": delivered,
+        "delivery_ratio": round(delivered / expected, 4) if expected else None,
+        "publish_seconds": round(publish_seconds, 2),
+        "latency_ms": {"p50": percentile(latencies, 0.5), "p95": percentile(latencies, 0.95),
+                       "p99": percentile(latencies, 0.99), "max": percentile(latencies, 1.0)},
+        "slow_sockets": sum(c.slow for c in clients),
+        "evictions": sum(s["evictions"] for s in worker_stats),
+        "per_worker": [{k: s[k] for k in ("local_connections", "received", "frames_sent", "writes", "evictions")}
+                       for s in worker_stats],
+    }, indent=2))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="WebSocket fan-out load test over several workers and one Redis")
+    parser.add_argument("--redis-url", default=os.getenv("REDIS_URL", "redis://localhost:6379/0"))
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--base-port", type=int, default=8100)
+    parser.add_argument("--sockets", type=int, default=2000)
+    parser.add_argument("--sockets-per-conversation", type=int, default=10)
+    parser.add_argument("--turns", type=int, default=20, help="Frames published per conversation")
+    parser.add_argument("--padding", type=int, default=200, help="Bytes of filler per frame")
+    parser.add_argument("--slow-sockets", type=int, default=20, help="Sockets that never read")
+    parser.add_argument("--send-queue-size", type=int, default=10, help="WS_SEND_QUEUE_SIZE for the workers")
+    parser.add_argument("--batch", action="store_true", help="Connect with ?batch=true")
+    parser.add_argument("--settle", type=float, default=3.0, help="Seconds to wait for delivery after the last publish")
+    args = parser.parse_args()
+
+    database = os.path.join(tempfile.mkdtemp(), "fanout.db")
+    engine = create_engine(f"sqlite:///{database}")
+    models.Base.metadata.create_all(bind=engine)
+    engine.dispose()
+
+    workers = start_workers(args.workers, args.base_port, args.redis_url, f"sqlite:///{database}", args.send_queue_size)
+    try:
+        asyncio.run(run(args))
+    finally:
+        for worker in workers:
+            worker.terminate()
+        for worker in workers:
+            worker.wait()
+
+
+if __name__ == "__main__":
+    main()
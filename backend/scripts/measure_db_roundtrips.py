@@ -0,0 +1,177 @@
+# backend/scripts/measure_db_roundtrips.py
+# Counts database round-trips per chat turn: the previous commit-after-every-step path vs
+# persist_turn (one transaction, INSERT ... RETURNING) vs the write-behind message log
+# (request path only; the bulk flushes are reported separately as round-trips per turn).
+#
+# Usage (from backend/):
+#   python scripts/measure_db_roundtrips.py [--database-url postgresql://...] [--turns 200]
+#
+# Round-trips are counted with SQLAlchemy engine events: every statement sent, every
+# transaction BEGIN the driver issues and every COMMIT. Latency per turn is reported too,
+# which is where the round-trip count shows up against a networked PostgreSQL.
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+# Make 'app' importable when run as a plain script
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from app.db import models  # noqa: E402
+from app.db.message_log import MessageWriteBehind  # noqa: E402
+from app.db.session import async_database_url  # noqa: E402
+from app.db.turns import persist_turn, record_turn  # noqa: E402
+
+
+class RoundTripCounter:
+    def __init__(self, engine):
+        self.statements = self.begins = self.commits = 0
+        self.attach(engine)
+
+    def attach(self, engine):
+        event.listen(engine, "before_cursor_execute", self._statement)
+        event.listen(engine, "begin", self._begin)
+        event.listen(engine, "commit", self._commit)
+
+    def _statement(self, *args):
+        self.statements += 1
+
+    def _begin(self, *args):
+        self.begins += 1
+
+    def _commit(self, *args):
+        self.commits += 1
+
+    def snapshot(self):
+        return self.statements, self.begins, self.commits
+
+
+def legacy_turn(db, conversation_id, text, escalate):
+    """The sequence chatbot.py ran before persist_turn, step for step."""
+    conversation = None
+    if conversation_id:
+        conversation = db.query(models.Conversation).filter(models.Conversation.id == conversation_id).first()
+    if not conversation:
+        conversation = models.Conversation(user_id="bench", start_time=datetime.utcnow())
+        db.add(conversation)
+        db.commit()
+        db.refresh(conversation)
+
+    def log_message(content, sender, intent=None, confidence=None):
+        message = models.Message(conversation_id=conversation.id, content=content, sender=sender,
+                                 intent=intent, confidence=confidence, timestamp=datetime.utcnow())
+        db.add(message)
+        db.commit()
+        db.refresh(message)
+        return message
+
+    user_message = log_message(text, "user")
+    user_message.intent = "track_order"
+    user_message.confidence = 0.95
+    db.commit()
+    db.refresh(user_message)
+    if escalate:
+        # create_escalation_ticket as it was: load conversation, flag it, insert ticket, commit, refresh
+        conversation = db.query(models.Conversation).filter(models.Conversation.id == conversation.id).first()
+        conversation.escalated = True
+        conversation.end_time = datetime.utcnow()
+        ticket = models.EscalationTicket(conversation_id=conversation.id, status="pending", created_at=datetime.utcnow())
+        db.add(ticket)
+        db.commit()
+        db.refresh(ticket)
+        reply = f"Ticket ID: {ticket.id}"
+    else:
+        reply = "Order 12345: Status is 'Shipped'."
+    bot_message = log_message(reply, "bot", "track_order", 1.0)
+    return conversation.id, user_message.id, bot_message.id
+
+
+async def new_turn(db, conversation_id, text, escalate):
+    turn = await persist_turn(db, conversation_id, "bench", text, "track_order", 0.95,
+                        "Ticket ID: {ticket_id}" if escalate else "Order 12345: Status is 'Shipped'.",
+                        "track_order", escalate=escalate)
+    return turn.conversation_id, turn.user_message_id, turn.bot_message_id
+
+
+def write_behind_turn_fn(message_log):
+    async def turn(db, conversation_id, text, escalate):
+        turn = await record_turn(db, conversation_id, "bench", text, "track_order", 0.95,
+                           "Ticket ID: {ticket_id}" if escalate else "Order 12345: Status is 'Shipped'.",
+                           "track_order", escalate=escalate, message_log=message_log)
+        return turn.conversation_id, turn.user_message_id, turn.bot_message_id
+    return turn
+
+
+async def measure(session_factory, counter, turn_fn, scenario, turns):
+    """turn_fn is sync (legacy, on a Session) or a coroutine function (on an AsyncSession)."""
+    is_async = asyncio.iscoroutinefunction(turn_fn)
+
+    async def run_turn(db, conversation_id, text, escalate):
+        result = turn_fn(db, conversation_id, text, escalate)
+        return await result if is_async else result
+
+    db = session_factory()
+    try:
+        existing = None
+        if scenario != "new_conversation":
+            existing = (await run_turn(db, None, "warm-up", False))[0]
+        before = counter.snapshot()
+        start = time.perf_counter()
+        for _ in range(turns):
+            await run_turn(db, existing, "where is my order 12345", scenario == "escalation")
+        elapsed = time.perf_counter() - start
+        statements, begins, commits = (after - b for after, b in zip(counter.snapshot(), before))
+    finally:
+        if is_async:
+            await db.close()
+        else:
+            db.close()
+    return {
+        "statements": round(statements / turns, 2),
+        "begins": round(begins / turns, 2),
+        "commits": round(commits / turns, 2),
+        "round_trips": round((statements + begins + commits) / turns, 2),
+        "ms_per_turn": round(elapsed / turns * 1000, 3),
+    }
+
+
+async def main(database_url, turns):
+    engine = create_engine(database_url)
+    models.Base.metadata.create_all(bind=engine)
+    session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    async_engine = create_async_engine(async_database_url(database_url))
+    async_session_factory = async_sessionmaker(async_engine, expire_on_commit=False, autoflush=False)
+    # One counter over both engines (the async engine's events fire on its sync_engine)
+    counter = RoundTripCounter(engine)
+    counter.attach(async_engine.sync_engine)
+
+    results = {}
+    for scenario in ("existing_conversation", "new_conversation", "escalation"):
+        message_log = MessageWriteBehind(session_factory)
+        results[scenario] = {
+            "before": await measure(session_factory, counter, legacy_turn, scenario, turns),
+            "after": await measure(async_session_factory, counter, new_turn, scenario, turns),
+            "write_behind": await measure(async_session_factory, counter, write_behind_turn_fn(message_log), scenario, turns),
+        }
+        before = counter.snapshot()
+        message_log.drain()
+        flushed = sum(after - b for after, b in zip(counter.snapshot(), before))
+        results[scenario]["write_behind"]["flush_round_trips"] = round(flushed / turns, 3)
+    await async_engine.dispose()
+    print(json.dumps({"database": engine.dialect.name, "turns": turns, "per_turn": results}, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure DB round-trips per chat turn")
+    parser.add_argument("--database-url", default="sqlite:////tmp/roundtrips.db")
+    parser.add_argument("--turns", type=int, default=200)
+    args = parser.parse_args()
+    asyncio.run(main(args.database_url, args.turns))
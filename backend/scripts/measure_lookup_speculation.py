@@ -0,0 +1,139 @@
+# backend/scripts/measure_lookup_speculation.py
+# /chat latency per intent with and without speculative lookups (app/core/lookups.py).
+#
+# Usage (from backend/):
+#   python scripts/measure_lookup_speculation.py [--turns 30] [--nlp-ms 50] [--real-model]
+#
+# The API runs in-process on a local port with a throwaway SQLite database and the mock
+# e-commerce service (order 150 ms, shipping and products 100 ms, no cache in front).
+# Classification is a keyword stand-in taking --nlp-ms, or the configured model with
+# --real-model. Each intent's messages are sent --turns times with LOOKUP_SPECULATION_ENABLED
+# off, then on. Reported per intent: p50/p95 /chat latency both ways, and the planner's own
+# figures for the speculative run (/admin/lookups/stats: lookups reused and cancelled, and the
+# latency saved against making the lookups one by one after classification).
+
+import argparse
+import asyncio
+import json
+import os
+import secrets
+import sys
+import tempfile
+import threading
+import time
+
+import httpx
+import uvicorn
+from sqlalchemy import create_engine
+
+# Make 'app' importable when run as a plain script
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+_database = os.path.join(tempfile.mkdtemp(), "lookups.db")
+os.environ["DATABASE_URL"] = f"sqlite:///{_database}" # Before app.config reads it
+os.environ["NLP_LOAD_ON_STARTUP"] = "false"
+os.environ["NLP_CACHE_ENABLED"] = "false" # Every turn pays for classification
+os.environ["ADMIN_API_ENABLED"] = "true" # For /admin/lookups/stats
+os.environ["ADMIN_API_TOKEN"] = ADMIN_TOKEN = secrets.token_hex(16)
+
+from app.api.v1 import chatbot  # noqa: E402
+from app.core import nlp  # noqa: E402
+from app.core.lookups import LookupStats  # noqa: E402
+from app.db import models  # noqa: E402
+from app.main import app  # noqa: E402
+from app.services.ecommerce_api import MockEcommerceAPI  # noqa: E402
+
+MESSAGES = {
+    "track_order": ["where is my order 12345, has it shipped?", "status of order 67890", "where is order 77777"],
+    "shipping_info": ["has 12345 shipped yet", "is 67890 shipped"],
+    "request_return": ["return the SuperWidget from order 12345"], # Speculated, then cancelled
+    "price_query": ["price of the SuperWidget"], # No order ID: nothing to speculate on
+    "greet": ["hi there"],
+}
+
+
+class KeywordClassifier:
+    RULES = [("human", "human_agent"), ("return", "request_return"), ("shipped", "shipping_info"),
+             ("order", "track_order"), ("price", "price_query"), ("hi", "greet")]
+
+    def __init__(self, delay_ms):
+        self.delay = delay_ms / 1000.0
+
+    def predict(self, text):
+        time.sleep(self.delay) # Runs on the inference executor, like a forward pass
+        lowered = text.lower()
+        intent = next((intent for keyword, intent in self.RULES if keyword in lowered), "general_query")
+        return intent, 0.95, nlp.IntentClassifier.extract_entities(intent, text)
+
+    def predict_batch(self, texts):
+        return [self.predict(text) for text in texts]
+
+
+def start_server(port):
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return server, thread
+
+
+def percentiles(values):
+    values = sorted(values)
+    return {"p50": round(values[len(values) // 2], 1), "p95": round(values[min(len(values) - 1, int(0.95 * len(values)))], 1)}
+
+
+async def chat_latencies(client, base, texts, turns):
+    latencies = []
+    for i in range(turns):
+        started = time.perf_counter()
+        response = await client.post(f"{base}/api/v1/chat/chat", json={"text": texts[i % len(texts)], "user_id": "lookups"})
+        response.raise_for_status()
+        latencies.append((time.perf_counter() - started) * 1000)
+    return latencies
+
+
+async def run(port, turns):
+    base = f"http://127.0.0.1:{port}"
+    results = {intent: {} for intent in MESSAGES}
+    async with httpx.AsyncClient(timeout=30, headers={"Authorization": f"Bearer {ADMIN_TOKEN}"}) as client:
+        for speculate in (False, True):
+            chatbot.lookup_planner.speculate = speculate
+            chatbot.lookup_planner.stats = LookupStats()
+            for intent, texts in MESSAGES.items():
+                key = "speculative_ms" if speculate else "sequential_ms"
+                results[intent][key] = percentiles(await chat_latencies(client, base, texts, turns))
+        planner = (await client.get(f"{base}/api/v1/admin/lookups/stats")).json()["intents"]
+    for intent, figures in results.items():
+        figures["planner"] = planner.get(intent)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chat latency per intent with and without speculative lookups")
+    parser.add_argument("--turns", type=int, default=30, help="Turns per intent and mode")
+    parser.add_argument("--nlp-ms", type=float, default=50, help="Classification time of the keyword stand-in")
+    parser.add_argument("--real-model", action="store_true", help="Load the configured NLP model instead")
+    parser.add_argument("--port", type=int, default=8151)
+    args = parser.parse_args()
+
+    engine = create_engine(f"sqlite:///{_database}")
+    models.Base.metadata.create_all(bind=engine)
+    engine.dispose()
+    if args.real_model:
+        nlp.model_manager.load()
+    else:
+        nlp.model_manager.use(KeywordClassifier(args.nlp_ms))
+    chatbot.ecommerce_service = MockEcommerceAPI(simulate_latency=True)
+
+    server, thread = start_server(args.port)
+    try:
+        results = asyncio.run(run(args.port, args.turns))
+    finally:
+        server.should_exit = True
+        thread.join()
+    print(json.dumps({"turns": args.turns, "nlp_ms": None if args.real_model else args.nlp_ms, "intents": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+# backend/scripts/measure_metrics_overhead.py
+# Cost of the Prometheus instrumentation (app/core/metrics.py), per span.
+#
+# Usage (from backend/):
+#   python scripts/measure_metrics_overhead.py [--iterations 200000]
+#
+# Times, against the same code without instrumentation:
+#   span           `with Span(series):` around an empty block (stages, DB commits, WebSocket writes)
+#   upstream_call  an @upstream_call coroutine against the same coroutine undecorated
+#   count_turn     the per-turn counters (turns by channel and intent, escalations)
+# and prints microseconds per operation, plus the total for a typical turn: tokenize, one
+# forward pass, entity extraction, two upstream calls, one commit, one WebSocket send and
+# its counters.
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+# Make 'app' importable when run as a plain script
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from prometheus_client import CollectorRegistry, Histogram  # noqa: E402
+
+from app.core.metrics import Span, count_turn, upstream_call  # noqa: E402
+
+
+def per_call_us(function, iterations):
+    started = time.perf_counter()
+    for _ in range(iterations):
+        function()
+    return (time.perf_counter() - started) / iterations * 1e6
+
+
+def measure_span(iterations):
+    series = Histogram("bench_span_seconds", "bench", registry=CollectorRegistry())
+
+    def bare():
+        pass
+
+    def spanned():
+        with Span(series):
+            pass
+    return per_call_us(spanned, iterations) - per_call_us(bare, iterations)
+
+
+def measure_upstream_call(iterations):
+    async def call(order_id):
+        return order_id
+
+    timed = upstream_call("bench")(call)
+
+    async def run(function):
+        started = time.perf_counter()
+        for _ in range(iterations):
+            await function("12345")
+        return (time.perf_counter() - started) / iterations * 1e6
+    return asyncio.run(run(timed)) - asyncio.run(run(call))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-span cost of the Prometheus instrumentation")
+    parser.add_argument("--iterations", type=int, default=200000)
+    args = parser.parse_args()
+
+    span_us = measure_span(args.iterations)
+    upstream_us = measure_upstream_call(args.iterations)
+    count_us = per_call_us(lambda: count_turn("bench", "track_order", False), args.iterations)
+    results = {
+        "iterations": args.iterations,
+        "span_us": round(span_us, 2),
+        "upstream_call_us": round(upstream_us, 2),
+        "count_turn_us": round(count_us, 2),
+        # tokenize + forward + entities + commit + ws_send, two upstream calls, the counters
+        "typical_turn_us": round(5 * span_us + 2 * upstream_us + count_us, 2),
+    }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+# backend/scripts/measure_ttfb.py
+# Time to first byte of a chat reply: the buffered paths (/chat, /ws) against the streaming
+# ones (/chat/stream Server-Sent Events, /ws?stream=true).
+#
+# Usage (from backend/):
+#   python scripts/measure_ttfb.py [--turns 50] [--nlp-ms 20] [--real-model]
+#
+# The API runs in-process on a local port with a throwaway SQLite database and the mock
+# e-commerce service, whose lookups take 100-150 ms (the upstream latency that buffered
+# replies wait for). Classification is a keyword stand-in taking --nlp-ms, or the configured
+# model with --real-model.
+#
+# Per path and message mix: p50/p95 of
+#   first_ms   request sent -> first byte (SSE event / WebSocket frame) received
+#   reply_ms   request sent -> the reply with its database ids
+# For the buffered paths both are the same moment.
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import httpx
+import uvicorn
+import websockets
+from sqlalchemy import create_engine
+
+# Make 'app' importable when run as a plain script
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+_database = os.path.join(tempfile.mkdtemp(), "ttfb.db")
+os.environ["DATABASE_URL"] = f"sqlite:///{_database}" # Before app.config reads it
+os.environ["NLP_LOAD_ON_STARTUP"] = "false"
+
+from app.api.v1 import chatbot  # noqa: E402
+from app.core import nlp  # noqa: E402
+from app.db import models  # noqa: E402
+from app.main import app  # noqa: E402
+from app.services.ecommerce_api import MockEcommerceAPI  # noqa: E402
+
+MESSAGES = {
+    "lookup": ["where is my order 12345", "has order 67890 shipped", "price of the SuperWidget"],
+    "no_lookup": ["hi there", "what can you do"],
+}
+
+
+class KeywordClassifier:
+    RULES = [("human", "human_agent"), ("return", "request_return"), ("shipped", "shipping_info"),
+             ("order", "track_order"), ("price", "price_query"), ("hi", "greet")]
+
+    def __init__(self, delay_ms):
+        self.delay = delay_ms / 1000.0
+
+    def predict(self, text):
+        time.sleep(self.delay) # Runs on the inference executor, like a forward pass
+        lowered = text.lower()
+        intent = next((intent for keyword, intent in self.RULES if keyword in lowered), "general_query")
+        return intent, 0.95, nlp.IntentClassifier.extract_entities(intent, text)
+
+    def predict_batch(self, texts):
+        return [self.predict(text) for text in texts]
+
+
+def start_server(port):
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return server, thread
+
+
+async def http_turn(client, base, text):
+    started = time.perf_counter()
+    response = await client.post(f"{base}/api/v1/chat/chat", json={"text": text, "user_id": "ttfb"})
+    response.raise_for_status()
+    elapsed = (time.perf_counter() - started) * 1000
+    return elapsed, elapsed
+
+
+async def sse_turn(client, base, text):
+    started = time.perf_counter()
+    first = None
+    async with client.stream("POST", f"{base}/api/v1/chat/chat/stream", json={"text": text, "user_id": "ttfb"}) as response:
+        async for line in response.aiter_lines():
+            if first is None and line.startswith("event:"):
+                first = (time.perf_counter() - started) * 1000
+            if line == "event: final":
+                return first, (time.perf_counter() - started) * 1000
+    raise RuntimeError("stream ended without a final event")
+
+
+async def ws_turns(base, texts, stream):
+    url = base.replace("http", "ws") + "/api/v1/chat/ws?user_id=ttfb" + ("&stream=true" if stream else "")
+    results = []
+    async with websockets.connect(url, ping_interval=None) as ws:
+        await ws.recv() # connection_ack
+        for text in texts:
+            started = time.perf_counter()
+            await ws.send(json.dumps({"text": text}))
+            first = None
+            while True:
+                frame = json.loads(await ws.recv())
+                if first is None:
+                    first = (time.perf_counter() - started) * 1000
+                if not stream or frame.get("type") == "final":
+                    results.append((first, (time.perf_counter() - started) * 1000))
+                    break
+    return results
+
+
+def summary(samples):
+    def pct(values, q):
+        values = sorted(values)
+        return round(values[min(len(values) - 1, int(q * len(values)))], 1)
+    firsts, replies = [s[0] for s in samples], [s[1] for s in samples]
+    return {"first_ms": {"p50": pct(firsts, 0.5), "p95": pct(firsts, 0.95)},
+            "reply_ms": {"p50": pct(replies, 0.5), "p95": pct(replies, 0.95)}}
+
+
+async def run(port, turns):
+    base = f"http://127.0.0.1:{port}"
+    results = {}
+    async with httpx.AsyncClient(timeout=30) as client:
+        for mix, texts in MESSAGES.items():
+            sequence = [texts[i % len(texts)] for i in range(turns)]
+            results[mix] = {
+                "http": summary([await http_turn(client, base, text) for text in sequence]),
+                "sse": summary([await sse_turn(client, base, text) for text in sequence]),
+                "ws": summary(await ws_turns(base, sequence, stream=False)),
+                "ws_stream": summary(await ws_turns(base, sequence, stream=True)),
+            }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time to first byte: buffered vs streaming chat replies")
+    parser.add_argument("--turns", type=int, default=50, help="Turns per path and message mix")
+    parser.add_argument("--nlp-ms", type=float, default=20, help="Classification time of the keyword stand-in")
+    parser.add_argument("--real-model", action="store_true", help="Load the configured NLP model instead")
+    parser.add_argument("--port", type=int, default=8150)
+    args = parser.parse_args()
+
+    engine = create_engine(f"sqlite:///{_database}")
+    models.Base.metadata.create_all(bind=engine)
+    engine.dispose()
+    if args.real_model:
+        nlp.model_manager.load()
+    else:
+        nlp.model_manager.use(KeywordClassifier(args.nlp_ms))
+    # The mock's own latency (no cache in front, so every turn pays it) stands in for the upstream
+    chatbot.ecommerce_service = MockEcommerceAPI(simulate_latency=True)
+
+    server, thread = start_server(args.port)
+    try:
+        results = asyncio.run(run(args.port, args.turns))
+    finally:
+        server.should_exit = True
+        thread.join()
+    print(json.dumps({"turns": args.turns, "nlp_ms": None if args.real_model else args.nlp_ms, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
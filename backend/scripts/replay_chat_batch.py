@@ -0,0 +1,171 @@
+# backend/scripts/replay_chat_batch.py
+# Replays a JSONL file of chat messages through the bulk endpoint (/chat/batch/stream) and,
+# for comparison, one message at a time through /chat.
+#
+# Usage (from backend/):
+#   python scripts/replay_chat_batch.py [path.jsonl] [--text-field text] [--repeat 20] [--nlp-ms 20]
+#
+# Each line is a JSON object; its --text-field is the message, and "user_id" and
+# "conversation_id" are passed through when present. Without a path the repository's
+# requests.jsonl is replayed with --text-field title (one message per line, repeated).
+#
+# The API runs in-process with a throwaway SQLite database, the mock e-commerce service with
+# its 100-150 ms latency, and a keyword stand-in for the model whose forward pass takes
+# --nlp-ms per call plus --nlp-item-ms per message (or the configured model with --real-model).
+#
+# Reported per path: total seconds, messages per second, and for the bulk path when the
+# first result line arrived.
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import httpx
+import uvicorn
+from sqlalchemy import create_engine
+
+# Make 'app' importable when run as a plain script
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+_database = os.path.join(tempfile.mkdtemp(), "replay.db")
+os.environ["DATABASE_URL"] = f"sqlite:///{_database}" # Before app.config reads it
+os.environ["NLP_LOAD_ON_STARTUP"] = "false"
+
+from app.api.v1 import chatbot  # noqa: E402
+from app.core import nlp  # noqa: E402
+from app.db import models  # noqa: E402
+from app.main import app  # noqa: E402
+from app.services.ecommerce_api import MockEcommerceAPI  # noqa: E402
+
+DEFAULT_FIXTURE = os.path.join(os.path.dirname(__file__), '..', '..', 'requests.jsonl')
+
+
+class KeywordClassifier:
+    RULES = [("human", "human_agent"), ("return", "request_return"), ("shipped", "shipping_info"),
+             ("order", "track_order"), ("price", "price_query"), ("hi", "greet")]
+
+    def __init__(self, call_ms, item_ms):
+        self.call = call_ms / 1000.0
+        self.item = item_ms / 1000.0
+
+    def classify(self, text):
+        lowered = text.lower()
+        intent = next((intent for keyword, intent in self.RULES if keyword in lowered), "general_query")
+        return intent, 0.95, nlp.IntentClassifier.extract_entities(intent, text)
+
+    def predict(self, text):
+        time.sleep(self.call + self.item) # Runs on the inference executor, like a forward pass
+        return self.classify(text)
+
+    def predict_batch(self, texts):
+        time.sleep(self.call + self.item * len(texts)) # A padded batch costs much less than len(texts) calls
+        return [self.classify(text) for text in texts]
+
+
+def load_items(path, text_field, repeat):
+    items = []
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            item = {"text": str(record.get(text_field, ""))}
+            for key in ("user_id", "conversation_id"):
+                if record.get(key) is not None:
+                    item[key] = record[key]
+            items.append(item)
+    return items * repeat
+
+
+def start_server(port):
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return server, thread
+
+
+async def replay_one_by_one(client, base, items):
+    started = time.perf_counter()
+    for item in items:
+        (await client.post(f"{base}/api/v1/chat/chat", json=item)).raise_for_status()
+    return {"seconds": time.perf_counter() - started, "errors": 0}
+
+
+async def replay_bulk(client, base, items):
+    body = "".join(json.dumps(item) + "\n" for item in items)
+    started = time.perf_counter()
+    first = None
+    results = 0
+    errors = 0
+    async with client.stream("POST", f"{base}/api/v1/chat/batch/stream", content=body,
+                             headers={"Content-Type": "application/x-ndjson"}) as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            if not line:
+                continue
+            if first is None:
+                first = time.perf_counter() - started
+            results += 1
+            errors += "error" in json.loads(line)
+    if results != len(items):
+        raise RuntimeError(f"{results} results for {len(items)} items")
+    return {"seconds": time.perf_counter() - started, "first_result_ms": round(first * 1000, 1), "errors": errors}
+
+
+async def run(port, items, sequential):
+    base = f"http://127.0.0.1:{port}"
+    report = {}
+    async with httpx.AsyncClient(timeout=600) as client:
+        report["bulk"] = await replay_bulk(client, base, items)
+        if sequential:
+            report["one_by_one"] = await replay_one_by_one(client, base, items)
+    for result in report.values():
+        result["messages_per_second"] = round(len(items) / result["seconds"], 1)
+        result["seconds"] = round(result["seconds"], 2)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay JSONL chat messages through /chat/batch/stream and /chat")
+    parser.add_argument("path", nargs="?", help="JSONL file (default: the repository's requests.jsonl)")
+    parser.add_argument("--text-field", help="Field holding the message (default: text; title for requests.jsonl)")
+    parser.add_argument("--repeat", type=int, default=None, help="Replay the file this many times (default: 1; 20 for requests.jsonl)")
+    parser.add_argument("--nlp-ms", type=float, default=20, help="Fixed cost of one forward pass of the stand-in")
+    parser.add_argument("--nlp-item-ms", type=float, default=1, help="Added cost per message in a forward pass")
+    parser.add_argument("--real-model", action="store_true", help="Load the configured NLP model instead")
+    parser.add_argument("--no-sequential", action="store_true", help="Skip the one-message-at-a-time comparison")
+    parser.add_argument("--port", type=int, default=8160)
+    args = parser.parse_args()
+
+    path = args.path or DEFAULT_FIXTURE
+    fixture = args.path is None
+    items = load_items(path, args.text_field or ("title" if fixture else "text"),
+                       args.repeat if args.repeat is not None else (20 if fixture else 1))
+
+    engine = create_engine(f"sqlite:///{_database}")
+    models.Base.metadata.create_all(bind=engine)
+    engine.dispose()
+    if args.real_model:
+        nlp.model_manager.load()
+    else:
+        nlp.model_manager.use(KeywordClassifier(args.nlp_ms, args.nlp_item_ms))
+    chatbot.ecommerce_service = MockEcommerceAPI(simulate_latency=True)
+
+    server, thread = start_server(args.port)
+    try:
+        report = asyncio.run(run(args.port, items, not args.no_sequential))
+    finally:
+        server.should_exit = True
+        thread.join()
+    print(json.dumps({"source": os.path.relpath(path), "messages": len(items), "results": report}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -22,4 +22,12 @@ CREATE TABLE IF NOT EXISTS escalation_tickets (
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     status VARCHAR(50),
     assigned_agent VARCHAR(255)
-);
\ No newline at end of file
+);
+
+-- Indexes for conversation history, per-user and ticket-queue queries. Alembic revision
+-- 0002 (backend/alembic/versions) creates the same ones and partitions `messages` by month.
+CREATE INDEX IF NOT EXISTS ix_conversations_user_id_start_time ON conversations (user_id, start_time);
+CREATE INDEX IF NOT EXISTS ix_messages_conversation_id_timestamp ON messages (conversation_id, timestamp);
+CREATE INDEX IF NOT EXISTS ix_messages_timestamp ON messages (timestamp);
+CREATE INDEX IF NOT EXISTS ix_escalation_tickets_conversation_id ON escalation_tickets (conversation_id);
+CREATE INDEX IF NOT EXISTS ix_escalation_tickets_status_created_at ON escalation_tickets (status, created_at);